@@ -0,0 +1,378 @@
+import asyncio
+import datetime
+import functools
+import itertools
+import os
+import threading
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, TypeVar
+from PasswordManager import IMPORT_CHUNK_SIZE, PasswordManager
+from Storage import StorageBackend, get_default_storage
+
+# Default size of the shared executor, the blocking work is file I/O and encryption that release the GIL in part
+DEFAULT_MAX_WORKERS: int = min(32, (os.cpu_count() or 1) + 4)
+
+# Number of decrypted records handed from the executor to the event loop at a time by iter_credentials
+ITER_BATCH_SIZE: int = 256
+
+Result = TypeVar('Result')
+
+# The executor running the blocking work of every AsyncPasswordManager without an own one, created on first use
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_guard: threading.Lock = threading.Lock()
+
+# Per event loop, the write lock of every user with a write queued or running.
+# An asyncio.Lock belongs to one loop, and a lock nobody waits on is dropped with its last reference.
+_write_locks: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, weakref.WeakValueDictionary]' = \
+    weakref.WeakKeyDictionary()
+
+
+def get_async_executor() -> ThreadPoolExecutor:
+    """
+        Return the executor shared by the AsyncPasswordManager instances, creating it on first use.
+
+        Returns:
+            ThreadPoolExecutor: The shared executor with DEFAULT_MAX_WORKERS threads unless configured otherwise.
+    """
+    global _executor
+    with _executor_guard:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(DEFAULT_MAX_WORKERS, thread_name_prefix='psm-async')
+        return _executor
+
+
+def configure_async_executor(max_workers: int = DEFAULT_MAX_WORKERS) -> ThreadPoolExecutor:
+    """
+        Replace the shared executor with a new one of the given size.
+
+        The current executor finishes its queued work in the background.
+
+        Args:
+            max_workers (int): Maximum number of threads running blocking work at the same time.
+
+        Returns:
+            ThreadPoolExecutor: The new shared executor.
+    """
+    global _executor
+    with _executor_guard:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = ThreadPoolExecutor(max_workers, thread_name_prefix='psm-async')
+        return _executor
+
+
+def _write_lock(key_ring_id: str) -> asyncio.Lock:
+    """
+        Return the lock serializing the writes to one user's vault on the running event loop.
+
+        Args:
+            key_ring_id (str): The storage-qualified user ID, see StorageBackend.key_ring_id.
+
+        Returns:
+            asyncio.Lock: The user's write lock.
+    """
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    locks: weakref.WeakValueDictionary = _write_locks.get(loop)
+    if locks is None:
+        locks = _write_locks[loop] = weakref.WeakValueDictionary()
+
+    lock: Optional[asyncio.Lock] = locks.get(key_ring_id)
+    if lock is None:
+        lock = locks[key_ring_id] = asyncio.Lock()
+    return lock
+
+
+def _next_batch(iterator: Iterator[Dict[str, str]], batch_size: int) -> List[Dict[str, str]]:
+    """
+        Pull the next records from a credential iterator, run in the executor.
+
+        Args:
+            iterator (Iterator[Dict[str, str]]): The iterator.
+            batch_size (int): Maximum number of records to pull.
+
+        Returns:
+            List[Dict[str, str]]: The records, an empty list once the iterator is exhausted.
+    """
+    return list(itertools.islice(iterator, batch_size))
+
+
+class AsyncPasswordManager:
+    """
+        An asyncio facade over PasswordManager for serving many users from one event loop.
+
+        Every method runs the blocking file, database and encryption work of the wrapped PasswordManager
+        in a bounded thread pool executor, so the event loop keeps serving other users while it runs.
+        Writes to one user's vault (save, update, delete, import, compact) are queued on a per-user asyncio.Lock
+        and run one at a time, in call order, even across AsyncPasswordManager instances of the same user;
+        reads do not wait for them. The wrapped manager is quiet, status messages are not printed.
+
+        Attributes:
+            - manager: PasswordManager
+                The wrapped synchronous manager.
+            - executor: ThreadPoolExecutor
+                The executor running the blocking work, the shared one from get_async_executor by default.
+
+        Methods:
+            - open(user_id: str, user_name: str, storage: Optional[StorageBackend],
+                   executor: Optional[ThreadPoolExecutor]) -> AsyncPasswordManager
+                Creates the manager of a user, loading or creating the user's key in the executor.
+
+            - save(website: str, login: str, password: str) -> None
+                Encrypts and saves credentials for a website.
+
+            - update(website: str, login: str, password: str) -> bool
+                Replaces the stored credentials of a website.
+
+            - delete(website: str) -> bool
+                Deletes the stored credentials of a website.
+
+            - import_credentials(credentials: Iterable[Mapping[str, str]], chunk_size: int) -> int
+                Encrypts and saves many credentials at once.
+
+            - compact() -> bool
+                Rewrites the user's vault with only its live records.
+
+            - get(website: str) -> List[Dict[str, str]]
+                Returns the credentials stored for one website.
+
+            - iter_credentials(batch_size: int, parallel: bool) -> AsyncIterator[Dict[str, str]]
+                Yields the user's decrypted credentials, decrypted in batches in the executor.
+
+            - save_audit_log(action: str) -> None
+                Saves an audit log entry.
+
+            - audit_tail(count: int) -> List[str]
+                Returns the most recent audit log entries.
+
+            - audit_page(page: int, page_size: int) -> List[str]
+                Returns one page of the audit history.
+
+            - audit_range(since: Optional[datetime.datetime], until: Optional[datetime.datetime]) -> List[str]
+                Returns the audit log entries of a time range.
+    """
+    def __init__(self, manager: PasswordManager, executor: Optional[ThreadPoolExecutor] = None):
+        """
+            Wrap an existing PasswordManager.
+
+            The user's key is loaded by the first operation that needs it, AsyncPasswordManager.open loads it ahead.
+
+            Args:
+                manager (PasswordManager): The manager to wrap, it is made quiet.
+                executor (Optional[ThreadPoolExecutor]): Executor for the blocking work, the shared one if None.
+        """
+        manager.quiet = True
+        self.manager: PasswordManager = manager
+        self.executor: ThreadPoolExecutor = executor or get_async_executor()
+
+        # The key of the user's write lock, the same for every manager of the user on the same storage
+        self._lock_key: str = manager.storage.key_ring_id(manager.user)
+
+    @classmethod
+    async def open(cls, user_id: str, user_name: str, storage: Optional[StorageBackend] = None,
+                   executor: Optional[ThreadPoolExecutor] = None) -> 'AsyncPasswordManager':
+        """
+            Create the manager of a user without blocking the event loop.
+
+            Args:
+                user_id (str): User ID.
+                user_name (str): User's name.
+                storage (Optional[StorageBackend]): Storage backend, the process default if None.
+                executor (Optional[ThreadPoolExecutor]): Executor for the blocking work, the shared one if None.
+
+            Returns:
+                AsyncPasswordManager: The manager.
+        """
+        # Resolve the default storage on the loop thread, so concurrent opens share one instance
+        storage = storage or get_default_storage()
+        executor = executor or get_async_executor()
+        manager: PasswordManager = PasswordManager(user_id, user_name, storage, quiet=True)
+
+        # The key is loaded lazily, load it now so the first operation does not pay for it
+        await asyncio.get_running_loop().run_in_executor(executor, manager.user.load_or_create_key)
+        return cls(manager, executor)
+
+    async def _run(self, func: Callable[..., Result], *args) -> Result:
+        """
+            Run a blocking call in the executor and wait for its result.
+
+            Args:
+                func (Callable[..., Result]): The function.
+                *args: Its arguments.
+
+            Returns:
+                Result: What the function returned.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(func, *args))
+
+    async def _write(self, func: Callable[..., Result], *args) -> Result:
+        """
+            Run a blocking vault write in the executor once the user's earlier writes are done.
+
+            Args:
+                func (Callable[..., Result]): The function.
+                *args: Its arguments.
+
+            Returns:
+                Result: What the function returned.
+        """
+        async with _write_lock(self._lock_key):
+            return await self._run(func, *args)
+
+    async def save(self, website: str, login: str, password: str) -> None:
+        """
+            Encrypt and save user credentials, replacing any stored for the same website.
+
+            Args:
+                website (str): Website name.
+                login (str): User login.
+                password (str): User password.
+        """
+        await self._write(self.manager.encrypt_save_credentials, website, login, password)
+
+    async def update(self, website: str, login: str, password: str) -> bool:
+        """
+            Replace the stored credentials of a website.
+
+            Args:
+                website (str): Website name.
+                login (str): New user login.
+                password (str): New user password.
+
+            Returns:
+                bool: True if the credentials were updated, False if none are stored for the website.
+        """
+        return await self._write(self.manager.update_credentials, website, login, password)
+
+    async def delete(self, website: str) -> bool:
+        """
+            Delete the stored credentials of a website.
+
+            Args:
+                website (str): Website name.
+
+            Returns:
+                bool: True if the credentials were deleted, False if none are stored for the website.
+        """
+        return await self._write(self.manager.delete_credentials, website)
+
+    async def import_credentials(self, credentials: Iterable[Mapping[str, str]],
+                                 chunk_size: int = IMPORT_CHUNK_SIZE) -> int:
+        """
+            Encrypt and save many user credentials at once.
+
+            The credentials are consumed in the executor, a lazy iterable must not depend on the event loop.
+
+            Args:
+                credentials (Iterable[Mapping[str, str]]): Records with 'website', 'login' and 'password' keys.
+                chunk_size (int): Number of encrypted records written to the vault at a time.
+
+            Returns:
+                int: The number of imported records.
+        """
+        return await self._write(self.manager.import_credentials, credentials, chunk_size)
+
+    async def compact(self) -> bool:
+        """
+            Rewrite the user's vault with only its live records.
+
+            Returns:
+                bool: True if the vault was compacted, False if there was nothing to compact.
+        """
+        return await self._write(self.manager.compact_credentials)
+
+    async def get(self, website: str) -> List[Dict[str, str]]:
+        """
+            Return the credentials stored for one website.
+
+            Args:
+                website (str): Website name.
+
+            Returns:
+                List[Dict[str, str]]: The matching records, empty if the website has no credentials.
+        """
+        return await self._run(self.manager.get_credentials, website)
+
+    async def iter_credentials(self, batch_size: int = ITER_BATCH_SIZE,
+                               parallel: bool = False) -> AsyncIterator[Dict[str, str]]:
+        """
+            Iterate over the user's stored credentials.
+
+            The records are read and decrypted in the executor batch_size at a time, so the event loop
+            only waits for one batch and memory use does not depend on the size of the vault.
+
+            Args:
+                batch_size (int): Number of records decrypted per executor call.
+                parallel (bool): Decrypt large files on a process pool, see PasswordManager.iter_credentials.
+
+            Yields:
+                Dict[str, str]: One credential record with 'website', 'login' and 'password' keys.
+
+            Raises:
+                FileNotFoundError: If the user's data file is not found (file storage).
+        """
+        iterator: Iterator[Dict[str, str]] = self.manager.iter_credentials(parallel)
+        pending: Optional[Future] = None
+        try:
+            while True:
+                pending = self.executor.submit(_next_batch, iterator, batch_size)
+                batch: List[Dict[str, str]] = await asyncio.wrap_future(pending)
+                if not batch:
+                    break
+                for credentials in batch:
+                    yield credentials
+        finally:
+            # Release the open vault file if the caller stopped early. A cancelled caller can leave a batch
+            # still running in a worker thread, the iterator is then closed once that batch is done.
+            if pending is None:
+                iterator.close()
+            else:
+                pending.add_done_callback(lambda _: iterator.close())
+
+    async def save_audit_log(self, action: str) -> None:
+        """
+            Save an audit log entry.
+
+            Args:
+                action (str): The action to be logged.
+        """
+        await self._run(self.manager.save_audit_log, action)
+
+    async def audit_tail(self, count: int) -> List[str]:
+        """
+            Return the most recent audit log entries.
+
+            Args:
+                count (int): Number of entries to return.
+
+            Returns:
+                List[str]: Up to count entries, oldest first.
+        """
+        return await self._run(self.manager.user.tail_audit_history, count)
+
+    async def audit_page(self, page: int, page_size: int = 100) -> List[str]:
+        """
+            Return one page of the audit history.
+
+            Args:
+                page (int): Zero-based page number, page 0 holds the oldest entries.
+                page_size (int): Number of entries per page.
+
+            Returns:
+                List[str]: The entries of the page, an empty list past the last page.
+        """
+        return await self._run(self.manager.user.get_audit_page, page, page_size)
+
+    async def audit_range(self, since: Optional[datetime.datetime] = None,
+                          until: Optional[datetime.datetime] = None) -> List[str]:
+        """
+            Return the audit log entries of a time range.
+
+            Args:
+                since (Optional[datetime.datetime]): Earliest time to include, from the start of the log if None.
+                until (Optional[datetime.datetime]): Latest time to include, to the end of the log if None.
+
+            Returns:
+                List[str]: The matching entries, oldest first.
+        """
+        return await self._run(lambda: list(self.manager.user.get_audit_range(since, until)))
@@ -0,0 +1,595 @@
+import datetime
+import gzip
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import IO, Deque, Iterator, List, Optional, Set, Tuple
+from AuditLogReader import AuditLogReader, check_audit_page, entry_timestamp_key, timestamp_key
+from FileLock import FileLock, user_lock
+
+# First line of every segment manifest
+SEGMENT_MANIFEST_HEADER: str = '#psm-audit-segments v1'
+
+# Default gzip level of archived segments; audit entries repeat the same user label and actions, so even
+# fast levels compress them well
+SEGMENT_COMPRESS_LEVEL: int = 6
+
+# One archived segment of an audit log, as listed in its manifest:
+# (sequence number, first timestamp key, last timestamp key, entries, uncompressed bytes, stored bytes)
+SegmentInfo = Tuple[int, int, int, int, int, int]
+
+
+class AuditRotationPolicy:
+    """
+        When the audit writer rotates an active audit file into a segment, and how long segments are kept.
+
+        The active file is rotated once it holds max_bytes bytes or its first entry is max_age seconds old,
+        whichever comes first. Rotated segments are compressed with gzip by the shared AuditArchiver; then the
+        oldest segments are deleted while their last entry is older than retention_age seconds or
+        all segments together take more than retention_bytes bytes. None disables a limit.
+
+        Attributes:
+            - max_bytes (Optional[int]): Size of the active file that triggers a rotation.
+            - max_age (Optional[float]): Age in seconds of the oldest active entry that triggers a rotation.
+            - retention_age (Optional[float]): Age in seconds after which a segment's last entry is deleted.
+            - retention_bytes (Optional[int]): Maximum stored size of all segments of one audit log.
+            - compress_level (int): gzip compression level of the segments.
+    """
+    def __init__(self, max_bytes: Optional[int] = 16 * 1024 * 1024, max_age: Optional[float] = None,
+                 retention_age: Optional[float] = None, retention_bytes: Optional[int] = None,
+                 compress_level: int = SEGMENT_COMPRESS_LEVEL):
+        """
+            Initialize the AuditRotationPolicy instance.
+
+            Args:
+                max_bytes (Optional[int]): Size of the active file that triggers a rotation.
+                max_age (Optional[float]): Age in seconds of the oldest active entry that triggers a rotation.
+                retention_age (Optional[float]): Seconds a segment is kept after its last entry.
+                retention_bytes (Optional[int]): Maximum stored size of all segments of one audit log.
+                compress_level (int): gzip compression level of the segments, 1 (fastest) to 9 (smallest).
+        """
+        self.max_bytes: Optional[int] = max_bytes
+        self.max_age: Optional[float] = max_age
+        self.retention_age: Optional[float] = retention_age
+        self.retention_bytes: Optional[int] = retention_bytes
+        self.compress_level: int = compress_level
+
+    def rotation_due(self, size: int, first_entry_time: Optional[float]) -> bool:
+        """
+            Check whether an active audit file must be rotated.
+
+            Args:
+                size (int): Size of the active file.
+                first_entry_time (Optional[float]): Unix time of its first entry, None if unknown or empty.
+
+            Returns:
+                bool: True if the file has reached the size or age limit.
+        """
+        if size == 0:
+            return False
+        if self.max_bytes is not None and size >= self.max_bytes:
+            return True
+        return self.max_age is not None and first_entry_time is not None and \
+            time.time() - first_entry_time >= self.max_age
+
+
+def manifest_file(audit_file: str) -> str:
+    """
+        Return the path of the manifest listing the archived segments of an audit file.
+
+        Args:
+            audit_file (str): Path of the active audit file.
+
+        Returns:
+            str: The manifest path.
+    """
+    return f'{audit_file}.segments'
+
+
+def raw_segment_file(audit_file: str, sequence: int) -> str:
+    """
+        Return the path a rotated, not yet compressed segment of an audit file has.
+
+        Args:
+            audit_file (str): Path of the active audit file.
+            sequence (int): Sequence number of the segment.
+
+        Returns:
+            str: The segment path.
+    """
+    return f'{audit_file}.{sequence:06d}'
+
+
+def segment_file(audit_file: str, sequence: int) -> str:
+    """
+        Return the path of a compressed segment of an audit file.
+
+        Args:
+            audit_file (str): Path of the active audit file.
+            sequence (int): Sequence number of the segment.
+
+        Returns:
+            str: The segment path.
+    """
+    return f'{raw_segment_file(audit_file, sequence)}.gz'
+
+
+def read_manifest(audit_file: str) -> List[SegmentInfo]:
+    """
+        Read the list of archived segments of an audit file.
+
+        Args:
+            audit_file (str): Path of the active audit file.
+
+        Returns:
+            List[SegmentInfo]: The segments, oldest first; empty if the log was never rotated.
+    """
+    segments: List[SegmentInfo] = []
+    try:
+        with open(manifest_file(audit_file), 'r', encoding='utf-8') as manifest:
+            if manifest.readline().strip() != SEGMENT_MANIFEST_HEADER:
+                return []
+            for line in manifest:
+                if line.endswith('\n'):
+                    sequence, first_key, last_key, entries, raw_size, stored_size = map(int, line.split())
+                    segments.append((sequence, first_key, last_key, entries, raw_size, stored_size))
+    except FileNotFoundError:
+        return []
+    return segments
+
+
+def audit_lock(lock_dir: str) -> FileLock:
+    """
+        Return the lock of a user's audit file, held while entries are appended, the file is rotated
+        and its manifest is read or changed.
+
+        Args:
+            lock_dir (str): The user's lock directory.
+
+        Returns:
+            FileLock: The lock, created on first use.
+    """
+    return user_lock(lock_dir, 'audit')
+
+
+def _write_manifest(audit_file: str, segments: List[SegmentInfo]) -> None:
+    """
+        Replace the manifest of an audit file atomically. The caller holds the audit file lock.
+
+        Args:
+            audit_file (str): Path of the active audit file.
+            segments (List[SegmentInfo]): The segments, oldest first.
+    """
+    temp_file: str = f'{manifest_file(audit_file)}.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as manifest:
+        manifest.write(f'{SEGMENT_MANIFEST_HEADER}\n')
+        manifest.writelines(' '.join(map(str, segment)) + '\n' for segment in segments)
+    os.replace(temp_file, manifest_file(audit_file))
+
+
+def pending_sequences(audit_file: str, segments: List[SegmentInfo]) -> List[int]:
+    """
+        Find the rotated segments of an audit file that are not archived yet.
+
+        Rotations number segments consecutively after the last archived one, so the pending ones are found
+        by probing the following sequence numbers instead of listing the directory.
+
+        Args:
+            audit_file (str): Path of the active audit file.
+            segments (List[SegmentInfo]): The archived segments, from read_manifest.
+
+        Returns:
+            List[int]: Sequence numbers of the pending segments, oldest first.
+    """
+    sequence: int = segments[-1][0] + 1 if segments else 1
+    sequences: List[int] = []
+    while os.path.exists(raw_segment_file(audit_file, sequence)):
+        sequences.append(sequence)
+        sequence += 1
+    return sequences
+
+
+def segment_files(audit_file: str) -> List[str]:
+    """
+        List the existing files of an audit log besides the active file: its manifest, archived and pending segments.
+
+        Args:
+            audit_file (str): Path of the active audit file.
+
+        Returns:
+            List[str]: The paths, empty for a log that was never rotated.
+    """
+    segments: List[SegmentInfo] = read_manifest(audit_file)
+    paths: List[str] = [segment_file(audit_file, segment[0]) for segment in segments]
+    paths += [raw_segment_file(audit_file, sequence) for sequence in pending_sequences(audit_file, segments)]
+    paths.append(manifest_file(audit_file))
+    return [path for path in paths if os.path.exists(path)]
+
+
+def rotate_audit_file(audit_file: str) -> str:
+    """
+        Turn the active audit file into a pending segment with a single rename; the next entry starts a new file.
+
+        The caller holds the audit file lock.
+
+        Args:
+            audit_file (str): Path of the active audit file.
+
+        Returns:
+            str: Path of the pending segment.
+    """
+    segments: List[SegmentInfo] = read_manifest(audit_file)
+    pending: List[int] = pending_sequences(audit_file, segments)
+    sequence: int = pending[-1] + 1 if pending else (segments[-1][0] + 1 if segments else 1)
+    segment: str = raw_segment_file(audit_file, sequence)
+    os.rename(audit_file, segment)
+    return segment
+
+
+def first_entry_time(audit_file: IO[bytes]) -> Optional[float]:
+    """
+        Read the time of the first entry of an audit file.
+
+        Args:
+            audit_file (IO[bytes]): The audit file, opened for binary reading.
+
+        Returns:
+            Optional[float]: The Unix time of the entry, None if the file is empty or does not start with an entry.
+    """
+    audit_file.seek(0)
+    key: Optional[int] = entry_timestamp_key(audit_file.readline())
+    if key is None:
+        return None
+    return datetime.datetime.strptime(str(key), '%Y%m%d%H%M%S').timestamp()
+
+
+def archive_audit_file(audit_file: str, lock_dir: str, policy: AuditRotationPolicy) -> None:
+    """
+        Compress the pending segments of an audit file, list them in its manifest and apply the retention limits.
+
+        Compression runs without the audit file lock; the lock is only held to update the manifest and delete files,
+        so the audit writer never waits for it. The steps can be repeated after an interruption, and archivers
+        of other processes may archive the same file at the same time: each compresses into its own temporary file
+        and a segment another archiver listed in the manifest meanwhile is skipped.
+
+        Args:
+            audit_file (str): Path of the active audit file.
+            lock_dir (str): The user's lock directory.
+            policy (AuditRotationPolicy): The compression level and retention limits.
+    """
+    lock: FileLock = audit_lock(lock_dir)
+    with lock:
+        pending: List[int] = pending_sequences(audit_file, read_manifest(audit_file))
+
+    for sequence in pending:
+        raw_file: str = raw_segment_file(audit_file, sequence)
+        compressed_file: str = segment_file(audit_file, sequence)
+
+        # Compress the segment, counting its entries and the timestamps of its first and last one
+        entries: int = 0
+        first_key: int = 0
+        last_key: int = 0
+        try:
+            source: IO[bytes] = open(raw_file, 'rb')
+        except FileNotFoundError:
+            # Another archiver has archived the segment already
+            continue
+        temp_file: str = f'{compressed_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with source, gzip.open(temp_file, 'wb', compresslevel=policy.compress_level) as target:
+            for line in source:
+                key: Optional[int] = entry_timestamp_key(line)
+                if key is not None:
+                    first_key = first_key or key
+                    last_key = key
+                entries += 1
+                target.write(line)
+            raw_size: int = source.tell()
+
+        with lock:
+            segments: List[SegmentInfo] = read_manifest(audit_file)
+            if any(segment[0] == sequence for segment in segments):
+                # Another archiver listed the segment while this one compressed it
+                os.remove(temp_file)
+                continue
+            os.replace(temp_file, compressed_file)
+            segments.append((sequence, first_key, last_key, entries, raw_size, os.path.getsize(compressed_file)))
+            _write_manifest(audit_file, segments)
+            os.remove(raw_file)
+
+    apply_retention(audit_file, lock_dir, policy)
+
+
+def apply_retention(audit_file: str, lock_dir: str, policy: AuditRotationPolicy) -> None:
+    """
+        Delete the oldest archived segments of an audit file that exceed the retention limits.
+
+        Args:
+            audit_file (str): Path of the active audit file.
+            lock_dir (str): The user's lock directory.
+            policy (AuditRotationPolicy): The retention limits.
+    """
+    if policy.retention_age is None and policy.retention_bytes is None:
+        return
+
+    cutoff_key: int = 0
+    if policy.retention_age is not None:
+        cutoff_key = timestamp_key(datetime.datetime.now() - datetime.timedelta(seconds=policy.retention_age))
+
+    with audit_lock(lock_dir):
+        segments: List[SegmentInfo] = read_manifest(audit_file)
+        stored_size: int = sum(segment[5] for segment in segments)
+        expired: int = 0
+        for segment in segments:
+            too_old: bool = segment[2] < cutoff_key
+            too_big: bool = policy.retention_bytes is not None and stored_size > policy.retention_bytes
+            if not (too_old or too_big):
+                break
+            stored_size -= segment[5]
+            expired += 1
+        if not expired:
+            return
+
+        # Drop the segments from the manifest first, so readers never look for a deleted file
+        _write_manifest(audit_file, segments[expired:])
+        for segment in segments[:expired]:
+            try:
+                os.remove(segment_file(audit_file, segment[0]))
+            except FileNotFoundError:
+                pass
+
+
+def iter_segment_lines(path: str) -> Iterator[bytes]:
+    """
+        Iterate over the entries of a segment, compressed or pending.
+
+        Args:
+            path (str): Path of the segment. A pending segment archived meanwhile is read from its compressed file.
+
+        Yields:
+            bytes: Each entry with its trailing newline; nothing if retention deleted the segment meanwhile.
+    """
+    try:
+        segment: IO[bytes] = gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+    except FileNotFoundError:
+        if path.endswith('.gz'):
+            return
+        # The archiver lists the compressed segment before it deletes the pending one, so it exists now
+        yield from iter_segment_lines(f'{path}.gz')
+        return
+    with segment:
+        yield from segment
+
+
+class AuditHistory:
+    """
+        Queries over the whole audit history of a user: the archived segments, the rotated segments
+        still waiting for the archiver and the active audit file, read in that order as one log.
+
+        Archived segments are streamed from their gzip files and skipped without decompressing when the manifest
+        shows they hold none of the requested entries; the active file is read through its AuditLogReader.
+        The list of segments is taken under the audit file lock, as rotations and archiving change it.
+
+        Attributes:
+            - audit_file (str): Path of the active audit file.
+            - lock_dir (str): The user's lock directory.
+            - active (AuditLogReader): The reader of the active audit file.
+    """
+    def __init__(self, audit_file: str, index_file: str, lock_dir: str):
+        """
+            Initialize the AuditHistory instance.
+
+            Args:
+                audit_file (str): Path of the active audit file.
+                index_file (str): Path of the sparse index file of the active audit file.
+                lock_dir (str): The user's lock directory.
+        """
+        self.audit_file: str = audit_file
+        self.lock_dir: str = lock_dir
+        self.active: AuditLogReader = AuditLogReader(audit_file, index_file)
+
+    def iter_entries(self) -> Iterator[str]:
+        """
+            Iterate over every entry of the history, holding one segment open at a time.
+
+            Yields:
+                str: Each entry with its trailing newline, oldest first.
+        """
+        segments, pending = self._segments()
+        for path in self._segment_paths(segments, pending):
+            for line in iter_segment_lines(path):
+                yield line.decode()
+        yield from self.active.iter_entries()
+
+    def tail(self, count: int) -> List[str]:
+        """
+            Return the last entries of the history, reading segments from the newest one only as far as needed.
+
+            Args:
+                count (int): Number of entries to return.
+
+            Returns:
+                List[str]: Up to count entries, oldest first.
+        """
+        entries: List[str] = self.active.tail(count)
+        if len(entries) >= count:
+            return entries
+
+        segments, pending = self._segments()
+        for path in reversed(self._segment_paths(segments, pending)):
+            needed: int = count - len(entries)
+            last_lines: Deque[bytes] = deque(iter_segment_lines(path), maxlen=needed)
+            entries = [line.decode() for line in last_lines] + entries
+            if len(entries) >= count:
+                break
+        return entries
+
+    def page(self, number: int, size: int) -> List[str]:
+        """
+            Return one page of the history; archived segments before the page are skipped by their entry count.
+
+            Args:
+                number (int): Zero-based page number, page 0 holds the oldest entries.
+                size (int): Number of entries per page.
+
+            Returns:
+                List[str]: The entries of the page, an empty list past the last page.
+
+            Raises:
+                ValueError: If the page number is negative or the page size is not positive.
+        """
+        check_audit_page(number, size)
+        first_entry: int = number * size
+        segments, pending = self._segments()
+
+        # Skip the archived segments that end before the page
+        skipped: int = 0
+        while skipped < len(segments) and first_entry >= segments[skipped][3]:
+            first_entry -= segments[skipped][3]
+            skipped += 1
+
+        entries: List[str] = []
+        for path in self._segment_paths(segments[skipped:], pending):
+            for line in iter_segment_lines(path):
+                if first_entry:
+                    first_entry -= 1
+                    continue
+                entries.append(line.decode())
+                if len(entries) == size:
+                    return entries
+        return entries + self.active.entries(first_entry, size - len(entries))
+
+    def between(self, since: Optional[datetime.datetime] = None,
+                until: Optional[datetime.datetime] = None) -> Iterator[str]:
+        """
+            Iterate over the entries logged in a time range, skipping the archived segments outside it.
+
+            Args:
+                since (Optional[datetime.datetime]): Earliest time to include, from the start of the log if None.
+                until (Optional[datetime.datetime]): Latest time to include, to the end of the log if None.
+
+            Yields:
+                str: Each matching entry with its trailing newline, oldest first.
+        """
+        since_key: Optional[int] = timestamp_key(since) if since is not None else None
+        until_key: Optional[int] = timestamp_key(until) if until is not None else None
+        segments, pending = self._segments()
+
+        # Archived segments are in time order, the manifest tells which ones overlap the range
+        segments = [segment for segment in segments if since_key is None or segment[2] >= since_key]
+        if until_key is not None:
+            segments = [segment for segment in segments if segment[1] <= until_key]
+
+        current_key: Optional[int] = None
+        for path in self._segment_paths(segments, pending):
+            for line in iter_segment_lines(path):
+                current_key = entry_timestamp_key(line) or current_key
+                if current_key is None or (since_key is not None and current_key < since_key):
+                    continue
+                if until_key is not None and current_key > until_key:
+                    return
+                yield line.decode()
+        yield from self.active.between(since, until)
+
+    def _segments(self) -> Tuple[List[SegmentInfo], List[int]]:
+        """
+            List the archived and the pending segments of the audit file.
+
+            Returns:
+                Tuple[List[SegmentInfo], List[int]]: The archived segments and the sequence numbers of the pending
+                ones, oldest first; both empty for a log that was never rotated.
+        """
+        # A log that was never rotated needs no lock
+        if not os.path.exists(manifest_file(self.audit_file)) and \
+                not os.path.exists(raw_segment_file(self.audit_file, 1)):
+            return [], []
+
+        with audit_lock(self.lock_dir):
+            segments: List[SegmentInfo] = read_manifest(self.audit_file)
+            return segments, pending_sequences(self.audit_file, segments)
+
+    def _segment_paths(self, segments: List[SegmentInfo], pending: List[int]) -> List[str]:
+        """
+            Return the paths of archived and pending segments in log order.
+
+            Args:
+                segments (List[SegmentInfo]): Archived segments.
+                pending (List[int]): Sequence numbers of pending segments.
+
+            Returns:
+                List[str]: The paths, oldest first.
+        """
+        return ([segment_file(self.audit_file, segment[0]) for segment in segments] +
+                [raw_segment_file(self.audit_file, sequence) for sequence in pending])
+
+
+class AuditArchiver:
+    """
+        Compresses rotated audit segments and applies retention on a background thread,
+        so that the audit writer only pays for the rename of a rotation.
+
+        Audit files are queued by schedule(); a file queued again before it is processed is archived once.
+    """
+    def __init__(self):
+        """
+            Initialize an idle AuditArchiver; its thread starts with the first scheduled file.
+        """
+        self._queue: 'queue.Queue[Tuple[str, str, AuditRotationPolicy]]' = queue.Queue()
+        self._queued: Set[str] = set()
+        self._guard: threading.Lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def schedule(self, audit_file: str, lock_dir: str, policy: AuditRotationPolicy) -> None:
+        """
+            Queue an audit file whose pending segments need archiving.
+
+            Args:
+                audit_file (str): Path of the active audit file.
+                lock_dir (str): The user's lock directory.
+                policy (AuditRotationPolicy): The compression level and retention limits.
+        """
+        with self._guard:
+            if audit_file in self._queued:
+                return
+            self._queued.add(audit_file)
+            self._queue.put((audit_file, lock_dir, policy))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='audit-archiver', daemon=True)
+                self._thread.start()
+
+    def wait(self) -> None:
+        """
+            Wait until every queued audit file is archived.
+        """
+        self._queue.join()
+
+    def _run(self) -> None:
+        """
+            Background thread loop, archives the queued audit files one at a time.
+        """
+        while True:
+            audit_file, lock_dir, policy = self._queue.get()
+            with self._guard:
+                self._queued.discard(audit_file)
+            try:
+                archive_audit_file(audit_file, lock_dir, policy)
+            except OSError:
+                # The segments stay pending and are archived with the next rotation of the file
+                pass
+            finally:
+                self._queue.task_done()
+
+
+# The archiver shared by every audit writer in the process
+_audit_archiver: AuditArchiver = AuditArchiver()
+
+
+def get_audit_archiver() -> AuditArchiver:
+    """
+        Return the archiver shared by every audit writer in the process.
+
+        Returns:
+            AuditArchiver: The shared archiver.
+    """
+    return _audit_archiver
@@ -0,0 +1,381 @@
+import bisect
+import datetime
+import mmap
+import os
+import threading
+from typing import Iterator, List, Optional, Tuple
+
+# First line of every audit index file, followed by the stride the index was built with
+AUDIT_INDEX_HEADER: str = '#psm-audit-index v1'
+
+# Every AUDIT_INDEX_STRIDE-th audit entry gets a checkpoint in the sparse index
+AUDIT_INDEX_STRIDE: int = 1000
+
+# Length of the timestamp at the start of every audit entry, 'DD-MM-YYYY HH:MM:SS'
+TIMESTAMP_LENGTH: int = 19
+
+
+def timestamp_key(moment: datetime.datetime) -> int:
+    """
+        Convert a datetime into the sortable integer used to compare audit timestamps.
+
+        Args:
+            moment (datetime.datetime): The point in time.
+
+        Returns:
+            int: The time as YYYYMMDDhhmmss.
+    """
+    return int(moment.strftime('%Y%m%d%H%M%S'))
+
+
+def entry_timestamp_key(entry: bytes) -> Optional[int]:
+    """
+        Read the timestamp at the start of an audit entry as a sortable integer.
+
+        Slicing the fixed-width fields is much cheaper than datetime.strptime, which matters when scanning large logs.
+
+        Args:
+            entry (bytes): One line of the audit file.
+
+        Returns:
+            Optional[int]: The time as YYYYMMDDhhmmss, or None if the line does not start with a timestamp.
+    """
+    try:
+        return int(entry[6:10] + entry[3:5] + entry[0:2] + entry[11:13] + entry[14:16] + entry[17:19])
+    except ValueError:
+        return None
+
+
+def check_audit_page(number: int, size: int) -> None:
+    """
+        Make sure a page of an audit log can be read, so a bad page never turns into a read of the whole log.
+
+        Args:
+            number (int): Zero-based page number.
+            size (int): Number of entries per page.
+
+        Raises:
+            ValueError: If the page number is negative or the page size is not positive.
+    """
+    if number < 0:
+        raise ValueError(f'The page number must not be negative, got {number}')
+    if size <= 0:
+        raise ValueError(f'The page size must be positive, got {size}')
+
+
+class AuditLogReader:
+    """
+        Tail, paged and time-range queries over a user's audit file that do not read the whole file.
+
+        - tail(n) reads backwards from the end of the memory-mapped file.
+        - page(number, size) and between(since, until) use a sparse index with a checkpoint for every
+          AUDIT_INDEX_STRIDE-th entry: (entry number, byte offset, timestamp). A query seeks to the
+          nearest checkpoint and reads forward only over the relevant byte range.
+
+        The index is kept in its own file. It is extended incrementally from its last checkpoint
+        and rebuilt if it does not match the audit file any more.
+
+        Attributes:
+            - audit_file (str): Path of the audit file.
+            - index_file (str): Path of the sparse index file.
+            - stride (int): Number of entries between two checkpoints.
+    """
+    def __init__(self, audit_file: str, index_file: str, stride: int = AUDIT_INDEX_STRIDE):
+        """
+            Initialize the AuditLogReader instance.
+
+            Args:
+                audit_file (str): Path of the audit file.
+                index_file (str): Path of the sparse index file.
+                stride (int): Number of entries between two checkpoints.
+        """
+        self.audit_file: str = audit_file
+        self.index_file: str = index_file
+        self.stride: int = stride
+
+        # Checkpoints as (entry number, byte offset, timestamp key), in file order
+        self._checkpoints: List[Tuple[int, int, int]] = []
+
+        # Number of complete entries and bytes of the audit file covered by the checkpoints
+        self._entry_count: int = 0
+        self._covered_size: int = 0
+        self._loaded: bool = False
+
+        # Held while the checkpoints are brought up to date, readers in several threads may share this reader
+        self._lock: threading.Lock = threading.Lock()
+
+    def tail(self, count: int) -> List[str]:
+        """
+            Return the last entries of the audit file.
+
+            Args:
+                count (int): Number of entries to return.
+
+            Returns:
+                List[str]: Up to count entries, oldest first, each with its trailing newline.
+        """
+        if count <= 0:
+            return []
+        try:
+            with open(self.audit_file, 'rb') as audit_file:
+                if os.fstat(audit_file.fileno()).st_size == 0:
+                    return []
+                with mmap.mmap(audit_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    end: int = len(mapped)
+
+                    # Ignore the newline that ends the last entry
+                    position: int = end - 1 if mapped[end - 1:end] == b'\n' else end
+                    for _ in range(count):
+                        position = mapped.rfind(b'\n', 0, position)
+                        if position < 0:
+                            break
+                    return mapped[position + 1:end].decode().splitlines(keepends=True)
+
+        except FileNotFoundError:
+            return []
+
+    def page(self, number: int, size: int) -> List[str]:
+        """
+            Return one page of the audit file.
+
+            Args:
+                number (int): Zero-based page number, page 0 holds the oldest entries.
+                size (int): Number of entries per page.
+
+            Returns:
+                List[str]: The entries of the page, an empty list past the last page.
+
+            Raises:
+                ValueError: If the page number is negative or the page size is not positive.
+        """
+        check_audit_page(number, size)
+        return self.entries(number * size, size)
+
+    def entries(self, first_entry: int, count: int) -> List[str]:
+        """
+            Return consecutive entries of the audit file.
+
+            Args:
+                first_entry (int): Zero-based number of the first entry.
+                count (int): Maximum number of entries.
+
+            Returns:
+                List[str]: The entries, an empty list past the last entry or for a count that is not positive.
+
+            Raises:
+                ValueError: If the first entry number is negative.
+        """
+        if first_entry < 0:
+            raise ValueError(f'The first entry number must not be negative, got {first_entry}')
+        if count <= 0:
+            return []
+        self._refresh()
+
+        # Start from the last checkpoint at or before the first entry of the page
+        position: int = bisect.bisect_right(self._checkpoints, (first_entry, float('inf'), 0)) - 1
+        entry_number, offset, _ = self._checkpoints[position] if position >= 0 else (0, 0, 0)
+
+        entries: List[str] = []
+        for line in self._read_from(offset):
+            if entry_number >= first_entry:
+                entries.append(line.decode())
+                if len(entries) == count:
+                    break
+            entry_number += 1
+        return entries
+
+    def between(self, since: Optional[datetime.datetime] = None,
+                until: Optional[datetime.datetime] = None) -> Iterator[str]:
+        """
+            Iterate over the entries logged in a time range.
+
+            Args:
+                since (Optional[datetime.datetime]): Earliest time to include, from the start of the log if None.
+                until (Optional[datetime.datetime]): Latest time to include, to the end of the log if None.
+
+            Yields:
+                str: Each matching entry with its trailing newline, oldest first.
+        """
+        since_key: Optional[int] = timestamp_key(since) if since is not None else None
+        until_key: Optional[int] = timestamp_key(until) if until is not None else None
+        self._refresh()
+
+        offset: int = 0
+        if since_key is not None:
+            # Start from the last checkpoint strictly before the range, entries with the same
+            # timestamp as the range start may come before a checkpoint that has it
+            keys: List[int] = [checkpoint[2] for checkpoint in self._checkpoints]
+            position: int = bisect.bisect_left(keys, since_key) - 1
+            if position >= 0:
+                offset = self._checkpoints[position][1]
+
+        current_key: Optional[int] = None
+        for line in self._read_from(offset):
+            current_key = entry_timestamp_key(line) or current_key
+            if current_key is None or (since_key is not None and current_key < since_key):
+                continue
+            if until_key is not None and current_key > until_key:
+                break
+            yield line.decode()
+
+    def iter_entries(self) -> Iterator[str]:
+        """
+            Iterate over every complete entry of the audit file, reading it sequentially.
+
+            Yields:
+                str: Each entry with its trailing newline, oldest first.
+        """
+        for line in self._read_from(0):
+            yield line.decode()
+
+    def _read_from(self, offset: int) -> Iterator[bytes]:
+        """
+            Iterate over the complete entries of the audit file from a byte offset.
+
+            Args:
+                offset (int): Offset of the first entry to read.
+
+            Yields:
+                bytes: Each entry with its trailing newline.
+        """
+        try:
+            with open(self.audit_file, 'rb') as audit_file:
+                audit_file.seek(offset)
+                for line in audit_file:
+                    # Stop at an entry that is still being written
+                    if not line.endswith(b'\n'):
+                        return
+                    yield line
+        except FileNotFoundError:
+            return
+
+    def _refresh(self) -> None:
+        """
+            Bring the sparse index up to date with the audit file.
+
+            Loads the index file on first use, checks that its last checkpoint still matches the audit file
+            (rebuilding it otherwise) and adds checkpoints for the entries appended since.
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+                self._loaded = True
+
+            try:
+                audit_size: int = os.path.getsize(self.audit_file)
+            except FileNotFoundError:
+                audit_size = 0
+
+            if audit_size < self._covered_size or not self._last_checkpoint_matches():
+                # The audit file was replaced or truncated, start over
+                self._checkpoints = []
+                self._entry_count = 0
+                self._covered_size = 0
+                self._write_index([], rewrite=True)
+
+            if audit_size > self._covered_size:
+                self._scan()
+
+    def _last_checkpoint_matches(self) -> bool:
+        """
+            Check that the entry at the last checkpoint's offset still has the checkpoint's timestamp.
+
+            Returns:
+                bool: True if there are no checkpoints or the last one matches the audit file.
+        """
+        if not self._checkpoints:
+            return True
+        _, offset, key = self._checkpoints[-1]
+        for line in self._read_from(offset):
+            return (offset == 0 or self._byte_before(offset) == b'\n') and entry_timestamp_key(line) == key
+        return False
+
+    def _byte_before(self, offset: int) -> bytes:
+        """
+            Read the byte just before an offset of the audit file.
+
+            Args:
+                offset (int): A positive offset.
+
+            Returns:
+                bytes: The byte, empty if the file is shorter.
+        """
+        with open(self.audit_file, 'rb') as audit_file:
+            audit_file.seek(offset - 1)
+            return audit_file.read(1)
+
+    def _scan(self) -> None:
+        """
+            Count the entries after the covered part of the audit file and add checkpoints for them.
+
+            Only the bytes after the last checkpoint are read.
+        """
+        if self._checkpoints:
+            entry_number, offset, _ = self._checkpoints[-1]
+        else:
+            entry_number, offset = 0, 0
+
+        new_checkpoints: List[Tuple[int, int, int]] = []
+        last_key: int = self._checkpoints[-1][2] if self._checkpoints else 0
+        for line in self._read_from(offset):
+            last_key = entry_timestamp_key(line) or last_key
+            if entry_number % self.stride == 0 and entry_number >= self._next_checkpoint_number():
+                new_checkpoints.append((entry_number, offset, last_key))
+            entry_number += 1
+            offset += len(line)
+
+        self._entry_count = entry_number
+        self._covered_size = offset
+        self._checkpoints.extend(new_checkpoints)
+        self._write_index(new_checkpoints, rewrite=False)
+
+    def _next_checkpoint_number(self) -> int:
+        """
+            Return the entry number of the next checkpoint that is not in the index yet.
+
+            Returns:
+                int: The entry number.
+        """
+        return self._checkpoints[-1][0] + self.stride if self._checkpoints else 0
+
+    def _load(self) -> None:
+        """
+            Load the checkpoints from the index file, ignoring an index built with another stride.
+        """
+        self._checkpoints = []
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as index_file:
+                if index_file.readline().strip() != f'{AUDIT_INDEX_HEADER} {self.stride}':
+                    return
+                for line in index_file:
+                    # Ignore a torn last line left by an interrupted write
+                    if line.endswith('\n'):
+                        entry_number, offset, key = line.split()
+                        self._checkpoints.append((int(entry_number), int(offset), int(key)))
+        except FileNotFoundError:
+            return
+
+        if self._checkpoints:
+            # The entries after the last checkpoint are counted again by the next scan
+            self._entry_count, self._covered_size, _ = self._checkpoints[-1]
+
+    def _write_index(self, checkpoints: List[Tuple[int, int, int]], rewrite: bool) -> None:
+        """
+            Save checkpoints to the index file.
+
+            Args:
+                checkpoints (List[Tuple[int, int, int]]): The checkpoints to save.
+                rewrite (bool): Replace the index file atomically instead of appending to it.
+        """
+        lines: List[str] = [f'{entry_number} {offset} {key}\n' for entry_number, offset, key in checkpoints]
+
+        if rewrite or not os.path.exists(self.index_file):
+            temp_file: str = f'{self.index_file}.tmp'
+            with open(temp_file, 'w', encoding='utf-8') as index_file:
+                index_file.write(f'{AUDIT_INDEX_HEADER} {self.stride}\n')
+                index_file.writelines(lines)
+            os.replace(temp_file, self.index_file)
+
+        elif lines:
+            with open(self.index_file, 'a', encoding='utf-8') as index_file:
+                index_file.writelines(lines)
@@ -0,0 +1,364 @@
+import atexit
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import IO, Dict, List, Optional, Tuple
+from AuditArchive import AuditRotationPolicy, audit_lock, first_entry_time, get_audit_archiver, rotate_audit_file
+
+# Durability levels for the audit files, from fastest to safest:
+#   'none'  - entries are written into the file buffers, the OS sees them when a buffer fills or a file is closed
+#   'flush' - file buffers are flushed to the OS after every batch, entries survive a crash of the process
+#   'fsync' - file buffers are flushed and fsync'ed after every batch, entries survive a crash of the machine
+DURABILITY_LEVELS: Tuple[str, ...] = ('none', 'flush', 'fsync')
+
+# Batches an audit file may fail to be written in before its queued entries are dropped and reported
+AUDIT_WRITE_ATTEMPTS: int = 3
+
+
+class AuditWriter:
+    """
+        A buffered audit log writer that appends queued entries from a background thread.
+
+        log_action only queues an entry; the background thread writes the queue in batches when
+        batch_size entries are pending or flush_interval seconds have passed, keeping the audit files open
+        between batches. flush() writes everything queued so far before returning, close() also stops
+        the thread and closes the files. The shared writer is closed automatically at interpreter exit.
+
+        With file_locking, the entries of a batch are written and flushed to the OS under the audit lock
+        in the user's lock directory (see FileLock), so batches from several processes never interleave within
+        an entry; 'none' durability then behaves like 'flush'.
+
+        With a rotation policy, an audit file that reaches the policy's size or age limit is renamed into a segment
+        right after a batch, under its lock, and the shared AuditArchiver compresses it and applies the retention
+        limits in the background (see AuditArchive). Rotation needs the lock, so it implies file_locking.
+
+        An audit file that cannot be written (e.g. its user's directory was removed) does not hold up the others:
+        its entries are put back in front of the queue and tried again with the next batches, and after
+        AUDIT_WRITE_ATTEMPTS failed batches they are dropped and reported on stderr.
+
+        Attributes:
+            - durability (str): One of DURABILITY_LEVELS.
+            - batch_size (int): Number of pending entries that triggers a write.
+            - flush_interval (float): Maximum time in seconds an entry waits in the queue.
+            - max_open_files (int): Number of audit files kept open between batches.
+            - file_locking (bool): Lock each audit file while a batch is written to it.
+            - rotation (Optional[AuditRotationPolicy]): When audit files are rotated, None to never rotate them.
+    """
+    def __init__(self, durability: str = 'flush', batch_size: int = 1000, flush_interval: float = 0.5,
+                 max_open_files: int = 64, file_locking: bool = True, rotation: Optional[AuditRotationPolicy] = None):
+        """
+            Initialize the AuditWriter instance.
+
+            Args:
+                durability (str): One of DURABILITY_LEVELS.
+                batch_size (int): Number of pending entries that triggers a write.
+                flush_interval (float): Maximum time in seconds an entry waits in the queue.
+                max_open_files (int): Number of audit files kept open between batches.
+                file_locking (bool): Lock each audit file while a batch is written to it, needed when other
+                    processes write to the same audit files.
+                rotation (Optional[AuditRotationPolicy]): When audit files are rotated, None to never rotate them.
+
+            Raises:
+                ValueError: If the durability level is unknown.
+        """
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f'Unknown durability level {durability!r}, expected one of {DURABILITY_LEVELS}')
+
+        self.durability: str = durability
+        self.batch_size: int = batch_size
+        self.flush_interval: float = flush_interval
+        self.max_open_files: int = max_open_files
+        self.file_locking: bool = file_locking or rotation is not None
+        self.rotation: Optional[AuditRotationPolicy] = rotation
+
+        # Queue of (audit file path, lock directory, log entry) waiting to be written
+        self._pending: List[Tuple[str, str, str]] = []
+        self._condition: threading.Condition = threading.Condition()
+
+        # Held while a batch is written, so batches reach the files in the order they were queued
+        self._io_lock: threading.Lock = threading.Lock()
+
+        # Audit files kept open between batches, least recently used first
+        self._open_files: 'OrderedDict[str, IO[str]]' = OrderedDict()
+
+        # Unix time of the first entry of every active audit file, read once per file for age-based rotation
+        self._first_entry_times: Dict[str, Optional[float]] = {}
+
+        # Number of batches in a row each audit file failed to be written in
+        self._failed_attempts: Dict[str, int] = {}
+
+        self._thread: Optional[threading.Thread] = None
+        self._stopping: bool = False
+
+    def write(self, path: str, lock_dir: str, entry: str) -> None:
+        """
+            Queue an entry to be appended to an audit file.
+
+            Args:
+                path (str): Path of the audit file.
+                lock_dir (str): The lock directory of the file's user.
+                entry (str): The log entry, including its trailing newline.
+        """
+        with self._condition:
+            self._pending.append((path, lock_dir, entry))
+
+            # Start the background thread on first use, or again after close()
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                self._thread.start()
+
+            # Wake the thread for the first entry of a batch, which starts the flush interval, and for a full batch
+            if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                self._condition.notify()
+
+    def flush(self) -> None:
+        """
+            Write every queued entry and flush the audit files to the OS.
+
+            With 'fsync' durability the files are also fsync'ed.
+        """
+        self._write_pending(force=True)
+
+    def close(self) -> None:
+        """
+            Flush the queue, stop the background thread and close the audit files.
+
+            The writer can still be used afterwards, the thread is started again by the next write.
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+        # Entries put back after a failed write are tried until they are written or dropped
+        while True:
+            self._write_pending(force=True)
+            with self._condition:
+                if not self._pending:
+                    break
+        with self._io_lock:
+            for audit_file in self._open_files.values():
+                audit_file.close()
+            self._open_files.clear()
+
+    def _run(self) -> None:
+        """
+            Background thread loop, writes the queue whenever a batch is full or the flush interval has passed.
+        """
+        while True:
+            with self._condition:
+                # Sleep until the first entry is queued, then give the batch flush_interval seconds to fill up
+                while not self._pending and not self._stopping:
+                    self._condition.wait()
+                if not self._stopping and len(self._pending) < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+                stopping: bool = self._stopping
+            self._write_pending(force=False)
+            if stopping:
+                return
+
+    def _write_pending(self, force: bool) -> None:
+        """
+            Write the queued entries, grouped by audit file, and apply the durability level.
+
+            Args:
+                force (bool): Flush the file buffers to the OS even with 'none' durability.
+        """
+        with self._io_lock:
+            with self._condition:
+                batch: List[Tuple[str, str, str]] = self._pending
+                self._pending = []
+            if not batch:
+                return
+
+            # Group the entries by file, keeping their order within each file
+            grouped: 'OrderedDict[Tuple[str, str], List[str]]' = OrderedDict()
+            for path, lock_dir, entry in batch:
+                grouped.setdefault((path, lock_dir), []).append(entry)
+
+            # Entries of the files that could not be written, in their queue order
+            unwritten: List[Tuple[str, str, str]] = []
+            for (path, lock_dir), entries in grouped.items():
+                try:
+                    self._write_entries(path, lock_dir, entries, force)
+                except OSError as error:
+                    # A failing file must neither lose the entries of the other files nor stop the background thread
+                    self._close_file(path)
+                    attempts: int = self._failed_attempts.get(path, 0) + 1
+                    if attempts < AUDIT_WRITE_ATTEMPTS:
+                        self._failed_attempts[path] = attempts
+                        unwritten.extend((path, lock_dir, entry) for entry in entries)
+                    else:
+                        del self._failed_attempts[path]
+                        print(f'{len(entries)} audit entries could not be written to {path}: {error}', file=sys.stderr)
+                else:
+                    self._failed_attempts.pop(path, None)
+
+            # Put the unwritten entries back in front of the entries queued meanwhile
+            if unwritten:
+                with self._condition:
+                    self._pending[:0] = unwritten
+
+    def _write_entries(self, path: str, lock_dir: str, entries: List[str], force: bool) -> None:
+        """
+            Append the queued entries of one audit file and apply the durability level. The caller holds the I/O lock.
+
+            Args:
+                path (str): Path of the audit file.
+                lock_dir (str): The lock directory of the file's user.
+                entries (List[str]): The entries, in the order they were queued.
+                force (bool): Flush the file buffer to the OS even with 'none' durability.
+
+            Raises:
+                OSError: If the file cannot be opened, locked or written.
+        """
+        audit_file: IO[str] = self._open(path)
+        if self.file_locking:
+            # The whole batch reaches the OS before another process can append to the file
+            with audit_lock(lock_dir):
+                audit_file = self._reopen_if_rotated(path, audit_file)
+                audit_file.write(''.join(entries))
+                audit_file.flush()
+                if self.durability == 'fsync':
+                    os.fsync(audit_file.fileno())
+                if self.rotation is not None:
+                    try:
+                        self._rotate_if_due(path, lock_dir, audit_file, self.rotation)
+                    except OSError:
+                        # The entries are written, the file is rotated after a later batch
+                        pass
+        else:
+            audit_file.write(''.join(entries))
+            if force or self.durability != 'none':
+                audit_file.flush()
+            if self.durability == 'fsync':
+                os.fsync(audit_file.fileno())
+
+    def _reopen_if_rotated(self, path: str, audit_file: IO[str]) -> IO[str]:
+        """
+            Replace a kept handle whose file was rotated away, by this or another process, with one on the new file.
+            The caller holds the audit file lock.
+
+            Args:
+                path (str): Path of the audit file.
+                audit_file (IO[str]): The kept handle.
+
+            Returns:
+                IO[str]: A handle on the file currently at path.
+        """
+        try:
+            if os.stat(path).st_ino == os.fstat(audit_file.fileno()).st_ino:
+                return audit_file
+        except FileNotFoundError:
+            pass
+        self._close_file(path)
+        return self._open(path)
+
+    def _rotate_if_due(self, path: str, lock_dir: str, audit_file: IO[str], policy: AuditRotationPolicy) -> None:
+        """
+            Rotate an audit file that has reached the size or age limit and queue it for archiving.
+            The caller holds the audit file lock and has flushed the handle.
+
+            Args:
+                path (str): Path of the audit file.
+                lock_dir (str): The lock directory of the file's user.
+                audit_file (IO[str]): The handle the batch was written through.
+                policy (AuditRotationPolicy): The rotation policy.
+        """
+        if policy.max_age is not None and path not in self._first_entry_times:
+            with open(path, 'rb') as reader:
+                self._first_entry_times[path] = first_entry_time(reader)
+        if not policy.rotation_due(os.fstat(audit_file.fileno()).st_size, self._first_entry_times.get(path)):
+            return
+
+        self._close_file(path)
+        rotate_audit_file(path)
+        get_audit_archiver().schedule(path, lock_dir, policy)
+
+    def _close_file(self, path: str) -> None:
+        """
+            Close the kept handle on an audit file, if any.
+
+            Args:
+                path (str): Path of the audit file.
+        """
+        audit_file: Optional[IO[str]] = self._open_files.pop(path, None)
+        if audit_file is not None:
+            audit_file.close()
+        self._first_entry_times.pop(path, None)
+
+    def _open(self, path: str) -> IO[str]:
+        """
+            Return an open handle on an audit file, closing the least recently used one if too many are open.
+
+            Args:
+                path (str): Path of the audit file.
+
+            Returns:
+                IO[str]: The file opened in append mode.
+        """
+        audit_file: Optional[IO[str]] = self._open_files.get(path)
+        if audit_file is not None:
+            self._open_files.move_to_end(path)
+            return audit_file
+
+        while len(self._open_files) >= self.max_open_files:
+            oldest_path, oldest_file = self._open_files.popitem(last=False)
+            oldest_file.close()
+            self._first_entry_times.pop(oldest_path, None)
+
+        audit_file = open(path, 'a')
+        self._open_files[path] = audit_file
+        return audit_file
+
+
+# The writer shared by every User in the process
+_audit_writer: AuditWriter = AuditWriter()
+
+
+def get_audit_writer() -> AuditWriter:
+    """
+        Return the audit writer shared by every User in the process.
+
+        Returns:
+            AuditWriter: The shared writer.
+    """
+    return _audit_writer
+
+
+def configure_audit_writer(durability: str = 'flush', batch_size: int = 1000, flush_interval: float = 0.5,
+                           max_open_files: int = 64, file_locking: bool = True,
+                           rotation: Optional[AuditRotationPolicy] = None) -> AuditWriter:
+    """
+        Replace the shared audit writer with one using new settings.
+
+        The current writer is flushed and closed first, so no queued entries are lost.
+
+        Args:
+            durability (str): One of DURABILITY_LEVELS.
+            batch_size (int): Number of pending entries that triggers a write.
+            flush_interval (float): Maximum time in seconds an entry waits in the queue.
+            max_open_files (int): Number of audit files kept open between batches.
+            file_locking (bool): Lock each audit file while a batch is written to it.
+            rotation (Optional[AuditRotationPolicy]): When audit files are rotated, None to never rotate them.
+
+        Returns:
+            AuditWriter: The new shared writer.
+    """
+    global _audit_writer
+    new_writer: AuditWriter = AuditWriter(durability, batch_size, flush_interval, max_open_files, file_locking,
+                                             rotation)
+    _audit_writer.close()
+    _audit_writer = new_writer
+    return new_writer
+
+
+@atexit.register
+def _close_audit_writer() -> None:
+    """
+        Write every queued audit entry before the interpreter exits.
+    """
+    _audit_writer.close()
@@ -0,0 +1,466 @@
+"""
+    Non-interactive command line of the password manager, for scripts and automation.
+
+    Run it from the directory holding users.json and the per-user files (or pass it as --data-root), through main.py
+    or directly:
+        python main.py create-user 12345 alice
+        python main.py add 12345 example.com --login alice --password secret
+        python main.py get 12345 example.com
+        python main.py list 12345
+        python main.py import 12345 credentials.csv
+        python main.py export 12345 backup.jsonl
+        python main.py audit 12345 --last 20
+        python main.py pipe < commands.jsonl > results.jsonl
+
+    Records are printed to stdout as JSON lines and audit entries as they are stored; the exit status is 0 on success,
+    1 if the command failed and 2 for invalid arguments. Without --password, add and update read the password
+    from the first line of stdin, so it does not show up in the process list.
+
+    The pipe subcommand reads one JSON command per line from stdin and writes one JSON result per line to stdout,
+    reusing the loaded registry, keys and indexes for every command; it exits with 1 if any command failed:
+        {"cmd": "add", "user_id": "12345", "website": "example.com", "login": "alice", "password": "secret"}
+        {"id": 7, "cmd": "get", "user_id": "12345", "website": "example.com"}
+    A command takes the same arguments as the subcommand of the same name, by their long option names with
+    underscores; an "id" member is copied into the result. Every result has "ok": true with a "result" member,
+    or "ok": false with an "error" message. A command that fails, whatever the reason, only fails its own line.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import sys
+from collections import OrderedDict
+from typing import Callable, Dict, IO, Iterator, List, Mapping, Optional
+from CredentialImporter import write_credentials_file
+from DataLayout import DATA_LAYOUTS
+from Metrics import enable_metrics, get_metrics
+from PasswordManager import PasswordManager
+from Storage import StorageBackend, get_default_storage
+
+# Number of users whose loaded PasswordManager a session keeps for the following commands
+SESSION_MANAGER_LIMIT: int = 1024
+
+# Marks a command argument without a default value
+_REQUIRED: object = object()
+
+
+class CommandError(Exception):
+    """
+        Raised for a command that cannot be carried out, such as one naming an unknown user.
+    """
+
+
+class CommandSession:
+    """
+        Runs commands against one storage, keeping the managers of recently used users loaded between commands.
+
+        A command is a mapping with a "cmd" member naming it and the arguments of that command,
+        the subcommands of the command line and the lines of the pipe mode are both run through it.
+
+        Attributes:
+            - storage: StorageBackend
+                The storage holding the users, keys, vaults and audit logs.
+    """
+    def __init__(self, storage: Optional[StorageBackend] = None):
+        """
+            Initialize the session.
+
+            Args:
+                storage (Optional[StorageBackend]): Storage backend, the process default if None.
+        """
+        self.storage: StorageBackend = storage or get_default_storage()
+
+        # Managers of the recently used users, least recently used first
+        self._managers: 'OrderedDict[str, PasswordManager]' = OrderedDict()
+
+        self._handlers: Dict[str, Callable[[Mapping[str, object]], object]] = {
+            'create-user': self._create_user, 'add': self._add, 'update': self._update, 'delete': self._delete,
+            'get': self._get, 'list': self._list, 'import': self._import, 'export': self._export,
+            'audit': self._audit,
+        }
+
+    def run(self, command: Mapping[str, object]) -> object:
+        """
+            Run one command.
+
+            Args:
+                command (Mapping[str, object]): The command name under "cmd" and its arguments.
+
+            Returns:
+                object: The result of the command, records and audit entries are returned as an iterator.
+
+            Raises:
+                CommandError: If the command is unknown, lacks an argument, has an argument of the wrong type
+                    or cannot be carried out.
+        """
+        name: object = command.get('cmd')
+        handler: Optional[Callable[[Mapping[str, object]], object]] = \
+            self._handlers.get(name) if isinstance(name, str) else None
+        if handler is None:
+            raise CommandError(f'Unknown command: {name}')
+        return handler(command)
+
+    def _manager(self, user_id: str) -> PasswordManager:
+        """
+            Return the manager of a registered user, reusing a loaded one.
+
+            Args:
+                user_id (str): User ID.
+
+            Returns:
+                PasswordManager: The user's quiet manager.
+
+            Raises:
+                CommandError: If no user is registered under the ID.
+        """
+        manager: Optional[PasswordManager] = self._managers.get(user_id)
+        if manager is not None:
+            self._managers.move_to_end(user_id)
+            return manager
+
+        user_name: Optional[str] = self.storage.load_users().get(user_id)
+        if not user_name:
+            raise CommandError(f'No user found with ID {user_id}')
+
+        manager = self._managers[user_id] = PasswordManager(user_id, user_name, self.storage, quiet=True)
+        if len(self._managers) > SESSION_MANAGER_LIMIT:
+            self._managers.popitem(last=False)
+        return manager
+
+    # Command handlers, each takes the command mapping
+
+    def _create_user(self, command: Mapping[str, object]) -> Dict[str, str]:
+        user_id: str = _argument(command, 'user_id')
+        user_name: str = _argument(command, 'user_name')
+        if not self.storage.add_user(user_id, user_name):
+            raise CommandError(f'User with ID {user_id} already exists')
+
+        # Create the user's key right away, so a backup of a new user already holds it
+        self._manager(user_id).user.load_or_create_key()
+        return {'user_id': user_id, 'user_name': user_name}
+
+    def _add(self, command: Mapping[str, object]) -> bool:
+        self._manager(_argument(command, 'user_id')).encrypt_save_credentials(
+            _argument(command, 'website'), _argument(command, 'login'), _argument(command, 'password'))
+        return True
+
+    def _update(self, command: Mapping[str, object]) -> bool:
+        website: str = _argument(command, 'website')
+        if not self._manager(_argument(command, 'user_id')).update_credentials(
+                website, _argument(command, 'login'), _argument(command, 'password')):
+            raise CommandError(f'No credentials saved for {website}')
+        return True
+
+    def _delete(self, command: Mapping[str, object]) -> bool:
+        website: str = _argument(command, 'website')
+        if not self._manager(_argument(command, 'user_id')).delete_credentials(website):
+            raise CommandError(f'No credentials saved for {website}')
+        return True
+
+    def _get(self, command: Mapping[str, object]) -> Iterator[Dict[str, str]]:
+        return iter(self._manager(_argument(command, 'user_id')).get_credentials(_argument(command, 'website')))
+
+    def _list(self, command: Mapping[str, object]) -> Iterator[Dict[str, str]]:
+        manager: PasswordManager = self._manager(_argument(command, 'user_id'))
+        manager.save_audit_log('- Deciphered the data')
+        return _iter_saved_credentials(manager)
+
+    def _import(self, command: Mapping[str, object]) -> int:
+        return self._manager(_argument(command, 'user_id')).import_credentials_file(_argument(command, 'path'))
+
+    def _export(self, command: Mapping[str, object]) -> int:
+        manager: PasswordManager = self._manager(_argument(command, 'user_id'))
+        exported_count: int = write_credentials_file(_argument(command, 'path'), _iter_saved_credentials(manager))
+        manager.save_audit_log(f'- Exported {exported_count} credentials')
+        return exported_count
+
+    def _audit(self, command: Mapping[str, object]) -> Iterator[str]:
+        manager: PasswordManager = self._manager(_argument(command, 'user_id'))
+        last: Optional[int] = _argument(command, 'last', None, int, minimum=0)
+        page: Optional[int] = _argument(command, 'page', None, int, minimum=0)
+        page_size: int = _argument(command, 'page_size', 100, int, minimum=1)
+        since: Optional[str] = _argument(command, 'since', None)
+        until: Optional[str] = _argument(command, 'until', None)
+
+        # Log the check first, as the interactive menu does
+        manager.save_audit_log('- Checked the credentials')
+
+        if last is not None:
+            entries: Iterator[str] = iter(manager.user.tail_audit_history(last))
+        elif page is not None:
+            entries = iter(manager.user.get_audit_page(page, page_size))
+        else:
+            entries = manager.user.get_audit_range(_parse_time(since), _parse_time(until))
+        return (entry.rstrip('\n') for entry in entries)
+
+
+def _argument(command: Mapping[str, object], name: str, default: object = _REQUIRED, expected_type: type = str,
+              minimum: Optional[int] = None):
+    """
+        Return an argument of a command, checking its type.
+
+        Args:
+            command (Mapping[str, object]): The command.
+            name (str): Name of the argument.
+            default (object): Value of a missing optional argument, the argument is required if not given.
+            expected_type (type): Type the argument must have, str or int; a missing optional argument may be None.
+            minimum (Optional[int]): Smallest value an integer argument may have, any value if None.
+
+        Returns:
+            The argument value.
+
+        Raises:
+            CommandError: If a required argument is missing, the argument has another type or is below the minimum.
+    """
+    value = command.get(name, default)
+    if value is _REQUIRED or (default is _REQUIRED and value is None):
+        raise CommandError(f'Missing argument: {name}')
+
+    # JSON true and false are ints to Python, they are not accepted as numbers
+    if value is not default and (not isinstance(value, expected_type) or isinstance(value, bool)):
+        raise CommandError(f'Argument {name} must be {"a string" if expected_type is str else "an integer"}')
+    if minimum is not None and value is not default and value < minimum:
+        raise CommandError(f'Argument {name} must be at least {minimum}')
+    return value
+
+
+def describe_error(error: Exception) -> str:
+    """
+        Turn the error a command failed with into a message for its result.
+
+        Args:
+            error (Exception): The error.
+
+        Returns:
+            str: The message.
+    """
+    from cryptography.fernet import InvalidToken
+
+    # A token that does not match the key has no message of its own
+    if isinstance(error, InvalidToken):
+        return 'The stored data cannot be decrypted with the user\'s key'
+    if isinstance(error, (CommandError, ValueError, OSError)):
+        return str(error)
+    return f'{type(error).__name__}: {error}'
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime.datetime]:
+    """
+        Parse an ISO 8601 local time argument such as 2024-05-01 or 2024-05-01T12:30:00.
+
+        Args:
+            value (Optional[str]): The argument, None if not given.
+
+        Returns:
+            Optional[datetime.datetime]: The time, None if not given.
+
+        Raises:
+            CommandError: If the time cannot be parsed.
+    """
+    if value is None:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'Invalid time: {value}') from None
+
+
+def _iter_saved_credentials(manager: PasswordManager) -> Iterator[Dict[str, str]]:
+    """
+        Stream a user's credentials, yielding nothing for a user who has not saved any yet.
+
+        Args:
+            manager (PasswordManager): The user's manager.
+
+        Yields:
+            Dict[str, str]: One credential record.
+    """
+    try:
+        yield from manager.iter_credentials()
+    except FileNotFoundError:
+        return
+
+
+def run_pipe(session: CommandSession, input_stream: IO[str], output_stream: IO[str]) -> int:
+    """
+        Run JSON commands read one per line and write one JSON result line per command.
+
+        Blank lines are skipped. Every result is flushed right away, so a caller can wait for it before sending
+        the next command.
+
+        Args:
+            session (CommandSession): The session running the commands.
+            input_stream (IO[str]): The command lines.
+            output_stream (IO[str]): Where the result lines are written.
+
+        Returns:
+            int: The number of commands that failed.
+    """
+    failed_count: int = 0
+    for line in input_stream:
+        if not line.strip():
+            continue
+
+        response: Dict[str, object] = {}
+        try:
+            command = json.loads(line)
+            if not isinstance(command, dict):
+                raise CommandError('A command must be a JSON object')
+            if 'id' in command:
+                response['id'] = command['id']
+
+            result: object = session.run(command)
+            if isinstance(result, Iterator):
+                result = list(result)
+            response.update(ok=True, result=result)
+
+        except Exception as error:
+            # Whatever a command fails with only fails that command, the session goes on with the next line
+            failed_count += 1
+            response.update(ok=False, error=describe_error(error))
+
+        output_stream.write(json.dumps(response) + '\n')
+        output_stream.flush()
+    return failed_count
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+        Build the parser of the command line.
+
+        Returns:
+            argparse.ArgumentParser: The parser, the chosen subcommand is stored as "cmd".
+    """
+    parser = argparse.ArgumentParser(prog='main.py', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    storage_options = parser.add_mutually_exclusive_group()
+    storage_options.add_argument('--users-file', help='the user registry of the flat-file storage')
+    storage_options.add_argument('--sqlite', metavar='DATABASE', help='use the SQLite storage in this database')
+    parser.add_argument('--data-root', metavar='DIR',
+                        help='directory holding the registry and the users\' files of the flat-file storage')
+    parser.add_argument('--layout', choices=DATA_LAYOUTS, default=None,
+                        help='keep every user\'s files directly in the data root (flat, the default) '
+                             'or in a directory per user under hash-prefix directories (sharded)')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help='record timing metrics and write them to PATH on exit, as JSON for a .json path '
+                             'and in the Prometheus text format otherwise')
+    parser.add_argument('--profile', metavar='OPERATION[:PATH]',
+                        help='run the calls of one operation, such as get_credentials, under cProfile '
+                             'and dump the stats to PATH, OPERATION.prof by default')
+    subparsers = parser.add_subparsers(dest='cmd', required=True, metavar='command')
+
+    create_user = subparsers.add_parser('create-user', help='register a user and create the user key')
+    create_user.add_argument('user_id')
+    create_user.add_argument('user_name')
+
+    for name, help_text in (('add', 'save the credentials of a website'),
+                            ('update', 'replace the stored credentials of a website')):
+        credentials_parser = subparsers.add_parser(name, help=help_text)
+        credentials_parser.add_argument('user_id')
+        credentials_parser.add_argument('website')
+        credentials_parser.add_argument('--login', required=True)
+        credentials_parser.add_argument('--password', help='read from the first line of stdin if not given')
+
+    for name, help_text in (('get', 'print the credentials of a website'),
+                            ('delete', 'delete the stored credentials of a website')):
+        website_parser = subparsers.add_parser(name, help=help_text)
+        website_parser.add_argument('user_id')
+        website_parser.add_argument('website')
+
+    list_parser = subparsers.add_parser('list', help='print all credentials of a user')
+    list_parser.add_argument('user_id')
+
+    import_parser = subparsers.add_parser('import', help='import credentials from a .csv or .jsonl file')
+    import_parser.add_argument('user_id')
+    import_parser.add_argument('path')
+
+    export_parser = subparsers.add_parser('export', help='export credentials to a .csv or .jsonl file')
+    export_parser.add_argument('user_id')
+    export_parser.add_argument('path')
+
+    audit_parser = subparsers.add_parser('audit', help='print audit log entries, all of them by default')
+    audit_parser.add_argument('user_id')
+    audit_selection = audit_parser.add_mutually_exclusive_group()
+    audit_selection.add_argument('--last', type=int, help='only the most recent entries')
+    audit_selection.add_argument('--page', type=int, help='one page of entries, page 0 holds the oldest')
+    audit_parser.add_argument('--page-size', type=int, default=100)
+    audit_parser.add_argument('--since', help='only entries from this local time on, e.g. 2024-05-01T12:00')
+    audit_parser.add_argument('--until', help='only entries up to this local time')
+
+    subparsers.add_parser('pipe', help='run JSON commands read from stdin, one per line')
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+        Run one subcommand of the command line.
+
+        Messages printed by the password manager itself go to stderr, stdout only carries the results.
+
+        Args:
+            argv (Optional[List[str]]): The arguments, sys.argv[1:] if None.
+
+        Returns:
+            int: The exit status.
+    """
+    parser: argparse.ArgumentParser = build_parser()
+    args = parser.parse_args(argv)
+    if args.sqlite is not None and (args.data_root is not None or args.layout is not None):
+        parser.error('--data-root and --layout apply to the flat-file storage, not to --sqlite')
+    command: Dict[str, object] = vars(args)
+
+    if args.metrics is not None or args.profile is not None:
+        profile_operation, _, profile_path = (args.profile or '').partition(':')
+        enable_metrics(profile_operation or None, profile_path or None)
+    try:
+        return _run_command(args, command)
+    finally:
+        if args.metrics is not None:
+            get_metrics().export(args.metrics)
+
+
+def _run_command(args: argparse.Namespace, command: Dict[str, object]) -> int:
+    """
+        Run the parsed subcommand.
+
+        Args:
+            args (argparse.Namespace): The parsed arguments.
+            command (Dict[str, object]): The same arguments as a command mapping.
+
+        Returns:
+            int: The exit status.
+    """
+    storage: Optional[StorageBackend] = None
+    if args.users_file is not None or args.data_root is not None or args.layout is not None:
+        from FileStorage import FileStorage
+        storage = FileStorage(args.users_file or 'users.json', data_root=args.data_root, layout=args.layout or 'flat')
+    elif args.sqlite is not None:
+        from SQLiteStorage import SQLiteStorage
+        storage = SQLiteStorage(args.sqlite)
+
+    output_stream: IO[str] = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        session: CommandSession = CommandSession(storage)
+        if args.cmd == 'pipe':
+            return 1 if run_pipe(session, sys.stdin, output_stream) else 0
+
+        if args.cmd in ('add', 'update') and args.password is None:
+            import getpass
+            command['password'] = (getpass.getpass('Password: ') if sys.stdin.isatty()
+                                   else sys.stdin.readline().rstrip('\n'))
+
+        try:
+            result: object = session.run(command)
+            if isinstance(result, Iterator):
+                for item in result:
+                    output_stream.write((item if isinstance(item, str) else json.dumps(item)) + '\n')
+            elif isinstance(result, int) and not isinstance(result, bool):
+                output_stream.write(f'{result}\n')
+        except Exception as error:
+            print(f'error: {describe_error(error)}', file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,415 @@
+import os
+import struct
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+from FileLock import FileLock
+from KeyRing import KeyFileReader
+from Metrics import add_bytes, phase, timed, timed_iter
+from Storage import CredentialWriter, StaleKeyError
+from VaultFormat import RECORD_ADD, RECORD_DELETE, BlockVaultFormat, compact_record, peek_record
+from WebsiteIndex import IndexEntry, WebsiteIndex
+
+if TYPE_CHECKING:
+    from cryptography.fernet import Fernet
+
+# Plaintext bytes collected in a block before it is sealed, used when a FileStorage enables blocks without a size
+VAULT_BLOCK_SIZE: int = 4096
+
+# Start of the tail plaintext: the data file size the tail continues, followed by the compact records of the tail
+_TAIL_BASE: struct.Struct = struct.Struct('>Q')
+
+# What a reader needs to know about a block vault at one instant:
+# (data file size, tail records, (website hash, block offset) of every live sealed record or None if all are live)
+BlockSnapshot = Tuple[int, List[bytes], Optional[Set[Tuple[str, int]]]]
+
+
+def tail_file(data_file: str) -> str:
+    """
+        Return the path of the file that holds the open tail block of a block vault.
+
+        Args:
+            data_file (str): Path of the data file.
+
+        Returns:
+            str: Path of the tail file.
+    """
+    return f'{data_file}.tail'
+
+
+def read_tail(data_file: str, cipher: 'Fernet') -> List[bytes]:
+    """
+        Read the records of the open tail block of a block vault.
+
+        The tail continues the data file only while the file still has the size recorded in the tail. Once the
+        tail has been sealed into the data file, or the file has been compacted, the tail is stale and ignored.
+
+        Args:
+            data_file (str): Path of the data file.
+            cipher (Fernet): The user's cipher.
+
+        Returns:
+            List[bytes]: The compact record plaintexts of the tail, in the order they were written.
+    """
+    try:
+        with open(tail_file(data_file), 'rb') as tail:
+            token: bytes = tail.read()
+        data_size: int = os.path.getsize(data_file)
+    except FileNotFoundError:
+        return []
+
+    if not token:
+        return []
+    plaintext: bytes = cipher.decrypt(token)
+    if _TAIL_BASE.unpack_from(plaintext)[0] != data_size:
+        return []
+    return BlockVaultFormat.records_in(plaintext[_TAIL_BASE.size:])
+
+
+def write_tail(data_file: str, cipher: 'Fernet', records: Sequence[bytes], data_size: int,
+               sync: bool = False) -> None:
+    """
+        Seal the open tail block of a block vault and replace the tail file with it atomically.
+
+        Args:
+            data_file (str): Path of the data file.
+            cipher (Fernet): The user's cipher.
+            records (Sequence[bytes]): The compact record plaintexts of the tail.
+            data_size (int): Size of the data file the tail continues.
+            sync (bool): fsync the new tail before it replaces the old one.
+    """
+    temp_file: str = f'{tail_file(data_file)}.tmp'
+    with open(temp_file, 'wb') as tail:
+        tail.write(cipher.encrypt(_TAIL_BASE.pack(data_size) + b''.join(records)))
+        if sync:
+            tail.flush()
+            os.fsync(tail.fileno())
+    os.replace(temp_file, tail_file(data_file))
+
+
+class BlockCredentialWriter(CredentialWriter):
+    """
+        Appends records to a block vault.
+
+        New records join the records of the open tail block, which is sealed again and atomically replaced
+        on every write. Once the tail holds block_size bytes of plaintext it is sealed into the data file as
+        one block and a new tail is started, so the data file itself is only ever appended to.
+        Every write holds the vault lock, which other processes writing to the vault respect as well, and fails
+        with a StaleKeyError once the key file starts with another key than the one the writer's cipher encrypts with.
+    """
+    def __init__(self, data_file: str, website_index: WebsiteIndex, cipher: 'Fernet', block_size: int,
+                 lock: FileLock, sync: bool = False, key_file: Optional[KeyFileReader] = None,
+                 key: Optional[bytes] = None):
+        """
+            Initialize the BlockCredentialWriter instance.
+
+            Args:
+                data_file (str): Absolute path of the user's data file.
+                website_index (WebsiteIndex): The user's website index.
+                cipher (Fernet): The user's cipher.
+                block_size (int): Plaintext bytes collected in a block before it is sealed.
+                lock (FileLock): The vault lock of the data file.
+                sync (bool): fsync the sealed blocks and the tail, for 'fsync' durability.
+                key_file (Optional[KeyFileReader]): The user's key file, checked before every write.
+                key (Optional[bytes]): The key the cipher encrypts with.
+        """
+        super().__init__(cipher)
+        self._key_file: Optional[KeyFileReader] = key_file
+        self._key: Optional[bytes] = key
+        self._path: str = data_file
+        self._website_index: WebsiteIndex = website_index
+        self._block_size: int = block_size
+        self._lock: FileLock = lock
+        self._sync: bool = sync
+
+    def write(self, records: Sequence[Tuple[str, bytes]], kind: str = RECORD_ADD) -> None:
+        """
+            Append records that were encrypted one per token, by opening them and sealing them into blocks.
+
+            Args:
+                records (Sequence[Tuple[str, bytes]]): (website, encrypted record) pairs.
+                kind (str): The kind of the records.
+        """
+        decrypt = self.cipher.decrypt
+        self.write_records([(website, compact_record(decrypt(encrypted_data)))
+                            for website, encrypted_data in records], kind)
+
+    def write_records(self, records: Sequence[Tuple[str, bytes]], kind: str = RECORD_ADD) -> None:
+        """
+            Append plaintext records, sealing every block that fills up and then the remaining tail.
+
+            Args:
+                records (Sequence[Tuple[str, bytes]]): (website, compact record plaintext) pairs.
+                kind (str): The kind of the records; it is read from each compact record, which carries it as well.
+
+            Raises:
+                StaleKeyError: If the first key of the key file is not the one the writer's cipher encrypts with.
+        """
+        encrypt = timed(self.cipher.encrypt, 'crypto')
+        with self._lock:
+            # A key rotation re-encrypts the vault under this lock before it drops the old key
+            current_key: Optional[bytes] = self._key_file.encryption_key() if self._key_file is not None else None
+            if current_key is not None and self._key is not None and current_key != self._key:
+                raise StaleKeyError(f'The key in {self._key_file.path} was replaced')
+            pending: List[bytes] = read_tail(self._path, self.cipher) + [plaintext for _, plaintext in records]
+
+            # Cut the pending records into full blocks, the rest stays in the open tail
+            blocks: List[List[bytes]] = []
+            tail: List[bytes] = []
+            tail_size: int = 0
+            for plaintext in pending:
+                tail.append(plaintext)
+                tail_size += len(plaintext)
+                if tail_size >= self._block_size:
+                    blocks.append(tail)
+                    tail = []
+                    tail_size = 0
+
+            with open(self._path, 'ab') as data_file:
+                # A new data file starts with the header of the block format
+                header: bytes = BlockVaultFormat.header if data_file.tell() == 0 else b''
+                offset: int = data_file.tell() + len(header)
+
+                framed_blocks: List[bytes] = [header]
+                entries: List[IndexEntry] = []
+                for block in blocks:
+                    framed_blocks.append(BlockVaultFormat.frame(encrypt(b''.join(block))))
+                    for plaintext in block:
+                        website, record_kind = peek_record(plaintext)
+                        entries.append((self._website_index.website_hash(website), offset,
+                                        len(framed_blocks[-1]), record_kind))
+                    offset += len(framed_blocks[-1])
+
+                with phase('io'):
+                    data_file.write(b''.join(framed_blocks))
+                    data_file.flush()
+                    if self._sync:
+                        os.fsync(data_file.fileno())
+                add_bytes('written', sum(len(framed_block) for framed_block in framed_blocks))
+
+            # Write the tail only after the sealed blocks, a crash in between leaves a stale tail that is ignored
+            with phase('io'):
+                write_tail(self._path, self.cipher, tail, offset, self._sync)
+            self._website_index.entries_appended(entries)
+
+    def close(self) -> None:
+        """
+            Nothing to release, the data file is opened for each write.
+        """
+
+
+def take_snapshot(data_file: str, website_index: WebsiteIndex, cipher: 'Fernet') -> BlockSnapshot:
+    """
+        Capture the state of a block vault needed to read it. The caller holds the vault lock.
+
+        Args:
+            data_file (str): Path of the data file.
+            website_index (WebsiteIndex): The user's website index.
+            cipher (Fernet): The user's cipher.
+
+        Returns:
+            BlockSnapshot: The snapshot.
+    """
+    data_size: int = os.path.getsize(data_file)
+    tail: List[bytes] = read_tail(data_file, cipher)
+
+    # Only look up liveness when some sealed record may be dead
+    live_records: Optional[Set[Tuple[str, int]]] = None
+    if tail or website_index.counts()[1]:
+        live_records = {(digest, offset) for digest, offset, _ in website_index.live_entries()}
+    return data_size, tail, live_records
+
+
+def iter_live_records(data_file: str, website_index: WebsiteIndex, cipher: 'Fernet',
+                      snapshot: BlockSnapshot) -> Iterator[bytes]:
+    """
+        Decrypt a block vault one block at a time and yield its live records in the order they were written.
+
+        A sealed record is live when it is not a tombstone, the index holds a live record of its website in the
+        record's block, and neither the rest of the block nor the tail holds a replacing record or a tombstone
+        of the website. A tail record is live when it is not a tombstone and no later tail record replaces it.
+
+        Args:
+            data_file (str): Path of the data file.
+            website_index (WebsiteIndex): The user's website index.
+            cipher (Fernet): The user's cipher.
+            snapshot (BlockSnapshot): The state of the vault to read.
+
+        Yields:
+            bytes: One compact record plaintext.
+    """
+    data_size, tail, live_records = snapshot
+    decrypt = timed(cipher.decrypt, 'crypto')
+    digest_of = website_index.website_hash
+
+    # The last replacing record or tombstone of a website in the tail hides every older record of the website
+    tail_records: List[Tuple[str, str]] = [peek_record(plaintext) for plaintext in tail]
+    tail_digests: List[str] = [digest_of(website) for website, _ in tail_records]
+    tail_hiding: Dict[str, int] = last_hiding_positions(tail_digests, tail_records)
+
+    with open(data_file, 'rb') as data:
+        for offset, _, token in timed_iter(BlockVaultFormat.iter_records(data, 0), 'io'):
+            # Blocks sealed after the snapshot hold the snapshot's tail records, those are read from the tail
+            if offset >= data_size:
+                break
+            add_bytes('read', len(token))
+            block: List[bytes] = BlockVaultFormat.records_in(decrypt(token))
+            if live_records is None:
+                yield from block
+                continue
+
+            block_records: List[Tuple[str, str]] = [peek_record(plaintext) for plaintext in block]
+            digests: List[str] = [digest_of(website) for website, _ in block_records]
+            block_hiding: Dict[str, int] = last_hiding_positions(digests, block_records)
+            for position, plaintext in enumerate(block):
+                digest: str = digests[position]
+                if block_records[position][1] != RECORD_DELETE and (digest, offset) in live_records and \
+                        block_hiding.get(digest, position) <= position and digest not in tail_hiding:
+                    yield plaintext
+
+    for position, plaintext in enumerate(tail):
+        if tail_records[position][1] != RECORD_DELETE and tail_hiding.get(tail_digests[position], position) <= position:
+            yield plaintext
+
+
+def last_hiding_positions(digests: Sequence[str], records: Sequence[Tuple[str, str]]) -> Dict[str, int]:
+    """
+        Find the last replacing record or tombstone of each website among consecutive records.
+
+        Args:
+            digests (Sequence[str]): The website hash of each record.
+            records (Sequence[Tuple[str, str]]): The (website, kind) of each record, as returned by peek_record.
+
+        Returns:
+            Dict[str, int]: The position of the last record that is not simply added, for each website hash
+            that has one; the records of the website before that position are dead.
+    """
+    return {digest: position for position, (digest, (_, kind)) in enumerate(zip(digests, records))
+            if kind != RECORD_ADD}
+
+
+def find_live_records(data_file: str, website_index: WebsiteIndex, cipher: 'Fernet', lock: FileLock,
+                      website: str) -> List[bytes]:
+    """
+        Find the live records of a website in a block vault, decrypting only the tail and the blocks that hold them.
+
+        Args:
+            data_file (str): Path of the data file.
+            website_index (WebsiteIndex): The user's website index.
+            cipher (Fernet): The user's cipher.
+            lock (FileLock): The vault lock of the data file.
+            website (str): Website name.
+
+        Returns:
+            List[bytes]: The compact record plaintexts in the order they were written, empty if the website has none.
+    """
+    with lock:
+        tail: List[bytes] = read_tail(data_file, cipher)
+        locations: List[Tuple[int, int]] = website_index.lookup(website)
+
+    # The tail holds the newest records; a replacing record or a tombstone there hides every sealed record
+    tail_records: List[bytes] = []
+    for plaintext in tail:
+        tail_website, kind = peek_record(plaintext)
+        if tail_website != website:
+            continue
+        if kind != RECORD_ADD:
+            tail_records.clear()
+            locations = []
+        if kind != RECORD_DELETE:
+            tail_records.append(plaintext)
+
+    sealed_records: List[bytes] = []
+    with open(data_file, 'rb') as data:
+        # Records of the website that share a block share its location, each block is decrypted once
+        for offset, size in sorted(set(locations)):
+            data.seek(offset)
+            token: bytes = BlockVaultFormat.unframe(data.read(size))
+            block_records: List[bytes] = []
+            for plaintext in BlockVaultFormat.records_in(cipher.decrypt(token)):
+                block_website, kind = peek_record(plaintext)
+                if block_website != website:
+                    continue
+                if kind != RECORD_ADD:
+                    block_records.clear()
+                if kind != RECORD_DELETE:
+                    block_records.append(plaintext)
+            sealed_records.extend(block_records)
+    return sealed_records + tail_records
+
+
+def block_vault_stats(website_index: WebsiteIndex, tail: Sequence[bytes]) -> Tuple[int, int]:
+    """
+        Count the live and dead records of a block vault.
+
+        Args:
+            website_index (WebsiteIndex): The user's website index.
+            tail (Sequence[bytes]): The records of the open tail block.
+
+        Returns:
+            Tuple[int, int]: (live records, dead records).
+    """
+    live_count, dead_count = website_index.counts()
+    if not tail:
+        return live_count, dead_count
+
+    # A replacing record or a tombstone in the tail makes the sealed records of its website dead,
+    # and the tail records before it
+    tail_records: List[Tuple[str, str]] = [peek_record(plaintext) for plaintext in tail]
+    tail_digests: List[str] = [website_index.website_hash(website) for website, _ in tail_records]
+    tail_hiding: Dict[str, int] = last_hiding_positions(tail_digests, tail_records)
+
+    overridden: int = sum(website_index.live_record_count(digest) for digest in tail_hiding)
+    tail_live: int = sum(1 for position, (digest, (_, kind)) in enumerate(zip(tail_digests, tail_records))
+                         if kind != RECORD_DELETE and tail_hiding.get(digest, position) <= position)
+    live_total: int = live_count - overridden + tail_live
+    return live_total, live_count + dead_count + len(tail) - live_total
+
+
+def compact_block_vault(data_file: str, website_index: WebsiteIndex, cipher: 'Fernet', block_size: int) -> None:
+    """
+        Rewrite a block vault with only its live records, sealed into full blocks. The caller holds the vault lock.
+
+        The live records, the tail included, are streamed into a temporary file that atomically replaces
+        the data file; the last block may be short and the old tail becomes stale.
+
+        Args:
+            data_file (str): Path of the data file.
+            website_index (WebsiteIndex): The user's website index.
+            cipher (Fernet): The user's cipher.
+            block_size (int): Plaintext bytes collected in a block before it is sealed.
+    """
+    temp_file: str = f'{data_file}.compact'
+    new_entries: List[IndexEntry] = []
+    snapshot: BlockSnapshot = take_snapshot(data_file, website_index, cipher)
+
+    with open(temp_file, 'wb') as new_file:
+        new_file.write(BlockVaultFormat.header)
+
+        def seal(block: List[bytes]) -> None:
+            framed_block: bytes = BlockVaultFormat.frame(cipher.encrypt(b''.join(block)))
+            for plaintext in block:
+                # Only live records are sealed again, so every one of them is indexed as added
+                new_entries.append((website_index.website_hash(peek_record(plaintext)[0]), new_file.tell(),
+                                    len(framed_block), RECORD_ADD))
+            new_file.write(framed_block)
+
+        block: List[bytes] = []
+        block_bytes: int = 0
+        for plaintext in iter_live_records(data_file, website_index, cipher, snapshot):
+            block.append(plaintext)
+            block_bytes += len(plaintext)
+            if block_bytes >= block_size:
+                seal(block)
+                block = []
+                block_bytes = 0
+        if block:
+            seal(block)
+
+        new_file.flush()
+        os.fsync(new_file.fileno())
+
+    os.replace(temp_file, data_file)
+    website_index.replace(new_entries)
+    try:
+        os.remove(tail_file(data_file))
+    except FileNotFoundError:
+        pass
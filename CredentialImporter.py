@@ -0,0 +1,136 @@
+import csv
+import json
+from typing import Dict, Iterable, Iterator, Mapping
+
+# Fields every imported credential record must provide
+CREDENTIAL_FIELDS: tuple = ('website', 'login', 'password')
+
+
+def check_credential_record(record: object, location: str) -> Dict[str, str]:
+    """
+        Take the credential fields of an imported record, making sure each of them is there and is a string.
+
+        Args:
+            record (object): The record, a mapping read from the input.
+            location (str): Where the record comes from, e.g. a file and line, for the error message.
+
+        Returns:
+            Dict[str, str]: The website, login and password of the record, in that order.
+
+        Raises:
+            ValueError: If the record is not a mapping, or a field is missing or not a string.
+    """
+    if not isinstance(record, Mapping):
+        raise ValueError(f'{location}: expected an object with {", ".join(CREDENTIAL_FIELDS)} fields')
+    credentials: Dict[str, str] = {}
+    for field in CREDENTIAL_FIELDS:
+        value = record.get(field)
+        if value is None:
+            raise ValueError(f'{location}: the {field} field is missing')
+        if not isinstance(value, str):
+            raise ValueError(f'{location}: the {field} field is not a string')
+        credentials[field] = value
+    return credentials
+
+
+def read_csv_credentials(path: str) -> Iterator[Dict[str, str]]:
+    """
+        Stream credentials from a CSV file.
+
+        The first row must be a header naming the website, login and password columns.
+        Rows are yielded one at a time, so the file is never loaded into memory as a whole.
+
+        Args:
+            path (str): Path of the CSV file.
+
+        Yields:
+            Dict[str, str]: One credential record per row.
+
+        Raises:
+            ValueError: If a row lacks a field, naming the line it ends on.
+    """
+    with open(path, 'r', encoding='utf-8', newline='') as csv_file:
+        csv_reader: csv.DictReader = csv.DictReader(csv_file)
+        for row in csv_reader:
+            yield check_credential_record(row, f'{path}, line {csv_reader.line_num}')
+
+
+def read_jsonl_credentials(path: str) -> Iterator[Dict[str, str]]:
+    """
+        Stream credentials from a JSON-lines file (one JSON object per line).
+
+        Blank lines are skipped.
+
+        Args:
+            path (str): Path of the JSON-lines file.
+
+        Yields:
+            Dict[str, str]: One credential record per line.
+
+        Raises:
+            ValueError: If a line is not valid JSON or its object lacks a field, naming the line.
+    """
+    with open(path, 'r', encoding='utf-8') as jsonl_file:
+        for line_number, line in enumerate(jsonl_file, 1):
+            if line.strip():
+                try:
+                    record: object = json.loads(line)
+                except ValueError as error:
+                    raise ValueError(f'{path}, line {line_number}: {error}') from error
+                yield check_credential_record(record, f'{path}, line {line_number}')
+
+
+def read_credentials_file(path: str) -> Iterator[Dict[str, str]]:
+    """
+        Stream credentials from a CSV or JSON-lines file, chosen by the file extension.
+
+        Args:
+            path (str): Path of a .csv, .jsonl or .ndjson file.
+
+        Returns:
+            Iterator[Dict[str, str]]: The credential records.
+
+        Raises:
+            ValueError: If the file extension is not supported.
+    """
+    lowered_path: str = path.lower()
+    if lowered_path.endswith('.csv'):
+        return read_csv_credentials(path)
+    if lowered_path.endswith(('.jsonl', '.ndjson')):
+        return read_jsonl_credentials(path)
+    raise ValueError(f'Unsupported import file format: {path}')
+
+
+def write_credentials_file(path: str, credentials: Iterable[Mapping[str, str]]) -> int:
+    """
+        Stream credentials to a CSV or JSON-lines file, chosen by the file extension.
+
+        The written files can be read back with read_credentials_file.
+
+        Args:
+            path (str): Path of a .csv, .jsonl or .ndjson file.
+            credentials (Iterable[Mapping[str, str]]): Records with 'website', 'login' and 'password' keys.
+
+        Returns:
+            int: The number of written records.
+
+        Raises:
+            ValueError: If the file extension is not supported.
+    """
+    lowered_path: str = path.lower()
+    if not lowered_path.endswith(('.csv', '.jsonl', '.ndjson')):
+        raise ValueError(f'Unsupported export file format: {path}')
+
+    written_count: int = 0
+    with open(path, 'w', encoding='utf-8', newline='') as export_file:
+        if lowered_path.endswith('.csv'):
+            csv_writer = csv.DictWriter(export_file, CREDENTIAL_FIELDS, extrasaction='ignore')
+            csv_writer.writeheader()
+            for record in credentials:
+                csv_writer.writerow(record)
+                written_count += 1
+        else:
+            for record in credentials:
+                export_file.write(json.dumps({field: record[field] for field in CREDENTIAL_FIELDS}) + '\n')
+                written_count += 1
+    return written_count
@@ -0,0 +1,142 @@
+import hashlib
+import os
+from typing import NamedTuple, Tuple
+
+# Layouts of the users' files under the data root: every file in the root itself ('flat'),
+# or a directory per user nested under hash-prefix directories ('sharded')
+DATA_LAYOUTS: Tuple[str, ...] = ('flat', 'sharded')
+
+# The sharded layout nests a user's directory SHARD_DEPTH levels deep, each level named by SHARD_WIDTH hex digits
+# of the SHA-256 of the user ID: 256 directories per level, so a million users leave about 15 per leaf directory
+SHARD_DEPTH: int = 2
+SHARD_WIDTH: int = 2
+
+
+class UserFiles(NamedTuple):
+    """
+        The paths of the files the flat-file storage keeps for one user, named like the User attributes.
+
+        Attributes:
+            - audit_file (str): The audit log.
+            - audit_index_file (str): The sparse timestamp/offset index of the audit log.
+            - key_file (str): The encryption key.
+            - users_data_file (str): The vault.
+            - index_file (str): The index of the vault by website.
+            - lock_dir (str): The directory holding the lock files of the user's files (see FileLock.user_lock).
+    """
+    audit_file: str
+    audit_index_file: str
+    key_file: str
+    users_data_file: str
+    index_file: str
+    lock_dir: str
+
+
+def user_file_names(user_id: str) -> UserFiles:
+    """
+        Return the names of a user's files, the same in every layout.
+
+        Args:
+            user_id (str): User ID.
+
+        Returns:
+            UserFiles: The file names, without a directory.
+    """
+    return UserFiles(f'{user_id}_audit.txt', f'{user_id}_audit_index.txt', f'{user_id}_key.txt',
+                     f'{user_id}_data.json', f'{user_id}_index.txt', f'{user_id}_locks')
+
+
+class DataLayout:
+    """
+        Places the users' files under a data root.
+
+        In the flat layout, every file is directly in the root, as the storage always did. In the sharded layout,
+        a user's files are in the directory <root>/<h1>/<h2>/<user ID>, where h1 and h2 are the first hex digits
+        of the SHA-256 of the user ID, so no directory grows with the number of users. The file names are the same
+        in both layouts.
+
+        The sharded layout still reads users whose files are in the flat layout: a user without a sharded directory
+        whose key, vault or audit log is found directly in the root keeps using those files until LayoutMigration
+        moves them.
+
+        Attributes:
+            - root (str): The data root, '' for the current directory.
+            - layout (str): One of DATA_LAYOUTS, for new users.
+    """
+    def __init__(self, root: str = '', layout: str = 'flat'):
+        """
+            Initialize the DataLayout instance.
+
+            Args:
+                root (str): The data root, '' for the current directory.
+                layout (str): One of DATA_LAYOUTS.
+
+            Raises:
+                ValueError: If the layout is unknown.
+        """
+        if layout not in DATA_LAYOUTS:
+            raise ValueError(f'Unknown data layout {layout!r}, expected one of {DATA_LAYOUTS}')
+        self.root: str = root
+        self.layout: str = layout
+
+    def user_files(self, user_id: str) -> UserFiles:
+        """
+            Return the paths of a user's files.
+
+            Args:
+                user_id (str): User ID.
+
+            Returns:
+                UserFiles: The paths, in the user's sharded directory unless the layout is flat
+                or the user still has files in the flat layout.
+        """
+        if self.layout == 'flat':
+            return self.flat_files(user_id)
+
+        # Users already in the sharded layout, and new users, need a single check
+        user_dir: str = self.user_dir(user_id)
+        if not os.path.isdir(user_dir):
+            flat_files: UserFiles = self.flat_files(user_id)
+            if any(os.path.exists(path) for path in (flat_files.key_file, flat_files.users_data_file,
+                                                       flat_files.audit_file)):
+                return flat_files
+        return self.sharded_files(user_id)
+
+    def flat_files(self, user_id: str) -> UserFiles:
+        """
+            Return the paths of a user's files in the flat layout.
+
+            Args:
+                user_id (str): User ID.
+
+            Returns:
+                UserFiles: The paths, directly in the root.
+        """
+        return UserFiles(*(os.path.join(self.root, name) for name in user_file_names(user_id)))
+
+    def sharded_files(self, user_id: str) -> UserFiles:
+        """
+            Return the paths of a user's files in the sharded layout.
+
+            Args:
+                user_id (str): User ID.
+
+            Returns:
+                UserFiles: The paths, in the user's directory.
+        """
+        user_dir: str = self.user_dir(user_id)
+        return UserFiles(*(os.path.join(user_dir, name) for name in user_file_names(user_id)))
+
+    def user_dir(self, user_id: str) -> str:
+        """
+            Return the directory of a user in the sharded layout.
+
+            Args:
+                user_id (str): User ID.
+
+            Returns:
+                str: The path of the directory, which may not exist yet.
+        """
+        digest: str = hashlib.sha256(user_id.encode('utf-8')).hexdigest()
+        shards = (digest[level * SHARD_WIDTH:(level + 1) * SHARD_WIDTH] for level in range(SHARD_DEPTH))
+        return os.path.join(self.root, *shards, user_id)
@@ -0,0 +1,261 @@
+import contextlib
+import os
+import threading
+import time
+from typing import Dict, Iterator, Optional, Set
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no fcntl, msvcrt locks byte ranges instead
+    fcntl = None
+    import msvcrt
+
+# Pause between two attempts to take a lock that another process holds, where the OS cannot wait for it
+LOCK_RETRY_INTERVAL: float = 0.001
+
+
+class FileLock:
+    """
+        A lock shared by the threads of this process and, through an advisory lock on a lock file,
+        by every other process that locks the same path.
+
+        The lock file is the locked path plus '.lock'. It is a separate file because the files it protects
+        are replaced through os.replace, while a lock must stay on the same file for every process.
+        The storage keeps the lock files of a user in one directory (see user_lock), created with the first lock.
+        The lock file is opened only while the lock is held, so idle locks cost no file descriptor.
+
+        flock is used rather than POSIX record locks (lockf): record locks belong to the whole process, so the
+        kernel reports a deadlock when threads of two processes wait on different locks held by the other process,
+        although each lock is released as soon as its holder is done. A process forked while a lock is held
+        closes its inherited copy of the lock file, so a process pool cannot keep the lock held.
+
+        The lock is reentrant within a thread, like threading.RLock. It is exclusive, or shared between processes
+        that only read (shared()); the threads of this process still take it one at a time. Windows has no shared
+        locks, so there a shared lock is exclusive. Use file_lock() to get the FileLock of a path shared
+        by the whole process.
+
+        Attributes:
+            - path (str): Absolute path of the lock file.
+    """
+    def __init__(self, path: str):
+        """
+            Initialize the FileLock instance.
+
+            Args:
+                path (str): Absolute path of the file to lock.
+        """
+        self.path: str = f'{path}.lock'
+        self._thread_lock: threading.RLock = threading.RLock()
+        self._depth: int = 0
+        self._shared: bool = False
+        self._lock_file: Optional[int] = None
+
+    def acquire(self, blocking: bool = True, shared: bool = False) -> bool:
+        """
+            Take the lock, waiting for other threads and processes to release it.
+
+            Args:
+                blocking (bool): Wait for the lock; if False, return at once when it is held elsewhere.
+                shared (bool): Take the lock shared with other processes that take it shared, to read only.
+
+            Returns:
+                bool: True if the lock was taken, False if blocking is False and the lock is held elsewhere.
+
+            Raises:
+                RuntimeError: If the thread holds the lock shared and asks for it exclusive; flock would have
+                    to release the lock to upgrade it.
+        """
+        if not self._thread_lock.acquire(blocking):
+            return False
+
+        # Nested acquisitions by the thread that holds the lock only count
+        if self._depth:
+            if self._shared and not shared:
+                self._thread_lock.release()
+                raise RuntimeError(f'{self.path} is held shared and cannot be taken exclusive')
+            self._depth += 1
+            return True
+
+        try:
+            lock_file: int = _open_lock_file(self.path)
+            try:
+                locked: bool = _lock_file(lock_file, blocking, shared)
+            except BaseException:
+                os.close(lock_file)
+                raise
+        except BaseException:
+            self._thread_lock.release()
+            raise
+
+        if not locked:
+            os.close(lock_file)
+            self._thread_lock.release()
+            return False
+
+        self._lock_file = lock_file
+        self._depth = 1
+        self._shared = shared
+        _held_locks.add(self)
+        return True
+
+    def release(self) -> None:
+        """
+            Release the lock; the lock file is unlocked and closed once the outermost acquisition is released.
+        """
+        self._depth -= 1
+        if not self._depth:
+            _held_locks.discard(self)
+            lock_file: int = self._lock_file
+            self._lock_file = None
+            try:
+                _unlock_file(lock_file)
+            finally:
+                os.close(lock_file)
+        self._thread_lock.release()
+
+    @contextlib.contextmanager
+    def shared(self) -> Iterator['FileLock']:
+        """
+            Hold the lock shared for the duration of a with block, see acquire.
+
+            Yields:
+                FileLock: This lock.
+        """
+        self.acquire(shared=True)
+        try:
+            yield self
+        finally:
+            self.release()
+
+    def __enter__(self) -> 'FileLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+def _open_lock_file(path: str) -> int:
+    """
+        Open a lock file, creating it and its directory if needed.
+
+        Args:
+            path (str): Absolute path of the lock file.
+
+        Returns:
+            int: Descriptor of the lock file, opened for writing.
+    """
+    try:
+        return os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+
+def _lock_file(lock_file: int, blocking: bool, shared: bool = False) -> bool:
+    """
+        Take the advisory lock of an open lock file.
+
+        Args:
+            lock_file (int): Descriptor of the lock file, opened for writing.
+            blocking (bool): Wait until the lock is free.
+            shared (bool): Take the lock shared; msvcrt only has exclusive locks.
+
+        Returns:
+            bool: True if the lock was taken, False if blocking is False and another process holds it.
+    """
+    if fcntl is not None:
+        operation: int = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        try:
+            fcntl.flock(lock_file, operation if blocking else operation | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    # msvcrt.locking gives up after ten seconds when blocking, so poll without blocking instead
+    while True:
+        try:
+            msvcrt.locking(lock_file, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            if not blocking:
+                return False
+            time.sleep(LOCK_RETRY_INTERVAL)
+
+
+def _unlock_file(lock_file: int) -> None:
+    """
+        Release the advisory lock of an open lock file.
+
+        Args:
+            lock_file (int): Descriptor of the lock file.
+    """
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        os.lseek(lock_file, 0, os.SEEK_SET)
+        msvcrt.locking(lock_file, msvcrt.LK_UNLCK, 1)
+
+
+# The locks held by some thread of this process right now
+_held_locks: Set[FileLock] = set()
+
+
+def _forget_inherited_locks() -> None:
+    """
+        Close the lock files a forked process inherited from its parent.
+
+        The parent still holds those locks; the child's copies of the descriptors would keep them held
+        for as long as the child runs. The forking thread was the only one copied, so no thread of the child
+        holds any lock and the per-lock thread locks are replaced as well.
+    """
+    for lock in list(_held_locks):
+        os.close(lock._lock_file)
+        lock._lock_file = None
+        lock._depth = 0
+        lock._shared = False
+        lock._thread_lock = threading.RLock()
+    _held_locks.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_inherited_locks)
+
+
+# The FileLock of every path locked so far in this process
+_file_locks: Dict[str, FileLock] = {}
+_file_locks_guard: threading.Lock = threading.Lock()
+
+
+def file_lock(path: str) -> FileLock:
+    """
+        Return the process-wide lock of a file.
+
+        Args:
+            path (str): Path of the file to lock, made absolute.
+
+        Returns:
+            FileLock: The lock, created on first use.
+    """
+    path = os.path.abspath(path)
+    with _file_locks_guard:
+        lock: Optional[FileLock] = _file_locks.get(path)
+        if lock is None:
+            lock = _file_locks[path] = FileLock(path)
+        return lock
+
+
+def user_lock(lock_dir: str, name: str) -> FileLock:
+    """
+        Return the process-wide lock of one of a user's files; every lock file of a user is in the user's
+        lock directory, instead of next to each file it protects.
+
+        Args:
+            lock_dir (str): The user's lock directory, created with the first lock.
+            name (str): The name of the lock, such as 'vault', 'compaction', 'index' or 'audit'.
+
+        Returns:
+            FileLock: The lock, whose lock file is <lock_dir>/<name>.lock.
+    """
+    return file_lock(os.path.join(lock_dir, name))
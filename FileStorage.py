@@ -0,0 +1,1309 @@
+import datetime
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, Dict, IO, Iterator, List, Optional, Sequence, Set, Tuple, TypeVar
+from AuditArchive import AuditHistory, segment_files
+from AuditWriter import get_audit_writer
+from BlockVault import (VAULT_BLOCK_SIZE, BlockCredentialWriter, block_vault_stats, compact_block_vault,
+                        find_live_records, iter_live_records, read_tail, tail_file, take_snapshot)
+from DataLayout import DataLayout, UserFiles, user_file_names
+from FileLock import FileLock, file_lock, user_lock
+from KeyRing import KeyFileReader, get_key_ring, stored_keys
+from Metrics import add_bytes, phase
+from RegistryCache import FileSignature, RegistryState, file_signature, registry_cache
+from Storage import CredentialWriter, StaleKeyError, StorageBackend
+from VaultFormat import (DEFAULT_VAULT_FORMAT, RECORD_ADD, BlockVaultFormat, compact_record, detect_open_vault_format,
+                         detect_vault_format, peek_record)
+from WebsiteIndex import IndexEntry, WebsiteIndex
+
+if TYPE_CHECKING:
+    from cryptography.fernet import Fernet
+    from User import User
+
+# The journal is compacted into the snapshot once it holds more entries than this or than the snapshot has users,
+# whichever is larger, which keeps the cost of registering a user O(1) amortized
+JOURNAL_COMPACT_MIN_ENTRIES: int = 1000
+
+# Number of vault bytes before a read offset that read_appended_records checks; they end the last record read,
+# whose random IV and HMAC make them unique to that vault file
+APPEND_ANCHOR_SIZE: int = 32
+
+# Number of per-user website indexes and audit readers kept in memory
+OPEN_INDEX_LIMIT: int = 256
+
+CachedItem = TypeVar('CachedItem')
+
+# Durability levels of vault appends: records always reach the OS at the end of each write ('flush'),
+# 'fsync' also waits until they are on disk so they survive a crash of the machine
+VAULT_DURABILITY_LEVELS: Tuple[str, ...] = ('flush', 'fsync')
+
+
+def vault_lock(lock_dir: str) -> FileLock:
+    """
+        Return the lock of a user's data file, held while records are appended and while a compaction swaps the file.
+
+        The lock is shared by the threads of this process and, through an advisory file lock, by other processes.
+
+        Args:
+            lock_dir (str): The user's lock directory.
+
+        Returns:
+            FileLock: The lock, created on first use.
+    """
+    return user_lock(lock_dir, 'vault')
+
+
+def remove_lock_dir(lock_dir: str) -> None:
+    """
+        Delete a user's lock directory and the lock files in it, once no process uses the user's files.
+
+        Args:
+            lock_dir (str): The user's lock directory, which may not exist.
+    """
+    try:
+        lock_names: List[str] = os.listdir(lock_dir)
+    except FileNotFoundError:
+        return
+    for lock_name in lock_names:
+        try:
+            os.remove(os.path.join(lock_dir, lock_name))
+        except FileNotFoundError:
+            pass
+    try:
+        os.rmdir(lock_dir)
+    except FileNotFoundError:
+        pass
+
+
+def same_file(path: str, other_path: str) -> bool:
+    """
+        Check whether two paths name the same file.
+
+        Args:
+            path (str): A path.
+            other_path (str): Another path.
+
+        Returns:
+            bool: True if both exist and are links to the same file.
+    """
+    try:
+        return os.path.samefile(path, other_path)
+    except FileNotFoundError:
+        return False
+
+
+def vault_rewrite_lock(lock_dir: str) -> FileLock:
+    """
+        Return the lock held by the one rewrite (compaction, migration or re-encryption) of a user's data file
+        that may run at a time; appends continue meanwhile.
+
+        Args:
+            lock_dir (str): The user's lock directory.
+
+        Returns:
+            FileLock: The lock, created on first use.
+    """
+    return user_lock(lock_dir, 'compaction')
+
+
+class PendingAppend:
+    """
+        Records a writer queued for a group commit, and the outcome once the commit is done.
+
+        Attributes:
+            - website_index (WebsiteIndex): The index to add the records to once they are written.
+            - records (Sequence[Tuple[str, bytes]]): (website, encrypted record) pairs.
+            - kind (str): The kind of the records, RECORD_ADD, RECORD_REPLACE or RECORD_DELETE.
+            - key (Optional[bytes]): The key the records were encrypted with, None if unknown.
+            - done (bool): The commit that included the records is over.
+            - error (Optional[BaseException]): The error that commit failed with, or the StaleKeyError the records
+              were left out with; None if they were written.
+    """
+    def __init__(self, website_index: WebsiteIndex, records: Sequence[Tuple[str, bytes]], kind: str,
+                 key: Optional[bytes] = None):
+        """
+            Initialize the PendingAppend instance.
+
+            Args:
+                website_index (WebsiteIndex): The index to add the records to.
+                records (Sequence[Tuple[str, bytes]]): (website, encrypted record) pairs.
+                kind (str): The kind of the records.
+                key (Optional[bytes]): The key the records were encrypted with, None if unknown.
+        """
+        self.website_index: WebsiteIndex = website_index
+        self.records: Sequence[Tuple[str, bytes]] = records
+        self.kind: str = kind
+        self.key: Optional[bytes] = key
+        self.done: bool = False
+        self.error: Optional[BaseException] = None
+
+
+class GroupCommit:
+    """
+        Merges the appends of concurrent writers of one data file into a single locked write and flush or fsync.
+
+        A writer queues its records and, when no other writer of the file is committing, becomes the leader:
+        it takes every queued append, writes them all with one call under the vault lock and wakes up the writers
+        whose records it wrote. Writers arriving meanwhile queue up and are written together by the next leader,
+        so N concurrent appends pay for about one lock round trip and one fsync instead of N.
+    """
+    def __init__(self):
+        """
+            Initialize an idle GroupCommit.
+        """
+        self._condition: threading.Condition = threading.Condition()
+        self._pending: List[PendingAppend] = []
+        self._committing: bool = False
+
+    def append(self, writer: 'FileCredentialWriter', pending: PendingAppend) -> None:
+        """
+            Queue records and wait until they are written, by this thread or by the leader of a commit.
+
+            Args:
+                writer (FileCredentialWriter): The writer of the calling thread, used if it becomes the leader.
+                pending (PendingAppend): The records.
+
+            Raises:
+                BaseException: The error the commit that included the records failed with.
+        """
+        with self._condition:
+            self._pending.append(pending)
+            while self._committing and not pending.done:
+                self._condition.wait()
+            if not pending.done:
+                # Lead the next commit, with every append queued so far
+                self._committing = True
+                batch: List[PendingAppend] = self._pending
+                self._pending = []
+
+        if not pending.done:
+            error: Optional[BaseException] = None
+            try:
+                writer.append_pending(batch)
+            except BaseException as commit_error:
+                error = commit_error
+            with self._condition:
+                for queued in batch:
+                    queued.done = True
+                    queued.error = error if error is not None else queued.error
+                self._committing = False
+                self._condition.notify_all()
+
+        if pending.error is not None:
+            raise pending.error
+
+
+# One group commit per data file
+_group_commits: Dict[str, GroupCommit] = {}
+_group_commits_guard: threading.Lock = threading.Lock()
+
+
+def vault_group_commit(data_file: str) -> GroupCommit:
+    """
+        Return the process-wide group commit of a data file.
+
+        Args:
+            data_file (str): Absolute path of the data file.
+
+        Returns:
+            GroupCommit: The group commit, created on first use.
+    """
+    with _group_commits_guard:
+        return _group_commits.setdefault(data_file, GroupCommit())
+
+
+class FileCredentialWriter(CredentialWriter):
+    """
+        Appends encrypted records to a user's data file through one open handle and keeps the website index current.
+
+        Appends hold the vault lock, so writers in other threads and processes never interleave their records.
+        With group_commit, the appends of concurrent writers of the same file are merged (see GroupCommit).
+        Under the lock, records encrypted with another key than the first key of the key file are left out with
+        a StaleKeyError, as a key rotation may have re-encrypted the vault already (see FileStorage.rotate_key).
+    """
+    def __init__(self, data_file: str, website_index: WebsiteIndex, cipher: 'Fernet', lock: FileLock,
+                 durability: str = 'flush', group_commit: bool = False, vault_format: Optional[type] = None,
+                 key_file: Optional[KeyFileReader] = None, key: Optional[bytes] = None):
+        """
+            Initialize the FileCredentialWriter instance.
+
+            Args:
+                data_file (str): Absolute path of the user's data file.
+                website_index (WebsiteIndex): The user's website index.
+                cipher (Fernet): The user's cipher.
+                lock (FileLock): The vault lock of the data file.
+                durability (str): One of VAULT_DURABILITY_LEVELS.
+                group_commit (bool): Merge the appends of concurrent writers into one write.
+                vault_format (Optional[type]): The format of the data file if the caller has detected it already.
+                key_file (Optional[KeyFileReader]): The user's key file, checked before every append.
+                key (Optional[bytes]): The key the cipher encrypts with.
+        """
+        super().__init__(cipher)
+        self._path: str = data_file
+        self._key_file: Optional[KeyFileReader] = key_file
+        self._key: Optional[bytes] = key
+        self._lock: FileLock = lock
+        self._website_index: WebsiteIndex = website_index
+        self._durability: str = durability
+        self._group_commit: Optional[GroupCommit] = vault_group_commit(data_file) if group_commit else None
+        self._data_file: IO[bytes] = open(data_file, 'ab')
+        self._vault_format: type = vault_format or self._detect_format()
+
+    def write(self, records: Sequence[Tuple[str, bytes]], kind: str = RECORD_ADD) -> None:
+        """
+            Append encrypted records to the data file, framed in the file's format, with a single write call.
+
+            Args:
+                records (Sequence[Tuple[str, bytes]]): (website, encrypted record) pairs.
+                kind (str): The kind of the records, RECORD_ADD, RECORD_REPLACE or RECORD_DELETE.
+
+            Raises:
+                StaleKeyError: If the records were not encrypted with the first key of the key file.
+        """
+        pending: PendingAppend = PendingAppend(self._website_index, records, kind, self._key)
+        if self._group_commit is not None:
+            self._group_commit.append(self, pending)
+        else:
+            self.append_pending([pending])
+            if pending.error is not None:
+                raise pending.error
+
+    def append_pending(self, appends: List[PendingAppend]) -> None:
+        """
+            Append the records of one or more writers of this data file with a single write call.
+
+            Args:
+                appends (List[PendingAppend]): The records of each writer, in the order to store them; the error of
+                    the appends encrypted with another key than the first key of the key file is set to a StaleKeyError.
+        """
+        with self._lock:
+            # A key rotation re-encrypts the vault under this lock before it drops the old key, records encrypted
+            # with another key than the one new records are encrypted with must be encrypted again
+            current_key: Optional[bytes] = self._key_file.encryption_key() if self._key_file is not None else None
+            if current_key is not None:
+                for pending in appends:
+                    if pending.key is not None and pending.key != current_key:
+                        pending.error = StaleKeyError(f'The key in {self._key_file.path} was replaced')
+                appends = [pending for pending in appends if pending.error is None]
+                if not appends:
+                    return
+
+            # A compaction or migration may have swapped the data file since it was opened, append to the new one
+            if os.fstat(self._data_file.fileno()).st_ino != os.stat(self._path).st_ino:
+                self._data_file.close()
+                self._data_file = open(self._path, 'ab')
+                self._vault_format = self._detect_format()
+
+            # Other processes may have appended since the last write, the records go after theirs
+            self._data_file.seek(0, os.SEEK_END)
+
+            # A new data file starts with the header of its format
+            header: bytes = self._vault_format.header if self._data_file.tell() == 0 else b''
+            offset: int = self._data_file.tell() + len(header)
+
+            # (website, offset, size) of each record of each append, for the website index
+            append_locations: List[List[Tuple[str, int, int]]] = []
+            framed_records: List[bytes] = [header]
+            for pending in appends:
+                locations: List[Tuple[str, int, int]] = []
+                for website, encrypted_data in pending.records:
+                    framed_records.append(self._vault_format.frame(encrypted_data))
+                    locations.append((website, offset, len(framed_records[-1])))
+                    offset += len(framed_records[-1])
+                append_locations.append(locations)
+
+            self._data_file.write(b''.join(framed_records))
+            self._data_file.flush()
+            if self._durability == 'fsync':
+                os.fsync(self._data_file.fileno())
+
+            for pending, locations in zip(appends, append_locations):
+                pending.website_index.record_appended(locations, pending.kind)
+
+    def _detect_format(self) -> type:
+        """
+            Detect the format of the open data file; an empty file gets the default format.
+
+            Returns:
+                type: The vault format class.
+        """
+        with open(self._path, 'rb') as data_file:
+            return detect_open_vault_format(data_file) or DEFAULT_VAULT_FORMAT
+
+    def close(self) -> None:
+        """
+            Close the data file.
+        """
+        self._data_file.close()
+
+
+class FileStorage(StorageBackend):
+    """
+        The flat-file storage: a shared users.json registry plus files per user in the working directory,
+        or in data_root when one is given.
+
+        - users_file: the registry snapshot, a JSON object mapping user IDs to names
+        - users_file + '.journal': one JSON line per user created since the last snapshot
+        - {user_id}_key.txt: the user's encryption key; during a key rotation, the new key followed by the old ones
+        - {user_id}_data.json: the encrypted records in one of the VaultFormat layouts, with {user_id}_index.txt
+          indexing them by website and telling live records from replaced or deleted ones and tombstones;
+          a block vault keeps its open tail block in {user_id}_data.json.tail
+        - {user_id}_audit.txt: the audit log, with {user_id}_audit_index.txt indexing it by time
+          and, once the audit writer rotates it (see AuditArchive), older entries in gzip segments
+          {user_id}_audit.txt.NNNNNN.gz listed in {user_id}_audit.txt.segments
+
+        Creating a user only appends to the journal; loading replays the journal over the snapshot, and the
+        journal is periodically compacted into a new snapshot that atomically replaces the old one.
+        Loaded registries are shared through the process-wide registry_cache.
+
+        Vaults seal every record as its own token unless block_size is set: new vaults are then created
+        as block vaults that seal about block_size bytes of records per token (see BlockVault).
+        Existing vaults keep their layout either way, it is detected from the data file.
+
+        Several processes can share the files: vault appends, compactions and registry changes hold advisory
+        file locks (see FileLock), and registry changes merge what other processes registered in the meantime.
+        With group_commit, concurrent appends to one vault from the threads of a process are merged into
+        a single write and, with 'fsync' durability, a single fsync.
+
+        With the 'sharded' layout, the files of a user are kept in a directory of their own, nested under
+        hash-prefix directories of the data root, instead of directly in the data root (see DataLayout);
+        users still in the flat layout are read where they are until LayoutMigration moves them.
+
+        Attributes:
+            - users_file (str): File path for user data in JSON format, in data_root unless absolute.
+            - journal_file (str): File path for the journal of user creations.
+            - block_size (Optional[int]): Plaintext bytes per block of new block vaults, None for per-record vaults.
+            - durability (str): One of VAULT_DURABILITY_LEVELS, for vault appends.
+            - group_commit (bool): Merge concurrent appends to the same vault.
+            - data_layout (DataLayout): Where the files of each user are kept.
+    """
+    def __init__(self, users_file: str = 'users.json', block_size: Optional[int] = None, durability: str = 'flush',
+                 group_commit: bool = False, data_root: Optional[str] = None, layout: str = 'flat'):
+        """
+            Initialize the FileStorage instance.
+
+            Args:
+                users_file (str): File path for user data in JSON format.
+                block_size (Optional[int]): Create new vaults as block vaults with blocks of this many plaintext
+                    bytes; VAULT_BLOCK_SIZE is a reasonable choice. None keeps one token per record.
+                durability (str): One of VAULT_DURABILITY_LEVELS, 'fsync' waits until appended records are on disk.
+                group_commit (bool): Merge the appends of threads writing to the same vault at the same time
+                    into one write, sharing its fsync.
+                data_root (Optional[str]): Directory holding the registry and the users' files,
+                    the working directory if None. It is created if missing.
+                layout (str): One of DATA_LAYOUTS, 'sharded' keeps the files of every user in a directory of their own.
+
+            Raises:
+                ValueError: If the durability level or the layout is unknown.
+        """
+        if durability not in VAULT_DURABILITY_LEVELS:
+            raise ValueError(f'Unknown durability level {durability!r}, expected one of {VAULT_DURABILITY_LEVELS}')
+
+        self.data_layout: DataLayout = DataLayout(data_root or '', layout)
+        if data_root:
+            os.makedirs(data_root, exist_ok=True)
+            users_file = os.path.join(data_root, users_file)
+
+        self.users_file: str = users_file
+        self.journal_file: str = f'{users_file}.journal'
+        self.block_size: Optional[int] = block_size
+        self.durability: str = durability
+        self.group_commit: bool = group_commit
+        self._registry: Optional[RegistryState] = None
+
+        # Website indexes and audit readers keep useful state in memory, so they are reused between calls
+        self._website_indexes: 'OrderedDict[Tuple[str, bytes], WebsiteIndex]' = OrderedDict()
+        self._audit_readers: 'OrderedDict[str, AuditHistory]' = OrderedDict()
+        self._cache_lock: threading.Lock = threading.Lock()
+
+        # Directories of the sharded layout known to exist, so writes do not check them every time
+        self._user_dirs: Set[str] = set()
+
+    # Registry
+
+    def load_users(self) -> Dict[str, str]:
+        """
+            Load or create the user data file.
+
+            Reuses the registry from the process-wide cache when the file has not been replaced since it was loaded,
+            otherwise tries to load user data from the file, creates a new file if not found.
+            The journal is replayed over the loaded data. Both are read under the registry's file lock, held shared
+            so that processes reading the registry do not wait for each other; a journal compaction by another
+            process takes it exclusive and is never seen half done.
+
+            Returns:
+                Dict[str, str]: User IDs mapped to user names, shared with every user of the same file.
+        """
+        with registry_cache.lock, file_lock(self.users_file).shared():
+            cached_registry: Optional[RegistryState] = registry_cache.get(self.users_file)
+            if cached_registry is not None:
+                # Apply only the journal entries appended since the registry was cached
+                self._registry = cached_registry
+                self._replay_journal()
+                return self._registry.users
+
+            try:
+                # Attempt to open the specified file for reading
+                with open(self.users_file, 'r', encoding='utf-8') as file:
+                    # Load user data from the file
+                    users: Dict[str, str] = json.load(file)
+
+            except FileNotFoundError:
+                # Print a message indicating that the specified file does not exist
+                # and inform that a new file is being created with the given filename
+                print(f"File '{self.users_file}' does not exist. Creating a new file.")
+
+                # If the file is not found, create a new file and initialize an empty user dictionary.
+                # Other readers may create it at the same time, each through its own temporary file; no writer
+                # can have filled it meanwhile, as writers take the lock exclusive
+                temp_file: str = f'{self.users_file}.{os.getpid()}.tmp'
+                with open(temp_file, 'w', encoding='utf-8') as new_file:
+                    # Initialize an empty user dictionary and save it to the new file
+                    json.dump({}, new_file)
+                os.replace(temp_file, self.users_file)
+                users: Dict[str, str] = {}
+
+            # Share the loaded registry with every other user of this file
+            self._registry = RegistryState(users, file_signature(self.users_file))
+            registry_cache.put(self.users_file, self._registry)
+
+            # Apply the users created since the last snapshot
+            self._replay_journal()
+            return self._registry.users
+
+    def add_user(self, user_id: str, user_name: str) -> bool:
+        """
+            Register a new user by appending it to the journal, compacting the journal when it has grown large.
+
+            Args:
+                user_id (str): User ID.
+                user_name (str): User's name.
+
+            Returns:
+                bool: True if the user was added, False if the user ID already exists.
+        """
+        entry: bytes = (json.dumps({'id': user_id, 'name': user_name}) + '\n').encode('utf-8')
+
+        with registry_cache.lock, file_lock(self.users_file):
+            # Bring the registry up to date with the users other processes registered, so no ID is added twice
+            self.load_users()
+            if user_id in self._registry.users:
+                return False
+            self._registry.users[user_id] = user_name
+
+            with open(self.journal_file, 'ab') as journal:
+                offset: int = journal.tell()
+                journal.write(entry)
+
+            # Mark the entry as applied, unless another process appended entries this registry has not seen yet
+            if offset == self._registry.journal_size:
+                self._registry.journal_size += len(entry)
+            self._registry.journal_entries += 1
+            registry_cache.changed()
+
+            # Compact once the journal outgrows the snapshot, so each entry is rewritten O(1) times on average
+            journal_entries: int = self._registry.journal_entries
+            if journal_entries > max(JOURNAL_COMPACT_MIN_ENTRIES, len(self._registry.users) - journal_entries):
+                self.save_users(self._registry.users)
+            return True
+
+    def save_users(self, users: Dict[str, str]) -> None:
+        """
+            Save user data to the file.
+
+            The data is written to a temporary file that atomically replaces the old one, so a crash mid-write
+            cannot truncate the registry. The journal is emptied afterwards, its entries are part of the new file.
+            Users that other processes registered since users was loaded are merged in first, under the registry's
+            file lock, so concurrent saves never lose a registration.
+
+            Args:
+                users (Dict[str, str]): User IDs mapped to user names; the merged users are added to it.
+        """
+        temp_file: str = f'{self.users_file}.tmp'
+
+        with registry_cache.lock, file_lock(self.users_file):
+            # Keep the registrations on disk that users does not know about yet; when users is the loaded registry
+            # and the snapshot has not been replaced, they are all in the journal entries appended since
+            if self._registry is not None and self._registry.users is users and \
+                    file_signature(self.users_file) == self._registry.snapshot_signature:
+                self._replay_journal()
+            else:
+                stored_users: Dict[str, str] = self._read_users_file()
+                try:
+                    with open(self.journal_file, 'r', encoding='utf-8') as journal:
+                        journal_data: str = journal.read()
+                except FileNotFoundError:
+                    journal_data = ''
+                for entry in self._parse_journal(journal_data[:journal_data.rfind('\n') + 1]):
+                    stored_users[entry['id']] = entry['name']
+                for user_id, user_name in stored_users.items():
+                    users.setdefault(user_id, user_name)
+
+            # Open the temporary file for writing and save the user data in JSON format
+            with open(temp_file, 'w', encoding='utf-8') as file:
+                json.dump(users, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_file, self.users_file)
+
+            # Empty the journal; replaying it over the new file would be harmless if this step is interrupted
+            with open(self.journal_file, 'w', encoding='utf-8'):
+                pass
+
+            # The cached registry now matches the new snapshot and the empty journal
+            if self._registry is not None and self._registry.users is users:
+                self._registry.snapshot_signature = file_signature(self.users_file)
+                self._registry.journal_size = 0
+                self._registry.journal_entries = 0
+            else:
+                registry_cache.invalidate(self.users_file)
+            registry_cache.changed()
+
+    def _replay_journal(self) -> int:
+        """
+            Apply the journal entries that are not part of the loaded user data yet.
+
+            Returns:
+                int: The number of journal entries applied.
+        """
+        try:
+            with open(self.journal_file, 'rb') as journal:
+                if os.fstat(journal.fileno()).st_size < self._registry.journal_size:
+                    # The journal was emptied without the snapshot changing, nothing new to apply
+                    self._registry.journal_size = 0
+                    return 0
+                journal.seek(self._registry.journal_size)
+                journal_data: str = journal.read().decode('utf-8')
+        except FileNotFoundError:
+            return 0
+
+        # Drop a torn last line left by an interrupted write
+        journal_data = journal_data[:journal_data.rfind('\n') + 1]
+        if not journal_data:
+            return 0
+
+        entries: List[Dict[str, str]] = self._parse_journal(journal_data)
+        users: Dict[str, str] = self._registry.users
+        for entry in entries:
+            users[entry['id']] = entry['name']
+        self._registry.journal_size += len(journal_data.encode('utf-8'))
+        self._registry.journal_entries += len(entries)
+        registry_cache.changed()
+        return len(entries)
+
+    def _read_users_file(self) -> Dict[str, str]:
+        """
+            Read the registry snapshot file, bypassing the registry cache.
+
+            Returns:
+                Dict[str, str]: User IDs mapped to user names, empty if the file does not exist.
+        """
+        try:
+            with open(self.users_file, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    @staticmethod
+    def _parse_journal(journal_data: str) -> List[Dict[str, str]]:
+        """
+            Parse journal lines into user entries.
+
+            Args:
+                journal_data (str): Complete journal lines.
+
+            Returns:
+                List[Dict[str, str]]: The entries, each with an 'id' and a 'name'; lines that are not valid JSON
+                are skipped.
+        """
+        if not journal_data:
+            return []
+        try:
+            # Parse the whole journal with one json.loads call by turning its lines into a JSON array
+            return json.loads('[' + journal_data[:-1].replace('\n', ',') + ']')
+        except ValueError:
+            # Fall back to line-by-line parsing, skipping lines that are not valid JSON
+            entries: List[Dict[str, str]] = []
+            for line in journal_data.splitlines():
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+            return entries
+
+    def user_files(self, user_id: str) -> UserFiles:
+        return self.data_layout.user_files(user_id)
+
+    def _ensure_user_dir(self, user: 'User') -> None:
+        """
+            Create the directory of a user's files before the first of them is written, in the sharded layout.
+
+            Args:
+                user (User): The user.
+        """
+        user_dir: str = os.path.dirname(user.key_file)
+        if user_dir and user_dir not in self._user_dirs:
+            os.makedirs(user_dir, exist_ok=True)
+            self._user_dirs.add(user_dir)
+
+    def move_user_to_sharded(self, user_id: str) -> bool:
+        """
+            Move a user's files from the flat layout into the user's directory of the sharded layout.
+
+            Every flat file is hard-linked into a staging directory next to the user's directory, which is renamed
+            into place once every file is in it; only then are the flat names removed. Until the rename the user
+            keeps using the complete set of flat files, afterwards the sharded ones, so an interruption at any point
+            leaves every file, the key above all, readable under one layout. Calling it again after an interruption
+            finishes the move: links to flat files that were replaced meanwhile are made again, and flat names left
+            after the rename are removed once they are checked to be the moved files. No other process may use
+            the user's files meanwhile.
+
+            Args:
+                user_id (str): User ID.
+
+            Returns:
+                bool: True if files were moved, False if the user has no files in the flat layout.
+
+            Raises:
+                ValueError: If the user has files in both layouts that differ.
+        """
+        # The pending audit entries of the user must reach the flat audit file before the files are listed
+        self.flush_audit()
+
+        # The user's files and the tail file of a block vault, with their names in the user's directory;
+        # the lock directory, the last of the user's files, stays behind and the sharded directory gets its own
+        flat_files: UserFiles = self.data_layout.flat_files(user_id)
+        flat_tail: str = tail_file(flat_files.users_data_file)
+        flat_paths: List[str] = list(flat_files[:-1]) + [flat_tail]
+        file_names: List[str] = list(user_file_names(user_id)[:-1]) + [os.path.basename(flat_tail)]
+        user_dir: str = self.data_layout.user_dir(user_id)
+        staging_dir: str = f'{user_dir}.moving'
+
+        present: List[Tuple[str, str]] = [(path, name) for path, name in zip(flat_paths, file_names)
+                                          if os.path.exists(path)]
+
+        # Rotated audit segments and their manifest move along with the audit file
+        present += [(path, os.path.basename(path)) for path in segment_files(flat_files.audit_file)]
+
+        if os.path.isdir(user_dir):
+            # Flat names left by a move interrupted after the rename are links to the files in the user's directory
+            for path, name in present:
+                if not same_file(path, os.path.join(user_dir, name)):
+                    raise ValueError(f'{user_id} has files in both the flat and the sharded layout')
+        elif present:
+            os.makedirs(staging_dir, exist_ok=True)
+
+            # Drop what an interrupted move staged for files that are gone since
+            staged_names: Set[str] = {name for _, name in present}
+            for name in os.listdir(staging_dir):
+                if name not in staged_names:
+                    os.remove(os.path.join(staging_dir, name))
+
+            # Link every file, again if a compaction or a rotation replaced it since an interrupted move linked it
+            for path, name in present:
+                staged_file: str = os.path.join(staging_dir, name)
+                if not same_file(path, staged_file):
+                    os.link(path, f'{staged_file}.link')
+                    os.replace(f'{staged_file}.link', staged_file)
+            os.replace(staging_dir, user_dir)
+        if not present:
+            return False
+
+        for path, _ in present:
+            os.remove(path)
+
+        # Drop the lock directory and the cached readers of the old paths
+        remove_lock_dir(flat_files.lock_dir)
+        moved_paths: Set[str] = {os.path.abspath(path) for path in flat_paths}
+        with self._cache_lock:
+            for cache_key in [cache_key for cache_key in self._website_indexes if cache_key[0] in moved_paths]:
+                del self._website_indexes[cache_key]
+            for cache_key in [cache_key for cache_key in self._audit_readers if cache_key in moved_paths]:
+                del self._audit_readers[cache_key]
+        return True
+
+    # Keys
+
+    def key_ring_id(self, user: 'User') -> str:
+        return os.path.abspath(user.key_file)
+
+    def load_key(self, user: 'User') -> Optional[bytes]:
+        try:
+            # Attempt to open the key file for reading in binary mode
+            with open(user.key_file, 'rb') as key_file:
+                return key_file.read()
+        except FileNotFoundError:
+            return None
+
+    def key_version(self, user: 'User') -> Optional[FileSignature]:
+        # The key file is only ever replaced as a whole (see _write_key_file), which gives it a new signature
+        return file_signature(user.key_file)
+
+    def save_key(self, user: 'User', key: bytes) -> None:
+        # Save the key to the key file in binary mode
+        self._ensure_user_dir(user)
+        with open(user.key_file, 'wb') as key_file:
+            key_file.write(key)
+
+    def rotate_key(self, user: 'User') -> Optional[Tuple[int, int]]:
+        """
+            Replace the user's encryption key with a new one and re-encrypt the vault with it.
+
+            The rotation takes three steps, after each of which the vault can be read, so a rotation that was
+            interrupted is finished by calling this again:
+                1. A new key is written to the key file in front of the current one. From then on the user's cipher
+                   encrypts with the new key and decrypts with either (MultiFernet).
+                2. The vault is re-encrypted into a temporary file that atomically replaces it, together with
+                   a website index hashed with the new key (see _reencrypt_vault).
+                3. The key file is rewritten with only the new key.
+
+            Other processes keep working meanwhile. Their key ring entries are tagged with the key file's signature,
+            so every User they load afterwards gets the new key, and a reader whose key no longer decrypts the vault
+            loads the key again and retries (see User.reload_key). Writers compare the key file with the key
+            of their cipher under the vault lock, which step 2 holds while it swaps the vault, so no record is
+            appended with the old key after the vault was re-encrypted; such a writer fails with a StaleKeyError
+            and PasswordManager writes the records again with the new key.
+
+            Args:
+                user (User): The user; its key is replaced with the new one.
+
+            Returns:
+                Optional[Tuple[int, int]]: The number of records re-encrypted and the size of the new data file,
+                or None if the user has no key.
+
+            Raises:
+                ValueError: If a key in the key file is not a valid encryption key.
+        """
+        from cryptography.fernet import Fernet
+
+        stored_key: Optional[bytes] = self.load_key(user)
+        if stored_key is None:
+            return None
+
+        # Step 1, unless an interrupted rotation already added the new key
+        keys: List[bytes] = stored_keys(stored_key)
+        if len(keys) == 1:
+            keys = [Fernet.generate_key()] + keys
+            self._write_key_file(user, b'\n'.join(keys) + b'\n')
+        get_key_ring().invalidate(self.key_ring_id(user))
+        user.key = b'\n'.join(keys) + b'\n'
+
+        # Step 2; the index of the vault was built with the previous key
+        rotated: Tuple[int, int] = self._reencrypt_vault(user, keys[1])
+
+        # Step 3
+        self._write_key_file(user, keys[0])
+        get_key_ring().invalidate(self.key_ring_id(user))
+        user.key = keys[0]
+        index_file: str = os.path.abspath(user.index_file)
+        with self._cache_lock:
+            for cache_key in [cache_key for cache_key in self._website_indexes
+                              if cache_key[0] == index_file and cache_key[1] != keys[0]]:
+                del self._website_indexes[cache_key]
+        return rotated
+
+    def _write_key_file(self, user: 'User', key: bytes) -> None:
+        """
+            Replace the user's key file atomically, so a crash never leaves it without a usable key.
+
+            Args:
+                user (User): The user.
+                key (bytes): The new content of the key file.
+        """
+        temp_file: str = f'{user.key_file}.tmp'
+        with open(temp_file, 'wb') as key_file:
+            key_file.write(key)
+            key_file.flush()
+            os.fsync(key_file.fileno())
+        os.replace(temp_file, user.key_file)
+
+    def _reencrypt_vault(self, user: 'User', previous_key: bytes) -> Tuple[int, int]:
+        """
+            Re-encrypt the live records of the user's vault with the user's new key and swap the new file in atomically.
+
+            The records are streamed from the data file into a temporary file one at a time, each keeping the time
+            it was originally encrypted at; replaced records and tombstones are dropped as in a compaction.
+            Appends wait on the vault lock until the new file and its index are in place. Block vaults are
+            compacted with the new key instead.
+
+            Args:
+                user (User): The user, whose cipher encrypts with the new key and decrypts with the previous one.
+                previous_key (bytes): The key the website index of the vault was built with.
+
+            Returns:
+                Tuple[int, int]: The number of records re-encrypted and the size of the new data file.
+        """
+        data_file: str = os.path.abspath(user.users_data_file)
+        index_file: str = os.path.abspath(user.index_file)
+        cipher = user.cipher
+        old_index: WebsiteIndex = WebsiteIndex(index_file, data_file, previous_key, cipher, user.lock_dir)
+        new_index: WebsiteIndex = self._website_index(user)
+        records: int = 0
+
+        with vault_rewrite_lock(user.lock_dir), vault_lock(user.lock_dir):
+            vault_format: Optional[type] = detect_vault_format(data_file)
+            if vault_format is None:
+                return 0, 0
+
+            if vault_format is BlockVaultFormat:
+                compact_block_vault(data_file, old_index, cipher, self.block_size or VAULT_BLOCK_SIZE)
+                new_index.rebuild()
+                return new_index.counts()[0], os.path.getsize(data_file)
+
+            temp_file: str = f'{data_file}.rotate'
+            new_entries: List[IndexEntry] = []
+            try:
+                with open(data_file, 'rb') as old_file, open(temp_file, 'wb') as new_file:
+                    new_file.write(vault_format.header)
+                    for _, offset, size in old_index.live_entries():
+                        old_file.seek(offset)
+                        token: bytes = vault_format.unframe(old_file.read(size))
+                        plaintext: bytes = cipher.decrypt(token)
+                        stored_record: bytes = vault_format.frame(
+                            cipher.encrypt_at_time(plaintext, cipher.extract_timestamp(token)))
+                        # Only live records are left, so every one of them is indexed as added
+                        new_entries.append((new_index.website_hash(peek_record(plaintext)[0]), new_file.tell(),
+                                            len(stored_record), RECORD_ADD))
+                        new_file.write(stored_record)
+                        records += 1
+
+                    new_file.flush()
+                    os.fsync(new_file.fileno())
+                os.replace(temp_file, data_file)
+            except BaseException:
+                # A record that does not decrypt leaves the vault as it was, without the half-written copy
+                try:
+                    os.remove(temp_file)
+                except FileNotFoundError:
+                    pass
+                raise
+            new_index.replace(new_entries)
+            add_bytes('written', os.path.getsize(data_file))
+            return records, os.path.getsize(data_file)
+
+    # Vault
+
+    def open_credential_writer(self, user: 'User') -> CredentialWriter:
+        self._ensure_user_dir(user)
+        data_file: str = os.path.abspath(user.users_data_file)
+        vault_format: Optional[type] = detect_vault_format(data_file)
+        cipher: 'Fernet' = user.cipher
+
+        # The key file as it was when the user's key was loaded, so the writers read it again only once it changed
+        key_file: KeyFileReader = KeyFileReader(os.path.abspath(user.key_file), user.stored_key, user.key_version)
+        if vault_format is BlockVaultFormat or (vault_format is None and self.block_size):
+            return BlockCredentialWriter(data_file, self._website_index(user), cipher,
+                                         self.block_size or VAULT_BLOCK_SIZE, vault_lock(user.lock_dir),
+                                         self.durability == 'fsync', key_file, user.key)
+        return FileCredentialWriter(data_file, self._website_index(user), cipher, vault_lock(user.lock_dir),
+                                    self.durability, self.group_commit, vault_format, key_file, user.key)
+
+    def iter_credential_tokens(self, user: 'User') -> Iterator[bytes]:
+        self._check_not_block_vault(user)
+
+        # Offsets of the live records, or None if the file holds no dead records. A compaction swaps the data file
+        # and replaces the index under the vault lock, so the file is opened under it too and the offsets match it.
+        live_offsets: Optional[Set[int]] = None
+        with vault_lock(user.lock_dir):
+            locations: Optional[List[Tuple[int, int]]] = self.live_record_locations(user)
+            data_file: IO[bytes] = open(user.users_data_file, 'rb')
+        if locations is not None:
+            live_offsets = {offset for offset, _ in locations}
+
+        with data_file:
+            vault_format: Optional[type] = detect_open_vault_format(data_file)
+            if vault_format is None:
+                return
+            for offset, _, token in vault_format.iter_records(data_file, 0):
+                # Skip dead records
+                if live_offsets is None or offset in live_offsets:
+                    yield token
+
+    def iter_credential_records(self, user: 'User') -> Iterator[bytes]:
+        if not self._is_block_vault(user):
+            yield from super().iter_credential_records(user)
+            return
+
+        data_file: str = os.path.abspath(user.users_data_file)
+        website_index: WebsiteIndex = self._website_index(user)
+        with vault_lock(user.lock_dir):
+            snapshot = take_snapshot(data_file, website_index, user.cipher)
+        yield from iter_live_records(data_file, website_index, user.cipher, snapshot)
+
+    def find_credential_tokens(self, user: 'User', website: str) -> List[bytes]:
+        self._check_not_block_vault(user)
+
+        # Look the records up and open the data file under the vault lock, so a compaction cannot swap the file
+        # in between and the offsets match the open file
+        with vault_lock(user.lock_dir):
+            locations: List[Tuple[int, int]] = self._website_index(user).lookup(website)
+            if not locations:
+                return []
+            data_file: IO[bytes] = open(user.users_data_file, 'rb')
+
+        tokens: List[bytes] = []
+        with data_file:
+            vault_format: Optional[type] = detect_open_vault_format(data_file)
+            for offset, size in locations:
+                data_file.seek(offset)
+                tokens.append(vault_format.unframe(data_file.read(size)))
+        return tokens
+
+    def find_credential_records(self, user: 'User', website: str) -> List[bytes]:
+        if not self._is_block_vault(user):
+            return super().find_credential_records(user, website)
+
+        data_file: str = os.path.abspath(user.users_data_file)
+        return find_live_records(data_file, self._website_index(user), user.cipher, vault_lock(user.lock_dir),
+                                 website)
+
+    def vault_stats(self, user: 'User') -> Tuple[int, int]:
+        if not self._is_block_vault(user):
+            return self._website_index(user).counts()
+
+        data_file: str = os.path.abspath(user.users_data_file)
+        with vault_lock(user.lock_dir):
+            return block_vault_stats(self._website_index(user), read_tail(data_file, user.cipher))
+
+    def cached_vault_stats(self, user: 'User') -> Optional[Tuple[int, int]]:
+        # The website index counts the records the writers append; the open tail of a block vault is counted
+        # once it is sealed
+        with self._cache_lock:
+            website_index: Optional[WebsiteIndex] = self._website_indexes.get((os.path.abspath(user.index_file),
+                                                                               user.key))
+        return website_index.cached_counts() if website_index is not None else None
+
+    def live_record_locations(self, user: 'User') -> Optional[List[Tuple[int, int]]]:
+        if self._is_block_vault(user):
+            return None
+        website_index: WebsiteIndex = self._website_index(user)
+        if website_index.counts()[1] == 0:
+            return None
+        return [(offset, size) for _, offset, size in website_index.live_entries()]
+
+    def vault_version(self, user: 'User') -> Optional[FileSignature]:
+        # Every write rewrites the tail file of a block vault, so a block vault does not only grow by appends
+        if self._is_block_vault(user):
+            return None
+        return file_signature(user.users_data_file)
+
+    def read_appended_records(self, user: 'User', start: int,
+                              anchor: bytes = b'') -> Optional[Tuple[List[bytes], int, bytes]]:
+        tokens: List[bytes] = []
+        with phase('io'), open(user.users_data_file, 'rb') as data_file:
+            vault_format: Optional[type] = detect_open_vault_format(data_file)
+            if vault_format is BlockVaultFormat:
+                return None
+            if vault_format is None:
+                return [], start, anchor
+
+            # A file that took the place, and the inode, of the one read up to start holds other bytes before it
+            if anchor:
+                data_file.seek(start - len(anchor))
+                if data_file.read(len(anchor)) != anchor:
+                    return None
+
+            # The header is not a record, a cache of an empty file starts after it
+            end: int = max(start, len(vault_format.header))
+            for offset, size, token in vault_format.iter_records(data_file, end):
+                tokens.append(token)
+                end = offset + size
+
+            data_file.seek(max(0, end - APPEND_ANCHOR_SIZE))
+            end_anchor: bytes = data_file.read(end - data_file.tell())
+
+        add_bytes('read', sum(len(token) for token in tokens))
+        with phase('crypto'):
+            return [user.cipher.decrypt(token) for token in tokens], end, end_anchor
+
+    def compact_vault(self, user: 'User') -> bool:
+        """
+            Rewrite the user's data file with only its live records and swap it in atomically.
+
+            The live records are copied without decrypting them while appends continue; then, under the vault lock,
+            the records appended in the meantime are carried over verbatim, the new file replaces the old one
+            through os.replace and the website index is replaced with one matching the new file.
+            Block vaults are compacted by sealing their live records into new blocks, see _compact_block_vault.
+
+            Args:
+                user (User): The user.
+
+            Returns:
+                bool: True if the vault was compacted, False if it is empty or is already being rewritten.
+        """
+        if self._is_block_vault(user):
+            return self._compact_block_vault(user)
+
+        def copy_live_records(vault_format: type, old_file: IO[bytes], new_file: IO[bytes],
+                              website_index: WebsiteIndex, copied_size: int) -> List[IndexEntry]:
+            new_entries: List[IndexEntry] = []
+            for digest, offset, size in website_index.live_entries():
+                if offset >= copied_size:
+                    break
+                old_file.seek(offset)
+                # Only live records are copied, so every one of them is indexed as added
+                new_entries.append((digest, new_file.tell(), size, RECORD_ADD))
+                new_file.write(old_file.read(size))
+            return new_entries
+
+        return self._rewrite_vault(user, 'compact', copy_live_records)
+
+    def migrate_vault(self, user: 'User', target_format: type = DEFAULT_VAULT_FORMAT) -> Optional[Tuple[int, int]]:
+        """
+            Convert the user's data file in place to another vault format, e.g. from text lines to the compact format.
+
+            Every record is decrypted, re-encoded as a compact record and encrypted again with its original timestamp,
+            streaming from the old file to a temporary one, so memory does not grow with the size of the vault.
+            The new file is swapped in atomically like a compaction; records appended meanwhile are converted as well.
+
+            Args:
+                user (User): The user.
+                target_format (type): The vault format to convert to.
+
+            Returns:
+                Optional[Tuple[int, int]]: The data file size before and after, or None if the file is missing,
+                already in the target format or is being rewritten. Block vaults are neither migrated from nor to.
+
+            Raises:
+                ValueError: If the user's key is not a valid encryption key.
+        """
+        source_format: Optional[type] = detect_vault_format(user.users_data_file)
+        if source_format in (None, target_format, BlockVaultFormat) or target_format is BlockVaultFormat:
+            return None
+        cipher = user.cipher
+
+        def convert(token: bytes) -> Tuple[bytes, bytes]:
+            # Re-encrypt the record as a compact one of the same kind, keeping the time it was originally encrypted at
+            plaintext: bytes = compact_record(cipher.decrypt(token))
+            return plaintext, target_format.frame(cipher.encrypt_at_time(plaintext, cipher.extract_timestamp(token)))
+
+        def convert_records(vault_format: type, old_file: IO[bytes], new_file: IO[bytes],
+                            website_index: WebsiteIndex, copied_size: int) -> List[IndexEntry]:
+            new_entries: List[IndexEntry] = []
+            for offset, _, token in vault_format.iter_records(old_file, 0):
+                if offset >= copied_size:
+                    break
+                plaintext, framed_record = convert(token)
+                website, kind = peek_record(plaintext)
+                new_entries.append((website_index.website_hash(website), new_file.tell(), len(framed_record), kind))
+                new_file.write(framed_record)
+            return new_entries
+
+        old_size: int = os.path.getsize(user.users_data_file)
+
+        def convert_stored_record(stored_record: bytes) -> bytes:
+            return convert(source_format.unframe(stored_record))[1]
+
+        if not self._rewrite_vault(user, 'migrate', convert_records, convert_stored_record, target_format):
+            return None
+        return old_size, os.path.getsize(user.users_data_file)
+
+    def _rewrite_vault(self, user: 'User', temp_suffix: str,
+                       copy_records: Callable[[type, IO[bytes], IO[bytes], WebsiteIndex, int], List[IndexEntry]],
+                       convert: Optional[Callable[[bytes], bytes]] = None,
+                       target_format: Optional[type] = None) -> bool:
+        """
+            Rewrite the user's data file into a temporary file and swap it in atomically.
+
+            copy_records writes the records covered by the website index while appends continue; then, under the
+            vault lock, the records appended in the meantime are carried over, the new file replaces the old one
+            through os.replace and the website index is replaced with one matching the new file.
+            Only one rewrite of a vault runs at a time.
+
+            Args:
+                user (User): The user.
+                temp_suffix (str): Suffix of the temporary file.
+                copy_records (Callable): Called with (old format, old file, new file, website index, covered size);
+                    writes the records before the covered size to the new file, which already holds the header,
+                    and returns their index entries.
+                convert (Optional[Callable[[bytes], bytes]]): Converts one stored record carried over from the tail,
+                    or None to copy the tail verbatim.
+                target_format (Optional[type]): Format of the new file, defaults to the format of the old one.
+
+            Returns:
+                bool: True if the vault was rewritten, False if it is empty or is already being rewritten.
+        """
+        data_file: str = os.path.abspath(user.users_data_file)
+        rewrite_lock: FileLock = vault_rewrite_lock(user.lock_dir)
+        if not rewrite_lock.acquire(blocking=False):
+            return False
+
+        try:
+            vault_format: Optional[type] = detect_vault_format(data_file)
+            if vault_format is None:
+                return False
+            website_index: WebsiteIndex = self._website_index(user)
+            website_index.refresh()
+            copied_size: int = website_index.covered_size
+            temp_file: str = f'{data_file}.{temp_suffix}'
+
+            with open(data_file, 'rb') as old_file, open(temp_file, 'wb') as new_file:
+                new_file.write((target_format or vault_format).header)
+                new_entries: List[IndexEntry] = copy_records(vault_format, old_file, new_file,
+                                                             website_index, copied_size)
+
+                with vault_lock(user.lock_dir):
+                    # Carry over the records appended while the others were copied
+                    for digest, offset, size, kind in website_index.scan(copied_size):
+                        old_file.seek(offset)
+                        record: bytes = old_file.read(size)
+                        if convert is not None:
+                            record = convert(record)
+                        new_entries.append((digest, new_file.tell(), len(record), kind))
+                        new_file.write(record)
+
+                    new_file.flush()
+                    os.fsync(new_file.fileno())
+                    os.replace(temp_file, data_file)
+                    website_index.replace(new_entries)
+            return True
+
+        finally:
+            rewrite_lock.release()
+
+    def _compact_block_vault(self, user: 'User') -> bool:
+        """
+            Rewrite a block vault with only its live records.
+
+            Unlike a per-record compaction this decrypts and seals every live record again, so it runs entirely
+            under the vault lock and appends wait for it.
+
+            Args:
+                user (User): The user.
+
+            Returns:
+                bool: True if the vault was compacted, False if a compaction of this vault is already running.
+        """
+        data_file: str = os.path.abspath(user.users_data_file)
+        rewrite_lock: FileLock = vault_rewrite_lock(user.lock_dir)
+        if not rewrite_lock.acquire(blocking=False):
+            return False
+
+        try:
+            with vault_lock(user.lock_dir):
+                compact_block_vault(data_file, self._website_index(user), user.cipher,
+                                    self.block_size or VAULT_BLOCK_SIZE)
+            return True
+        finally:
+            rewrite_lock.release()
+
+    def vault_file(self, user: 'User') -> Optional[str]:
+        # Block vaults hold several records per token, they are not split between processes
+        return None if self._is_block_vault(user) else user.users_data_file
+
+    def _is_block_vault(self, user: 'User') -> bool:
+        """
+            Check whether the user's data file is a block vault.
+
+            Args:
+                user (User): The user.
+
+            Returns:
+                bool: True for a block vault, False for a per-record vault or a missing file.
+        """
+        return detect_vault_format(user.users_data_file) is BlockVaultFormat
+
+    def _check_not_block_vault(self, user: 'User') -> None:
+        """
+            Make sure the user's vault stores a token per record, as the token-level methods require.
+
+            Args:
+                user (User): The user.
+
+            Raises:
+                ValueError: If the user's data file is a block vault.
+        """
+        if self._is_block_vault(user):
+            raise ValueError(f'{user.users_data_file} is a block vault, it has no per-record tokens')
+
+    def _website_index(self, user: 'User') -> WebsiteIndex:
+        """
+            Return the website index of a user's data file, reusing the one kept in memory if any.
+
+            Args:
+                user (User): The user.
+
+            Returns:
+                WebsiteIndex: The index.
+        """
+        self._ensure_user_dir(user)
+        index_file: str = os.path.abspath(user.index_file)
+        return self._cached(self._website_indexes, (index_file, user.key),
+                            lambda: WebsiteIndex(index_file, os.path.abspath(user.users_data_file),
+                                                 user.key, user.cipher, os.path.abspath(user.lock_dir)))
+
+    # Audit log
+
+    def append_audit(self, user: 'User', entry: str) -> None:
+        # Queue the entry, the shared audit writer appends it to the audit file in the background
+        self._ensure_user_dir(user)
+        get_audit_writer().write(os.path.abspath(user.audit_file), os.path.abspath(user.lock_dir), entry)
+
+    def flush_audit(self) -> None:
+        # Write out any log entries still queued in the audit writer
+        get_audit_writer().flush()
+
+    def read_audit(self, user: 'User') -> Optional[str]:
+        # Join the rotated segments and the active audit file
+        history: str = ''.join(self.iter_audit(user))
+        if not history and not os.path.exists(user.audit_file):
+            return None
+        return history
+
+    def iter_audit(self, user: 'User') -> Iterator[str]:
+        self.flush_audit()
+        return self._audit_reader(user).iter_entries()
+
+    def tail_audit(self, user: 'User', count: int) -> List[str]:
+        self.flush_audit()
+        return self._audit_reader(user).tail(count)
+
+    def audit_page(self, user: 'User', page: int, page_size: int) -> List[str]:
+        self.flush_audit()
+        return self._audit_reader(user).page(page, page_size)
+
+    def audit_range(self, user: 'User', since: Optional[datetime.datetime],
+                    until: Optional[datetime.datetime]) -> Iterator[str]:
+        self.flush_audit()
+        return self._audit_reader(user).between(since, until)
+
+    def _audit_reader(self, user: 'User') -> AuditHistory:
+        """
+            Return the reader of a user's audit history, reusing the one kept in memory if any.
+
+            Args:
+                user (User): The user.
+
+            Returns:
+                AuditHistory: The reader of the rotated segments and the active audit file.
+        """
+        audit_file: str = os.path.abspath(user.audit_file)
+        return self._cached(self._audit_readers, audit_file,
+                            lambda: AuditHistory(audit_file, os.path.abspath(user.audit_index_file),
+                                                 os.path.abspath(user.lock_dir)))
+
+    def _cached(self, cache: 'OrderedDict', cache_key, factory: Callable[[], CachedItem]) -> CachedItem:
+        """
+            Look up an item in a small LRU cache, creating it with factory on a miss.
+
+            The lookup and the creation happen under one lock, so threads sharing the storage share one item per key.
+
+            Args:
+                cache (OrderedDict): The cache.
+                cache_key: Key of the item.
+                factory (Callable[[], CachedItem]): Creates the item.
+
+            Returns:
+                CachedItem: The cached or new item.
+        """
+        with self._cache_lock:
+            item = cache.get(cache_key)
+            if item is None:
+                item = cache[cache_key] = factory()
+                if len(cache) > OPEN_INDEX_LIMIT:
+                    cache.popitem(last=False)
+            else:
+                cache.move_to_end(cache_key)
+            return item
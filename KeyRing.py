@@ -0,0 +1,269 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+from RegistryCache import FileSignature, file_signature
+
+if TYPE_CHECKING:
+    from cryptography.fernet import Fernet
+
+
+def stored_keys(stored_key: bytes) -> List[bytes]:
+    """
+        Split a stored key into the keys it holds.
+
+        A stored key is a single key, or while a key rotation is in progress the new key followed by the old ones,
+        one per line (see FileStorage.rotate_key): the first key encrypts, every key decrypts.
+
+        Args:
+            stored_key (bytes): The key as loaded from the storage.
+
+        Returns:
+            List[bytes]: The keys, the one to encrypt with first; a single key is returned unchanged.
+    """
+    keys: List[bytes] = stored_key.split()
+    return keys if len(keys) > 1 else [stored_key]
+
+
+class KeyFileReader:
+    """
+        Reads a user's key file for a writer that checks the key before every append, reading the file again
+        only when its signature changed.
+
+        A key rotation re-encrypts the vault and then drops the old key (see FileStorage.rotate_key), so a writer
+        compares the key its cipher encrypts with to the first key of the key file under the vault lock: records
+        are never appended with a key the rotation has already re-encrypted the vault away from.
+
+        Attributes:
+            - path (str): Path of the key file.
+    """
+    def __init__(self, path: str, key: Optional[bytes] = None, signature: Optional[FileSignature] = None):
+        """
+            Initialize the KeyFileReader instance.
+
+            Args:
+                path (str): Path of the key file.
+                key (Optional[bytes]): The content of the key file when it had the given signature, if known.
+                signature (Optional[FileSignature]): The signature the key was read at, taken before reading it;
+                    None reads the file on first use.
+        """
+        self.path: str = path
+        self._key: Optional[bytes] = key
+        self._signature: Optional[FileSignature] = signature if key is not None else None
+
+    def read(self) -> Optional[bytes]:
+        """
+            Return the current content of the key file.
+
+            Returns:
+                Optional[bytes]: The stored key, or None if the key file does not exist.
+        """
+        signature: Optional[FileSignature] = file_signature(self.path)
+        if signature is None:
+            return None
+        if signature != self._signature:
+            # Take the signature before reading, so content that changed meanwhile is read again next time
+            try:
+                with open(self.path, 'rb') as key_file:
+                    self._key = key_file.read()
+            except FileNotFoundError:
+                return None
+            self._signature = signature
+        return self._key
+
+    def encryption_key(self) -> Optional[bytes]:
+        """
+            Return the key new data is encrypted with, see stored_keys.
+
+            Returns:
+                Optional[bytes]: The first key of the key file, or None if the key file does not exist.
+        """
+        stored_key: Optional[bytes] = self.read()
+        return stored_keys(stored_key)[0] if stored_key is not None else None
+
+
+class _KeyRingEntry:
+    """
+        One cached key, with the cipher built from it when ciphers are cached and the version of the stored key
+        it was loaded from.
+    """
+    def __init__(self, key: bytes, cipher: Optional['Fernet'], version: Optional[Tuple[int, ...]]):
+        # A mutable copy of the key that can be overwritten with zeros when the entry is dropped
+        self.key_buffer: bytearray = bytearray(key)
+        self.key: bytes = key
+        self.cipher: Optional['Fernet'] = cipher
+        self.version: Optional[Tuple[int, ...]] = version
+        self.loaded_at: float = time.monotonic()
+
+    def wipe(self) -> None:
+        """
+            Overwrite the mutable key copy with zeros and drop the references to the key and cipher.
+
+            The immutable bytes object and the cipher's internal copies cannot be overwritten from Python;
+            they are released for garbage collection.
+        """
+        for position in range(len(self.key_buffer)):
+            self.key_buffer[position] = 0
+        self.key = b''
+        self.cipher = None
+
+
+class KeyRing:
+    """
+        A process-wide, bounded cache of loaded encryption keys with LRU eviction and a time-to-live.
+
+        Keys are cached by an identifier from the storage backend (for files, the absolute path of the
+        user's key file), together with the Fernet cipher
+        built from them when cache_ciphers is enabled and the version of the stored key (for files, the key file's
+        signature, see StorageBackend.key_version). A lookup with another version misses, so a key rotated
+        by another process is picked up by the next lookup; backends without versions rely on the ttl, after which
+        entries are reloaded. invalidate() drops an entry at once. Evicted and invalidated entries are wiped
+        as far as Python allows.
+
+        Attributes:
+            - capacity (int): Maximum number of cached keys.
+            - ttl (float): Seconds a cached key stays valid after it was loaded.
+            - cache_ciphers (bool): Also cache the ciphers built from the keys.
+            - hits (int): Number of lookups answered from the cache.
+            - misses (int): Number of lookups that had to read the key file.
+            - evictions (int): Number of entries dropped for capacity or age.
+    """
+    def __init__(self, capacity: int = 1024, ttl: float = 300.0, cache_ciphers: bool = True):
+        """
+            Initialize the KeyRing instance.
+
+            Args:
+                capacity (int): Maximum number of cached keys.
+                ttl (float): Seconds a cached key stays valid after it was loaded.
+                cache_ciphers (bool): Also cache the ciphers built from the keys.
+        """
+        self.capacity: int = capacity
+        self.ttl: float = ttl
+        self.cache_ciphers: bool = cache_ciphers
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self._entries: 'OrderedDict[str, _KeyRingEntry]' = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+
+    def get(self, key_id: str, version: Optional[Tuple[int, ...]] = None) -> Optional[Tuple[bytes, Optional['Fernet']]]:
+        """
+            Look up a cached key.
+
+            Args:
+                key_id (str): Identifier of the key, from StorageBackend.key_ring_id.
+                version (Optional[Tuple[int, ...]]): The current version of the stored key, from
+                    StorageBackend.key_version; an entry loaded from another version is dropped.
+
+            Returns:
+                Optional[Tuple[bytes, Optional[Fernet]]]: The key and its cached cipher (None if ciphers are not cached),
+                or None on a miss.
+        """
+        with self._lock:
+            entry: Optional[_KeyRingEntry] = self._entries.get(key_id)
+
+            if entry is not None and (entry.version != version or time.monotonic() - entry.loaded_at > self.ttl):
+                # The key was replaced since or the entry is too old, drop it and let the caller read the key file again
+                del self._entries[key_id]
+                entry.wipe()
+                self.evictions += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key_id)
+            self.hits += 1
+            return entry.key, entry.cipher
+
+    def put(self, key_id: str, key: bytes, cipher: Optional['Fernet'] = None,
+            version: Optional[Tuple[int, ...]] = None) -> None:
+        """
+            Cache a key that was just loaded or created, evicting the least recently used keys if the ring is full.
+
+            Args:
+                key_id (str): Identifier of the key, from StorageBackend.key_ring_id.
+                key (bytes): The key.
+                cipher (Optional[Fernet]): The cipher built from the key, kept only if cache_ciphers is enabled.
+                version (Optional[Tuple[int, ...]]): The version of the stored key, taken before it was loaded.
+        """
+        with self._lock:
+            previous_entry: Optional[_KeyRingEntry] = self._entries.pop(key_id, None)
+            if previous_entry is not None:
+                previous_entry.wipe()
+
+            self._entries[key_id] = _KeyRingEntry(key, cipher if self.cache_ciphers else None, version)
+
+            while len(self._entries) > self.capacity:
+                _, evicted_entry = self._entries.popitem(last=False)
+                evicted_entry.wipe()
+                self.evictions += 1
+
+    def invalidate(self, key_id: Optional[str] = None) -> None:
+        """
+            Drop one cached key, e.g. after rotating it, or every cached key.
+
+            Args:
+                key_id (Optional[str]): Identifier of the key, every key if None.
+        """
+        with self._lock:
+            if key_id is None:
+                dropped_entries = list(self._entries.values())
+                self._entries.clear()
+            else:
+                dropped_entry: Optional[_KeyRingEntry] = self._entries.pop(key_id, None)
+                dropped_entries = [dropped_entry] if dropped_entry is not None else []
+
+            for entry in dropped_entries:
+                entry.wipe()
+
+    def stats(self) -> Dict[str, float]:
+        """
+            Return the cache counters.
+
+            Returns:
+                Dict[str, float]: hits, misses, hit_rate, evictions, size and capacity.
+        """
+        with self._lock:
+            lookups: int = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'evictions': self.evictions,
+                    'size': len(self._entries),
+                    'capacity': self.capacity}
+
+
+# The key ring shared by every User in the process
+_key_ring: KeyRing = KeyRing()
+
+
+def get_key_ring() -> KeyRing:
+    """
+        Return the key ring shared by every User in the process.
+
+        Returns:
+            KeyRing: The shared key ring.
+    """
+    return _key_ring
+
+
+def configure_key_ring(capacity: int = 1024, ttl: float = 300.0, cache_ciphers: bool = True) -> KeyRing:
+    """
+        Replace the shared key ring with an empty one using new settings.
+
+        The keys of the current ring are wiped.
+
+        Args:
+            capacity (int): Maximum number of cached keys.
+            ttl (float): Seconds a cached key stays valid after it was loaded.
+            cache_ciphers (bool): Also cache the ciphers built from the keys.
+
+        Returns:
+            KeyRing: The new shared key ring.
+    """
+    global _key_ring
+    _key_ring.invalidate()
+    _key_ring = KeyRing(capacity, ttl, cache_ciphers)
+    return _key_ring
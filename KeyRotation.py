@@ -0,0 +1,275 @@
+"""
+    Rotate the encryption keys of the users: give every user a new key and re-encrypt their vault with it
+    (see FileStorage.rotate_key).
+
+    Other processes may keep reading and writing the vaults meanwhile, they pick up the new keys on their own.
+    Run it as:
+        python KeyRotation.py                              (every user in users.json, in the current directory)
+        python KeyRotation.py --data-root /srv/psm         (every user in /srv/psm/users.json)
+        python KeyRotation.py --workers 8 12345 67890      (only the given user IDs, on 8 processes)
+
+    Users are taken from the registry one at a time and rotated by a pool of worker processes, as re-encrypting
+    is CPU-bound, with at most a few users queued per process. Every rotated user is appended to a checkpoint file:
+    an interrupted run is resumed by running it again, which skips the users in the checkpoint and finishes
+    the rotation of the users it was working on. The checkpoint is deleted once every user has been rotated;
+    use --restart to start a new rotation over an old checkpoint. Progress and throughput are printed every
+    PROGRESS_INTERVAL seconds.
+"""
+import argparse
+import functools
+import itertools
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, wait
+from typing import Callable, Dict, IO, Iterable, Iterator, Optional, Set, Tuple
+from FileStorage import FileStorage
+from User import User
+
+# First line of every checkpoint file
+CHECKPOINT_HEADER: str = '#psm-key-rotation v1'
+
+# Rotations queued per worker process; a small queue keeps the processes busy without holding every user in memory
+QUEUED_ROTATIONS_PER_WORKER: int = 4
+
+# A progress line is printed at most every PROGRESS_INTERVAL seconds
+PROGRESS_INTERVAL: float = 5.0
+
+# Storage of the worker process, built once per process
+_worker_storage: Optional[FileStorage] = None
+
+
+class RotationCheckpoint:
+    """
+        The checkpoint file of a key rotation: the IDs of the users already rotated, one per line.
+
+        A line is flushed as soon as a user is rotated. A line lost in a crash only makes the next run
+        rotate that user once more, which is harmless.
+
+        Attributes:
+            - path (str): Path of the checkpoint file.
+    """
+    def __init__(self, path: str):
+        """
+            Initialize the RotationCheckpoint instance.
+
+            Args:
+                path (str): Path of the checkpoint file.
+        """
+        self.path: str = path
+        self._file: Optional[IO[str]] = None
+
+    def load(self) -> Set[str]:
+        """
+            Read the users rotated by an earlier, interrupted run.
+
+            Returns:
+                Set[str]: The user IDs, empty if there is no checkpoint.
+        """
+        try:
+            with open(self.path, 'r', encoding='utf-8') as checkpoint:
+                if checkpoint.readline().rstrip('\n') != CHECKPOINT_HEADER:
+                    return set()
+                # A line without its newline was cut off by a crash
+                return {line[:-1] for line in checkpoint if line.endswith('\n')}
+        except FileNotFoundError:
+            return set()
+
+    def record(self, user_id: str) -> None:
+        """
+            Add a rotated user to the checkpoint.
+
+            Args:
+                user_id (str): User ID.
+        """
+        if self._file is None:
+            is_new: bool = not os.path.exists(self.path)
+            self._file = open(self.path, 'a', encoding='utf-8')
+            if is_new:
+                self._file.write(f'{CHECKPOINT_HEADER}\n')
+        self._file.write(f'{user_id}\n')
+        self._file.flush()
+
+    def close(self, completed: bool) -> None:
+        """
+            Close the checkpoint file.
+
+            Args:
+                completed (bool): Every user was rotated; the checkpoint is deleted so the next run starts
+                    a new rotation.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if completed:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+def _init_worker(users_file: str, data_root: str, layout: str, block_size: Optional[int]) -> None:
+    """
+        Build the storage in a freshly started worker process.
+
+        Args:
+            users_file (str): Absolute path of the user registry.
+            data_root (str): Absolute path of the data root.
+            layout (str): The data layout.
+            block_size (Optional[int]): Plaintext bytes per block of block vaults.
+    """
+    global _worker_storage
+    _worker_storage = FileStorage(users_file, block_size, data_root=data_root, layout=layout)
+
+
+def rotate_user_key(storage: FileStorage, user_id: str, user_name: str) -> Optional[Tuple[int, int]]:
+    """
+        Rotate the key of one user and record it in the user's audit log.
+
+        Args:
+            storage (FileStorage): The storage holding the user's files.
+            user_id (str): User ID.
+            user_name (str): User's name.
+
+        Returns:
+            Optional[Tuple[int, int]]: The number of records re-encrypted and the size of the new data file,
+            or None if the user has no key.
+    """
+    user: User = User(user_id, user_name, storage)
+    rotated: Optional[Tuple[int, int]] = storage.rotate_key(user)
+    if rotated is not None:
+        user.log_action(f'- Rotated the encryption key, {rotated[0]} records re-encrypted')
+
+        # Worker processes exit without running the audit writer's exit handler
+        storage.flush_audit()
+    return rotated
+
+
+def _rotate_in_worker(user_id: str, user_name: str) -> Optional[Tuple[int, int]]:
+    """
+        Rotate the key of one user in a worker process.
+
+        Args:
+            user_id (str): User ID.
+            user_name (str): User's name.
+
+        Returns:
+            Optional[Tuple[int, int]]: As rotate_user_key.
+    """
+    return rotate_user_key(_worker_storage, user_id, user_name)
+
+
+def rotate_keys(storage: FileStorage, users: Iterable[Tuple[str, str]], checkpoint: RotationCheckpoint,
+                workers: int = 4) -> Dict[str, int]:
+    """
+        Rotate the keys of users on a pool of worker processes, skipping the users in the checkpoint.
+
+        Args:
+            storage (FileStorage): The storage holding the users' files.
+            users (Iterable[Tuple[str, str]]): (user ID, user name) of the users to rotate, read lazily.
+            checkpoint (RotationCheckpoint): The checkpoint of this rotation.
+            workers (int): Number of worker processes; 1 rotates in this process.
+
+        Returns:
+            Dict[str, int]: The number of users 'rotated', 'skipped' (in the checkpoint or without a key)
+            and 'failed', and the 'records' and 'bytes' re-encrypted.
+    """
+    counts: Dict[str, int] = {'rotated': 0, 'skipped': 0, 'failed': 0, 'records': 0, 'bytes': 0}
+    started: float = time.perf_counter()
+    reported: float = started
+    done_users: Set[str] = checkpoint.load()
+
+    def iter_pending_users() -> Iterator[Tuple[str, str]]:
+        # Users of the checkpoint are skipped without being queued
+        for user_id, user_name in users:
+            if user_id in done_users:
+                counts['skipped'] += 1
+            else:
+                yield user_id, user_name
+
+    pending_users: Iterator[Tuple[str, str]] = iter_pending_users()
+
+    def report(final: bool = False) -> None:
+        nonlocal reported
+        now: float = time.perf_counter()
+        if not final and now - reported < PROGRESS_INTERVAL:
+            return
+        reported = now
+        elapsed: float = max(now - started, 1e-9)
+        print(f'{counts["rotated"]} users rotated, {counts["failed"]} failed, '
+              f'{counts["rotated"] / elapsed:.1f} users/s, {counts["records"] / elapsed:.0f} records/s, '
+              f'{counts["bytes"] / elapsed / 1e6:.1f} MB/s')
+
+    def collect(user_id: str, result: Callable[[], Optional[Tuple[int, int]]]) -> None:
+        try:
+            rotated: Optional[Tuple[int, int]] = result()
+        except Exception as error:
+            # Any error of one user, such as a vault that does not decrypt with the user's key (InvalidToken),
+            # fails that user only; the next run tries it again
+            counts['failed'] += 1
+            print(f'{user_id}: {str(error) or type(error).__name__}')
+            return
+        if rotated is None:
+            counts['skipped'] += 1
+        else:
+            counts['rotated'] += 1
+            counts['records'] += rotated[0]
+            counts['bytes'] += rotated[1]
+        checkpoint.record(user_id)
+        report()
+
+    if workers <= 1:
+        for user_id, user_name in pending_users:
+            collect(user_id, functools.partial(rotate_user_key, storage, user_id, user_name))
+    else:
+        # Forked workers would write the audit entries still queued in this process a second time
+        storage.flush_audit()
+
+        # The queued rotations and their user IDs
+        pending: Dict[Future, str] = {}
+        executor: Executor = ProcessPoolExecutor(
+            workers, initializer=_init_worker,
+            initargs=(os.path.abspath(storage.users_file), os.path.abspath(storage.data_layout.root),
+                      storage.data_layout.layout, storage.block_size))
+        with executor:
+            while True:
+                # Queue rotations until the queue is full or every user is queued
+                for user_id, user_name in itertools.islice(pending_users,
+                                                           workers * QUEUED_ROTATIONS_PER_WORKER - len(pending)):
+                    pending[executor.submit(_rotate_in_worker, user_id, user_name)] = user_id
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(pending.pop(future), future.result)
+
+    report(final=True)
+    checkpoint.close(completed=counts['failed'] == 0)
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('user_ids', nargs='*', help='users to rotate, every registered user by default')
+    parser.add_argument('--data-root', default=None, help='directory holding the registry and the users\' files')
+    parser.add_argument('--users-file', default='users.json', help='the user registry, in the data root')
+    parser.add_argument('--layout', choices=('flat', 'sharded'), default='flat', help='layout of the users\' files')
+    parser.add_argument('--checkpoint', default='key_rotation.checkpoint', help='the checkpoint file, in the data root')
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint of an earlier run')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='worker processes')
+    args = parser.parse_args()
+
+    storage: FileStorage = FileStorage(args.users_file, data_root=args.data_root, layout=args.layout)
+    checkpoint: RotationCheckpoint = RotationCheckpoint(os.path.join(args.data_root or '', args.checkpoint))
+    if args.restart:
+        checkpoint.close(completed=True)
+
+    registry = storage.load_users()
+    users: Iterable[Tuple[str, str]] = ((user_id, registry[user_id]) for user_id in args.user_ids or registry
+                                        if user_id in registry)
+    counts: Dict[str, int] = rotate_keys(storage, users, checkpoint, args.workers)
+    print(f'{counts["rotated"]} users rotated, {counts["skipped"]} skipped, {counts["failed"]} failed, '
+          f'{counts["records"]} records re-encrypted')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+    Move the users' files from the flat layout, where every file is directly in the data root, to the sharded layout,
+    where every user has a directory nested under hash-prefix directories (see DataLayout).
+
+    Run it while no other process uses the data root:
+        python LayoutMigration.py                              (every user in users.json, in the current directory)
+        python LayoutMigration.py --data-root /srv/psm         (every user in /srv/psm/users.json)
+        python LayoutMigration.py --workers 16 12345 67890     (only the given user IDs, on 16 threads)
+
+    Users are taken from the registry one at a time and moved by a pool of threads, with at most a few moves queued
+    per thread, so memory use does not grow with the number of users. Every user is moved on its own and completely
+    or not at all (see FileStorage.move_user_to_sharded): an interrupted migration is resumed by running it again,
+    users already moved are skipped after a few stat calls. Afterwards, open the storage with layout='sharded'.
+"""
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Set
+from FileStorage import FileStorage
+
+# Moves queued per worker thread; a small queue keeps the threads busy without holding every user in memory
+QUEUED_MOVES_PER_WORKER: int = 4
+
+# A progress line is printed every PROGRESS_EVERY users
+PROGRESS_EVERY: int = 10000
+
+
+def migrate_layout(storage: FileStorage, user_ids: Iterable[str], workers: int = 8) -> Dict[str, int]:
+    """
+        Move the files of users from the flat to the sharded layout on a pool of threads.
+
+        Args:
+            storage (FileStorage): The storage whose data root holds the files.
+            user_ids (Iterable[str]): The users to move, read lazily.
+            workers (int): Number of threads moving files.
+
+        Returns:
+            Dict[str, int]: The number of users 'moved', 'skipped' (nothing left to move) and 'failed'.
+    """
+    counts: Dict[str, int] = {'moved': 0, 'skipped': 0, 'failed': 0}
+    started: float = time.perf_counter()
+    user_ids = iter(user_ids)
+
+    # The queued moves and their user IDs
+    pending: Dict[Future, str] = {}
+
+    def collect(done: Set[Future]) -> None:
+        for future in done:
+            user_id: str = pending.pop(future)
+            try:
+                counts['moved' if future.result() else 'skipped'] += 1
+            except (OSError, ValueError) as error:
+                counts['failed'] += 1
+                print(f'{user_id}: {error}')
+
+            handled: int = sum(counts.values())
+            if handled % PROGRESS_EVERY == 0:
+                elapsed: float = time.perf_counter() - started
+                print(f'{handled} users, {counts["moved"]} moved, {handled / elapsed:.0f} users/s')
+
+    with ThreadPoolExecutor(workers, thread_name_prefix='psm-layout') as executor:
+        while True:
+            # Queue moves until the queue is full or every user is queued
+            for user_id in itertools.islice(user_ids, workers * QUEUED_MOVES_PER_WORKER - len(pending)):
+                pending[executor.submit(storage.move_user_to_sharded, user_id)] = user_id
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('user_ids', nargs='*', help='users to move, every registered user by default')
+    parser.add_argument('--data-root', default=None, help='directory holding the registry and the users\' files')
+    parser.add_argument('--users-file', default='users.json', help='the user registry, in the data root')
+    parser.add_argument('--workers', type=int, default=min(32, (os.cpu_count() or 1) * 2),
+                        help='threads moving files')
+    args = parser.parse_args()
+
+    storage: FileStorage = FileStorage(args.users_file, data_root=args.data_root, layout='sharded')
+    user_ids: Iterable[str] = args.user_ids or storage.load_users().keys()
+    counts: Dict[str, int] = migrate_layout(storage, user_ids, args.workers)
+    print(f'{counts["moved"]} users moved, {counts["skipped"]} already moved or without files, '
+          f'{counts["failed"]} failed')
+
+
+if __name__ == '__main__':
+    main()
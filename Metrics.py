@@ -0,0 +1,568 @@
+"""
+    Timing and metrics instrumentation of the password manager operations.
+
+    Instrumentation is off until enable_metrics() is called. While it is off, the instrumented methods only check
+    one module global, and the phase helpers return their argument unchanged, so the hot paths keep their speed.
+
+    While it is on, every call of an instrumented operation (a PasswordManager, User or UserManager method) records:
+        psm_operations_total{operation, outcome}          counter of calls, outcome "ok" or "error"
+        psm_operation_duration_seconds{operation}         latency histogram of the whole call
+        psm_phase_duration_seconds{operation, phase}      latency histogram of the io, crypto and parse phases
+        psm_bytes_total{operation, direction}             bytes read from and written to the storage
+    Phases and bytes are attributed to the innermost instrumented operation running in the thread.
+
+    The registry can be exported as a Prometheus text-format file (for the node exporter textfile collector)
+    or as a JSON snapshot. One operation can also be profiled: its calls run under cProfile and the collected
+    stats are dumped to a file that pstats or snakeviz can read.
+"""
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+Func = TypeVar('Func', bound=Callable)
+Item = TypeVar('Item')
+
+# Upper bounds in seconds of the latency histogram buckets, from single record decryption to whole vault rewrites
+LATENCY_BUCKETS: Tuple[float, ...] = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                                      0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Label values of a metric, as (name, value) pairs in a fixed order
+Labels = Tuple[Tuple[str, str], ...]
+
+# Code flag of generator functions (inspect.CO_GENERATOR), inspect itself is too slow to import at startup
+_CO_GENERATOR: int = 0x20
+
+
+class Histogram:
+    """
+        A latency histogram with fixed buckets.
+
+        Attributes:
+            - bucket_counts: List[int]
+                Number of observations per bucket, the last bucket counts those above every bound.
+            - count: int
+                Number of observations.
+            - total: float
+                Sum of the observed values.
+    """
+    def __init__(self):
+        self.bucket_counts: List[int] = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count: int = 0
+        self.total: float = 0.0
+
+    def observe(self, value: float) -> None:
+        """
+            Record one observation.
+
+            Args:
+                value (float): The observed value in seconds.
+        """
+        self.bucket_counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+
+
+class MetricsRegistry:
+    """
+        The counters and histograms recorded while instrumentation is on.
+
+        All methods are thread safe.
+
+        Attributes:
+            - profile_operation: Optional[str]
+                The operation whose calls run under cProfile, None if no operation is profiled.
+            - profile_path: Optional[str]
+                Where the cProfile stats of the profiled operation are dumped.
+    """
+    def __init__(self, profile_operation: Optional[str] = None, profile_path: Optional[str] = None):
+        """
+            Initialize an empty registry.
+
+            Args:
+                profile_operation (Optional[str]): The operation to profile, None to profile nothing.
+                profile_path (Optional[str]): Where to dump its stats, {operation}.prof if None.
+        """
+        self._lock: threading.Lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+
+        self.profile_operation: Optional[str] = profile_operation
+        self.profile_path: Optional[str] = profile_path or (f'{profile_operation}.prof' if profile_operation else None)
+
+        # The profiler of the profiled operation, created on its first call and kept across its calls
+        self._profiler = None
+        self._profile_lock: threading.Lock = threading.Lock()
+
+    def increment(self, name: str, labels: Labels, amount: float = 1) -> None:
+        """
+            Add to a counter.
+
+            Args:
+                name (str): Metric name.
+                labels (Labels): Label values.
+                amount (float): The amount to add.
+        """
+        with self._lock:
+            self._counters[name, labels] = self._counters.get((name, labels), 0) + amount
+
+    def observe(self, name: str, labels: Labels, seconds: float) -> None:
+        """
+            Record a latency in a histogram.
+
+            Args:
+                name (str): Metric name.
+                labels (Labels): Label values.
+                seconds (float): The latency.
+        """
+        with self._lock:
+            histogram: Optional[Histogram] = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[name, labels] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self) -> Dict[str, list]:
+        """
+            Return a copy of every metric as plain data.
+
+            Returns:
+                Dict[str, list]: "counters" and "histograms" lists; each entry holds the metric name and labels,
+                counters their value, histograms their count, sum and cumulative bucket counts by upper bound.
+        """
+        with self._lock:
+            counters: list = [{'name': name, 'labels': dict(labels), 'value': value}
+                              for (name, labels), value in sorted(self._counters.items())]
+            histograms: list = []
+            for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                cumulative: List[int] = []
+                running_count: int = 0
+                for bucket_count in histogram.bucket_counts:
+                    running_count += bucket_count
+                    cumulative.append(running_count)
+                histograms.append({'name': name, 'labels': dict(labels), 'count': histogram.count,
+                                   'sum': histogram.total,
+                                   'buckets': dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'],
+                                                       cumulative))})
+        return {'counters': counters, 'histograms': histograms}
+
+    def to_prometheus(self) -> str:
+        """
+            Render every metric in the Prometheus text exposition format.
+
+            Returns:
+                str: The metrics text.
+        """
+        snapshot: Dict[str, list] = self.snapshot()
+        lines: List[str] = []
+        typed: set = set()
+
+        for counter in snapshot['counters']:
+            if counter['name'] not in typed:
+                typed.add(counter['name'])
+                lines.append(f'# TYPE {counter["name"]} counter')
+            lines.append(f'{counter["name"]}{_label_text(counter["labels"])} {counter["value"]}')
+
+        for histogram in snapshot['histograms']:
+            name: str = histogram['name']
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} histogram')
+            for bound, bucket_count in histogram['buckets'].items():
+                lines.append(f'{name}_bucket{_label_text({**histogram["labels"], "le": bound})} {bucket_count}')
+            lines.append(f'{name}_sum{_label_text(histogram["labels"])} {histogram["sum"]:.9g}')
+            lines.append(f'{name}_count{_label_text(histogram["labels"])} {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str) -> None:
+        """
+            Write the metrics to a Prometheus text-format file.
+
+            The file is replaced atomically, a collector never reads a half written file.
+
+            Args:
+                path (str): Path of the file, usually ending in .prom.
+        """
+        _write_atomically(path, self.to_prometheus())
+
+    def write_json(self, path: str) -> None:
+        """
+            Write a JSON snapshot of the metrics.
+
+            Args:
+                path (str): Path of the file.
+        """
+        _write_atomically(path, json.dumps(self.snapshot(), indent=2) + '\n')
+
+    def export(self, path: str) -> None:
+        """
+            Write the metrics as JSON if the path ends in .json, in the Prometheus text format otherwise.
+
+            Args:
+                path (str): Path of the file.
+        """
+        if path.lower().endswith('.json'):
+            self.write_json(path)
+        else:
+            self.write_prometheus(path)
+
+    def reset(self) -> None:
+        """
+            Drop every recorded metric.
+        """
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def run_profiled(self, func: Callable, *args, dump: bool = True):
+        """
+            Call the profiled operation under cProfile, collecting the stats over all its calls.
+
+            Calls made while another call is being profiled, in this or another thread, run unprofiled.
+
+            Args:
+                func (Callable): The operation.
+                *args: Its arguments.
+                dump (bool): Dump the stats collected so far once the call returns.
+
+            Returns:
+                What the operation returned.
+        """
+        if not self._profile_lock.acquire(blocking=False):
+            return func(*args)
+        try:
+            if self._profiler is None:
+                import cProfile
+                self._profiler = cProfile.Profile()
+            self._profiler.enable()
+            try:
+                return func(*args)
+            finally:
+                self._profiler.disable()
+                if dump:
+                    self._profiler.dump_stats(self.profile_path)
+        finally:
+            self._profile_lock.release()
+
+    def dump_profile(self) -> None:
+        """
+            Dump the stats collected for the profiled operation, if it was called.
+        """
+        with self._profile_lock:
+            if self._profiler is not None:
+                self._profiler.dump_stats(self.profile_path)
+
+
+def _label_text(labels: Dict[str, str]) -> str:
+    """
+        Render label values in the Prometheus format.
+
+        Args:
+            labels (Dict[str, str]): The labels.
+
+        Returns:
+            str: {name="value",...}, an empty string without labels.
+    """
+    if not labels:
+        return ''
+    escaped: Dict[str, str] = {name: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                               for name, value in labels.items()}
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped.items()) + '}'
+
+
+def _write_atomically(path: str, text: str) -> None:
+    """
+        Replace a file with new contents through a temporary file.
+
+        Args:
+            path (str): Path of the file.
+            text (str): The new contents.
+    """
+    temp_path: str = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as temp_file:
+        temp_file.write(text)
+    os.replace(temp_path, path)
+
+
+# The registry while instrumentation is on, None while it is off
+_registry: Optional[MetricsRegistry] = None
+
+# The innermost instrumented operation running in each thread
+_current = threading.local()
+
+
+def enable_metrics(profile_operation: Optional[str] = None, profile_path: Optional[str] = None) -> MetricsRegistry:
+    """
+        Turn instrumentation on with an empty registry.
+
+        Args:
+            profile_operation (Optional[str]): An operation to run under cProfile, such as 'encrypt_save_credentials'.
+            profile_path (Optional[str]): Where to dump its stats, {operation}.prof if None.
+
+        Returns:
+            MetricsRegistry: The registry recording the metrics.
+    """
+    global _registry
+    _registry = MetricsRegistry(profile_operation, profile_path)
+    return _registry
+
+
+def disable_metrics() -> Optional[MetricsRegistry]:
+    """
+        Turn instrumentation off.
+
+        Returns:
+            Optional[MetricsRegistry]: The registry that was recording, for a last export, None if none was.
+    """
+    global _registry
+    registry: Optional[MetricsRegistry] = _registry
+    _registry = None
+    return registry
+
+
+def get_metrics() -> Optional[MetricsRegistry]:
+    """
+        Return the registry recording the metrics.
+
+        Returns:
+            Optional[MetricsRegistry]: The registry, None while instrumentation is off.
+    """
+    return _registry
+
+
+def _current_operation() -> str:
+    """
+        Return the innermost instrumented operation running in this thread.
+
+        Returns:
+            str: The operation name, 'none' outside instrumented operations.
+    """
+    return getattr(_current, 'operation', 'none')
+
+
+def instrumented(operation: str) -> Callable[[Func], Func]:
+    """
+        Decorate a method as an instrumented operation.
+
+        For a generator function, only the time spent producing the items is counted, not the time
+        the caller spends between them.
+
+        Args:
+            operation (str): The operation name used as the metric label.
+
+        Returns:
+            Callable[[Func], Func]: The decorator.
+    """
+    def decorate(func: Func) -> Func:
+        if func.__code__.co_flags & _CO_GENERATOR:
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                generator = func(*args, **kwargs)
+                if _registry is None:
+                    return generator
+                return _measure_iterator(_registry, operation, generator)
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            registry: Optional[MetricsRegistry] = _registry
+            if registry is None:
+                return func(*args, **kwargs)
+
+            outer_operation: str = _current_operation()
+            _current.operation = operation
+            outcome: str = 'error'
+            started: float = time.perf_counter()
+            try:
+                if registry.profile_operation == operation:
+                    result = registry.run_profiled(functools.partial(func, *args, **kwargs))
+                else:
+                    result = func(*args, **kwargs)
+                outcome = 'ok'
+                return result
+            finally:
+                registry.observe('psm_operation_duration_seconds', (('operation', operation),),
+                                 time.perf_counter() - started)
+                registry.increment('psm_operations_total', (('operation', operation), ('outcome', outcome)))
+                _current.operation = outer_operation
+        return wrapper
+    return decorate
+
+
+def _measure_iterator(registry: MetricsRegistry, operation: str, iterator: Iterator[Item]) -> Iterator[Item]:
+    """
+        Yield the items of an instrumented generator, timing only the time spent inside it.
+
+        Args:
+            registry (MetricsRegistry): The registry.
+            operation (str): The operation name.
+            iterator (Iterator[Item]): The generator.
+
+        Yields:
+            Item: The items of the generator.
+    """
+    elapsed: float = 0.0
+    outcome: str = 'ok'
+    profiled: bool = registry.profile_operation == operation
+    try:
+        while True:
+            outer_operation: str = _current_operation()
+            _current.operation = operation
+            started: float = time.perf_counter()
+            try:
+                item: Item = registry.run_profiled(next, iterator, dump=False) if profiled else next(iterator)
+            except StopIteration:
+                return
+            except Exception:
+                outcome = 'error'
+                raise
+            finally:
+                elapsed += time.perf_counter() - started
+                _current.operation = outer_operation
+            yield item
+    finally:
+        # Also reached when the caller stops early, which counts as a successful call
+        iterator.close()
+        if profiled:
+            registry.dump_profile()
+        registry.observe('psm_operation_duration_seconds', (('operation', operation),), elapsed)
+        registry.increment('psm_operations_total', (('operation', operation), ('outcome', outcome)))
+
+
+class _Phase:
+    """
+        Times one phase of the running operation, used as a context manager.
+    """
+    __slots__ = ('registry', 'name', 'started')
+
+    def __init__(self, registry: MetricsRegistry, name: str):
+        self.registry: MetricsRegistry = registry
+        self.name: str = name
+        self.started: float = 0.0
+
+    def __enter__(self) -> '_Phase':
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.registry.observe('psm_phase_duration_seconds',
+                              (('operation', _current_operation()), ('phase', self.name)),
+                              time.perf_counter() - self.started)
+
+
+class _NoPhase:
+    """
+        The phase context manager used while instrumentation is off, it does nothing.
+    """
+    __slots__ = ()
+
+    def __enter__(self) -> '_NoPhase':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+_NO_PHASE: _NoPhase = _NoPhase()
+
+
+def phase(name: str):
+    """
+        Time the enclosed block as a phase of the running operation.
+
+        Args:
+            name (str): The phase, 'io', 'crypto' or 'parse'.
+
+        Returns:
+            A context manager, a shared no-op one while instrumentation is off.
+    """
+    registry: Optional[MetricsRegistry] = _registry
+    return _NO_PHASE if registry is None else _Phase(registry, name)
+
+
+def timed(func: Func, name: str) -> Func:
+    """
+        Time every call of a function as a phase of the running operation.
+
+        Meant for functions called once per record in a loop; wrap them once before the loop.
+
+        Args:
+            func (Func): The function, such as a cipher's encrypt method.
+            name (str): The phase, 'io', 'crypto' or 'parse'.
+
+        Returns:
+            Func: The function itself while instrumentation is off, a timing wrapper otherwise.
+    """
+    registry: Optional[MetricsRegistry] = _registry
+    if registry is None:
+        return func
+
+    def timed_func(*args, **kwargs):
+        started: float = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            registry.observe('psm_phase_duration_seconds', (('operation', _current_operation()), ('phase', name)),
+                             time.perf_counter() - started)
+    return timed_func
+
+
+def timed_iter(iterable: Iterable[Item], name: str) -> Iterable[Item]:
+    """
+        Time the production of every item of an iterable as a phase of the running operation.
+
+        Args:
+            iterable (Iterable[Item]): The iterable, such as a generator reading records from a file.
+            name (str): The phase, 'io', 'crypto' or 'parse'.
+
+        Returns:
+            Iterable[Item]: The iterable itself while instrumentation is off, a timing generator otherwise.
+    """
+    registry: Optional[MetricsRegistry] = _registry
+    if registry is None:
+        return iterable
+    return _timed_items(registry, iter(iterable), name)
+
+
+def _timed_items(registry: MetricsRegistry, iterator: Iterator[Item], name: str) -> Iterator[Item]:
+    """
+        Yield the items of an iterator, recording the time taken by each next() call.
+
+        Args:
+            registry (MetricsRegistry): The registry.
+            iterator (Iterator[Item]): The iterator.
+            name (str): The phase.
+
+        Yields:
+            Item: The items.
+    """
+    try:
+        while True:
+            started: float = time.perf_counter()
+            try:
+                item: Item = next(iterator)
+            except StopIteration:
+                return
+            registry.observe('psm_phase_duration_seconds', (('operation', _current_operation()), ('phase', name)),
+                             time.perf_counter() - started)
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            close()
+
+
+def add_bytes(direction: str, amount: int) -> None:
+    """
+        Count bytes read from or written to the storage by the running operation.
+
+        Args:
+            direction (str): 'read' or 'written'.
+            amount (int): Number of bytes.
+    """
+    registry: Optional[MetricsRegistry] = _registry
+    if registry is not None:
+        registry.increment('psm_bytes_total', (('operation', _current_operation()), ('direction', direction)),
+                           amount)
@@ -0,0 +1,127 @@
+import bisect
+import os
+from collections import deque
+from typing import TYPE_CHECKING, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+from VaultFormat import DEFAULT_VAULT_FORMAT, VAULT_FORMATS, decode_record, detect_open_vault_format
+
+# The process pool and the cipher are imported on first use, so importing this module stays cheap
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+    from cryptography.fernet import Fernet
+
+# Files smaller than this are decrypted serially, starting a process pool costs more than it saves
+PARALLEL_MIN_FILE_SIZE: int = 1024 * 1024
+
+# Default size in bytes of the record-aligned chunks handed to the worker processes
+PARALLEL_CHUNK_SIZE: int = 1024 * 1024
+
+# Cipher cached per worker process, so the key is parsed once per process and not once per chunk
+_worker_cipher: Optional['Fernet'] = None
+
+
+def _init_worker(key: bytes) -> None:
+    """
+        Build the cipher in a freshly started worker process.
+
+        Args:
+            key (bytes): The user's stored key, which lists several keys during a key rotation.
+    """
+    from cryptography.fernet import Fernet, MultiFernet
+    from KeyRing import stored_keys
+
+    global _worker_cipher
+    keys: List[bytes] = stored_keys(key)
+    _worker_cipher = Fernet(key) if len(keys) == 1 else MultiFernet([Fernet(one_key) for one_key in keys])
+
+
+def _decrypt_chunk(path: str, start: int, end: int, format_version: int,
+                   locations: Optional[List[Tuple[int, int]]] = None) -> List[Dict[str, str]]:
+    """
+        Decrypt and decode the records of a byte range of the data file in a worker process.
+
+        Args:
+            path (str): Path of the user's data file.
+            start (int): Offset of the first byte of the chunk, always the start of a record.
+            end (int): Offset just past the last byte of the chunk, always the end of a record.
+            format_version (int): Version of the data file's vault format.
+            locations (Optional[List[Tuple[int, int]]]): (offset, size) of the live records in the chunk,
+                or None if every record of the chunk is live.
+
+        Returns:
+            List[Dict[str, str]]: The decrypted records of the chunk, in file order.
+    """
+    decrypt = _worker_cipher.decrypt
+    vault_format: type = VAULT_FORMATS[format_version]
+    with open(path, 'rb') as data_file:
+        data_file.seek(start)
+        chunk: bytes = data_file.read(end - start)
+
+    if locations is None:
+        return [decode_record(decrypt(token)) for token in vault_format.chunk_tokens(chunk)]
+    unframe = vault_format.unframe
+    return [decode_record(decrypt(unframe(chunk[offset - start:offset - start + size]))) for offset, size in locations]
+
+
+def split_record_aligned_chunks(path: str, chunk_size: int = PARALLEL_CHUNK_SIZE) -> Tuple[type, List[Tuple[int, int]]]:
+    """
+        Split a vault file into byte ranges of about chunk_size bytes that start and end on record boundaries.
+
+        Args:
+            path (str): Path of the vault file.
+            chunk_size (int): Target size of a chunk in bytes.
+
+        Returns:
+            Tuple[type, List[Tuple[int, int]]]: The file's vault format and the (start, end) offsets of each chunk,
+            covering every record in order.
+    """
+    with open(path, 'rb') as data_file:
+        vault_format: Optional[type] = detect_open_vault_format(data_file)
+        if vault_format is None:
+            return DEFAULT_VAULT_FORMAT, []
+        return vault_format, vault_format.split_chunks(data_file, chunk_size)
+
+
+def iter_credentials_parallel(path: str, key: bytes, workers: Optional[int] = None,
+                              chunk_size: int = PARALLEL_CHUNK_SIZE,
+                              live_locations: Optional[Sequence[Tuple[int, int]]] = None) -> Iterator[Dict[str, str]]:
+    """
+        Decrypt a user's data file on a process pool and yield the records in file order.
+
+        Only a bounded number of chunks is in flight at a time, so memory stays proportional to
+        workers * chunk_size rather than to the size of the file.
+
+        Args:
+            path (str): Path of the user's data file.
+            key (bytes): The user's stored key (User.stored_key).
+            workers (Optional[int]): Number of worker processes, defaults to the number of CPUs.
+            chunk_size (int): Target size in bytes of the chunk decrypted by one task.
+            live_locations (Optional[Sequence[Tuple[int, int]]]): (offset, size) of the live records in file order,
+                or None if every record of the file is live. Only live records are decrypted.
+
+        Yields:
+            Dict[str, str]: One credential record with 'website', 'login' and 'password' keys.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = workers or os.cpu_count() or 1
+    vault_format, chunks = split_record_aligned_chunks(path, chunk_size)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(key,)) as executor:
+        pending: Deque['Future'] = deque()
+
+        for start, end in chunks:
+            # Hand each worker only the live records of its chunk
+            chunk_locations: Optional[List[Tuple[int, int]]] = None
+            if live_locations is not None:
+                first: int = bisect.bisect_left(live_locations, (start, 0))
+                last: int = bisect.bisect_left(live_locations, (end, 0))
+                chunk_locations = list(live_locations[first:last])
+
+            pending.append(executor.submit(_decrypt_chunk, path, start, end, vault_format.version, chunk_locations))
+
+            # Keep two chunks per worker in flight, yielding the oldest results first to preserve order
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
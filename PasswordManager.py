@@ -1,6 +1,23 @@
-import json
+import itertools
+import os
+import threading
 from User import User
-from typing import Dict, Optional
+from CredentialImporter import check_credential_record, read_credentials_file
+from Metrics import instrumented, phase, timed
+from ParallelDecryptor import PARALLEL_CHUNK_SIZE, PARALLEL_MIN_FILE_SIZE, iter_credentials_parallel
+from Storage import CredentialWriter, StaleKeyError, StorageBackend
+from VaultFormat import RECORD_ADD, RECORD_DELETE, RECORD_REPLACE, decode_record, encode_record
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, TypeVar
+
+# Number of encrypted records collected in memory before they are written to the data file in one go
+IMPORT_CHUNK_SIZE: int = 1000
+
+# A vault is compacted in the background once it holds at least COMPACTION_MIN_DEAD dead records
+# and more than COMPACTION_DEAD_RATIO dead records per live record
+COMPACTION_MIN_DEAD: int = 100
+COMPACTION_DEAD_RATIO: float = 0.5
+
+T = TypeVar('T')
 
 
 class PasswordManager:
@@ -17,40 +34,74 @@ class PasswordManager:
                The unique identifier of the user.
            - user_name: str
                The name of the user.
+           - storage: StorageBackend
+               The storage holding the user's vault and audit log.
+           - quiet: bool
+               If True, the status messages of saves, updates, deletes and imports are not printed.
 
        Methods:
-           - __init__(user_id: str, user_name: str) -> None
+           - __init__(user_id: str, user_name: str, storage: Optional[StorageBackend], quiet: bool) -> None
                Initializes a PasswordManager instance with the associated User instance.
 
            - encrypt_save_credentials(website: str, login: str, password: str) -> None
                Encrypts and saves user credentials for a specified website.
 
-           - decrypt_display_credentials() -> None
+           - get_credentials(website: str) -> List[Dict[str, str]]
+               Decrypts and returns only the credentials stored for one website.
+
+           - update_credentials(website: str, login: str, password: str) -> bool
+               Replaces the stored credentials of a website.
+
+           - delete_credentials(website: str) -> bool
+               Deletes the stored credentials of a website.
+
+           - compact_credentials() -> bool
+               Rewrites the user's vault with only its live records.
+
+           - import_credentials(credentials: Iterable[Mapping[str, str]], chunk_size: int) -> int
+               Encrypts and saves many credentials at once, returns the number of imported records.
+
+           - import_credentials_file(path: str, chunk_size: int) -> int
+               Imports credentials from a CSV or JSON-lines file.
+
+           - iter_credentials(parallel: bool, workers: Optional[int], chunk_size: int) -> Iterator[Dict[str, str]]
+               Yields the user's decrypted credentials one record at a time, optionally decrypting on a process pool.
+
+           - decrypt_display_credentials(parallel: bool, workers: Optional[int], chunk_size: int) -> None
                Decrypts and displays stored user credentials.
 
            - save_audit_log(action: str) -> None
                Saves an audit log entry for a specified user action.
 
-           - show_audit_history() -> Optional[str]
-               Displays the audit history of user actions or returns None if no history is found.
+           - show_audit_history(last: Optional[int]) -> Iterator[str]
+               Returns an iterator over the audit entries of user actions, oldest first, or only the last entries;
+               the iterator is empty if no history is found.
        """
-    def __init__(self, user_id: str, user_name: str):
+    def __init__(self, user_id: str, user_name: str, storage: Optional[StorageBackend] = None, quiet: bool = False):
         """
             Initialize the PasswordManager instance.
 
             Args:
                 user_id (str): User ID.
                 user_name (str): User's name.
+                storage (Optional[StorageBackend]): Storage backend, the process default if None.
+                quiet (bool): Do not print status messages, for managers driven by a program rather than a person.
         """
         # Create a User instance associated with the PasswordManager
-        self.user: User = User(user_id, user_name)
+        self.user: User = User(user_id, user_name, storage)
         self.user_id: str = user_id
         self.user_name: str = user_name
+        self.storage: StorageBackend = self.user.storage
+        self.quiet: bool = quiet
 
+    @instrumented('encrypt_save_credentials')
     def encrypt_save_credentials(self, website: str, login: str, password: str) -> None:
         """
             Encrypt and save user credentials.
 
+            The new record is appended to the vault next to any credentials stored for the same website before,
+            which all stay live; use update_credentials to replace them.
+
             Args:
                 website (str): Website name.
                 login (str): User login.
@@ -59,45 +110,419 @@ class PasswordManager:
         # Create a dictionary with user credentials
         data: Dict[str, str] = {'website': website, 'login': login, 'password': password}
 
-        # Encrypt the credentials data using the User's encryption method
-        encrypted_data: bytes = self.user.encrypt_data(json.dumps(data))
+        # Encode the credentials as a compact record
+        with phase('parse'):
+            record: bytes = encode_record(data)
 
-        # Append the encrypted data to the user's data file
-        with open(self.user.users_data_file, 'ab') as data_file:
-            data_file.write(encrypted_data + b'\n')
+        # Encrypt the record with the User's cipher and append it to the user's vault
+        self._save_records([(website, record)])
 
         # Save an audit log entry indicating the action
         self.save_audit_log(f'- Saved credentials for {website}')
 
         # Print a success message
-        print('Data saved successfully\n')
+        self._notify('Data saved successfully\n')
+
+    @instrumented('get_credentials')
+    def get_credentials(self, website: str) -> List[Dict[str, str]]:
+        """
+            Decrypt and return the credentials stored for one website.
+
+            The storage finds the matching records through its website index, so only those records are read
+            and decrypted instead of the whole vault.
+
+            Args:
+                website (str): Website name.
+
+            Returns:
+                List[Dict[str, str]]: The matching credential records in the order they were saved,
+                or an empty list if none are stored.
+
+            Raises:
+                ValueError: If the user's key is not a valid encryption key.
+        """
+        found_credentials: List[Dict[str, str]] = []
+
+        decode = timed(decode_record, 'parse')
+        for record in self._read_vault(self.storage.find_credential_records, website):
+            credentials: Dict[str, str] = decode(record)
+
+            # Guard against hash collisions, the record must really belong to the website
+            if credentials['website'] == website:
+                found_credentials.append(credentials)
+
+        # Save an audit log entry indicating the action
+        self.save_audit_log(f'- Looked up credentials for {website}')
+        return found_credentials
+
+    @instrumented('update_credentials')
+    def update_credentials(self, website: str, login: str, password: str) -> bool:
+        """
+            Replace the stored credentials of a website.
+
+            The new record is appended to the vault as a replacing record: it hides every record stored for the website
+            before, which are dropped by the next compaction.
+
+            Args:
+                website (str): Website name.
+                login (str): New user login.
+                password (str): New user password.
+
+            Returns:
+                bool: True if the credentials were updated, False if none are stored for the website.
+        """
+        if not self._has_credentials(website):
+            self._notify(f'No credentials saved for {website}\n')
+            return False
+
+        # Encrypt the new credentials and append them to the user's vault
+        data: Dict[str, object] = {'website': website, 'login': login, 'password': password, 'replaces': True}
+        self._save_records([(website, encode_record(data))], RECORD_REPLACE)
+
+        # Save an audit log entry indicating the action
+        self.save_audit_log(f'- Updated credentials for {website}')
+        self._schedule_compaction()
+
+        self._notify('Data updated successfully\n')
+        return True
+
+    @instrumented('delete_credentials')
+    def delete_credentials(self, website: str) -> bool:
+        """
+            Delete the stored credentials of a website.
+
+            An encrypted tombstone is appended to the vault; it hides the website's records until
+            the next compaction drops them together with the tombstone.
+
+            Args:
+                website (str): Website name.
+
+            Returns:
+                bool: True if the credentials were deleted, False if none are stored for the website.
+        """
+        if not self._has_credentials(website):
+            self._notify(f'No credentials saved for {website}\n')
+            return False
+
+        # Encrypt the tombstone, so the deleted website name does not reach the disk in plain text
+        tombstone: Dict[str, object] = {'website': website, 'deleted': True}
+        self._save_records([(website, encode_record(tombstone))], RECORD_DELETE)
+
+        # Save an audit log entry indicating the action
+        self.save_audit_log(f'- Deleted credentials for {website}')
+        self._schedule_compaction()
+
+        self._notify('Data deleted successfully\n')
+        return True
+
+    @instrumented('compact_credentials')
+    def compact_credentials(self) -> bool:
+        """
+            Rewrite the user's vault with only its live records.
+
+            Returns:
+                bool: True if the vault was compacted, False if there was nothing to compact
+                or a compaction is already running.
+        """
+        return self.storage.compact_vault(self.user)
+
+    def _notify(self, message: str) -> None:
+        """
+            Print a status message unless the manager is quiet.
+
+            Args:
+                message (str): The message.
+        """
+        if not self.quiet:
+            print(message)
+
+    def _has_credentials(self, website: str) -> bool:
+        """
+            Check whether live credentials are stored for a website.
+
+            Args:
+                website (str): Website name.
+
+            Returns:
+                bool: True if the website has a live record.
+        """
+        return any(decode_record(record)['website'] == website
+                   for record in self._read_vault(self.storage.find_credential_records, website))
+
+    def _read_vault(self, read: Callable[..., T], *args) -> T:
+        """
+            Read from the user's vault, and read once more with the key loaded again if the vault does not decrypt
+            with the key in use, as another process may have rotated it (see FileStorage.rotate_key).
+
+            Args:
+                read (Callable[..., T]): The storage method, called with the user and args.
+                *args: The other arguments of the storage method.
+
+            Returns:
+                T: What the storage method returned.
+
+            Raises:
+                InvalidToken: If the vault does not decrypt with the stored key either.
+        """
+        from cryptography.fernet import InvalidToken
+
+        try:
+            return read(self.user, *args)
+        except InvalidToken:
+            if not self.user.reload_key():
+                raise
+        return read(self.user, *args)
+
+    def _write_records(self, credential_writer: CredentialWriter, records: List[Tuple[str, bytes]],
+                       kind: str = RECORD_ADD) -> CredentialWriter:
+        """
+            Encrypt records and append them to the user's vault through a writer. If another process rotated the key
+            since the writer was opened, the writer is closed and the records are written through a new writer
+            with the key loaded again.
+
+            Args:
+                credential_writer (CredentialWriter): The open writer.
+                records (List[Tuple[str, bytes]]): (website, compact record) pairs.
+                kind (str): The kind of the records.
+
+            Returns:
+                CredentialWriter: The writer to go on with, the given one or the one that replaced it.
+        """
+        try:
+            credential_writer.write_records(records, kind)
+            return credential_writer
+        except StaleKeyError:
+            credential_writer.close()
+            self.user.reload_key()
+
+        credential_writer = self.storage.open_credential_writer(self.user)
+        try:
+            credential_writer.write_records(records, kind)
+        except BaseException:
+            credential_writer.close()
+            raise
+        return credential_writer
+
+    def _save_records(self, records: List[Tuple[str, bytes]], kind: str = RECORD_ADD) -> None:
+        """
+            Encrypt records and append them to the user's vault through a writer of their own.
+
+            Args:
+                records (List[Tuple[str, bytes]]): (website, compact record) pairs.
+                kind (str): The kind of the records.
+        """
+        credential_writer: CredentialWriter = self.storage.open_credential_writer(self.user)
+        try:
+            credential_writer = self._write_records(credential_writer, records, kind)
+        finally:
+            credential_writer.close()
+
+    def _schedule_compaction(self) -> None:
+        """
+            Start a background compaction of the user's vault if dead records have piled up.
+
+            The check only looks at the record counts the storage keeps in memory, so it adds no I/O to the write
+            it follows. The compaction runs in a daemon thread, so read cost tracks the live records without
+            the caller waiting for the rewrite.
+        """
+        counts: Optional[Tuple[int, int]] = self.storage.cached_vault_stats(self.user)
+        if counts is None:
+            return
+        live_count, dead_count = counts
+        if dead_count >= COMPACTION_MIN_DEAD and dead_count > live_count * COMPACTION_DEAD_RATIO:
+            threading.Thread(target=self.storage.compact_vault, args=(self.user,),
+                             name=f'compact-{self.user_id}', daemon=True).start()
+
+    @instrumented('import_credentials')
+    def import_credentials(self, credentials: Iterable[Mapping[str, str]],
+                           chunk_size: int = IMPORT_CHUNK_SIZE) -> int:
+        """
+            Encrypt and save many user credentials at once.
+
+            Records are streamed through encryption and written in chunks through a single open
+            writer on the user's vault, so memory use does not depend on the size of the input.
+            One summarizing audit log entry is written for the whole import.
+
+            An import that fails partway, e.g. on a record without a password, keeps the records before
+            the failing one, which were written already or are written before the error is raised,
+            and logs how many were imported.
+
+            Args:
+                credentials (Iterable[Mapping[str, str]]): Records with 'website', 'login' and 'password' keys.
+                chunk_size (int): Number of encrypted records written to the vault at a time.
+
+            Returns:
+                int: The number of imported records.
+
+            Raises:
+                ValueError: If a record lacks a field or a field is not a string.
+        """
+        imported_count: int = 0
+
+        # (website, compact record) pairs of the current chunk
+        chunk: List[Tuple[str, bytes]] = []
+
+        encode = timed(encode_record, 'parse')
+
+        # Open the user's vault once for the whole import, or again if the key is rotated meanwhile
+        credential_writer: CredentialWriter = self.storage.open_credential_writer(self.user)
+
+        def write_chunk() -> None:
+            # Take the chunk off first, so records whose write failed are not written again
+            nonlocal chunk, credential_writer, imported_count
+            records: List[Tuple[str, bytes]] = chunk
+            chunk = []
+            credential_writer = self._write_records(credential_writer, records)
+            imported_count += len(records)
+
+        try:
+            for record_number, record in enumerate(credentials, 1):
+                # Keep the same field order as encrypt_save_credentials
+                data: Dict[str, str] = check_credential_record(record, f'Record {record_number}')
+                chunk.append((data['website'], encode(data)))
+
+                # Write a full chunk in one call and start a new one
+                if len(chunk) >= chunk_size:
+                    write_chunk()
+
+            # Write the records left over from the last incomplete chunk
+            if chunk:
+                write_chunk()
+
+        except BaseException:
+            # Keep the records read before the failure and log what the import stored
+            try:
+                if chunk:
+                    write_chunk()
+            finally:
+                self.save_audit_log(f'- Imported {imported_count} credentials, then the import failed')
+            raise
+
+        finally:
+            credential_writer.close()
+
+        # Save a single audit log entry for the whole import
+        self.save_audit_log(f'- Imported {imported_count} credentials')
+
+        # Print a success message
+        self._notify(f'{imported_count} credentials imported successfully\n')
+        return imported_count
 
-    def decrypt_display_credentials(self) -> None:
+    def import_credentials_file(self, path: str, chunk_size: int = IMPORT_CHUNK_SIZE) -> int:
+        """
+            Import user credentials from a CSV or JSON-lines file.
+
+            A CSV file needs a header row with website, login and password columns.
+            A JSON-lines file (.jsonl or .ndjson) needs one object with the same keys per line.
+
+            Args:
+                path (str): Path of the file to import.
+                chunk_size (int): Number of encrypted records written to the vault at a time.
+
+            Returns:
+                int: The number of imported records.
+
+            Raises:
+                ValueError: If the file extension is not supported.
+        """
+        return self.import_credentials(read_credentials_file(path), chunk_size)
+
+    @instrumented('iter_credentials')
+    def iter_credentials(self, parallel: bool = False, workers: Optional[int] = None,
+                         chunk_size: int = PARALLEL_CHUNK_SIZE) -> Iterator[Dict[str, str]]:
+        """
+            Iterate over the user's stored credentials.
+
+            Streams the live records of the user's vault from the storage, decrypting and decoding each record
+            as it goes, so only one record is held in memory at a time and the first record is available
+            before the rest of the vault has been read.
+
+            With parallel=True, vault files of at least PARALLEL_MIN_FILE_SIZE bytes are split into
+            record-aligned chunks that are decrypted on a process pool; records are still yielded in file order.
+            Smaller files, block vaults and backends that do not keep vaults in plain files always use the serial path.
+
+            If the vault stops decrypting with the user's key because another process rotated it, the key is loaded
+            again and the vault is read once more, skipping the records already yielded; the rotation rewrites
+            the live records in the same order.
+
+            Args:
+                parallel (bool): Decrypt large files on a process pool.
+                workers (Optional[int]): Number of worker processes, defaults to the number of CPUs.
+                chunk_size (int): Target size in bytes of the chunk decrypted by one worker task.
+
+            Yields:
+                Dict[str, str]: One credential record with 'website', 'login' and 'password' keys.
+
+            Raises:
+                FileNotFoundError: If the user's data file is not found (file storage).
+                ValueError: If the user's key is not a valid encryption key.
+                InvalidToken: If the vault does not decrypt with the stored key either.
+        """
+        from cryptography.fernet import InvalidToken
+
+        yielded_count: int = 0
+        try:
+            for credentials in self._iter_vault(parallel, workers, chunk_size):
+                yield credentials
+                yielded_count += 1
+            return
+        except InvalidToken:
+            if not self.user.reload_key():
+                raise
+
+        for credentials in itertools.islice(self._iter_vault(parallel, workers, chunk_size), yielded_count, None):
+            yield credentials
+
+    def _iter_vault(self, parallel: bool, workers: Optional[int], chunk_size: int) -> Iterator[Dict[str, str]]:
+        """
+            Iterate over the user's stored credentials with the key in use, see iter_credentials.
+
+            Args:
+                parallel (bool): Decrypt large files on a process pool.
+                workers (Optional[int]): Number of worker processes, defaults to the number of CPUs.
+                chunk_size (int): Target size in bytes of the chunk decrypted by one worker task.
+
+            Yields:
+                Dict[str, str]: One credential record with 'website', 'login' and 'password' keys.
+        """
+        # Hand large vault files to the process pool
+        vault_file: Optional[str] = self.storage.vault_file(self.user)
+        if parallel and vault_file is not None and os.path.getsize(vault_file) >= PARALLEL_MIN_FILE_SIZE:
+            yield from iter_credentials_parallel(vault_file, self.user.stored_key, workers, chunk_size,
+                                                 self.storage.live_record_locations(self.user))
+            return
+
+        decode = timed(decode_record, 'parse')
+        for record in self.storage.iter_credential_records(self.user):
+            yield decode(record)
+
+    @instrumented('decrypt_display_credentials')
+    def decrypt_display_credentials(self, parallel: bool = False, workers: Optional[int] = None,
+                                    chunk_size: int = PARALLEL_CHUNK_SIZE) -> None:
         """
             Decrypt and display user credentials.
 
-            Attempts to read the user's data file, decrypts each line, and prints the decrypted JSON data.
-            If the decryption key is not found (TypeError), it prints an error message.
+            Streams the user's credentials through iter_credentials and prints each record as soon as it is decrypted.
+            The parallel, workers and chunk_size arguments are passed on to iter_credentials.
+            If the decryption key is not found or invalid (ValueError), or does not decrypt the stored data
+            (InvalidToken), it prints an error message.
             If the data file is not found (FileNotFoundError), it informs the user to save credentials first.
 
             Raises:
-                TypeError: If the decryption key is not found.
+                ValueError: If the decryption key is not found.
                 FileNotFoundError: If the data file is not found.
 
         """
+        from cryptography.fernet import InvalidToken
+
         try:
-            # Attempt to open the user's data file for reading
-            with open(self.user.users_data_file, 'r') as data_file:
-                encrypted_data: list[str] = data_file.readlines()
-            decrypted_data_json_line: list[str] = [self.user.decrypt_data(line.strip()) for line in encrypted_data]
-
-            # Decrypt each line in the data file and print the decrypted JSON data
-            for line in decrypted_data_json_line:
-                for key, val in json.loads(line).items():
+            # Decrypt the data file one line at a time and print each record right away
+            for credentials in self.iter_credentials(parallel, workers, chunk_size):
+                for key, val in credentials.items():
                     print(f'{key}: {val}')
                 print()
 
-        except TypeError:
+        except ValueError:
             # Handle the case where the decryption key is not found
             print('Key is not found\n')
 
@@ -105,6 +530,10 @@ class PasswordManager:
             # Handle the case where the data file is not found
             print('No such file or directory. To create a file, you need to save any credentials.\n')
 
+        except InvalidToken:
+            # Handle the case where the stored data does not match the stored key
+            print('The stored data cannot be decrypted with the key\n')
+
         # Save an audit log entry indicating the action
         self.save_audit_log(f'- Deciphered the data')
 
@@ -120,19 +549,30 @@ class PasswordManager:
         """
         self.user.log_action(action)
 
-    def show_audit_history(self) -> Optional[str]:
+    @instrumented('show_audit_history')
+    def show_audit_history(self, last: Optional[int] = None) -> Iterator[str]:
         """
             Show user audit history.
 
             Retrieves and returns the audit history of user actions using the get_audit_history method
             of the associated User instance. Additionally, logs the action of checking credentials in the audit log.
+            When last is given, only the most recent entries are read, from the end of the audit file.
+
+            Args:
+                last (Optional[int]): Number of most recent entries to show, the whole history if None.
 
             Returns:
-                Optional[str]: Audit history as a string or None if no history is found.
+                Iterator[str]: The audit log entries, oldest first; the whole history is streamed
+                rather than read into memory.
 
         """
         # Save an audit log entry indicating the action of checking credentials
         self.save_audit_log(f'- Checked the credentials')
 
+        if last is not None:
+            # Read only the tail of the audit file
+            print()  # Adding an empty line for better visual separation in the output
+            return iter(self.user.tail_audit_history(last))
+
         # Retrieve and return the audit history using the get_audit_history method
         return self.user.get_audit_history()
@@ -0,0 +1,145 @@
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+# Identity of a file's current contents: (inode, modification time in ns, size)
+FileSignature = Tuple[int, int, int]
+
+
+def file_signature(path: str) -> Optional[FileSignature]:
+    """
+        Return the identity of a file's current contents.
+
+        A file replaced through os.replace gets a new inode, and an edited file a new modification time or size.
+
+        Args:
+            path (str): Path of the file.
+
+        Returns:
+            Optional[FileSignature]: (inode, modification time in ns, size), or None if the file does not exist.
+    """
+    try:
+        stat_result: os.stat_result = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size
+
+
+class RegistryState:
+    """
+        The loaded contents of one user registry, shared by every UserManager in the process that uses it.
+
+        Attributes:
+            - users (Dict[str, str]): User IDs mapped to user names.
+            - snapshot_signature (Optional[FileSignature]): Signature of the snapshot file the users were loaded from.
+            - journal_size (int): Number of journal bytes already applied to users.
+            - journal_entries (int): Number of journal entries applied to users.
+    """
+    def __init__(self, users: Dict[str, str], snapshot_signature: Optional[FileSignature]):
+        """
+            Initialize the RegistryState instance.
+
+            Args:
+                users (Dict[str, str]): User IDs mapped to user names, as loaded from the snapshot.
+                snapshot_signature (Optional[FileSignature]): Signature of the snapshot file.
+        """
+        self.users: Dict[str, str] = users
+        self.snapshot_signature: Optional[FileSignature] = snapshot_signature
+        self.journal_size: int = 0
+        self.journal_entries: int = 0
+
+
+class RegistryCache:
+    """
+        A process-wide, thread-safe cache of loaded user registries, keyed by the absolute registry file path.
+
+        A cached registry stays valid while its snapshot file keeps the same signature; entries appended to the
+        journal by other processes are applied incrementally. Every change made through the cache bumps
+        a generation counter, and hit/miss counters show how effective the cache is.
+
+        Attributes:
+            - lock (threading.RLock): Held while a registry is loaded or changed.
+            - hits (int): Number of loads answered from the cache.
+            - misses (int): Number of loads that had to read the snapshot file.
+            - generation (int): Incremented whenever a cached registry changes or is invalidated.
+    """
+    def __init__(self):
+        """
+            Initialize an empty RegistryCache.
+        """
+        self.lock: threading.RLock = threading.RLock()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.generation: int = 0
+        self._states: Dict[str, RegistryState] = {}
+
+    def get(self, users_file: str) -> Optional[RegistryState]:
+        """
+            Return the cached registry for a file if its snapshot has not changed on disk.
+
+            Args:
+                users_file (str): Path of the registry snapshot file.
+
+            Returns:
+                Optional[RegistryState]: The cached registry, or None on a miss.
+        """
+        with self.lock:
+            state: Optional[RegistryState] = self._states.get(os.path.abspath(users_file))
+            signature: Optional[FileSignature] = file_signature(users_file)
+            if state is None or signature is None or state.snapshot_signature != signature:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return state
+
+    def put(self, users_file: str, state: RegistryState) -> None:
+        """
+            Store a freshly loaded registry.
+
+            Args:
+                users_file (str): Path of the registry snapshot file.
+                state (RegistryState): The loaded registry.
+        """
+        with self.lock:
+            self._states[os.path.abspath(users_file)] = state
+            self.generation += 1
+
+    def changed(self) -> None:
+        """
+            Record that a cached registry was changed in place.
+        """
+        with self.lock:
+            self.generation += 1
+
+    def invalidate(self, users_file: Optional[str] = None) -> None:
+        """
+            Drop one cached registry, or all of them, so the next load reads the files again.
+
+            Args:
+                users_file (Optional[str]): Path of the registry snapshot file, every registry if None.
+        """
+        with self.lock:
+            if users_file is None:
+                self._states.clear()
+            else:
+                self._states.pop(os.path.abspath(users_file), None)
+            self.generation += 1
+
+    def stats(self) -> Dict[str, float]:
+        """
+            Return the cache counters.
+
+            Returns:
+                Dict[str, float]: hits, misses, hit_rate, generation and the number of cached registries.
+        """
+        with self.lock:
+            lookups: int = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'generation': self.generation,
+                    'registries': len(self._states)}
+
+
+# The cache shared by every UserManager (and so every User) in the process
+registry_cache: RegistryCache = RegistryCache()
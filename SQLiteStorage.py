@@ -0,0 +1,245 @@
+import datetime
+import os
+import sqlite3
+import threading
+from typing import TYPE_CHECKING, Dict, Iterator, List, MutableMapping, Optional, Sequence, Tuple
+from AuditLogReader import check_audit_page, entry_timestamp_key, timestamp_key
+from Storage import CredentialWriter, StorageBackend
+from VaultFormat import RECORD_ADD, RECORD_DELETE
+from WebsiteIndex import derive_website_hash_key, website_hash
+
+if TYPE_CHECKING:
+    from User import User
+
+# Number of rows fetched from a cursor at a time while streaming a vault
+FETCH_SIZE: int = 1000
+
+SCHEMA: str = '''
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    user_name TEXT NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS user_keys (
+    user_id TEXT PRIMARY KEY,
+    key BLOB NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS credentials (
+    record_id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    website_hash TEXT NOT NULL,
+    token BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS credentials_by_user ON credentials (user_id, record_id);
+CREATE INDEX IF NOT EXISTS credentials_by_website ON credentials (user_id, website_hash);
+
+CREATE TABLE IF NOT EXISTS audit (
+    entry_id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    logged_at INTEGER NOT NULL,
+    entry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS audit_by_user ON audit (user_id, entry_id);
+CREATE INDEX IF NOT EXISTS audit_by_time ON audit (user_id, logged_at);
+'''
+
+
+class SQLiteUserMap(MutableMapping):
+    """
+        The user registry of an SQLite database seen as a mapping from user IDs to user names.
+
+        Every operation is a query on the primary key, so nothing is loaded up front.
+    """
+    def __init__(self, storage: 'SQLiteStorage'):
+        self._storage: SQLiteStorage = storage
+
+    def __getitem__(self, user_id: str) -> str:
+        row = self._storage.connection().execute(
+            'SELECT user_name FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        if row is None:
+            raise KeyError(user_id)
+        return row[0]
+
+    def __setitem__(self, user_id: str, user_name: str) -> None:
+        with self._storage.connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO users (user_id, user_name) VALUES (?, ?)',
+                               (user_id, user_name))
+
+    def __delitem__(self, user_id: str) -> None:
+        with self._storage.connection() as connection:
+            if connection.execute('DELETE FROM users WHERE user_id = ?', (user_id,)).rowcount == 0:
+                raise KeyError(user_id)
+
+    def __contains__(self, user_id: object) -> bool:
+        return self._storage.connection().execute(
+            'SELECT 1 FROM users WHERE user_id = ?', (user_id,)).fetchone() is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return (row[0] for row in self._storage.connection().execute('SELECT user_id FROM users'))
+
+    def __len__(self) -> int:
+        return self._storage.connection().execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+
+class SQLiteCredentialWriter(CredentialWriter):
+    """
+        Inserts encrypted records into the credentials table, one transaction per write() call.
+    """
+    def __init__(self, storage: 'SQLiteStorage', user: 'User'):
+        super().__init__(user.cipher)
+        self._connection: sqlite3.Connection = storage.connection()
+        self._user_id: str = user.user_id
+        self._hash_key: bytes = derive_website_hash_key(user.key)
+
+    def write(self, records: Sequence[Tuple[str, bytes]], kind: str = RECORD_ADD) -> None:
+        rows: List[Tuple[str, bytes]] = [(website_hash(self._hash_key, website), encrypted_data)
+                                         for website, encrypted_data in records]
+        with self._connection:
+            if kind != RECORD_ADD:
+                # Replaced and deleted rows are removed right away; of the batch, the newest record
+                # of each website replaces the others
+                latest_records: Dict[str, bytes] = dict(rows)
+                self._connection.executemany(
+                    'DELETE FROM credentials WHERE user_id = ? AND website_hash = ?',
+                    [(self._user_id, digest) for digest in latest_records])
+                rows = [] if kind == RECORD_DELETE else list(latest_records.items())
+            self._connection.executemany(
+                'INSERT INTO credentials (user_id, website_hash, token) VALUES (?, ?, ?)',
+                [(self._user_id, digest, encrypted_data) for digest, encrypted_data in rows])
+
+    def close(self) -> None:
+        # The connection is shared by the thread, it stays open
+        pass
+
+
+class SQLiteStorage(StorageBackend):
+    """
+        Storage in a single SQLite database instead of several files per user.
+
+        The database runs in WAL mode with synchronous=NORMAL, so readers do not block the writer and a commit
+        does not wait for an fsync of the main database. Credentials are indexed by user and by keyed website
+        hash, audit entries by user and by time; batches of credentials are inserted in one transaction.
+        Updates and deletes remove the replaced rows in the same transaction, so there is nothing to compact.
+        Each thread uses its own connection.
+
+        Attributes:
+            - database (str): Path of the database file.
+    """
+    def __init__(self, database: str = 'password_manager.db'):
+        """
+            Initialize the SQLiteStorage instance and create the schema if needed.
+
+            Args:
+                database (str): Path of the database file.
+        """
+        self.database: str = database
+        self._local: threading.local = threading.local()
+        self._users: SQLiteUserMap = SQLiteUserMap(self)
+        self.connection().executescript(SCHEMA)
+
+    def connection(self) -> sqlite3.Connection:
+        """
+            Return the calling thread's connection to the database, opening it on first use.
+
+            Returns:
+                sqlite3.Connection: The connection.
+        """
+        connection: Optional[sqlite3.Connection] = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.database)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    # Registry
+
+    def load_users(self) -> SQLiteUserMap:
+        return self._users
+
+    def add_user(self, user_id: str, user_name: str) -> bool:
+        with self.connection() as connection:
+            return connection.execute('INSERT OR IGNORE INTO users (user_id, user_name) VALUES (?, ?)',
+                                      (user_id, user_name)).rowcount == 1
+
+    def save_users(self, users: MutableMapping[str, str]) -> None:
+        if users is self._users:
+            # The mapping writes through to the database, there is nothing left to save
+            return
+        with self.connection() as connection:
+            connection.executemany('INSERT OR REPLACE INTO users (user_id, user_name) VALUES (?, ?)',
+                                   list(users.items()))
+
+    # Keys
+
+    def key_ring_id(self, user: 'User') -> str:
+        return f'{os.path.abspath(self.database)}#{user.user_id}'
+
+    def load_key(self, user: 'User') -> Optional[bytes]:
+        row = self.connection().execute('SELECT key FROM user_keys WHERE user_id = ?', (user.user_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def save_key(self, user: 'User', key: bytes) -> None:
+        with self.connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO user_keys (user_id, key) VALUES (?, ?)', (user.user_id, key))
+
+    # Vault
+
+    def open_credential_writer(self, user: 'User') -> SQLiteCredentialWriter:
+        return SQLiteCredentialWriter(self, user)
+
+    def iter_credential_tokens(self, user: 'User') -> Iterator[bytes]:
+        cursor: sqlite3.Cursor = self.connection().execute(
+            'SELECT token FROM credentials WHERE user_id = ? ORDER BY record_id', (user.user_id,))
+        while True:
+            rows: List[Tuple[bytes]] = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                return
+            for row in rows:
+                yield row[0]
+
+    def find_credential_tokens(self, user: 'User', website: str) -> List[bytes]:
+        rows = self.connection().execute(
+            'SELECT token FROM credentials WHERE user_id = ? AND website_hash = ? ORDER BY record_id',
+            (user.user_id, website_hash(derive_website_hash_key(user.key), website))).fetchall()
+        return [row[0] for row in rows]
+
+    def vault_stats(self, user: 'User') -> Tuple[int, int]:
+        row = self.connection().execute('SELECT COUNT(*) FROM credentials WHERE user_id = ?', (user.user_id,)).fetchone()
+        return row[0], 0
+
+    # Audit log
+
+    def append_audit(self, user: 'User', entry: str) -> None:
+        with self.connection() as connection:
+            connection.execute('INSERT INTO audit (user_id, logged_at, entry) VALUES (?, ?, ?)',
+                               (user.user_id, entry_timestamp_key(entry.encode()) or 0, entry))
+
+    def read_audit(self, user: 'User') -> Optional[str]:
+        rows = self.connection().execute(
+            'SELECT entry FROM audit WHERE user_id = ? ORDER BY entry_id', (user.user_id,)).fetchall()
+        return ''.join(row[0] for row in rows) if rows else None
+
+    def tail_audit(self, user: 'User', count: int) -> List[str]:
+        rows = self.connection().execute(
+            'SELECT entry FROM audit WHERE user_id = ? ORDER BY entry_id DESC LIMIT ?',
+            (user.user_id, max(count, 0))).fetchall()
+        return [row[0] for row in reversed(rows)]
+
+    def audit_page(self, user: 'User', page: int, page_size: int) -> List[str]:
+        # A negative LIMIT would return every entry
+        check_audit_page(page, page_size)
+        rows = self.connection().execute(
+            'SELECT entry FROM audit WHERE user_id = ? ORDER BY entry_id LIMIT ? OFFSET ?',
+            (user.user_id, page_size, page * page_size)).fetchall()
+        return [row[0] for row in rows]
+
+    def audit_range(self, user: 'User', since: Optional[datetime.datetime],
+                    until: Optional[datetime.datetime]) -> Iterator[str]:
+        since_key: int = timestamp_key(since) if since is not None else 0
+        until_key: int = timestamp_key(until) if until is not None else 99999999999999
+        cursor: sqlite3.Cursor = self.connection().execute(
+            'SELECT entry FROM audit WHERE user_id = ? AND logged_at BETWEEN ? AND ? ORDER BY entry_id',
+            (user.user_id, since_key, until_key))
+        return (row[0] for row in cursor)
@@ -0,0 +1,343 @@
+import threading
+import time
+from PasswordManager import PasswordManager
+from Metrics import instrumented, timed
+from Storage import StorageBackend
+from VaultFormat import RECORD_ADD, RECORD_DELETE, decode_record, peek_record
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# A session drops its decrypted records once they have not been used for SESSION_IDLE_TTL seconds,
+# and at the latest SESSION_ABSOLUTE_TTL seconds after they were decrypted, even while they are in use
+SESSION_IDLE_TTL: float = 300.0
+SESSION_ABSOLUTE_TTL: float = 3600.0
+
+
+def wipe_buffer(buffer: bytearray) -> None:
+    """
+        Overwrite a buffer with zeros in place.
+
+        Args:
+            buffer (bytearray): The buffer.
+    """
+    buffer[:] = bytes(len(buffer))
+
+
+class Session:
+    """
+        A signed-in user, kept alive between actions so that showing the vault again does not decrypt it again.
+
+        The session keeps the live records of the user's vault decrypted in memory, in the order they were stored.
+        Before every use it compares the vault version from the storage (file identity, modification time
+        and size) with the version the records were read at: an unchanged vault is served from memory,
+        a vault that only grew since has just the appended bytes read and decrypted, and a vault that was
+        replaced (compacted, migrated) is read again from the start. Vaults without a version, such as block vaults
+        and SQLite, are read in full every time.
+
+        The records are dropped after idle_ttl seconds without use and absolute_ttl seconds after they were read,
+        by a timer so that they do not stay in memory while nobody uses the session; the next use reads them again.
+        Logging out drops them as well. The cached plaintexts are kept in bytearrays that are overwritten with zeros
+        when dropped; the bytes and strings Python creates while decrypting and decoding them cannot be overwritten
+        and are only released.
+
+        Attributes:
+            - manager: PasswordManager
+                The manager of the signed-in user, shared by every action of the session.
+            - idle_ttl: float
+                Seconds the decrypted records are kept without being used.
+            - absolute_ttl: float
+                Seconds the decrypted records are kept at most.
+
+        Methods:
+            - credentials() -> List[Dict[str, str]]
+                Returns the user's live credentials, in the order they were stored.
+
+            - encrypt_save_credentials(website: str, login: str, password: str) -> None
+                Encrypts and saves user credentials through the session's manager.
+
+            - decrypt_display_credentials() -> None
+                Displays the user's credentials from memory.
+
+            - clear() -> None
+                Drops and wipes the decrypted records.
+
+            - close() -> None
+                Logs out: drops the decrypted records and ends the session.
+    """
+    def __init__(self, user_id: str, user_name: str, storage: Optional[StorageBackend] = None,
+                 idle_ttl: float = SESSION_IDLE_TTL, absolute_ttl: float = SESSION_ABSOLUTE_TTL, quiet: bool = False):
+        """
+            Initialize the Session instance.
+
+            Args:
+                user_id (str): User ID.
+                user_name (str): User's name.
+                storage (Optional[StorageBackend]): Storage backend, the process default if None.
+                idle_ttl (float): Seconds the decrypted records are kept without being used.
+                absolute_ttl (float): Seconds the decrypted records are kept at most.
+                quiet (bool): Do not print status messages.
+        """
+        self.manager: PasswordManager = PasswordManager(user_id, user_name, storage, quiet)
+        self.idle_ttl: float = idle_ttl
+        self.absolute_ttl: float = absolute_ttl
+        self._lock: threading.Lock = threading.Lock()
+        self._closed: bool = False
+
+        # Compact plaintext of every live record under its position in the vault, in the order the records were stored,
+        # and the positions of the live records of every website
+        self._records: Dict[int, bytearray] = {}
+        self._website_positions: Dict[str, List[int]] = {}
+        self._next_position: int = 0
+
+        # Vault version the records were read at, None while nothing is cached
+        self._version: Optional[Tuple[int, int, int]] = None
+
+        # Offset in the vault file up to which the records were read, and the bytes just before it,
+        # which tell the file apart from another one that got its inode after a compaction
+        self._read_offset: int = 0
+        self._anchor: bytes = b''
+
+        # Monotonic times the records were read and last used
+        self._loaded_at: float = 0.0
+        self._used_at: float = 0.0
+        self._expiry_timer: Optional[threading.Timer] = None
+
+    @instrumented('session_credentials')
+    def credentials(self) -> List[Dict[str, str]]:
+        """
+            Return the user's live credentials, reading only what changed in the vault since the last call.
+
+            Returns:
+                List[Dict[str, str]]: Records with 'website', 'login' and 'password' keys,
+                in the order they were stored.
+
+            Raises:
+                ValueError: If the session is closed or the user's key is not a valid encryption key.
+                FileNotFoundError: If the user's data file is not found (file storage).
+        """
+        with self._lock:
+            self._refresh()
+            decode = timed(decode_record, 'parse')
+            credentials: List[Dict[str, str]] = [decode(plaintext) for plaintext in self._records.values()]
+
+            # Records of a vault without a version cannot be checked later, so they are not kept
+            if self._version is None:
+                self._clear()
+            return credentials
+
+    def encrypt_save_credentials(self, website: str, login: str, password: str) -> None:
+        """
+            Encrypt and save user credentials; the next read of the session picks them up from the vault.
+
+            Args:
+                website (str): Website name.
+                login (str): User login.
+                password (str): User password.
+        """
+        self._check_open()
+        self.manager.encrypt_save_credentials(website, login, password)
+
+    def decrypt_display_credentials(self) -> None:
+        """
+            Display the user's credentials, decrypting only the records saved since they were last displayed.
+
+            If the decryption key is not found or invalid (ValueError), or does not decrypt the stored data
+            (InvalidToken), it prints an error message.
+            If the data file is not found (FileNotFoundError), it informs the user to save credentials first.
+        """
+        from cryptography.fernet import InvalidToken
+
+        self._check_open()
+        try:
+            for credentials in self.credentials():
+                for key, val in credentials.items():
+                    print(f'{key}: {val}')
+                print()
+
+        except ValueError:
+            # Handle the case where the decryption key is not found
+            print('Key is not found\n')
+
+        except FileNotFoundError:
+            # Handle the case where the data file is not found
+            print('No such file or directory. To create a file, you need to save any credentials.\n')
+
+        except InvalidToken:
+            # Handle the case where the stored data does not match the stored key
+            print('The stored data cannot be decrypted with the key\n')
+
+        # Save an audit log entry indicating the action
+        self.manager.save_audit_log(f'- Deciphered the data')
+
+    def clear(self) -> None:
+        """
+            Drop the decrypted records and overwrite their buffers; the next read decrypts the vault again.
+        """
+        with self._lock:
+            self._clear()
+
+    def close(self) -> None:
+        """
+            Log out: drop the decrypted records and end the session.
+        """
+        with self._lock:
+            self._clear()
+            self._closed = True
+
+    def __enter__(self) -> 'Session':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _check_open(self) -> None:
+        """
+            Make sure the session has not been logged out.
+
+            Raises:
+                ValueError: If the session is closed.
+        """
+        if self._closed:
+            raise ValueError('The session is closed')
+
+    def _refresh(self) -> None:
+        """
+            Bring the decrypted records up to date with the vault. The caller holds the session lock.
+
+            If the vault no longer decrypts with the user's key because another process rotated it, the key is loaded
+            again and the whole vault is read with it.
+
+            Raises:
+                ValueError: If the session is closed or the user's key is not a valid encryption key.
+                InvalidToken: If the vault does not decrypt with the stored key either.
+                FileNotFoundError: If the user's data file is not found (file storage).
+        """
+        from cryptography.fernet import InvalidToken
+
+        self._check_open()
+        now: float = time.monotonic()
+        if self._version is not None and self._expired(now):
+            self._clear()
+
+        try:
+            self._read_changes(now)
+        except InvalidToken:
+            # Another process rotated the key and re-encrypted the vault, read all of it again with the new key
+            if not self.manager.user.reload_key():
+                raise
+            self._clear()
+            self._read_changes(now)
+
+    def _read_changes(self, now: float) -> None:
+        """
+            Read what changed in the vault since the records were read, or the whole vault. The caller holds
+            the session lock.
+
+            Args:
+                now (float): Monotonic time of the read.
+
+            Raises:
+                InvalidToken: If the vault does not decrypt with the user's key.
+                FileNotFoundError: If the user's data file is not found (file storage).
+        """
+        storage: StorageBackend = self.manager.storage
+        user = self.manager.user
+        version: Optional[Tuple[int, int, int]] = storage.vault_version(user)
+        self._used_at = now
+        if version is not None and version == self._version:
+            return
+
+        # A vault with the same identity, no older and no smaller, only grew by appends since it was read, unless
+        # it is a new file that reused the inode; read just the new records if the bytes before them are unchanged
+        if version is not None and self._version is not None and version[0] == self._version[0] \
+                and version[1] >= self._version[1] and version[2] >= self._read_offset:
+            appended: Optional[Tuple[List[bytes], int, bytes]] = storage.read_appended_records(
+                user, self._read_offset, self._anchor)
+            if appended is not None:
+                self._apply(appended[0])
+                self._version, self._read_offset, self._anchor = version, appended[1], appended[2]
+                return
+
+        # Otherwise read the vault from the start. A vault with a version is read up to an exact offset, so records
+        # appended meanwhile are read once by the next incremental read; its dead records are dropped by _apply.
+        self._clear()
+        if version is None:
+            self._apply(storage.iter_credential_records(user))
+            return
+        records: Optional[Tuple[List[bytes], int, bytes]] = storage.read_appended_records(user, 0)
+        if records is None:
+            self._apply(storage.iter_credential_records(user))
+            return
+        self._apply(records[0])
+        self._version, self._read_offset, self._anchor = version, records[1], records[2]
+        self._loaded_at = now
+        self._schedule_expiry()
+
+    def _apply(self, plaintexts: Iterable[bytes]) -> None:
+        """
+            Apply decrypted records to the cache in the order they were stored: an added record joins the records
+            of its website, a replacing record removes them first and a tombstone only removes them.
+
+            Args:
+                plaintexts (Iterable[bytes]): The record plaintexts.
+        """
+        for plaintext in plaintexts:
+            website, kind = peek_record(plaintext)
+            if kind != RECORD_ADD:
+                for position in self._website_positions.pop(website, ()):
+                    wipe_buffer(self._records.pop(position))
+            if kind != RECORD_DELETE:
+                self._records[self._next_position] = bytearray(plaintext)
+                self._website_positions.setdefault(website, []).append(self._next_position)
+                self._next_position += 1
+
+    def _expired(self, now: float) -> bool:
+        """
+            Check whether the decrypted records have outlived the idle or the absolute TTL.
+
+            Args:
+                now (float): The current monotonic time.
+
+            Returns:
+                bool: True if the records must be dropped.
+        """
+        return now - self._used_at >= self.idle_ttl or now - self._loaded_at >= self.absolute_ttl
+
+    def _schedule_expiry(self) -> None:
+        """
+            Start the timer that drops the decrypted records once they expire. The caller holds the session lock.
+        """
+        if self._expiry_timer is not None:
+            self._expiry_timer.cancel()
+        delay: float = max(0.0, min(self._used_at + self.idle_ttl, self._loaded_at + self.absolute_ttl)
+                           - time.monotonic())
+        self._expiry_timer = threading.Timer(delay, self._on_expiry_timer)
+        self._expiry_timer.daemon = True
+        self._expiry_timer.start()
+
+    def _on_expiry_timer(self) -> None:
+        """
+            Drop the decrypted records if they expired, or wait again until they do if they were used meanwhile.
+        """
+        with self._lock:
+            if self._version is None:
+                return
+            if self._expired(time.monotonic()):
+                self._clear()
+            else:
+                self._schedule_expiry()
+
+    def _clear(self) -> None:
+        """
+            Drop the decrypted records and overwrite their buffers. The caller holds the session lock.
+        """
+        for plaintext in self._records.values():
+            wipe_buffer(plaintext)
+        self._records.clear()
+        self._website_positions.clear()
+        self._next_position = 0
+        self._version = None
+        self._read_offset = 0
+        self._anchor = b''
+        if self._expiry_timer is not None:
+            self._expiry_timer.cancel()
+            self._expiry_timer = None
@@ -0,0 +1,502 @@
+import datetime
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Iterator, List, MutableMapping, Optional, Sequence, Tuple
+from DataLayout import UserFiles, user_file_names
+from Metrics import add_bytes, phase, timed, timed_iter
+from VaultFormat import RECORD_ADD
+
+if TYPE_CHECKING:
+    from cryptography.fernet import Fernet
+    from User import User
+
+
+class StaleKeyError(Exception):
+    """
+        Raised by a CredentialWriter whose cipher was built from a key that another process has rotated since;
+        the records are not written, the caller reloads the user's key and writes them again.
+    """
+
+
+class CredentialWriter(ABC):
+    """
+        A handle for appending encrypted credential records to one user's vault.
+
+        Writers are used as context managers; the records given to one write() call are stored together
+        (one buffered write for files, one transaction for databases).
+
+        Attributes:
+            - cipher (Fernet): The user's cipher, used by write_records to seal plaintext records.
+    """
+    def __init__(self, cipher: 'Fernet'):
+        """
+            Initialize the CredentialWriter instance.
+
+            Args:
+                cipher (Fernet): The user's cipher.
+        """
+        self.cipher: 'Fernet' = cipher
+
+    def write_records(self, records: Sequence[Tuple[str, bytes]], kind: str = RECORD_ADD) -> None:
+        """
+            Encrypt plaintext records and append them to the vault.
+
+            Every record is sealed as its own Fernet token and passed to write(); writers of block vaults
+            override this to seal many records into one token.
+
+            Args:
+                records (Sequence[Tuple[str, bytes]]): (website, compact record plaintext) pairs,
+                    in the order to store them.
+                kind (str): The kind of the records, RECORD_ADD, RECORD_REPLACE or RECORD_DELETE.
+        """
+        encrypt = timed(self.cipher.encrypt, 'crypto')
+        tokens: List[Tuple[str, bytes]] = [(website, encrypt(plaintext)) for website, plaintext in records]
+        with phase('io'):
+            self.write(tokens, kind)
+        add_bytes('written', sum(len(token) for _, token in tokens))
+
+    @abstractmethod
+    def write(self, records: Sequence[Tuple[str, bytes]], kind: str = RECORD_ADD) -> None:
+        """
+            Append encrypted records to the vault.
+
+            An added record is stored next to the older records of its website. A replacing record hides every
+            older record of its website, and a tombstone, the encrypted deletion marker of a website, hides them
+            as well as itself. The kind is also part of each record plaintext (see VaultFormat.encode_record).
+
+            Args:
+                records (Sequence[Tuple[str, bytes]]): (website, encrypted record) pairs, in the order to store them.
+                kind (str): The kind of the records, RECORD_ADD, RECORD_REPLACE or RECORD_DELETE.
+
+            Raises:
+                StaleKeyError: If the user's key was rotated since the writer was opened.
+        """
+
+    @abstractmethod
+    def close(self) -> None:
+        """
+            Release the resources held by the writer.
+        """
+
+    def __enter__(self) -> 'CredentialWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class StorageBackend(ABC):
+    """
+        The storage used by UserManager, User and PasswordManager for the user registry, the users' keys,
+        their encrypted vaults and their audit logs.
+
+        Vault records are stored already encrypted; backends only see the plaintext website name to index it
+        under a keyed hash. Implementations: FileStorage (the per-user file layout) and SQLiteStorage.
+    """
+    # Registry
+
+    @abstractmethod
+    def load_users(self) -> MutableMapping[str, str]:
+        """
+            Load the user registry.
+
+            Returns:
+                MutableMapping[str, str]: User IDs mapped to user names.
+        """
+
+    @abstractmethod
+    def add_user(self, user_id: str, user_name: str) -> bool:
+        """
+            Register a new user.
+
+            Args:
+                user_id (str): User ID.
+                user_name (str): User's name.
+
+            Returns:
+                bool: True if the user was added, False if the user ID already exists.
+        """
+
+    @abstractmethod
+    def save_users(self, users: MutableMapping[str, str]) -> None:
+        """
+            Store the whole user registry.
+
+            Args:
+                users (MutableMapping[str, str]): User IDs mapped to user names.
+        """
+
+    def user_files(self, user_id: str) -> UserFiles:
+        """
+            Return the paths of the files kept for a user, used by backends that store users in files.
+
+            Args:
+                user_id (str): User ID.
+
+            Returns:
+                UserFiles: The paths; by default the flat file names in the current directory.
+        """
+        return user_file_names(user_id)
+
+    # Keys
+
+    @abstractmethod
+    def key_ring_id(self, user: 'User') -> str:
+        """
+            Return the identifier of the user's key in the process-wide key ring.
+
+            Args:
+                user (User): The user.
+
+            Returns:
+                str: An identifier unique across backends and storage locations.
+        """
+
+    @abstractmethod
+    def load_key(self, user: 'User') -> Optional[bytes]:
+        """
+            Load the user's encryption key.
+
+            Args:
+                user (User): The user.
+
+            Returns:
+                Optional[bytes]: The key, or None if the user has no key yet.
+        """
+
+    @abstractmethod
+    def save_key(self, user: 'User', key: bytes) -> None:
+        """
+            Store the user's encryption key.
+
+            Args:
+                user (User): The user.
+                key (bytes): The key.
+        """
+
+    def key_version(self, user: 'User') -> Optional[Tuple[int, int, int]]:
+        """
+            Return the version of the user's stored key, which changes whenever the key is replaced,
+            so a key cached in memory is known to be the stored one.
+
+            Args:
+                user (User): The user.
+
+            Returns:
+                Optional[Tuple[int, int, int]]: The version, or None if the user has no key or the backend
+                cannot tell whether it changed.
+        """
+        return None
+
+    # Vault
+
+    @abstractmethod
+    def open_credential_writer(self, user: 'User') -> CredentialWriter:
+        """
+            Open a writer that appends encrypted records to the user's vault.
+
+            Args:
+                user (User): The user.
+
+            Returns:
+                CredentialWriter: The writer.
+        """
+
+    @abstractmethod
+    def iter_credential_tokens(self, user: 'User') -> Iterator[bytes]:
+        """
+            Iterate over the live encrypted records of the user's vault in the order they were stored.
+
+            Replaced records and tombstones are skipped.
+
+            Args:
+                user (User): The user.
+
+            Yields:
+                bytes: One encrypted record.
+
+            Raises:
+                FileNotFoundError: If the backend keeps vaults in files and the user's file does not exist.
+        """
+
+    @abstractmethod
+    def find_credential_tokens(self, user: 'User', website: str) -> List[bytes]:
+        """
+            Find the live encrypted records stored for a website without scanning the whole vault.
+
+            The result may contain records of other websites whose keyed hash collides, callers check the
+            decrypted website name.
+
+            Args:
+                user (User): The user.
+                website (str): Website name.
+
+            Returns:
+                List[bytes]: The encrypted records, in the order they were stored.
+        """
+
+    def iter_credential_records(self, user: 'User') -> Iterator[bytes]:
+        """
+            Iterate over the live decrypted records of the user's vault in the order they were stored.
+
+            Decrypts the tokens of iter_credential_tokens one at a time; block vaults decrypt a block at a time.
+
+            Args:
+                user (User): The user.
+
+            Yields:
+                bytes: One record plaintext.
+
+            Raises:
+                FileNotFoundError: If the backend keeps vaults in files and the user's file does not exist.
+        """
+        decrypt = timed(user.cipher.decrypt, 'crypto')
+        for encrypted_data in timed_iter(self.iter_credential_tokens(user), 'io'):
+            add_bytes('read', len(encrypted_data))
+            yield decrypt(encrypted_data)
+
+    def find_credential_records(self, user: 'User', website: str) -> List[bytes]:
+        """
+            Find and decrypt the live records stored for a website without scanning the whole vault.
+
+            As with find_credential_tokens, callers check the decoded website name.
+
+            Args:
+                user (User): The user.
+                website (str): Website name.
+
+            Returns:
+                List[bytes]: The record plaintexts, in the order they were stored.
+        """
+        with phase('io'):
+            tokens: List[bytes] = self.find_credential_tokens(user, website)
+        add_bytes('read', sum(len(token) for token in tokens))
+        with phase('crypto'):
+            return [user.cipher.decrypt(encrypted_data) for encrypted_data in tokens]
+
+    @abstractmethod
+    def vault_stats(self, user: 'User') -> Tuple[int, int]:
+        """
+            Count the live and dead (replaced or deleted) records of the user's vault.
+
+            Args:
+                user (User): The user.
+
+            Returns:
+                Tuple[int, int]: (live records, dead records).
+        """
+
+    def cached_vault_stats(self, user: 'User') -> Optional[Tuple[int, int]]:
+        """
+            Return the live and dead record counts of the user's vault kept in memory, without any I/O.
+
+            The counts follow the records appended through this backend, so they are cheap enough to check
+            after every write; they may miss records appended by other processes.
+
+            Args:
+                user (User): The user.
+
+            Returns:
+                Optional[Tuple[int, int]]: (live records, dead records), or None if the backend keeps no counts
+                in memory or has not loaded them yet.
+        """
+        return None
+
+    def compact_vault(self, user: 'User') -> bool:
+        """
+            Rewrite the user's vault with only its live records.
+
+            Args:
+                user (User): The user.
+
+            Returns:
+                bool: True if the vault was compacted, False if the backend has nothing to compact
+                or a compaction of this vault is already running.
+        """
+        return False
+
+    def vault_file(self, user: 'User') -> Optional[str]:
+        """
+            Return the path of the user's vault if the backend keeps it in a file of one token per record.
+
+            Args:
+                user (User): The user.
+
+            Returns:
+                Optional[str]: The path, or None if the vault is not a plain file.
+        """
+        return None
+
+    def live_record_locations(self, user: 'User') -> Optional[List[Tuple[int, int]]]:
+        """
+            Return where the live records are in the user's vault file, when it also holds dead records.
+
+            Args:
+                user (User): The user.
+
+            Returns:
+                Optional[List[Tuple[int, int]]]: (offset, stored size) of every live record in file order,
+                or None if every record in the file is live or the vault is not a plain file.
+        """
+        return None
+
+    def vault_version(self, user: 'User') -> Optional[Tuple[int, int, int]]:
+        """
+            Return the version of the user's vault, for callers that keep its decrypted records in memory.
+
+            A version is (file identity, modification time in ns, size). While the identity stays the same, the vault
+            only grows by appends, so records cached up to a size are brought up to date with read_appended_records.
+            A replaced vault can get the identity of the file it replaced back, so read_appended_records also
+            checks the bytes before the cached size.
+
+            Args:
+                user (User): The user.
+
+            Returns:
+                Optional[Tuple[int, int, int]]: The version, or None if the vault does not exist or the backend
+                cannot tell whether it changed.
+        """
+        return None
+
+    def read_appended_records(self, user: 'User', start: int,
+                              anchor: bytes = b'') -> Optional[Tuple[List[bytes], int, bytes]]:
+        """
+            Decrypt the records stored in the user's vault from a byte offset on,
+            replaced records and tombstones included.
+
+            Args:
+                user (User): The user.
+                start (int): Offset of the first record to read, the end offset of the previous read.
+                anchor (bytes): The anchor returned by the previous read; the vault is only read if the bytes
+                    just before start are still the same.
+
+            Returns:
+                Optional[Tuple[List[bytes], int, bytes]]: The record plaintexts in the order they were stored,
+                the offset after the last complete record and the anchor of that offset; or None if the backend
+                cannot read a vault from an offset, or the bytes before start changed and the vault must be read
+                from the start.
+
+            Raises:
+                FileNotFoundError: If the backend keeps vaults in files and the user's file does not exist.
+        """
+        return None
+
+    # Audit log
+
+    @abstractmethod
+    def append_audit(self, user: 'User', entry: str) -> None:
+        """
+            Append an entry to the user's audit log.
+
+            Args:
+                user (User): The user.
+                entry (str): The log entry, including its trailing newline.
+        """
+
+    def flush_audit(self) -> None:
+        """
+            Make every audit entry appended so far visible to readers.
+        """
+
+    @abstractmethod
+    def read_audit(self, user: 'User') -> Optional[str]:
+        """
+            Read the user's whole audit log.
+
+            Args:
+                user (User): The user.
+
+            Returns:
+                Optional[str]: The log, or None if the user has no audit history.
+        """
+
+    def iter_audit(self, user: 'User') -> Iterator[str]:
+        """
+            Iterate over the entries of the user's audit log without holding the whole log in memory.
+
+            The default splits read_audit; backends with large logs stream them.
+
+            Args:
+                user (User): The user.
+
+            Yields:
+                str: Each entry with its trailing newline, oldest first.
+        """
+        yield from (self.read_audit(user) or '').splitlines(keepends=True)
+
+    @abstractmethod
+    def tail_audit(self, user: 'User', count: int) -> List[str]:
+        """
+            Read the last entries of the user's audit log.
+
+            Args:
+                user (User): The user.
+                count (int): Number of entries.
+
+            Returns:
+                List[str]: Up to count entries, oldest first.
+        """
+
+    @abstractmethod
+    def audit_page(self, user: 'User', page: int, page_size: int) -> List[str]:
+        """
+            Read one page of the user's audit log.
+
+            Args:
+                user (User): The user.
+                page (int): Zero-based page number, page 0 holds the oldest entries.
+                page_size (int): Number of entries per page.
+
+            Returns:
+                List[str]: The entries of the page.
+
+            Raises:
+                ValueError: If the page number is negative or the page size is not positive.
+        """
+
+    @abstractmethod
+    def audit_range(self, user: 'User', since: Optional[datetime.datetime],
+                    until: Optional[datetime.datetime]) -> Iterator[str]:
+        """
+            Read the entries of the user's audit log logged in a time range.
+
+            Args:
+                user (User): The user.
+                since (Optional[datetime.datetime]): Earliest time to include, from the start of the log if None.
+                until (Optional[datetime.datetime]): Latest time to include, to the end of the log if None.
+
+            Returns:
+                Iterator[str]: The matching entries, oldest first.
+        """
+
+
+# The storage used when no backend is passed explicitly, created on first use
+_default_storage: Optional[StorageBackend] = None
+
+
+def get_default_storage() -> StorageBackend:
+    """
+        Return the storage used when no backend is passed explicitly.
+
+        Returns:
+            StorageBackend: The configured default, a FileStorage on users.json unless changed.
+    """
+    global _default_storage
+    if _default_storage is None:
+        from FileStorage import FileStorage
+        _default_storage = FileStorage()
+    return _default_storage
+
+
+def configure_default_storage(storage: StorageBackend) -> StorageBackend:
+    """
+        Set the storage used when no backend is passed explicitly.
+
+        Args:
+            storage (StorageBackend): The new default.
+
+        Returns:
+            StorageBackend: The new default.
+    """
+    global _default_storage
+    _default_storage = storage
+    return storage
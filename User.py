@@ -1,6 +1,35 @@
 import datetime
-from cryptography.fernet import Fernet
+import time
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional, Tuple
+from DataLayout import UserFiles
 from UserManager import UserManager
+from KeyRing import get_key_ring, stored_keys
+from Metrics import add_bytes, instrumented, phase
+from Storage import StorageBackend
+
+# cryptography is imported when the key is first needed, runs that never encrypt do not pay for it
+if TYPE_CHECKING:
+    from cryptography.fernet import Fernet
+
+# Audit timestamp of the current second as (second, text), shared by all users so it is formatted only once per second;
+# both are replaced together, so a thread never pairs a new second with the text of another one
+_timestamp: Tuple[int, str] = (-1, '')
+
+
+def _audit_timestamp() -> str:
+    """
+        Return the current time formatted for the audit log, reusing the string while the second has not changed.
+
+        Returns:
+            str: The timestamp in the format 'DD-MM-YYYY HH:MM:SS'.
+    """
+    global _timestamp
+    current_second: int = int(time.time())
+    cached_second, cached_text = _timestamp
+    if current_second != cached_second:
+        cached_text = datetime.datetime.fromtimestamp(current_second).strftime('%d-%m-%Y %H:%M:%S')
+        _timestamp = (current_second, cached_text)
+    return cached_text
 
 
 class User(UserManager):
@@ -8,24 +37,50 @@ class User(UserManager):
         A class representing a user with additional functionality for logging actions,
         managing encryption keys, and handling user data.
     """
-    def __init__(self, user_id: str, user_name: str):
-        super().__init__()   # Call the constructor of the base class (UserManager)
+    def __init__(self, user_id: str, user_name: str, storage: Optional[StorageBackend] = None):
+        super().__init__(storage=storage)   # Call the constructor of the base class (UserManager)
         self.user_name: str = user_name
         self.user_id: str = user_id
 
-        # The name of the file where specific user actions will be stored.
+        # The file paths below are used by the flat-file storage, other storage backends ignore them.
+        # The storage places them under its data root, see DataLayout.
+        files: UserFiles = self.storage.user_files(user_id)
+
+        # The path of the file where specific user actions will be stored.
         # The file will be created when the user performs certain actions, such as saving a password.
         # The file format will be txt
-        self.audit_file: str = f'{user_id}_audit.txt'
+        self.audit_file: str = files.audit_file
+
+        # The path of the file where the sparse timestamp/offset index of the audit file will be stored
+        self.audit_index_file: str = files.audit_index_file
+
+        # The path of the file where the specific user's key for encryption and decryption of data will be stored
+        self.key_file: str = files.key_file
+
+        # The path of the file for a specific user where data (site, login, password) will be stored
+        self.users_data_file: str = files.users_data_file
+
+        # The path of the file where the index of the user's data file by website will be stored
+        self.index_file: str = files.index_file
+
+        # The path of the directory where the lock files of the user's files will be stored
+        self.lock_dir: str = files.lock_dir
+
+        # The user information written into every audit log entry, built on the first logged action
+        self._audit_label: Optional[str] = None
+
+        # The user's key, loaded or created by load_or_create_key on first use
+        self._key: Optional[bytes] = None
 
-        # The name of the file where the specific user's key for encryption and decryption of data will be stored
-        self.key_file: str = f'{user_id}_key.txt'
+        # The key as stored, which also lists the old keys while a key rotation is in progress
+        self._stored_key: Optional[bytes] = None
 
-        # The name of the file for a specific user where data (site, login, password) will be stored
-        self.users_data_file: str = f'{user_id}_data.json'
+        # The Fernet cipher built from the user's key.
+        # It is created once when the key is assigned and reused by every encrypt/decrypt call
+        self._cipher: Optional['Fernet'] = None
 
-        # We create or load a saved user key
-        self.load_or_create_key()
+        # The version of the stored key the key was loaded from (see StorageBackend.key_version), None if unknown
+        self._key_version: Optional[Tuple[int, int, int]] = None
 
     def __str__(self) -> str:
         """
@@ -36,26 +91,155 @@ class User(UserManager):
         """
         return f'User: {self.user_name}, ID: {self.user_id}'
 
+    @property
+    def key(self) -> bytes:
+        """
+            The user's encryption key, loaded from the storage (or created) on first access.
+
+            Returns:
+                bytes: The key used to build the user's cipher; during a key rotation, the new key.
+        """
+        if self._key is None:
+            self.load_or_create_key()
+        return self._key
+
+    @key.setter
+    def key(self, value: bytes) -> None:
+        """
+            Set the user's encryption key and rebuild the cached cipher.
+
+            Args:
+                value (bytes): The new encryption key, or a stored key listing the new and the old keys
+                    of a key rotation in progress (see stored_keys).
+        """
+        from cryptography.fernet import Fernet, MultiFernet
+
+        keys: List[bytes] = stored_keys(value)
+        self._key = keys[0]
+        self._stored_key = value
+        self._key_version = None
+
+        # Build the cipher once here, so the key is not parsed again on every encrypt/decrypt call.
+        # During a key rotation the cipher encrypts with the new key and decrypts with any of the keys.
+        # A key that Fernet cannot parse leaves the cipher empty; decrypt_data reports it when used
+        try:
+            self._cipher = Fernet(value) if len(keys) == 1 else MultiFernet([Fernet(key) for key in keys])
+        except ValueError:
+            self._cipher = None
+
+    @property
+    def stored_key(self) -> bytes:
+        """
+            The user's key as stored, loading it on first access.
+
+            Returns:
+                bytes: The key, or during a key rotation the new key followed by the old ones (see stored_keys).
+        """
+        if self._stored_key is None:
+            self.load_or_create_key()
+        return self._stored_key
+
+    @property
+    def key_version(self) -> Optional[Tuple[int, int, int]]:
+        """
+            The version of the stored key the user's key was loaded from.
+
+            Returns:
+                Optional[Tuple[int, int, int]]: The version taken before the key was loaded, or None if it is unknown,
+                e.g. for a key that was assigned rather than loaded.
+        """
+        return self._key_version
+
+    @property
+    def cipher(self) -> 'Fernet':
+        """
+            The cached Fernet cipher built from the user's key, loading the key on first access.
+
+            Returns:
+                Fernet: The cipher object, a MultiFernet during a key rotation.
+
+            Raises:
+                ValueError: If the stored key is not a valid Fernet key.
+        """
+        if self._cipher is None:
+            key: bytes = self.key
+            if self._cipher is None:
+                from cryptography.fernet import Fernet
+
+                # Let Fernet raise the same ValueError it raises for an invalid key
+                self._cipher = Fernet(key)
+        return self._cipher
+
+    @instrumented('load_or_create_key')
     def load_or_create_key(self) -> None:
         """
             Load or create the encryption key for the user.
 
-            Tries to load the key from the file, creates a new key if not found.
+            Takes the key (and its cipher) from the shared key ring if the user was active recently and the stored key
+            has not been replaced since, otherwise tries to load the key from the storage, creates a new key
+            if not found.
         """
-        try:
-            # Attempt to open the key file for reading in binary mode
-            with open(self.key_file, 'rb') as key_file:
-                # Read the key from the file
-                self.key: bytes = key_file.read()
+        key_ring_id: str = self.storage.key_ring_id(self)
+
+        # Take the version before loading, so a key replaced meanwhile is never cached under the new version
+        with phase('io'):
+            key_version: Optional[Tuple[int, int, int]] = self.storage.key_version(self)
+        cached_key = get_key_ring().get(key_ring_id, key_version)
+        if cached_key is not None:
+            # Reuse the cached key, and the cached cipher if there is one instead of building it again
+            key, cipher = cached_key
+            if cipher is None:
+                self.key = key
+            else:
+                self._key, self._stored_key, self._cipher = stored_keys(key)[0], key, cipher
+            self._key_version = key_version
+            return
+
+        # Attempt to load the key from the storage
+        with phase('io'):
+            stored_key: Optional[bytes] = self.storage.load_key(self)
+
+        if stored_key is not None:
+            self.key: bytes = stored_key
 
-        except FileNotFoundError:
-            # If the key file is not found, generate a new key
-            self.key: bytes = Fernet.generate_key()
+        else:
+            from cryptography.fernet import Fernet
 
-            # Save the new key to the key file in binary mode
-            with open(self.key_file, 'wb') as key_file:
-                key_file.write(self.key)
+            # If the key is not found, generate a new key
+            with phase('crypto'):
+                self.key: bytes = Fernet.generate_key()
 
+            # Save the new key to the storage
+            with phase('io'):
+                self.storage.save_key(self, self.key)
+                key_version = self.storage.key_version(self)
+
+        # Remember the key for the next User of this user ID
+        self._key_version = key_version
+        get_key_ring().put(key_ring_id, self._stored_key, self._cipher, key_version)
+
+    def reload_key(self) -> bool:
+        """
+            Load the user's key from the storage again, e.g. after data did not decrypt because another process
+            rotated the key (see FileStorage.rotate_key).
+
+            Unlike load_or_create_key, a missing key is never replaced with a new one.
+
+            Returns:
+                bool: True if the stored key differs from the key in use and replaced it, False otherwise.
+        """
+        with phase('io'):
+            key_version: Optional[Tuple[int, int, int]] = self.storage.key_version(self)
+            stored_key: Optional[bytes] = self.storage.load_key(self)
+        if stored_key is None or stored_key == self._stored_key:
+            return False
+
+        self.key = stored_key
+        self._key_version = key_version
+        get_key_ring().put(self.storage.key_ring_id(self), self._stored_key, self._cipher, key_version)
+        return True
+
+    @instrumented('log_action')
     def log_action(self, action: str) -> None:
         """
             Log a user action with a timestamp.
@@ -64,32 +248,102 @@ class User(UserManager):
                 action (str): The action to be logged.
         """
         # Get the current timestamp in the specified format
-        timestamp: str = datetime.datetime.now().strftime('%d-%m-%Y %H:%M:%S')
+        timestamp: str = _audit_timestamp()
 
         # Create a log entry containing timestamp, user information, and the action
-        log_entry: str = f'{timestamp} - {str(self)} - {action}\n'
+        # The user information is the same in every entry, so it is built only once per user
+        if self._audit_label is None:
+            self._audit_label = str(self)
+        log_entry: str = f'{timestamp} - {self._audit_label} - {action}\n'
+
+        # Append the log entry to the user's audit log in the storage.
+        # The append is the whole operation, it is not timed as a separate phase to keep this hot path lean
+        self.storage.append_audit(self, log_entry)
+        add_bytes('written', len(log_entry))
+
+    @instrumented('get_audit_history')
+    def get_audit_history(self) -> Iterator[str]:
+        """
+            Retrieve the audit history of user actions, streamed across the rotated segments and the active file.
+
+            Yields:
+                str: Each entry with its trailing newline, oldest first, or a message if no history is found.
+        """
+        entries: Iterator[str] = self.iter_audit_history()
+        first_entry: Optional[str] = next(entries, None)
+        if first_entry is None:
+            # If there is no audit log, return a message indicating no audit history
+            yield 'No audit history.\n'
+            return
+
+        print()  # Adding an empty line for better visual separation in the output
+        yield first_entry
+        yield from entries
+
+    @instrumented('iter_audit_history')
+    def iter_audit_history(self) -> Iterator[str]:
+        """
+            Iterate over the whole audit history, rotated segments included, one entry at a time.
+
+            The history is never held in memory as a whole.
+
+            Yields:
+                str: Each entry with its trailing newline, oldest first.
+        """
+        for entry in self.storage.iter_audit(self):
+            add_bytes('read', len(entry))
+            yield entry
+
+    @instrumented('tail_audit_history')
+    def tail_audit_history(self, count: int) -> List[str]:
+        """
+            Retrieve the most recent audit log entries.
+
+            The storage reads only the end of the audit log, so the cost does not depend on its size.
 
-        # Open the audit file in append mode and write the log entry
-        with open(self.audit_file, 'a') as audit_file:
-            audit_file.write(log_entry)
+            Args:
+                count (int): Number of entries to return.
 
-    def get_audit_history(self) -> str:
+            Returns:
+                List[str]: Up to count entries, oldest first.
         """
-            Retrieve the audit history of user actions.
+        return self.storage.tail_audit(self, count)
+
+    @instrumented('get_audit_page')
+    def get_audit_page(self, page: int, page_size: int = 100) -> List[str]:
+        """
+            Retrieve one page of the audit history.
+
+            Args:
+                page (int): Zero-based page number, page 0 holds the oldest entries.
+                page_size (int): Number of entries per page.
 
             Returns:
-                str: A string containing the audit history or a message if no history is found.
+                List[str]: The entries of the page, an empty list past the last page.
+
+            Raises:
+                ValueError: If the page number is negative or the page size is not positive.
         """
-        try:
-            # Attempt to open the audit file for reading
-            with open(self.audit_file, 'r') as audit_file:
-                print()  # Adding an empty line for better visual separation in the output
-                return audit_file.read()  # Read and return the contents of the audit file
+        return self.storage.audit_page(self, page, page_size)
+
+    @instrumented('get_audit_range')
+    def get_audit_range(self, since: Optional[datetime.datetime] = None,
+                        until: Optional[datetime.datetime] = None) -> Iterator[str]:
+        """
+            Retrieve the audit log entries of a time range.
+
+            Only the part of the audit log around the range is read, located through a timestamp index.
+
+            Args:
+                since (Optional[datetime.datetime]): Earliest time to include, from the start of the log if None.
+                until (Optional[datetime.datetime]): Latest time to include, to the end of the log if None.
 
-        except FileNotFoundError:
-            # If the audit file is not found, return a message indicating no audit history
-            return 'No audit history.\n'
+            Returns:
+                Iterator[str]: The matching entries, oldest first.
+        """
+        return self.storage.audit_range(self, since, until)
 
+    @instrumented('encrypt_data')
     def encrypt_data(self, data: str) -> bytes:
         """
             Encrypt user data using the user's key.
@@ -100,15 +354,13 @@ class User(UserManager):
             Returns:
                 bytes: The encrypted data.
         """
-        # Create a Fernet cipher object using the user's key
-        cipher: Fernet = Fernet(self.key)
-
-        # Encrypt the input data by encoding it and then encrypting with the cipher
-        encrypted_data: bytes = cipher.encrypt(data.encode())
+        # Encrypt the input data by encoding it and then encrypting with the cached cipher
+        encrypted_data: bytes = self.cipher.encrypt(data.encode())
 
         # Return the resulting encrypted data
         return encrypted_data
 
+    @instrumented('decrypt_data')
     def decrypt_data(self, encrypted_data: str) -> str:  # TODO: ЗРОБИТИ ЩОБ КОРИСТУВАЧ ВВОДИВ СВІЙ КЛЮЧ
         """
             Decrypt user data using the user's key.
@@ -118,15 +370,68 @@ class User(UserManager):
 
             Returns:
                 str: The decrypted data or a message if no decryption key is found."""
-        try:
-            # Create a Fernet cipher object using the user's key
-            cipher: Fernet = Fernet(self.key)
+        # Decrypt the encrypted data with the cached cipher, decode it to a string, and return the result
+        decrypted_data: Optional[List[str]] = self._decrypt_all([encrypted_data])
+        if decrypted_data is not None:
+            return decrypted_data[0]
 
-            # Decrypt the encrypted data, decode it to a string, and return the result
-            decrypted_data: str = cipher.decrypt(encrypted_data).decode()
-            return decrypted_data
+    @instrumented('encrypt_many')
+    def encrypt_many(self, data: Iterable[str]) -> List[bytes]:
+        """
+            Encrypt several pieces of user data with one cipher.
 
-        # If a ValueError occurs (e.g., due to a missing or invalid key),
-        # print a message and return an empty string or handle the exception accordingly
-        except ValueError:
-            print(f'No decryption key found in the file {self.key_file}\n')
+            Args:
+                data (Iterable[str]): The data items to be encrypted.
+
+            Returns:
+                List[bytes]: The encrypted data, in the same order as the input.
+        """
+        # Bind the cipher method once, so the loop does no attribute lookups per item
+        encrypt = self.cipher.encrypt
+        return [encrypt(item.encode()) for item in data]
+
+    @instrumented('decrypt_many')
+    def decrypt_many(self, encrypted_data: Iterable[str]) -> List[str]:
+        """
+            Decrypt several pieces of user data with one cipher.
+
+            Args:
+                encrypted_data (Iterable[str]): The encrypted data items to be decrypted.
+
+            Returns:
+                List[str]: The decrypted data, in the same order as the input,
+                or an empty list if no decryption key is found.
+        """
+        # Same handling as decrypt_data for a missing or invalid key
+        decrypted_data: Optional[List[str]] = self._decrypt_all(list(encrypted_data))
+        return decrypted_data if decrypted_data is not None else []
+
+    def _decrypt_all(self, encrypted_data: List[str]) -> Optional[List[str]]:
+        """
+            Decrypt data with the user's cipher, loading the key again once if the data does not match it.
+
+            Args:
+                encrypted_data (List[str]): The encrypted data items to be decrypted.
+
+            Returns:
+                Optional[List[str]]: The decrypted data, in the same order as the input, or None after printing
+                a message if the key is missing or invalid or does not decrypt the data.
+        """
+        from cryptography.fernet import InvalidToken
+
+        for attempt in range(2):
+            try:
+                # Bind the cipher method once, so the loop does no attribute lookups per item
+                decrypt = self.cipher.decrypt
+                return [decrypt(item).decode() for item in encrypted_data]
+
+            # The data may have been encrypted with a key that another process rotated in after this key was loaded
+            except InvalidToken:
+                if attempt or not self.reload_key():
+                    print(f'The data cannot be decrypted with the key in the file {self.key_file}\n')
+                    return None
+
+            # If a ValueError occurs (e.g., due to a missing or invalid key), print a message
+            except ValueError:
+                print(f'No decryption key found in the file {self.key_file}\n')
+                return None
@@ -1,5 +1,6 @@
-import json
-from typing import Dict
+from typing import MutableMapping, Optional
+from Metrics import instrumented, phase
+from Storage import StorageBackend, get_default_storage
 
 
 class UserManager:
@@ -8,20 +9,27 @@ class UserManager:
 
         This class provides functionality for loading, saving, creating, and retrieving user data.
 
+        The users are kept by a storage backend (see Storage.StorageBackend). By default this is the
+        flat-file storage, where users_file is a JSON snapshot with an append-only journal of creations
+        next to it; SQLiteStorage keeps them in a database table instead.
+
         Attributes:
         - users_file (str): File path for user data in JSON format.
+        - storage (StorageBackend): The storage holding the registry, keys, vaults and audit logs.
+        - users (MutableMapping[str, str]): User IDs mapped to user names, loaded from the storage on first use.
 
         Methods:
-            - __init__(users_file='users.json') -> None
-                Initializes the UserManager instance with the specified or default user data file.
-                Calls the load_users method to load or create the user data file.
+            - __init__(users_file='users.json', storage=None) -> None
+                Initializes the UserManager instance with the specified or default user data file,
+                or with the given storage backend.
+                The registry is not read until users is first used.
 
             - load_users() -> None
                 Load or create the user data file.
-                Tries to load user data from the file; creates a new file if not found.
+                Tries to load user data from the storage; creates a new file if not found.
 
             - save_users() -> None
-                Save user data to the file.
+                Save user data to the storage.
 
             - create_user(user_id: str, user_name: str) -> bool
                 Create a new user and save it.
@@ -38,41 +46,63 @@ class UserManager:
 
     """
 
-    def __init__(self, users_file='users.json'):
+    def __init__(self, users_file='users.json', storage: Optional[StorageBackend] = None):
         self.users_file: str = users_file  # users_file: str - file path for user data in JSON format
-        self.load_users()  # Load or create user data file
 
+        # storage: StorageBackend - where users, keys, vaults and audit logs are kept;
+        # the process default unless a storage or a non-default users_file is given
+        if storage is None:
+            if users_file == 'users.json':
+                storage = get_default_storage()
+            else:
+                from FileStorage import FileStorage
+                storage = FileStorage(users_file)
+        self.storage: StorageBackend = storage
+
+        # The registry, loaded by load_users on first use so that creating a user object does no file I/O
+        self._users: Optional[MutableMapping[str, str]] = None
+
+    @property
+    def users(self) -> MutableMapping[str, str]:
+        """
+        The user registry, loaded from the storage on first access.
+
+        Returns:
+            MutableMapping[str, str]: User IDs mapped to user names.
+        """
+        if self._users is None:
+            self.load_users()
+        return self._users
+
+    @users.setter
+    def users(self, value: MutableMapping[str, str]) -> None:
+        """
+        Replace the user registry held by this object.
+
+        Args:
+            value (MutableMapping[str, str]): User IDs mapped to user names.
+        """
+        self._users = value
+
+    @instrumented('load_users')
     def load_users(self) -> None:
         """
         Load or create user data file.
 
-        Tries to load user data from the file, creates a new file if not found.
+        Asks the storage backend for the registry; the file storage creates a new file if not found.
         """
-        try:
-            # Attempt to open the specified file for reading
-            with open(self.users_file, 'r', encoding='utf-8') as file:
-                # Load user data from the file
-                self.users: Dict[str, str] = json.load(file)
-
-        except FileNotFoundError:
-            # Print a message indicating that the specified file does not exist
-            # and inform that a new file is being created with the given filename
-            print(f"File '{self.users_file}' does not exist. Creating a new file.")
-
-            # If the file is not found, create a new file and initialize an empty user dictionary
-            with open(self.users_file, 'w', encoding='utf-8') as new_file:
-                # Initialize an empty user dictionary and save it to the new file
-                json.dump({}, new_file)
-            self.users: Dict[str, str] = {}
+        with phase('io'):
+            self.users: MutableMapping[str, str] = self.storage.load_users()
 
+    @instrumented('save_users')
     def save_users(self) -> None:
         """
-        Save user data to the file.
+        Save user data to the storage.
         """
-        # Open the file for writing and save the user data in JSON format
-        with open(self.users_file, 'w', encoding='utf-8') as file:
-            json.dump(self.users, file)
+        with phase('io'):
+            self.storage.save_users(self.users)
 
+    @instrumented('create_user')
     def create_user(self, user_id: str, user_name: str) -> bool:
         """
         Create a new user and save it.
@@ -84,12 +114,8 @@ class UserManager:
         Returns:
             bool: True if the user was created and saved successfully, False otherwise.
         """
-        # Check if the user ID already exists
-        if user_id not in self.users:
-
-            # If not, add the user to the dictionary, save the updated data
-            self.users[user_id]: str = user_name
-            self.save_users()  # Save the updated user data to the file
+        # Add the user unless the user ID already exists; the storage checks and adds in one step
+        if self.storage.add_user(user_id, user_name):
 
             # print a success message; then, return True
             print(f'User "{user_name}" with ID {user_id} has been created and saved.\n')
@@ -100,6 +126,7 @@ class UserManager:
             print(f'User with ID {user_id} already exists.\n')
             return False
 
+    @instrumented('get_user_name')
     def get_user_name(self, user_id: str) -> bool:
         """
                 Get the username associated with the provided user ID.
@@ -0,0 +1,461 @@
+import base64
+import json
+import os
+import struct
+from typing import Dict, IO, Iterator, List, Optional, Tuple
+
+# Version byte that starts a compact record plaintext; a JSON record plaintext always starts with '{'
+COMPACT_RECORD_VERSION: int = 2
+
+# Fixed layout of a compact record plaintext: version, flags, then the UTF-8 lengths of website, login and password,
+# followed by the three fields themselves
+_COMPACT_RECORD_HEADER: struct.Struct = struct.Struct('>BBHHH')
+
+# Kinds of records: a saved credential is added next to the other records of its website, an updated one
+# replaces every older record of its website and a tombstone hides them all
+RECORD_ADD: str = 'add'
+RECORD_REPLACE: str = 'replace'
+RECORD_DELETE: str = 'delete'
+
+# Flag bits of a compact record marking it as a tombstone or as replacing the older records of its website
+_DELETED_FLAG: int = 0x01
+_REPLACES_FLAG: int = 0x02
+
+# Length prefix of a record in a binary vault file
+_RECORD_LENGTH: struct.Struct = struct.Struct('>I')
+
+
+def encode_record(record: Dict[str, object]) -> bytes:
+    """
+        Encode a credential record into the compact plaintext that gets encrypted.
+
+        Args:
+            record (Dict[str, object]): A record with 'website', 'login' and 'password' keys, plus a true 'replaces'
+                key if it replaces the older records of its website; or a tombstone with 'website' and 'deleted' keys.
+
+        Returns:
+            bytes: The compact plaintext.
+
+        Raises:
+            ValueError: If a field is longer than 65535 bytes once encoded.
+    """
+    deleted: bool = bool(record.get('deleted'))
+    flags: int = _DELETED_FLAG if deleted else _REPLACES_FLAG if record.get('replaces') else 0
+    website: bytes = record['website'].encode('utf-8')
+    login: bytes = b'' if deleted else record['login'].encode('utf-8')
+    password: bytes = b'' if deleted else record['password'].encode('utf-8')
+
+    if max(len(website), len(login), len(password)) > 0xFFFF:
+        raise ValueError('A credential field is longer than 65535 bytes')
+
+    return _COMPACT_RECORD_HEADER.pack(COMPACT_RECORD_VERSION, flags, len(website), len(login),
+                                       len(password)) + website + login + password
+
+
+def decode_record(plaintext: bytes) -> Dict[str, object]:
+    """
+        Decode a decrypted record plaintext, compact or JSON.
+
+        The kind of the record is left out, see peek_record.
+
+        Args:
+            plaintext (bytes): The decrypted record.
+
+        Returns:
+            Dict[str, object]: The record with 'website', 'login' and 'password' keys,
+                or a tombstone with 'website' and 'deleted' keys.
+    """
+    # Records written before the compact format are JSON objects
+    if plaintext[:1] == b'{':
+        return json.loads(plaintext)
+
+    version, flags, website_length, login_length, password_length = _COMPACT_RECORD_HEADER.unpack_from(plaintext)
+    if version != COMPACT_RECORD_VERSION:
+        raise ValueError(f'Unknown record format version {version}')
+
+    login_start: int = _COMPACT_RECORD_HEADER.size + website_length
+    password_start: int = login_start + login_length
+    website: str = plaintext[_COMPACT_RECORD_HEADER.size:login_start].decode('utf-8')
+    if flags & _DELETED_FLAG:
+        return {'website': website, 'deleted': True}
+    return {'website': website,
+            'login': plaintext[login_start:password_start].decode('utf-8'),
+            'password': plaintext[password_start:password_start + password_length].decode('utf-8')}
+
+
+def peek_record(plaintext: bytes) -> Tuple[str, str]:
+    """
+        Read only the website and the kind of a decrypted record plaintext.
+
+        Args:
+            plaintext (bytes): The decrypted record, compact or JSON.
+
+        Returns:
+            Tuple[str, str]: The website and the kind of the record, RECORD_ADD, RECORD_REPLACE or RECORD_DELETE.
+    """
+    if plaintext[:1] == b'{':
+        record: Dict[str, object] = json.loads(plaintext)
+        return record['website'], record_kind(record)
+
+    _, flags, website_length, _, _ = _COMPACT_RECORD_HEADER.unpack_from(plaintext)
+    website: bytes = plaintext[_COMPACT_RECORD_HEADER.size:_COMPACT_RECORD_HEADER.size + website_length]
+    kind: str = RECORD_DELETE if flags & _DELETED_FLAG else RECORD_REPLACE if flags & _REPLACES_FLAG else RECORD_ADD
+    return website.decode('utf-8'), kind
+
+
+def record_kind(record: Dict[str, object]) -> str:
+    """
+        Tell the kind of a record given as a dictionary, as accepted by encode_record.
+
+        Args:
+            record (Dict[str, object]): The record.
+
+        Returns:
+            str: RECORD_ADD, RECORD_REPLACE or RECORD_DELETE.
+    """
+    return RECORD_DELETE if record.get('deleted') else RECORD_REPLACE if record.get('replaces') else RECORD_ADD
+
+
+def compact_record(plaintext: bytes) -> bytes:
+    """
+        Return a decrypted record plaintext in the compact encoding, converting a JSON record and keeping its kind.
+
+        Args:
+            plaintext (bytes): The decrypted record, compact or JSON.
+
+        Returns:
+            bytes: The compact plaintext.
+
+        Raises:
+            ValueError: If a field is longer than 65535 bytes once encoded.
+    """
+    if plaintext[:1] == b'{':
+        return encode_record(json.loads(plaintext))
+    return plaintext
+
+
+class TextVaultFormat:
+    """
+        The original vault file layout: one base64 Fernet token per line, no header.
+
+        Attributes:
+            - version (int): Format version.
+            - header (bytes): Bytes that start every file of this format.
+    """
+    version: int = 1
+    header: bytes = b''
+
+    @staticmethod
+    def frame(token: bytes) -> bytes:
+        """
+            Turn a Fernet token into the bytes stored in the vault file.
+
+            Args:
+                token (bytes): The base64 Fernet token.
+
+            Returns:
+                bytes: The stored record.
+        """
+        return token + b'\n'
+
+    @staticmethod
+    def unframe(record: bytes) -> bytes:
+        """
+            Turn a stored record back into a Fernet token.
+
+            Args:
+                record (bytes): The stored record.
+
+            Returns:
+                bytes: The base64 Fernet token.
+        """
+        return record.strip()
+
+    @staticmethod
+    def records_in(plaintext: bytes) -> List[bytes]:
+        """
+            Split the plaintext of one decrypted token into record plaintexts.
+
+            Args:
+                plaintext (bytes): The decrypted token.
+
+            Returns:
+                List[bytes]: The record plaintexts; every token of this format holds exactly one.
+        """
+        return [plaintext]
+
+    @staticmethod
+    def iter_records(data_file: IO[bytes], start: int) -> Iterator[Tuple[int, int, bytes]]:
+        """
+            Read the complete records of a vault file from a byte offset.
+
+            Args:
+                data_file (IO[bytes]): The vault file, opened for binary reading.
+                start (int): Offset where reading starts, always the start of a record.
+
+            Yields:
+                Tuple[int, int, bytes]: (offset, stored size, Fernet token) of each record, in file order.
+        """
+        data_file.seek(start)
+        offset: int = start
+        for line in data_file:
+            # Stop at a record that is still being written
+            if not line.endswith(b'\n'):
+                return
+            token: bytes = line.strip()
+
+            # Skip empty lines
+            if token:
+                yield offset, len(line), token
+            offset += len(line)
+
+    @staticmethod
+    def chunk_tokens(chunk: bytes) -> List[bytes]:
+        """
+            Split a record-aligned chunk of a vault file into Fernet tokens.
+
+            Args:
+                chunk (bytes): The chunk.
+
+            Returns:
+                List[bytes]: The tokens, in file order.
+        """
+        return [line for line in chunk.split() if line]
+
+    @staticmethod
+    def split_chunks(data_file: IO[bytes], chunk_size: int) -> List[Tuple[int, int]]:
+        """
+            Split a vault file into byte ranges of about chunk_size bytes that start and end on record boundaries.
+
+            Args:
+                data_file (IO[bytes]): The vault file, opened for binary reading.
+                chunk_size (int): Target size of a chunk in bytes.
+
+            Returns:
+                List[Tuple[int, int]]: (start, end) offsets of each chunk, covering every record in order.
+        """
+        file_size: int = os.fstat(data_file.fileno()).st_size
+        chunks: List[Tuple[int, int]] = []
+        start: int = 0
+        while start < file_size:
+            # Jump ahead by the chunk size and extend the chunk to the end of the line found there
+            data_file.seek(min(start + chunk_size, file_size))
+            data_file.readline()
+            end: int = min(data_file.tell(), file_size)
+            chunks.append((start, end))
+            start = end
+        return chunks
+
+
+class BinaryVaultFormat:
+    """
+        The compact vault file layout: a header, then records framed by a 4-byte big-endian length
+        and holding the raw, not base64-encoded, Fernet token.
+
+        Attributes:
+            - version (int): Format version.
+            - header (bytes): Bytes that start every file of this format.
+    """
+    version: int = 2
+    header: bytes = b'\x00PSMV\x02'
+
+    @staticmethod
+    def frame(token: bytes) -> bytes:
+        """
+            Turn a Fernet token into the bytes stored in the vault file.
+
+            Args:
+                token (bytes): The base64 Fernet token.
+
+            Returns:
+                bytes: The stored record.
+        """
+        raw_token: bytes = base64.urlsafe_b64decode(token)
+        return _RECORD_LENGTH.pack(len(raw_token)) + raw_token
+
+    @staticmethod
+    def unframe(record: bytes) -> bytes:
+        """
+            Turn a stored record back into a Fernet token.
+
+            Args:
+                record (bytes): The stored record.
+
+            Returns:
+                bytes: The base64 Fernet token.
+        """
+        return base64.urlsafe_b64encode(record[_RECORD_LENGTH.size:])
+
+    @staticmethod
+    def records_in(plaintext: bytes) -> List[bytes]:
+        """
+            Split the plaintext of one decrypted token into record plaintexts.
+
+            Args:
+                plaintext (bytes): The decrypted token.
+
+            Returns:
+                List[bytes]: The record plaintexts; every token of this format holds exactly one.
+        """
+        return [plaintext]
+
+    @classmethod
+    def iter_records(cls, data_file: IO[bytes], start: int) -> Iterator[Tuple[int, int, bytes]]:
+        """
+            Read the complete records of a vault file from a byte offset.
+
+            Args:
+                data_file (IO[bytes]): The vault file, opened for binary reading.
+                start (int): Offset where reading starts, always the start of a record or of the file.
+
+            Yields:
+                Tuple[int, int, bytes]: (offset, stored size, Fernet token) of each record, in file order.
+        """
+        offset: int = max(start, len(cls.header))
+        data_file.seek(offset)
+        while True:
+            prefix: bytes = data_file.read(_RECORD_LENGTH.size)
+            if len(prefix) < _RECORD_LENGTH.size:
+                return
+            length: int = _RECORD_LENGTH.unpack(prefix)[0]
+            raw_token: bytes = data_file.read(length)
+
+            # Stop at a record that is still being written
+            if len(raw_token) < length:
+                return
+            yield offset, _RECORD_LENGTH.size + len(raw_token), base64.urlsafe_b64encode(raw_token)
+            offset += _RECORD_LENGTH.size + len(raw_token)
+
+    @staticmethod
+    def chunk_tokens(chunk: bytes) -> List[bytes]:
+        """
+            Split a record-aligned chunk of a vault file into Fernet tokens.
+
+            Args:
+                chunk (bytes): The chunk, not including the file header.
+
+            Returns:
+                List[bytes]: The tokens, in file order.
+        """
+        tokens: List[bytes] = []
+        position: int = 0
+        while position < len(chunk):
+            length: int = _RECORD_LENGTH.unpack_from(chunk, position)[0]
+            position += _RECORD_LENGTH.size
+            tokens.append(base64.urlsafe_b64encode(chunk[position:position + length]))
+            position += length
+        return tokens
+
+    @classmethod
+    def split_chunks(cls, data_file: IO[bytes], chunk_size: int) -> List[Tuple[int, int]]:
+        """
+            Split a vault file into byte ranges of about chunk_size bytes that start and end on record boundaries.
+
+            The records are walked one length prefix at a time, without reading their tokens.
+
+            Args:
+                data_file (IO[bytes]): The vault file, opened for binary reading.
+                chunk_size (int): Target size of a chunk in bytes.
+
+            Returns:
+                List[Tuple[int, int]]: (start, end) offsets of each chunk, covering every record in order.
+        """
+        file_size: int = os.fstat(data_file.fileno()).st_size
+        chunks: List[Tuple[int, int]] = []
+        start: int = len(cls.header)
+        position: int = start
+        while position + _RECORD_LENGTH.size <= file_size:
+            data_file.seek(position)
+            length: int = _RECORD_LENGTH.unpack(data_file.read(_RECORD_LENGTH.size))[0]
+            record_end: int = position + _RECORD_LENGTH.size + length
+
+            # Leave out a record that is still being written
+            if record_end > file_size:
+                break
+            position = record_end
+            if position - start >= chunk_size:
+                chunks.append((start, position))
+                start = position
+        if position > start:
+            chunks.append((start, position))
+        return chunks
+
+
+class BlockVaultFormat(BinaryVaultFormat):
+    """
+        The block vault file layout: framed like the compact layout, but each token seals a whole block
+        of compact records instead of a single one.
+
+        Attributes:
+            - version (int): Format version.
+            - header (bytes): Bytes that start every file of this format.
+    """
+    version: int = 3
+    header: bytes = b'\x00PSMV\x03'
+
+    @staticmethod
+    def records_in(plaintext: bytes) -> List[bytes]:
+        """
+            Split the plaintext of one decrypted block into record plaintexts.
+
+            Args:
+                plaintext (bytes): The decrypted block, a concatenation of compact records.
+
+            Returns:
+                List[bytes]: The record plaintexts, in the order they were written.
+        """
+        records: List[bytes] = []
+        position: int = 0
+        while position < len(plaintext):
+            # The header ends with the lengths of the three fields
+            field_lengths: Tuple[int, ...] = _COMPACT_RECORD_HEADER.unpack_from(plaintext, position)[2:]
+            record_end: int = position + _COMPACT_RECORD_HEADER.size + sum(field_lengths)
+            records.append(plaintext[position:record_end])
+            position = record_end
+        return records
+
+
+# Every supported vault format by version
+VAULT_FORMATS: Dict[int, type] = {TextVaultFormat.version: TextVaultFormat,
+                                  BinaryVaultFormat.version: BinaryVaultFormat,
+                                  BlockVaultFormat.version: BlockVaultFormat}
+
+# Format of newly created vault files
+DEFAULT_VAULT_FORMAT: type = BinaryVaultFormat
+
+
+def detect_vault_format(path: str) -> Optional[type]:
+    """
+        Detect the format of a vault file from its first bytes.
+
+        Args:
+            path (str): Path of the vault file.
+
+        Returns:
+            Optional[type]: The format class, or None if the file is missing or empty.
+    """
+    try:
+        with open(path, 'rb') as data_file:
+            return detect_open_vault_format(data_file)
+    except FileNotFoundError:
+        return None
+
+
+def detect_open_vault_format(data_file: IO[bytes]) -> Optional[type]:
+    """
+        Detect the format of an open vault file from its first bytes.
+
+        Args:
+            data_file (IO[bytes]): The vault file, opened for binary reading.
+
+        Returns:
+            Optional[type]: The format class, or None if the file is empty.
+    """
+    data_file.seek(0)
+    start: bytes = data_file.read(len(BinaryVaultFormat.header))
+    if not start:
+        return None
+    for vault_format in (BinaryVaultFormat, BlockVaultFormat):
+        if start == vault_format.header:
+            return vault_format
+    return TextVaultFormat
@@ -0,0 +1,102 @@
+"""
+    Convert the users' data files from the original text-line vault format to the compact binary format.
+
+    Run it from the directory holding users.json and the per-user files:
+        python VaultMigration.py                 (every user in users.json)
+        python VaultMigration.py 12345 67890     (only the given user IDs)
+        python VaultMigration.py --measure       (also time decoding each vault before and after)
+
+    Each data file is converted in place by FileStorage.migrate_vault, streaming one record at a time;
+    files already in the compact format are left alone.
+"""
+import argparse
+import time
+from typing import List, Optional, Tuple
+from FileStorage import FileStorage
+from User import User
+from VaultFormat import TextVaultFormat, decode_record, detect_vault_format
+
+
+def measure_decode_rate(storage: FileStorage, user: User) -> Tuple[int, float]:
+    """
+        Decrypt and decode every record of a user's vault and time it.
+
+        Args:
+            storage (FileStorage): The storage holding the vault.
+            user (User): The user.
+
+        Returns:
+            Tuple[int, float]: The number of records and the records decoded per second.
+    """
+    # Bring the website index up to date first, building it is not part of decoding
+    storage.vault_stats(user)
+
+    decrypt = user.cipher.decrypt
+    record_count: int = 0
+    started: float = time.perf_counter()
+    for token in storage.iter_credential_tokens(user):
+        decode_record(decrypt(token))
+        record_count += 1
+    elapsed: float = time.perf_counter() - started
+    return record_count, record_count / elapsed if elapsed else 0.0
+
+
+def migrate_users(storage: FileStorage, user_ids: Optional[List[str]] = None, measure: bool = False) -> Tuple[int, int]:
+    """
+        Migrate the data files of several users and print a line per user.
+
+        Args:
+            storage (FileStorage): The storage holding the registry and the vaults.
+            user_ids (Optional[List[str]]): The users to migrate, every registered user if None.
+            measure (bool): Also report the decode speed of each vault before and after.
+
+        Returns:
+            Tuple[int, int]: The total data file size before and after, over the migrated users.
+    """
+    users = storage.load_users()
+    total_before: int = 0
+    total_after: int = 0
+
+    for user_id in user_ids or list(users):
+        if user_id not in users:
+            print(f'{user_id}: no such user')
+            continue
+        user: User = User(user_id, users[user_id], storage)
+        if detect_vault_format(user.users_data_file) is not TextVaultFormat:
+            print(f'{user_id}: nothing to migrate')
+            continue
+
+        rate_before: float = measure_decode_rate(storage, user)[1] if measure else 0.0
+        sizes: Optional[Tuple[int, int]] = storage.migrate_vault(user)
+        if sizes is None:
+            print(f'{user_id}: nothing to migrate')
+            continue
+
+        size_before, size_after = sizes
+        total_before += size_before
+        total_after += size_after
+        line: str = (f'{user_id}: {size_before} -> {size_after} bytes '
+                     f'({(size_before - size_after) / size_before:.0%} smaller)')
+        if measure:
+            record_count, rate_after = measure_decode_rate(storage, user)
+            line += f', decode {rate_before:.0f} -> {rate_after:.0f} records/s over {record_count} records'
+        print(line)
+
+    return total_before, total_after
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('user_ids', nargs='*', help='users to migrate, every registered user by default')
+    parser.add_argument('--users-file', default='users.json', help='the user registry')
+    parser.add_argument('--measure', action='store_true', help='time decoding each vault before and after')
+    args = parser.parse_args()
+
+    total_before, total_after = migrate_users(FileStorage(args.users_file), args.user_ids or None, args.measure)
+    if total_before:
+        print(f'total: {total_before} -> {total_after} bytes '
+              f'({(total_before - total_after) / total_before:.0%} smaller)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,541 @@
+import hashlib
+import hmac
+import os
+import threading
+from typing import TYPE_CHECKING, IO, Dict, Iterable, List, Optional, Tuple
+from FileLock import FileLock, user_lock
+from VaultFormat import (RECORD_ADD, RECORD_DELETE, RECORD_REPLACE, detect_open_vault_format, detect_vault_format,
+                         peek_record)
+
+if TYPE_CHECKING:
+    from cryptography.fernet import Fernet
+
+# First line of every index file, followed by a fingerprint of the key the index was built with
+INDEX_HEADER: str = '#psm-index v3'
+
+# One index entry: (website hash, offset, stored size, record kind)
+IndexEntry = Tuple[str, int, int, str]
+
+# Markers ending the index line of a record that is not simply added
+_KIND_MARKERS: Dict[str, str] = {RECORD_REPLACE: 'r', RECORD_DELETE: 'd'}
+_MARKER_KINDS: Dict[str, str] = {marker: kind for kind, marker in _KIND_MARKERS.items()}
+
+
+def derive_website_hash_key(key: bytes) -> bytes:
+    """
+        Derive the key used to hash website names from a user's encryption key.
+
+        The encryption key itself is never used for hashing.
+
+        Args:
+            key (bytes): The user's encryption key.
+
+        Returns:
+            bytes: The hashing key.
+    """
+    return hmac.new(key, b'psm website index', hashlib.sha256).digest()
+
+
+def website_hash(hash_key: bytes, website: str) -> str:
+    """
+        Compute the keyed hash under which a website is indexed.
+
+        Args:
+            hash_key (bytes): Key returned by derive_website_hash_key.
+            website (str): Website name.
+
+        Returns:
+            str: Hex digest of the keyed hash.
+    """
+    # hmac.digest takes the one-shot OpenSSL path, much cheaper than building an hmac object per call
+    return hmac.digest(hash_key, website.encode(), 'sha256').hex()[:32]
+
+
+class WebsiteIndex:
+    """
+        A persistent per-user index from websites to the records that hold their credentials.
+
+        Each entry maps a keyed hash (HMAC-SHA256) of a website name to the byte offset and stored size
+        (framing included) of one encrypted record in the user's data file, so plaintext site names never
+        reach the disk and a lookup decrypts only the matching record.
+
+        A website can have several live records: every saved record is added to them. A replacing record
+        (written by an update) makes every older record of its website dead, and a tombstone (written by a delete)
+        does the same and is dead itself. The index knows which records are live without decrypting anything,
+        so reads skip dead records and compaction can drop them.
+        In a block vault every record of a block is indexed under the location of the whole block.
+
+        The index file is append-only text:
+            #psm-index v3 <key fingerprint>
+            <website hash> <offset> <size>          (an added record)
+            <website hash> <offset> <size> r        (a replacing record)
+            <website hash> <offset> <size> d        (a tombstone)
+            ...
+
+        The data file size covered by the index is the end of its last entry, or the end of the data file
+        header while it has none. When the data file grew past that point, only the new records are indexed;
+        when the index is missing, was built with another key or covers more than the data file holds,
+        it is rebuilt from scratch.
+
+        Changes to the index file hold the index lock in the user's lock directory (see FileLock), so indexes
+        of the same vault in other threads and processes never write an entry twice; entries they append are
+        loaded incrementally.
+
+        Attributes:
+            - index_file (str): Path of the index file.
+            - data_file (str): Path of the user's data file.
+    """
+    def __init__(self, index_file: str, data_file: str, key: bytes, cipher: 'Fernet', lock_dir: str):
+        """
+            Initialize the WebsiteIndex instance.
+
+            Args:
+                index_file (str): Path of the index file.
+                data_file (str): Path of the user's data file.
+                key (bytes): The user's encryption key, used to derive the hashing key.
+                cipher (Fernet): The user's cipher, used to decrypt records while indexing.
+                lock_dir (str): The user's lock directory.
+        """
+        self.index_file: str = index_file
+        self.data_file: str = data_file
+        self._cipher: 'Fernet' = cipher
+
+        # Derive a separate key for hashing website names
+        self._hash_key: bytes = derive_website_hash_key(key)
+        self._fingerprint: str = hmac.new(self._hash_key, b'fingerprint', hashlib.sha256).hexdigest()[:16]
+
+        # In-memory copy of the index, loaded on first use: the (offset, size) of the live records of every website
+        # hash in file order, plus the total number of entries and of live records
+        self._entries: Optional[Dict[str, List[Tuple[int, int]]]] = None
+        self._entry_count: int = 0
+        self._live_count: int = 0
+        self._covered_size: int = 0
+
+        # Inode of the loaded index file and the offset just past the last line in memory,
+        # to load only the lines other writers append
+        self._index_inode: int = 0
+        self._index_position: int = 0
+
+        # Held while the index is refreshed or changed, so threads sharing the index never append an entry twice;
+        # the file lock does the same for other index objects and processes
+        self._lock: threading.RLock = threading.RLock()
+        self._file_lock: FileLock = user_lock(lock_dir, 'index')
+
+    @property
+    def covered_size(self) -> int:
+        """
+            The number of data file bytes covered by the in-memory index.
+
+            Returns:
+                int: The offset just past the last indexed record.
+        """
+        return self._covered_size
+
+    def website_hash(self, website: str) -> str:
+        """
+            Compute the keyed hash under which a website is stored in the index.
+
+            Args:
+                website (str): Website name.
+
+            Returns:
+                str: Hex digest of the keyed hash.
+        """
+        return website_hash(self._hash_key, website)
+
+    def lookup(self, website: str) -> List[Tuple[int, int]]:
+        """
+            Find the live records of a website.
+
+            Brings the index up to date with the data file first.
+
+            Args:
+                website (str): Website name.
+
+            Returns:
+                List[Tuple[int, int]]: (offset, size) of each record in file order, empty if the website has none.
+                Records of a block vault that share a block share its location.
+        """
+        with self._lock:
+            self.refresh()
+            return list(self._entries.get(self.website_hash(website), ()))
+
+    def live_entries(self) -> List[Tuple[str, int, int]]:
+        """
+            List the live records of the data file.
+
+            Returns:
+                List[Tuple[str, int, int]]: (website hash, offset, size) of every live record, in file order.
+        """
+        with self._lock:
+            self.refresh()
+            return sorted(((digest, offset, length) for digest, locations in self._entries.items()
+                           for offset, length in locations), key=lambda entry: entry[1])
+
+    def counts(self) -> Tuple[int, int]:
+        """
+            Count the live and dead records of the data file.
+
+            Tombstones count as dead records, they only exist to hide older ones.
+
+            Returns:
+                Tuple[int, int]: (live records, dead records).
+        """
+        with self._lock:
+            self.refresh()
+            return self._live_count, self._entry_count - self._live_count
+
+    def cached_counts(self) -> Optional[Tuple[int, int]]:
+        """
+            Count the live and dead records known to the in-memory index, without reading any file.
+
+            Records this process appends are counted as they are written; records other processes appended
+            since the last refresh are not counted yet.
+
+            Returns:
+                Optional[Tuple[int, int]]: (live records, dead records), or None if the index is not loaded.
+        """
+        # Two plain reads, not worth waiting for a refresh running in another thread
+        if self._entries is None:
+            return None
+        return self._live_count, self._entry_count - self._live_count
+
+    def live_record_count(self, digest: str) -> int:
+        """
+            Count the live records of a website hash, without bringing the index up to date.
+
+            Args:
+                digest (str): The website hash.
+
+            Returns:
+                int: The number of live records indexed under the hash.
+        """
+        return len(self._entries.get(digest, ())) if self._entries is not None else 0
+
+    def refresh(self) -> None:
+        """
+            Bring the index up to date with the data file.
+
+            Loads the index file if needed, indexes records appended since it was last updated
+            and rebuilds it when it is missing or stale. The index file lock is only taken when there is
+            something to change.
+        """
+        with self._lock:
+            try:
+                data_size: int = os.path.getsize(self.data_file)
+            except FileNotFoundError:
+                data_size = 0
+
+            # Nothing to do while the index covers the whole data file and no other writer has changed the index file
+            if self._entries is not None and self._covered_size == data_size and \
+                    self._read_covered_size() == self._covered_size:
+                return
+
+            with self._file_lock:
+                self._refresh_locked(data_size)
+
+    def _refresh_locked(self, data_size: int) -> None:
+        """
+            Bring the index up to date with the data file, holding the index file lock.
+
+            Args:
+                data_size (int): Size of the data file.
+        """
+        # (Re)load the index file when it is not in memory yet or another writer has extended or replaced it;
+        # lines appended by other writers are loaded on their own unless the index file was replaced
+        if self._entries is None or self._read_covered_size() != self._covered_size:
+            if not (self._entries is not None and self._load_appended()) and not self._load():
+                self.rebuild()
+                return
+
+        if self._covered_size > data_size:
+            # The data file was replaced or truncated, the offsets no longer apply
+            self.rebuild()
+
+        elif self._covered_size < data_size:
+            # Index only the records appended since the last update
+            self._append_entries(self.scan(self._covered_size))
+
+    def rebuild(self) -> None:
+        """
+            Rebuild the index from scratch by scanning the whole data file.
+
+            The new index is written to a temporary file and swapped in atomically.
+        """
+        self.replace(self.scan(0))
+
+    def replace(self, entries: List[IndexEntry]) -> None:
+        """
+            Replace the whole index, e.g. after the data file was compacted.
+
+            The new index is written to a temporary file and swapped in atomically.
+
+            Args:
+                entries (List[IndexEntry]): Every entry of the new index, in file order.
+        """
+        with self._lock, self._file_lock:
+            self._write_index_file(entries)
+            self._entries = {}
+            self._entry_count = 0
+            self._live_count = 0
+            self._covered_size = self._data_start()
+            self._remember(entries)
+
+    def record_appended(self, records: Iterable[Tuple[str, int, int]], kind: str = RECORD_ADD) -> None:
+        """
+            Add records that were just appended to the data file.
+
+            Args:
+                records (Iterable[Tuple[str, int, int]]): (website, offset, size) of each new record, in file order.
+                kind (str): The kind of the records, RECORD_ADD, RECORD_REPLACE or RECORD_DELETE.
+        """
+        self.entries_appended([(self.website_hash(website), offset, size, kind)
+                               for website, offset, size in records])
+
+    def entries_appended(self, entries: List[IndexEntry]) -> None:
+        """
+            Add the entries of records that were just appended to the data file.
+
+            The entries are only appended when the index file exists and already covers the data file
+            up to the first new record; otherwise the index is left alone and the next refresh picks
+            the records up from the data file. This keeps every save O(1) in the size of the index.
+
+            Args:
+                entries (List[IndexEntry]): The entries, in file order.
+        """
+        with self._lock, self._file_lock:
+            if not entries:
+                return
+
+            # While the in-memory index covers the data file up to the new records and the index file is still
+            # the one it was read from, one stat call is enough to tell that the entries can be appended
+            if self._entries is not None and self._covered_size == entries[0][1] and self._index_file_unchanged():
+                self._append_entries(entries)
+                return
+
+            covered_size: Optional[int] = self._read_covered_size()
+            if covered_size is None and entries[0][1] == self._data_start() and not os.path.exists(self.index_file):
+                # The records start a new data file, so the index can be started right away without a scan,
+                # and kept in memory from the start
+                self._write_index_file([])
+                covered_size = entries[0][1]
+                self._entries = {}
+                self._entry_count = 0
+                self._live_count = 0
+                self._covered_size = covered_size
+            if covered_size is None or covered_size != entries[0][1]:
+                return
+
+            self._append_entries(entries)
+
+    def scan(self, start: int) -> List[IndexEntry]:
+        """
+            Decrypt the data file from a byte offset and collect index entries for its records.
+
+            Args:
+                start (int): Offset where the scan starts, always the start of a record.
+
+            Returns:
+                List[IndexEntry]: The entries of every complete record found, in file order.
+        """
+        entries: List[IndexEntry] = []
+        decrypt = self._cipher.decrypt
+
+        try:
+            with open(self.data_file, 'rb') as data_file:
+                vault_format: Optional[type] = detect_open_vault_format(data_file)
+                if vault_format is None:
+                    return entries
+                for offset, size, token in vault_format.iter_records(data_file, start):
+                    # A token holds one record, or a whole block of them that all share the block's location
+                    for plaintext in vault_format.records_in(decrypt(token)):
+                        website, kind = peek_record(plaintext)
+                        entries.append((self.website_hash(website), offset, size, kind))
+
+        except FileNotFoundError:
+            pass
+
+        return entries
+
+    def _load(self) -> bool:
+        """
+            Load the index file into memory.
+
+            Returns:
+                bool: True if a usable index was loaded, False if it is missing or was built with another key.
+        """
+        try:
+            with open(self.index_file, 'rb') as index_file:
+                if index_file.readline().decode().strip() != f'{INDEX_HEADER} {self._fingerprint}':
+                    return False
+
+                self._entries = {}
+                self._entry_count = 0
+                self._live_count = 0
+                self._covered_size = self._data_start()
+                self._index_inode = os.fstat(index_file.fileno()).st_ino
+                self._index_position = index_file.tell()
+                self._read_lines(index_file)
+                return True
+
+        except FileNotFoundError:
+            return False
+
+    def _load_appended(self) -> bool:
+        """
+            Load the lines other writers appended to the index file since it was loaded.
+
+            Returns:
+                bool: True if the lines were loaded, False if the index file was replaced or is missing.
+        """
+        try:
+            with open(self.index_file, 'rb') as index_file:
+                stat_result: os.stat_result = os.fstat(index_file.fileno())
+                if stat_result.st_ino != self._index_inode or stat_result.st_size < self._index_position:
+                    return False
+                index_file.seek(self._index_position)
+                self._read_lines(index_file)
+                return True
+
+        except FileNotFoundError:
+            return False
+
+    def _read_lines(self, index_file: IO[bytes]) -> None:
+        """
+            Read the index lines from the current position of the index file into memory.
+
+            Args:
+                index_file (IO[bytes]): The index file, positioned at the start of a line.
+        """
+        index_data: bytes = index_file.read()
+
+        # Ignore a torn last line left by an interrupted write, it is read again once complete
+        index_data = index_data[:index_data.rfind(b'\n') + 1]
+        self._index_position += len(index_data)
+
+        entries: List[IndexEntry] = []
+        for line in index_data.decode().splitlines():
+            fields: List[str] = line.split()
+            entries.append((fields[0], int(fields[1]), int(fields[2]),
+                            _MARKER_KINDS[fields[3]] if len(fields) > 3 else RECORD_ADD))
+        self._remember(entries)
+
+    def _index_file_unchanged(self) -> bool:
+        """
+            Check that the index file is the one in memory and that no other writer has appended to it since.
+
+            Returns:
+                bool: True if the file has the inode and the size the in-memory index was read or written at.
+        """
+        try:
+            stat_result: os.stat_result = os.stat(self.index_file)
+        except FileNotFoundError:
+            return False
+        return stat_result.st_ino == self._index_inode and stat_result.st_size == self._index_position
+
+    def _read_covered_size(self) -> Optional[int]:
+        """
+            Read the data file size covered by the index file from its last entry, without loading the whole index.
+
+            Returns:
+                Optional[int]: The covered size, or None if the index file is missing or was built with another key.
+        """
+        try:
+            with open(self.index_file, 'rb') as index_file:
+                if index_file.readline().decode().strip() != f'{INDEX_HEADER} {self._fingerprint}':
+                    return None
+                header_end: int = index_file.tell()
+
+                # The last entry is short, reading the final few hundred bytes is enough to find it
+                index_file.seek(0, os.SEEK_END)
+                index_file.seek(max(header_end, index_file.tell() - 256))
+                tail_data: bytes = index_file.read()
+
+        except FileNotFoundError:
+            return None
+
+        # Ignore a torn last line, another writer is still appending it
+        tail: List[bytes] = tail_data[:tail_data.rfind(b'\n') + 1].splitlines()
+
+        if not tail:
+            return self._data_start()
+        fields: List[bytes] = tail[-1].split()
+        return int(fields[1]) + int(fields[2])
+
+    def _write_index_file(self, entries: List[IndexEntry]) -> None:
+        """
+            Write a new index file holding the header and the given entries, replacing any old one atomically.
+
+            Args:
+                entries (List[IndexEntry]): The entries, in file order.
+        """
+        temp_file: str = f'{self.index_file}.tmp'
+        with open(temp_file, 'wb') as index_file:
+            index_file.write(f'{INDEX_HEADER} {self._fingerprint}\n'.encode())
+            index_file.write(''.join(self._format(entry) for entry in entries).encode())
+            self._index_inode = os.fstat(index_file.fileno()).st_ino
+            self._index_position = index_file.tell()
+        os.replace(temp_file, self.index_file)
+
+    def _append_entries(self, entries: List[IndexEntry]) -> None:
+        """
+            Append entries to the index file and to the in-memory copy, if it is loaded.
+
+            Args:
+                entries (List[IndexEntry]): The entries, in file order.
+        """
+        if not entries:
+            return
+        with open(self.index_file, 'ab') as index_file:
+            # Another index of the vault appended to the file since it was read, load its lines first
+            if self._entries is not None and index_file.tell() != self._index_position and not self._load_appended():
+                self._entries = None
+
+            index_file.write(''.join(self._format(entry) for entry in entries).encode())
+            self._index_position = index_file.tell()
+        if self._entries is not None:
+            self._remember(entries)
+
+    def _remember(self, entries: List[IndexEntry]) -> None:
+        """
+            Add entries to the in-memory copy of the index: an added record joins the live records of its website,
+            a replacing record or a tombstone first makes them all dead.
+
+            Args:
+                entries (List[IndexEntry]): The entries, in file order.
+        """
+        for digest, offset, length, kind in entries:
+            # Keep the number of live records current
+            if kind != RECORD_ADD:
+                self._live_count -= len(self._entries.pop(digest, ()))
+            if kind != RECORD_DELETE:
+                self._entries.setdefault(digest, []).append((offset, length))
+                self._live_count += 1
+            self._covered_size = max(self._covered_size, offset + length)
+        self._entry_count += len(entries)
+
+    def _data_start(self) -> int:
+        """
+            Find where the records of the data file start, just past its header.
+
+            Returns:
+                int: The offset of the first record.
+        """
+        vault_format: Optional[type] = detect_vault_format(self.data_file)
+        return len(vault_format.header) if vault_format is not None else 0
+
+    @staticmethod
+    def _format(entry: IndexEntry) -> str:
+        """
+            Format one entry as a line of the index file.
+
+            Args:
+                entry (IndexEntry): The entry.
+
+            Returns:
+                str: The line, with its trailing newline.
+        """
+        digest, offset, length, kind = entry
+        if kind == RECORD_ADD:
+            return f'{digest} {offset} {length}\n'
+        return f'{digest} {offset} {length} {_KIND_MARKERS[kind]}\n'
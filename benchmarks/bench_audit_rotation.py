@@ -0,0 +1,81 @@
+"""
+    Benchmark of audit log rotation and compression.
+
+    Logs --entries audit entries for one user with and without a rotation policy rotating every --segment-bytes,
+    then reads the whole history back and measures:
+        - log_action, no rotation / rotated: the cost per logged entry, flushes included
+        - stored size: the uncompressed size of the rotated segments against their gzip size on disk
+        - history read, streamed: iterating over every entry across the segments and the active file
+        - tail / last page: the reads that only touch the newest segment and the active file
+"""
+import argparse
+import os
+import time
+
+from bench_utils import report, temporary_workdir
+from AuditArchive import AuditRotationPolicy, get_audit_archiver, read_manifest
+from AuditWriter import configure_audit_writer
+from PasswordManager import PasswordManager
+from UserManager import UserManager
+
+
+def log_entries(entries: int) -> float:
+    """
+        Log audit entries for the user 'bench' and wait until they are written.
+
+        Args:
+            entries (int): Number of entries.
+
+        Returns:
+            float: The elapsed time in seconds.
+    """
+    manager: PasswordManager = PasswordManager('bench', 'bench', quiet=True)
+    started: float = time.perf_counter()
+    for entry_number in range(entries):
+        manager.save_audit_log(f'- Viewed the credentials of site{entry_number % 500}.example')
+    manager.storage.flush_audit()
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=500000, help='number of audit entries logged')
+    parser.add_argument('--segment-bytes', type=int, default=4 * 1024 * 1024, help='size that triggers a rotation')
+    args = parser.parse_args()
+
+    with temporary_workdir():
+        UserManager().create_user('bench', 'bench')
+        report('log_action, no rotation', log_entries(args.entries), args.entries)
+    configure_audit_writer()
+
+    with temporary_workdir():
+        UserManager().create_user('bench', 'bench')
+        configure_audit_writer(rotation=AuditRotationPolicy(max_bytes=args.segment_bytes))
+        report('log_action, rotated', log_entries(args.entries), args.entries)
+        get_audit_archiver().wait()
+
+        manager: PasswordManager = PasswordManager('bench', 'bench', quiet=True)
+        segments = read_manifest(os.path.abspath(manager.user.audit_file))
+        raw_size: int = sum(segment[4] for segment in segments)
+        stored_size: int = sum(segment[5] for segment in segments)
+        print(f'{"stored size":<32} {len(segments)} segments, {raw_size / 1e6:.1f} MB raw, '
+              f'{stored_size / 1e6:.1f} MB gzip ({raw_size / max(stored_size, 1):.1f}x)')
+
+        started: float = time.perf_counter()
+        read_entries: int = sum(1 for _ in manager.user.iter_audit_history())
+        report('history read, streamed', time.perf_counter() - started, read_entries)
+
+        started = time.perf_counter()
+        manager.user.tail_audit_history(100)
+        report('tail 100', time.perf_counter() - started, 1)
+
+        started = time.perf_counter()
+        manager.user.get_audit_page(args.entries // 100 - 1, 100)
+        report('last page of 100', time.perf_counter() - started, 1)
+
+        # Write the queued audit entries before the directory goes away
+        configure_audit_writer()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+    Benchmark of the per-record vault layout against block vaults.
+
+    For the per-record layout and for block vaults of each --block-sizes size, measures:
+        - bulk write:  PasswordManager.import_credentials of --records credentials into an empty vault
+        - full scan:   PasswordManager.iter_credentials over the whole vault
+        - single save: --saves calls to encrypt_save_credentials, each rewriting the open tail block
+    and prints the size of the resulting data file, including the tail file of a block vault.
+"""
+import argparse
+import os
+import time
+from typing import List, Optional
+
+from bench_utils import best_of, report, temporary_workdir
+from BlockVault import tail_file
+from FileStorage import FileStorage
+from PasswordManager import PasswordManager
+
+
+def run_layout(name: str, block_size: Optional[int], records: int, saves: int, repeat: int) -> None:
+    """
+        Measure one vault layout in a fresh working directory.
+
+        Args:
+            name (str): Name printed in front of the results.
+            block_size (Optional[int]): Block size of the vault, None for the per-record layout.
+            records (int): Number of credentials imported in bulk.
+            saves (int): Number of credentials saved one at a time.
+            repeat (int): Runs per scan measurement, the best one is reported.
+    """
+    with temporary_workdir():
+        manager: PasswordManager = PasswordManager('bench', 'bench', FileStorage(block_size=block_size), quiet=True)
+
+        started: float = time.perf_counter()
+        manager.import_credentials({'website': f'site{i}.example', 'login': f'user{i}@example.com',
+                                    'password': 'p' * 16} for i in range(records))
+        report(f'{name}: bulk write', time.perf_counter() - started, records)
+
+        scan_time: float = best_of(lambda: sum(1 for _ in manager.iter_credentials()), repeat)
+        report(f'{name}: full scan', scan_time, records)
+
+        started = time.perf_counter()
+        for i in range(saves):
+            manager.encrypt_save_credentials(f'extra{i}.example', f'user{i}', 'p' * 16)
+        save_time: float = time.perf_counter() - started
+        report(f'{name}: single save', save_time, saves)
+
+        # A block vault keeps its open tail block next to the data file
+        data_file: str = manager.user.users_data_file
+        data_size: int = os.path.getsize(data_file)
+        if os.path.exists(tail_file(data_file)):
+            data_size += os.path.getsize(tail_file(data_file))
+        print(f'{name + ": data file":<32} {data_size:10d} bytes  {data_size / (records + saves):8.1f} bytes/record')
+
+        # Write the queued audit entries before the temporary directory is removed
+        manager.storage.flush_audit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=100000, help='number of credentials imported in bulk')
+    parser.add_argument('--saves', type=int, default=1000, help='number of credentials saved one at a time')
+    parser.add_argument('--block-sizes', type=int, nargs='+', default=[4096, 16384, 65536],
+                        help='block sizes in plaintext bytes')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per scan measurement, the best one is reported')
+    args = parser.parse_args()
+
+    print(f'{args.records} records, best of {args.repeat}')
+    layouts: List[Optional[int]] = [None] + args.block_sizes
+    for block_size in layouts:
+        run_layout('per-record' if block_size is None else f'block {block_size}', block_size,
+                   args.records, args.saves, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+    Micro-benchmark for User encryption and decryption.
+
+    Compares three ways of processing the same records:
+        - per-call: a new Fernet object for every record (the old behaviour of encrypt_data/decrypt_data)
+        - cached:   encrypt_data/decrypt_data with the cipher cached on the User
+        - batched:  encrypt_many/decrypt_many
+"""
+import argparse
+import json
+from typing import List
+
+from bench_utils import best_of, report, temporary_workdir
+from cryptography.fernet import Fernet
+from User import User
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=20000, help='number of records to process')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement, the best one is reported')
+    args = parser.parse_args()
+
+    with temporary_workdir():
+        user: User = User('bench', 'bench')
+        records: List[str] = [json.dumps({'website': f'site{i}.example', 'login': f'user{i}', 'password': 'p' * 16})
+                              for i in range(args.records)]
+        tokens: List[bytes] = user.encrypt_many(records)
+
+        def per_call_encrypt() -> None:
+            for record in records:
+                Fernet(user.key).encrypt(record.encode())
+
+        def per_call_decrypt() -> None:
+            for token in tokens:
+                Fernet(user.key).decrypt(token).decode()
+
+        def cached_encrypt() -> None:
+            for record in records:
+                user.encrypt_data(record)
+
+        def cached_decrypt() -> None:
+            for token in tokens:
+                user.decrypt_data(token)
+
+        print(f'{args.records} records, best of {args.repeat}')
+        report('encrypt per-call', best_of(per_call_encrypt, args.repeat), args.records)
+        report('encrypt cached', best_of(cached_encrypt, args.repeat), args.records)
+        report('encrypt_many', best_of(lambda: user.encrypt_many(records), args.repeat), args.records)
+        report('decrypt per-call', best_of(per_call_decrypt, args.repeat), args.records)
+        report('decrypt cached', best_of(cached_decrypt, args.repeat), args.records)
+        report('decrypt_many', best_of(lambda: user.decrypt_many(tokens), args.repeat), args.records)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+    Benchmark of the key rotation pipeline.
+
+    Creates --users users with --records credentials each, then rotates every key:
+        - rotate, 1 worker:   every user rotated in this process
+        - rotate, N workers:  every user rotated on a pool of --workers processes
+    and reports users and records re-encrypted per second. Each case starts from freshly created vaults.
+"""
+import argparse
+import os
+import time
+
+from bench_utils import report, temporary_workdir
+from FileStorage import FileStorage
+from KeyRotation import RotationCheckpoint, rotate_keys
+from PasswordManager import PasswordManager
+from UserManager import UserManager
+
+
+def create_users(users: int, records: int) -> None:
+    """
+        Create users with a vault of records each in the current directory.
+
+        Args:
+            users (int): Number of users.
+            records (int): Number of credentials per user.
+    """
+    user_manager: UserManager = UserManager()
+    for user_number in range(users):
+        user_manager.create_user(f'user{user_number}', f'user{user_number}')
+        PasswordManager(f'user{user_number}', f'user{user_number}', quiet=True).import_credentials(
+            {'website': f'site{i}.example', 'login': f'user{i}@example.com', 'password': 'p' * 16}
+            for i in range(records))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200, help='number of users')
+    parser.add_argument('--records', type=int, default=500, help='number of credentials per user')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='worker processes of the pool')
+    args = parser.parse_args()
+
+    for workers in sorted({1, args.workers}):
+        with temporary_workdir():
+            create_users(args.users, args.records)
+            storage: FileStorage = FileStorage()
+            users = list(storage.load_users().items())
+
+            started: float = time.perf_counter()
+            counts = rotate_keys(storage, users, RotationCheckpoint('key_rotation.checkpoint'), workers)
+            elapsed: float = time.perf_counter() - started
+            report(f'rotate, {workers} workers, per user', elapsed, counts['rotated'])
+            report(f'rotate, {workers} workers, per record', elapsed, counts['records'])
+
+            # Write the queued audit entries before the directory goes away
+            storage.flush_audit()
+
+
+if __name__ == '__main__':
+    main()
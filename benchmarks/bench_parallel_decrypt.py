@@ -0,0 +1,50 @@
+"""
+    Benchmark of serial versus process-pool vault decryption.
+
+    Builds one vault of --records credentials and decrypts it with PasswordManager.iter_credentials,
+    first serially and then in parallel mode with 1, 2, 4, ... workers up to the number of CPUs.
+"""
+import argparse
+import os
+from typing import List
+
+from bench_utils import best_of, report, temporary_workdir
+from PasswordManager import PasswordManager
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=100000, help='number of credentials in the vault')
+    parser.add_argument('--chunk-size', type=int, default=1024 * 1024, help='bytes per worker task')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement, the best one is reported')
+    args = parser.parse_args()
+
+    with temporary_workdir():
+        manager: PasswordManager = PasswordManager('bench', 'bench')
+        manager.import_credentials({'website': f'site{i}.example', 'login': f'user{i}', 'password': 'p' * 16}
+                                   for i in range(args.records))
+        vault_size: int = os.path.getsize(manager.user.users_data_file)
+        print(f'{args.records} records, {vault_size / 1024 / 1024:.1f} MiB, {os.cpu_count()} CPUs, '
+              f'best of {args.repeat}')
+
+        serial_time: float = best_of(lambda: sum(1 for _ in manager.iter_credentials()), args.repeat)
+        report('serial', serial_time, args.records)
+
+        worker_counts: List[int] = []
+        workers: int = 1
+        while workers <= (os.cpu_count() or 1):
+            worker_counts.append(workers)
+            workers *= 2
+
+        for workers in worker_counts:
+            parallel_time: float = best_of(
+                lambda: sum(1 for _ in manager.iter_credentials(True, workers, args.chunk_size)), args.repeat)
+            report(f'parallel, {workers} workers', parallel_time, args.records)
+            print(f'{"":<32} speedup x{serial_time / parallel_time:.2f}')
+
+        # Write the queued audit entries before the temporary directory is removed
+        manager.storage.flush_audit()
+
+
+if __name__ == '__main__':
+    main()
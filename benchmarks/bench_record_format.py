@@ -0,0 +1,55 @@
+"""
+    Benchmark of the original text-line vault format against the compact binary record format.
+
+    Builds a vault of --records credentials in the original format (one base64 token of a JSON record per line),
+    reads it back, migrates it in place with FileStorage.migrate_vault and reads it again, reporting the file size
+    and the decode speed of PasswordManager.iter_credentials for both formats.
+"""
+import argparse
+import json
+import os
+import time
+
+from bench_utils import best_of, report, temporary_workdir
+from PasswordManager import PasswordManager
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=100000, help='number of credentials in the vault')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement, the best one is reported')
+    args = parser.parse_args()
+
+    with temporary_workdir():
+        manager: PasswordManager = PasswordManager('bench', 'bench')
+        encrypt = manager.user.cipher.encrypt
+
+        # Write the vault the way the original text format stored it
+        with open(manager.user.users_data_file, 'wb') as data_file:
+            data_file.writelines(
+                encrypt(json.dumps({'website': f'site{i}.example', 'login': f'user{i}@example.com',
+                                    'password': 'p' * 16}).encode()) + b'\n'
+                for i in range(args.records))
+        text_size: int = os.path.getsize(manager.user.users_data_file)
+
+        text_time: float = best_of(lambda: sum(1 for _ in manager.iter_credentials()), args.repeat)
+
+        started: float = time.perf_counter()
+        manager.storage.migrate_vault(manager.user)
+        migration_time: float = time.perf_counter() - started
+        compact_size: int = os.path.getsize(manager.user.users_data_file)
+
+        compact_time: float = best_of(lambda: sum(1 for _ in manager.iter_credentials()), args.repeat)
+
+        print(f'{args.records} records, best of {args.repeat}')
+        print(f'{"text size":<32} {text_size:10d} bytes  {text_size / args.records:8.1f} bytes/record')
+        print(f'{"compact size":<32} {compact_size:10d} bytes  {compact_size / args.records:8.1f} bytes/record')
+        print(f'{"":<32} {(text_size - compact_size) / text_size:.0%} smaller')
+        report('decode text', text_time, args.records)
+        report('decode compact', compact_time, args.records)
+        print(f'{"":<32} speedup x{text_time / compact_time:.2f}')
+        report('migrate in place', migration_time, args.records)
+
+
+if __name__ == '__main__':
+    main()
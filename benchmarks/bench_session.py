@@ -0,0 +1,54 @@
+"""
+    Benchmark of repeated credential views with and without a Session.
+
+    For a vault of --records credentials, measures --views views of the whole vault:
+        - rebuild:         a new PasswordManager per view decrypting the whole vault, as the menu did before sessions
+        - session, cached: one Session whose vault did not change between views
+        - session, append: one Session with one credential saved by another manager before every view,
+                           so each view reads only the appended record
+"""
+import argparse
+import time
+
+from bench_utils import report, temporary_workdir
+from PasswordManager import PasswordManager
+from Session import Session
+from UserManager import UserManager
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=10000, help='number of credentials in the vault')
+    parser.add_argument('--views', type=int, default=50, help='number of views measured per case')
+    args = parser.parse_args()
+
+    with temporary_workdir():
+        UserManager().create_user('bench', 'bench')
+        writer: PasswordManager = PasswordManager('bench', 'bench', quiet=True)
+        writer.import_credentials({'website': f'site{i}.example', 'login': f'user{i}@example.com',
+                                   'password': 'p' * 16} for i in range(args.records))
+
+        started: float = time.perf_counter()
+        for _ in range(args.views):
+            sum(1 for _ in PasswordManager('bench', 'bench', quiet=True).iter_credentials())
+        report('rebuild', time.perf_counter() - started, args.views)
+
+        with Session('bench', 'bench', quiet=True) as session:
+            session.credentials()
+            started = time.perf_counter()
+            for _ in range(args.views):
+                session.credentials()
+            report('session, cached', time.perf_counter() - started, args.views)
+
+            started = time.perf_counter()
+            for view in range(args.views):
+                writer.encrypt_save_credentials(f'extra{view}.example', 'user', 'p' * 16)
+                session.credentials()
+            report('session, append', time.perf_counter() - started, args.views)
+
+        # Write the queued audit entries before the directory goes away
+        writer.storage.flush_audit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+    Cold start benchmark of the command line entry points, with a regression budget.
+
+    Imports each entry module in a fresh interpreter under -X importtime and reports the cumulative import time
+    of the module (best of --repeat runs) and the wall-clock time of a full interpreter run importing it,
+    next to a bare interpreter start for reference. Also checks that the modules listed in LAZY_MODULES
+    are not imported at startup, they must only be loaded by the paths that need them.
+
+    Exits with status 1 if a module is over its budget or imports a lazy module, so it can run in CI:
+        python benchmarks/bench_startup.py
+        python benchmarks/bench_startup.py --budget-scale 2     (a slower machine)
+"""
+import argparse
+import subprocess
+import sys
+import time
+from typing import Dict, List, Set, Tuple
+
+from bench_utils import REPO_ROOT
+
+# Budget in milliseconds for the cumulative import time of each entry module
+IMPORT_BUDGETS_MS: Dict[str, float] = {
+    'main': 45.0,
+    'BatchCli': 50.0,
+}
+
+# Heavy modules that the entry modules must not import at startup
+LAZY_MODULES: Tuple[str, ...] = ('cryptography', 'multiprocessing', 'concurrent.futures', 'sqlite3', 'asyncio')
+
+
+def measure_import(module: str) -> Tuple[float, float, Set[str]]:
+    """
+        Import a module in a fresh interpreter and time it.
+
+        Args:
+            module (str): Name of the module, importable from the repository root.
+
+        Returns:
+            Tuple[float, float, Set[str]]: The cumulative import time of the module in milliseconds,
+            the wall-clock time of the whole run in milliseconds and the names of all imported modules.
+    """
+    started: float = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=REPO_ROOT,
+                               capture_output=True, text=True, check=True)
+    wall_ms: float = (time.perf_counter() - started) * 1e3
+
+    # Lines look like "import time:   self [us] | cumulative | imported package", nested imports are indented
+    import_ms: float = 0.0
+    imported: Set[str] = set()
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or line.endswith('imported package'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imported.add(name.strip())
+        if name.strip() == module:
+            import_ms = int(cumulative) / 1e3
+    return import_ms, wall_ms, imported
+
+
+def bare_start_ms() -> float:
+    """
+        Return the wall-clock time of starting and stopping an interpreter that imports nothing.
+
+        Returns:
+            float: The time in milliseconds.
+    """
+    started: float = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], check=True)
+    return (time.perf_counter() - started) * 1e3
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='runs per module, the best one is reported')
+    parser.add_argument('--budget-scale', type=float, default=1.0, help='multiply every budget by this factor')
+    args = parser.parse_args()
+
+    # The first run warms the file system cache and writes the bytecode cache, it is not counted
+    measure_import('main')
+
+    bare_ms: float = min(bare_start_ms() for _ in range(args.repeat))
+    print(f'{"bare interpreter":<20} {"":>10}   {bare_ms:8.1f} ms wall')
+
+    failures: List[str] = []
+    for module, budget_ms in IMPORT_BUDGETS_MS.items():
+        runs: List[Tuple[float, float, Set[str]]] = [measure_import(module) for _ in range(args.repeat)]
+        import_ms: float = min(run[0] for run in runs)
+        wall_ms: float = min(run[1] for run in runs)
+        budget_ms *= args.budget_scale
+
+        status: str = 'ok' if import_ms <= budget_ms else 'OVER BUDGET'
+        print(f'{module:<20} {import_ms:8.1f} ms import {wall_ms:8.1f} ms wall  '
+              f'(budget {budget_ms:.1f} ms) {status}')
+        if import_ms > budget_ms:
+            failures.append(f'{module} imports in {import_ms:.1f} ms, over its {budget_ms:.1f} ms budget')
+
+        eager: List[str] = [lazy for lazy in LAZY_MODULES
+                            if any(name == lazy or name.startswith(lazy + '.') for name in runs[0][2])]
+        if eager:
+            failures.append(f'{module} imports {", ".join(eager)} at startup')
+
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+    Benchmark of the flat-file storage against the SQLite storage.
+
+    For each backend, provisions --users users (registry entry and key), writes --credentials records per user
+    in one batch, then measures a full scan of every vault, single-website lookups and audit appends.
+    Records are drawn from a small pool of pre-encrypted tokens so the numbers show storage cost, not encryption.
+    The defaults match the 10k users x 1k credentials target; use smaller values for a quick run.
+"""
+import argparse
+import contextlib
+import io
+import random
+import time
+from typing import Callable, List, Tuple
+
+from bench_utils import report, temporary_workdir
+from FileStorage import FileStorage
+from SQLiteStorage import SQLiteStorage
+from Storage import StorageBackend
+from User import User
+
+
+def run_backend(name: str, make_storage: Callable[[], StorageBackend], users: int, credentials: int,
+                lookups: int) -> None:
+    with temporary_workdir(), contextlib.redirect_stdout(io.StringIO()):
+        storage: StorageBackend = make_storage()
+        results: List[Tuple[str, float, int]] = []
+
+        started: float = time.perf_counter()
+        user_objects: List[User] = []
+        for user_number in range(users):
+            user: User = User(f'u{user_number}', f'name{user_number}', storage)
+            user.create_user(user.user_id, user.user_name)
+            user_objects.append(user)
+        results.append(('provision users', time.perf_counter() - started, users))
+
+        token_pool: List[bytes] = user_objects[0].encrypt_many(f'record {number}' for number in range(64))
+
+        started = time.perf_counter()
+        for user in user_objects:
+            with storage.open_credential_writer(user) as credential_writer:
+                credential_writer.write([(f'site{number}', token_pool[number % len(token_pool)])
+                                         for number in range(credentials)])
+        results.append(('write credentials', time.perf_counter() - started, users * credentials))
+
+        started = time.perf_counter()
+        scanned: int = sum(1 for user in user_objects for _ in storage.iter_credential_tokens(user))
+        results.append(('full scan', time.perf_counter() - started, scanned))
+
+        randomizer: random.Random = random.Random(1)
+        started = time.perf_counter()
+        for _ in range(lookups):
+            storage.find_credential_tokens(randomizer.choice(user_objects), f'site{randomizer.randrange(credentials)}')
+        results.append(('website lookup', time.perf_counter() - started, lookups))
+
+        started = time.perf_counter()
+        for user in user_objects:
+            user.log_action('- benchmark')
+        storage.flush_audit()
+        results.append(('audit append', time.perf_counter() - started, users))
+
+    print(f'{name}:')
+    for label, seconds, count in results:
+        report(f'  {label}', seconds, count)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10000, help='number of users')
+    parser.add_argument('--credentials', type=int, default=1000, help='credentials per user')
+    parser.add_argument('--lookups', type=int, default=10000, help='number of single-website lookups')
+    args = parser.parse_args()
+
+    print(f'{args.users} users x {args.credentials} credentials')
+    run_backend('file', FileStorage, args.users, args.credentials, args.lookups)
+    run_backend('sqlite', lambda: SQLiteStorage('bench.db'), args.users, args.credentials, args.lookups)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""
+    Benchmark suite of the hot paths across growing data sizes, with a baseline regression gate.
+
+    For every size in --sizes, builds a synthetic registry of that many users, a vault of that many credentials
+    and an audit log of that many entries in a fresh temporary directory, then measures:
+        create_user                  registering one more user in the registry
+        encrypt_save_credentials     saving one credential into the vault
+        decrypt_display_credentials  decrypting and printing the whole vault, per record
+        log_action                   appending one audit entry, including the final flush
+        get_audit_history            reading the whole audit log, per entry
+    Each measurement is the best of --repeat runs. The table shows microseconds per operation for every size and
+    the growth from the smallest to the largest size, which stays near 1 for a path that scales as it should.
+    Everything runs offline on the local file system.
+
+    Results can be written as JSON and compared against a stored baseline; the comparison fails (exit status 1)
+    when a measurement is slower than its baseline by more than --threshold:
+        python benchmarks/bench_suite.py --json baseline.json
+        python benchmarks/bench_suite.py --compare baseline.json --threshold 0.25
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+from typing import IO, Callable, Dict, List, Optional, Tuple
+
+from bench_utils import best_of, temporary_workdir
+from FileStorage import FileStorage
+from PasswordManager import PasswordManager
+from User import User
+from UserManager import UserManager
+
+# Version of the JSON result layout, a baseline with another version is not compared
+RESULTS_VERSION: int = 1
+
+# One measurement: (benchmark name, data size, operations timed, best total seconds)
+Measurement = Tuple[str, int, int, float]
+
+
+def synthetic_credentials(count: int, prefix: str = 'site') -> List[Dict[str, str]]:
+    return [{'website': f'{prefix}{number}.example', 'login': f'user{number}@example.com',
+             'password': f'pw-{number:08d}-{"x" * 8}'} for number in range(count)]
+
+
+def build_workload(size: int) -> PasswordManager:
+    """
+        Build the synthetic data of one size in the current directory.
+
+        Args:
+            size (int): Number of registered users, vault records and audit entries.
+
+        Returns:
+            PasswordManager: The manager of the user owning the vault and the audit log.
+    """
+    storage: FileStorage = FileStorage()
+    for user_number in range(size):
+        storage.add_user(f'u{user_number}', f'name{user_number}')
+
+    manager: PasswordManager = PasswordManager('u0', 'name0', storage, quiet=True)
+    manager.import_credentials(synthetic_credentials(size))
+    for entry_number in range(size):
+        manager.save_audit_log(f'- Synthetic entry {entry_number}')
+    storage.flush_audit()
+    return manager
+
+
+def run_size(size: int, ops: int, repeat: int, selected: List[str]) -> List[Measurement]:
+    """
+        Measure the selected benchmarks on data of one size.
+
+        Args:
+            size (int): Number of registered users, vault records and audit entries.
+            ops (int): Number of operations timed by the per-operation benchmarks.
+            repeat (int): Runs per measurement, the best one is kept.
+            selected (List[str]): Names of the benchmarks to run.
+
+        Returns:
+            List[Measurement]: The measurements.
+    """
+    results: List[Measurement] = []
+    with temporary_workdir(), contextlib.redirect_stdout(io.StringIO()) as silenced:
+        manager: PasswordManager = build_workload(size)
+        storage = manager.storage
+        run_number: List[int] = [0]
+
+        def create_users() -> None:
+            # New user IDs on every run, an existing ID is rejected without being written
+            run_number[0] += 1
+            user_manager: UserManager = UserManager(storage=storage)
+            for user_number in range(ops):
+                user_manager.create_user(f'r{run_number[0]}-{user_number}', 'bench')
+
+        def save_credentials() -> None:
+            run_number[0] += 1
+            for record in synthetic_credentials(ops, f'new{run_number[0]}-'):
+                manager.encrypt_save_credentials(record['website'], record['login'], record['password'])
+
+        def display_credentials() -> None:
+            manager.decrypt_display_credentials()
+            silenced.seek(0)
+            silenced.truncate()
+
+        def log_actions() -> None:
+            user: User = manager.user
+            for _ in range(ops):
+                user.log_action('- Benchmark action')
+            storage.flush_audit()
+
+        def read_audit_history() -> None:
+            for _ in manager.user.get_audit_history():
+                pass
+
+        benchmarks: Dict[str, Tuple[Callable[[], None], int]] = {
+            'create_user': (create_users, ops),
+            'encrypt_save_credentials': (save_credentials, ops),
+            'decrypt_display_credentials': (display_credentials, size),
+            'log_action': (log_actions, ops),
+            'get_audit_history': (read_audit_history, size),
+        }
+        for name in selected:
+            func, count = benchmarks[name]
+            results.append((name, size, count, best_of(func, repeat)))
+    return results
+
+
+def to_json(measurements: List[Measurement], args: argparse.Namespace) -> Dict[str, object]:
+    return {
+        'version': RESULTS_VERSION,
+        'environment': {'python': platform.python_version(), 'implementation': platform.python_implementation(),
+                        'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'settings': {'sizes': args.sizes, 'ops': args.ops, 'repeat': args.repeat},
+        'results': [{'name': name, 'size': size, 'ops': count, 'seconds': seconds,
+                     'us_per_op': seconds / count * 1e6 if count else 0.0}
+                    for name, size, count, seconds in measurements],
+    }
+
+
+def print_table(results: List[Dict[str, object]], sizes: List[int], stream: IO[str]) -> None:
+    names: List[str] = list(dict.fromkeys(result['name'] for result in results))
+    per_op: Dict[Tuple[str, int], float] = {(result['name'], result['size']): result['us_per_op']
+                                            for result in results}
+    print(f'{"us/op":<30}' + ''.join(f'{size:>12}' for size in sizes) + f'{"growth":>10}', file=stream)
+    for name in names:
+        row: List[float] = [per_op.get((name, size), 0.0) for size in sizes]
+        growth: str = f'x{row[-1] / row[0]:.2f}' if row[0] else '-'
+        print(f'{name:<30}' + ''.join(f'{value:12.2f}' for value in row) + f'{growth:>10}', file=stream)
+
+
+def compare(results: List[Dict[str, object]], baseline_path: str, threshold: float) -> List[str]:
+    """
+        Compare results against a stored baseline and print a line per measurement found in both.
+
+        Args:
+            results (List[Dict[str, object]]): The current results.
+            baseline_path (str): Path of a JSON file written with --json.
+            threshold (float): Allowed slowdown as a fraction, 0.25 allows 25% more time per operation.
+
+        Returns:
+            List[str]: A description of every regression, empty if none.
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as baseline_file:
+        baseline: Dict[str, object] = json.load(baseline_file)
+    if baseline.get('version') != RESULTS_VERSION:
+        return [f'{baseline_path} has result version {baseline.get("version")}, expected {RESULTS_VERSION}']
+
+    baseline_per_op: Dict[Tuple[str, int], float] = {(result['name'], result['size']): result['us_per_op']
+                                                     for result in baseline['results']}
+    regressions: List[str] = []
+    print(f'\n{"compared to " + baseline_path:<42}{"baseline":>12}{"current":>12}{"change":>10}')
+    for result in results:
+        baseline_us: Optional[float] = baseline_per_op.get((result['name'], result['size']))
+        if not baseline_us:
+            continue
+        ratio: float = result['us_per_op'] / baseline_us
+        status: str = 'REGRESSED' if ratio > 1 + threshold else ''
+        label: str = f'{result["name"]} @ {result["size"]}'
+        print(f'{label:<42}{baseline_us:12.2f}{result["us_per_op"]:12.2f}{ratio - 1:+10.0%} {status}')
+        if status:
+            regressions.append(f'{label} is {ratio - 1:.0%} slower than the baseline')
+    return regressions
+
+
+def main() -> None:
+    benchmark_names: List[str] = ['create_user', 'encrypt_save_credentials', 'decrypt_display_credentials',
+                                  'log_action', 'get_audit_history']
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=lambda value: [int(size) for size in value.split(',')],
+                        default=[100, 1000, 10000], help='comma-separated data sizes, default 100,1000,10000')
+    parser.add_argument('--ops', type=int, default=200, help='operations timed by the per-operation benchmarks')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement, the best one is kept')
+    parser.add_argument('--only', type=lambda value: value.split(','), default=benchmark_names,
+                        help='comma-separated benchmarks to run, all of them by default')
+    parser.add_argument('--json', metavar='PATH', help='write the results as JSON to PATH, - for stdout')
+    parser.add_argument('--compare', metavar='BASELINE', help='compare against results written with --json')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown against the baseline')
+    args = parser.parse_args()
+
+    unknown: List[str] = [name for name in args.only if name not in benchmark_names]
+    if unknown:
+        parser.error(f'unknown benchmarks: {", ".join(unknown)}')
+
+    measurements: List[Measurement] = []
+    for size in args.sizes:
+        started: float = time.perf_counter()
+        measurements.extend(run_size(size, args.ops, args.repeat, args.only))
+        print(f'size {size}: {time.perf_counter() - started:.1f} s', file=sys.stderr)
+
+    document: Dict[str, object] = to_json(measurements, args)
+    # Keep stdout clean for the JSON document when it is written there
+    print_table(document['results'], args.sizes, sys.stderr if args.json == '-' else sys.stdout)
+
+    if args.json == '-':
+        json.dump(document, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, 'w', encoding='utf-8') as json_file:
+            json.dump(document, json_file, indent=2)
+
+    if args.compare:
+        regressions: List[str] = compare(document['results'], args.compare, args.threshold)
+        for regression in regressions:
+            print(f'FAIL: {regression}')
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
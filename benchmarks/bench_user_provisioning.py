@@ -0,0 +1,58 @@
+"""
+    Benchmark of bulk user provisioning through UserManager.create_user.
+
+    Registers --users users one at a time and reports the rate for every tenth of the run,
+    which stays flat when registration is O(1) amortized. The registry is loaded again at the end
+    to measure journal replay.
+"""
+import argparse
+import contextlib
+import io
+import time
+
+from bench_utils import best_of, report, temporary_workdir
+from RegistryCache import registry_cache
+from UserManager import UserManager
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000, help='number of users to create')
+    args = parser.parse_args()
+
+    with temporary_workdir(), contextlib.redirect_stdout(io.StringIO()) as silenced:
+        manager: UserManager = UserManager()
+        step: int = max(1, args.users // 10)
+        results = []
+
+        started: float = time.perf_counter()
+        for first in range(0, args.users, step):
+            batch_started: float = time.perf_counter()
+            for user_number in range(first, min(first + step, args.users)):
+                manager.create_user(f'u{user_number}', f'name{user_number}')
+                silenced.seek(0)
+                silenced.truncate()
+            results.append((first, time.perf_counter() - batch_started, min(step, args.users - first)))
+        total: float = time.perf_counter() - started
+
+        def cached_load() -> None:
+            # A new UserManager loads its registry lazily, so the load is asked for explicitly
+            UserManager().load_users()
+
+        cached_load_time: float = best_of(cached_load)
+
+        def uncached_load() -> None:
+            registry_cache.invalidate()
+            UserManager().load_users()
+
+        load_time: float = best_of(uncached_load)
+
+    for first, seconds, count in results:
+        report(f'create_user from {first}', seconds, count)
+    report('create_user total', total, args.users)
+    report('load registry', load_time, args.users)
+    report('load registry (cached)', cached_load_time, args.users)
+
+
+if __name__ == '__main__':
+    main()
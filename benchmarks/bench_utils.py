@@ -0,0 +1,87 @@
+"""
+    Shared helpers for the benchmark scripts in this directory.
+
+    The benchmarks are plain scripts that are run from the repository root, for example:
+        python benchmarks/bench_cipher.py
+"""
+import contextlib
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, Iterator, Sequence
+
+# The project modules live in the repository root, one level above this directory
+REPO_ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+@contextlib.contextmanager
+def temporary_workdir() -> Iterator[str]:
+    """
+        Run the enclosed block inside a fresh temporary working directory.
+
+        The project writes users.json and the per-user files relative to the working directory,
+        so every benchmark runs in its own directory and leaves nothing behind.
+
+        Yields:
+            str: Path of the temporary directory.
+    """
+    previous_dir: str = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='psm_bench_') as work_dir:
+        os.chdir(work_dir)
+        try:
+            yield work_dir
+        finally:
+            os.chdir(previous_dir)
+
+
+def best_of(func: Callable[[], object], repeat: int = 3) -> float:
+    """
+        Run a function several times and return the fastest wall-clock time.
+
+        Args:
+            func (Callable[[], object]): The function to be timed.
+            repeat (int): How many times to run it.
+
+        Returns:
+            float: The best time in seconds.
+    """
+    best: float = float('inf')
+    for _ in range(repeat):
+        started: float = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def report(name: str, seconds: float, count: int) -> None:
+    """
+        Print one benchmark result line.
+
+        Args:
+            name (str): Name of the measured path.
+            seconds (float): Total time in seconds.
+            count (int): Number of operations performed in that time.
+    """
+    per_op_us: float = seconds / count * 1e6 if count else 0.0
+    rate: float = count / seconds if seconds else 0.0
+    print(f'{name:<32} {seconds:10.4f} s  {per_op_us:10.2f} us/op  {rate:12.0f} ops/s')
+
+
+def percentile(samples: Sequence[float], fraction: float) -> float:
+    """
+        Return a percentile of a set of samples by the nearest-rank method.
+
+        Args:
+            samples (Sequence[float]): The samples, in any order.
+            fraction (float): The percentile as a fraction, 0.99 for p99.
+
+        Returns:
+            float: The sample at that rank, 0.0 if there are no samples.
+    """
+    if not samples:
+        return 0.0
+    ordered: Sequence[float] = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, int(fraction * len(ordered) + 0.5) - 1))]
@@ -0,0 +1,121 @@
+"""
+    Load test of AsyncPasswordManager with many concurrent simulated users on one event loop.
+
+    Opens --users managers at once, then every user runs --ops operations drawn from a mix of saves, lookups,
+    updates, deletes, audit tails and full vault iterations, with a random pause of up to --think-ms between
+    operations. All users run concurrently, the executor bounds how much blocking work runs at the same time.
+
+    Reports the p50, p99 and maximum latency per operation type, the overall throughput, and the worst
+    event loop lag seen by a heartbeat task, which stays small as long as nothing blocks the loop.
+        python benchmarks/load_test_async.py --users 2000 --ops 20
+        python benchmarks/load_test_async.py --backend sqlite --workers 8
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from bench_utils import percentile, temporary_workdir
+from AsyncPasswordManager import AsyncPasswordManager, configure_async_executor
+from FileStorage import FileStorage
+from SQLiteStorage import SQLiteStorage
+from Storage import StorageBackend
+
+# Relative weights of the operations a simulated user performs
+OPERATION_MIX: List[Tuple[str, int]] = [('save', 40), ('get', 30), ('update', 10), ('delete', 5),
+                                        ('audit_tail', 10), ('iterate', 5)]
+
+# Number of distinct websites a simulated user works with
+WEBSITES_PER_USER: int = 20
+
+
+async def simulate_user(user_number: int, storage: StorageBackend, ops: int, think_ms: float,
+                        latencies: Dict[str, List[float]]) -> None:
+    randomizer: random.Random = random.Random(user_number)
+    names: List[str] = [name for name, _ in OPERATION_MIX]
+    weights: List[int] = [weight for _, weight in OPERATION_MIX]
+
+    started: float = time.perf_counter()
+    manager: AsyncPasswordManager = await AsyncPasswordManager.open(f'u{user_number}', f'name{user_number}', storage)
+    latencies['open'].append(time.perf_counter() - started)
+
+    for operation in randomizer.choices(names, weights, k=ops):
+        if think_ms:
+            await asyncio.sleep(randomizer.random() * think_ms / 1000)
+        website: str = f'site{randomizer.randrange(WEBSITES_PER_USER)}.example'
+
+        started = time.perf_counter()
+        if operation == 'save':
+            await manager.save(website, f'login{user_number}', f'password{randomizer.random()}')
+        elif operation == 'get':
+            await manager.get(website)
+        elif operation == 'update':
+            await manager.update(website, f'login{user_number}', f'password{randomizer.random()}')
+        elif operation == 'delete':
+            await manager.delete(website)
+        elif operation == 'audit_tail':
+            await manager.audit_tail(10)
+        else:
+            try:
+                async for _ in manager.iter_credentials():
+                    pass
+            except FileNotFoundError:
+                # Nothing saved by this user yet
+                pass
+        latencies[operation].append(time.perf_counter() - started)
+
+
+async def heartbeat(interval: float, lags: List[float], stop: asyncio.Event) -> None:
+    # Measures how late the loop wakes the task up, the time some callback kept the loop busy
+    while not stop.is_set():
+        started: float = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def run(storage: StorageBackend, users: int, ops: int, think_ms: float) -> None:
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    lags: List[float] = []
+    stop: asyncio.Event = asyncio.Event()
+    monitor: asyncio.Task = asyncio.create_task(heartbeat(0.01, lags, stop))
+
+    started: float = time.perf_counter()
+    await asyncio.gather(*(simulate_user(user_number, storage, ops, think_ms, latencies)
+                           for user_number in range(users)))
+    elapsed: float = time.perf_counter() - started
+    stop.set()
+    await monitor
+    storage.flush_audit()
+
+    print(f'{"operation":<12} {"count":>8} {"p50 ms":>10} {"p99 ms":>10} {"max ms":>10}')
+    for operation in ['open'] + [name for name, _ in OPERATION_MIX]:
+        samples: List[float] = latencies[operation]
+        print(f'{operation:<12} {len(samples):8d} {percentile(samples, 0.5) * 1e3:10.2f} '
+              f'{percentile(samples, 0.99) * 1e3:10.2f} {max(samples, default=0.0) * 1e3:10.2f}')
+
+    total: int = sum(len(samples) for samples in latencies.values())
+    print(f'{users} users, {total} operations in {elapsed:.2f} s ({total / elapsed:.0f} ops/s), '
+          f'event loop lag p99 {percentile(lags, 0.99) * 1e3:.2f} ms, max {max(lags, default=0.0) * 1e3:.2f} ms')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000, help='number of concurrent simulated users')
+    parser.add_argument('--ops', type=int, default=20, help='operations per user')
+    parser.add_argument('--think-ms', type=float, default=5.0, help='maximum random pause between operations')
+    parser.add_argument('--workers', type=int, default=None, help='executor threads, the library default if unset')
+    parser.add_argument('--backend', choices=['file', 'sqlite'], default='file', help='storage backend')
+    args = parser.parse_args()
+
+    if args.workers is not None:
+        configure_async_executor(args.workers)
+
+    with temporary_workdir():
+        storage: StorageBackend = FileStorage() if args.backend == 'file' else SQLiteStorage('psm.db')
+        asyncio.run(run(storage, args.users, args.ops, args.think_ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+"""
+    Multi-process stress test of concurrent writers sharing one FileStorage directory.
+
+    Creates --users shared users, then starts --processes worker processes with --threads threads each. Every thread
+    saves --ops credentials into the shared vaults, updating some of its earlier websites so that dead records
+    pile up and background compactions run while others append; every save and update also writes an audit
+    entry. Threads register new users as they go and some of them save the whole registry, racing with
+    the registrations of the other processes.
+
+    When every worker is done, the files are read back from scratch and checked:
+        - every vault holds exactly the last credentials each thread saved for each of its websites, every record
+          decrypts and the website index agrees with the vault
+        - every audit log holds one well-formed entry per save and update, none lost or interleaved with another
+        - the registry holds every user registered by any process
+    Reports the write throughput and exits with status 1 if anything was lost or corrupted:
+        python benchmarks/stress_multiprocess.py --processes 4 --threads 4
+        python benchmarks/stress_multiprocess.py --durability fsync --group-commit
+        python benchmarks/stress_multiprocess.py --block-size 4096
+"""
+import argparse
+import contextlib
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from bench_utils import temporary_workdir
+from AuditLogReader import entry_timestamp_key
+from FileStorage import FileStorage
+from PasswordManager import PasswordManager
+from RegistryCache import registry_cache
+from UserManager import UserManager
+
+# Every REWRITE_EVERY-th save of a thread updates the website it saved two saves before
+REWRITE_EVERY: int = 4
+
+# Audit entries of saves and updates, followed by the website
+AUDIT_MARKERS: Tuple[str, ...] = ('Saved credentials for ', 'Updated credentials for ')
+
+# One planned save: (shared user number, website, login, password)
+PlannedSave = Tuple[int, str, str, str]
+
+
+def planned_saves(worker: int, thread: int, ops: int, users: int) -> List[PlannedSave]:
+    """
+        List the saves one thread makes, in order; the workers and the final check both use it.
+
+        Args:
+            worker (int): Number of the worker process.
+            thread (int): Number of the thread in the worker.
+            ops (int): Number of saves.
+            users (int): Number of shared users.
+
+        Returns:
+            List[PlannedSave]: The saves.
+    """
+    saves: List[PlannedSave] = []
+    for op in range(ops):
+        # A rewrite goes to the same user and website as the save it replaces
+        target: int = op - 2 if is_rewrite(op) else op
+        saves.append(((worker + thread + target) % users, f'w{worker}-t{thread}-{target}.example',
+                      f'login-{worker}-{thread}-{target}', f'pw-{worker}-{thread}-{op}'))
+    return saves
+
+
+def is_rewrite(op: int) -> bool:
+    """
+        Tell whether a planned save updates an earlier website of its thread instead of saving a new one.
+
+        Args:
+            op (int): Number of the save in its thread.
+
+        Returns:
+            bool: True for an update.
+    """
+    return op % REWRITE_EVERY == REWRITE_EVERY - 1
+
+
+def run_worker(worker: int, args: argparse.Namespace, work_dir: str, barrier, results) -> None:
+    """
+        Body of one worker process: run the threads and report when they started and finished.
+
+        Args:
+            worker (int): Number of the worker process.
+            args (argparse.Namespace): The command line settings.
+            work_dir (str): The shared working directory.
+            barrier (multiprocessing.Barrier): Released once every worker is ready, so they all start together.
+            results (multiprocessing.Queue): Receives (worker, started, finished, error).
+    """
+    try:
+        os.chdir(work_dir)
+        storage: FileStorage = FileStorage(block_size=args.block_size, durability=args.durability,
+                                           group_commit=args.group_commit)
+        managers: List[PasswordManager] = [PasswordManager(f'shared{number}', f'shared{number}', storage, quiet=True)
+                                           for number in range(args.users)]
+        for manager in managers:
+            manager.user.load_or_create_key()
+        errors: List[str] = []
+
+        def run_thread(thread: int) -> None:
+            try:
+                user_manager: UserManager = UserManager(storage=storage)
+                for op, (user_number, website, login, password) in enumerate(
+                        planned_saves(worker, thread, args.ops, args.users)):
+                    if is_rewrite(op):
+                        managers[user_number].update_credentials(website, login, password)
+                    else:
+                        managers[user_number].encrypt_save_credentials(website, login, password)
+                    if op % args.register_every == 0:
+                        user_manager.create_user(f'w{worker}-t{thread}-u{op}', 'stress')
+                    if op % args.save_users_every == args.save_users_every - 1:
+                        user_manager.save_users()
+            except Exception:
+                errors.append(traceback.format_exc())
+
+        threads: List[threading.Thread] = [threading.Thread(target=run_thread, args=(thread,))
+                                           for thread in range(args.threads)]
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            barrier.wait()
+            started: float = time.time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            storage.flush_audit()
+            finished: float = time.time()
+
+            # Let background compactions finish, so the check sees the files at rest
+            for thread in threading.enumerate():
+                if thread.name.startswith('compact-'):
+                    thread.join()
+
+        results.put((worker, started, finished, '\n'.join(errors)))
+    except Exception:
+        results.put((worker, 0.0, 0.0, traceback.format_exc()))
+
+
+def check_files(args: argparse.Namespace) -> List[str]:
+    """
+        Read the shared files back with fresh caches and compare them with the planned saves.
+
+        Args:
+            args (argparse.Namespace): The command line settings.
+
+        Returns:
+            List[str]: A description of every problem found, empty if none.
+    """
+    problems: List[str] = []
+    registry_cache.invalidate()
+    storage: FileStorage = FileStorage()
+
+    # The last save or update of every website wins, and each of them logs one audit entry
+    expected: List[Dict[str, Tuple[str, str]]] = [{} for _ in range(args.users)]
+    expected_audit: List[Counter] = [Counter() for _ in range(args.users)]
+    expected_users: List[str] = [f'shared{number}' for number in range(args.users)]
+    for worker in range(args.processes):
+        for thread in range(args.threads):
+            for op, (user_number, website, login, password) in enumerate(
+                    planned_saves(worker, thread, args.ops, args.users)):
+                expected[user_number][website] = (login, password)
+                expected_audit[user_number][website] += 1
+                if op % args.register_every == 0:
+                    expected_users.append(f'w{worker}-t{thread}-u{op}')
+
+    for user_number in range(args.users):
+        manager: PasswordManager = PasswordManager(f'shared{user_number}', f'shared{user_number}', storage, quiet=True)
+        label: str = f'shared{user_number}'
+
+        stored: Dict[str, Tuple[str, str]] = {}
+        try:
+            for record in manager.iter_credentials():
+                if record['website'] in stored:
+                    problems.append(f'{label}: {record["website"]} has more than one live record')
+                stored[record['website']] = (record['login'], record['password'])
+        except Exception as error:
+            problems.append(f'{label}: vault cannot be read ({type(error).__name__}: {error})')
+            continue
+
+        missing: List[str] = [website for website in expected[user_number] if website not in stored]
+        unexpected: List[str] = [website for website in stored if website not in expected[user_number]]
+        stale: List[str] = [website for website, credentials in expected[user_number].items()
+                            if website in stored and stored[website] != credentials]
+        for count, description in ((len(missing), 'lost'), (len(unexpected), 'unexpected'), (len(stale), 'stale')):
+            if count:
+                problems.append(f'{label}: {count} {description} records')
+
+        # Read the audit log before the lookups below add entries of their own
+        audit: str = storage.read_audit(manager.user) or ''
+        if audit and not audit.endswith('\n'):
+            problems.append(f'{label}: the audit log ends with a partial entry')
+        logged: Counter = Counter()
+        malformed: int = 0
+        for line in audit.splitlines():
+            websites: List[str] = [line[line.find(marker) + len(marker):] for marker in AUDIT_MARKERS if marker in line]
+            if entry_timestamp_key(line.encode()) is None or not websites:
+                malformed += 1
+            else:
+                logged[websites[0]] += 1
+        if malformed:
+            problems.append(f'{label}: {malformed} malformed audit entries')
+        if logged != expected_audit[user_number]:
+            lost: int = sum((expected_audit[user_number] - logged).values())
+            extra: int = sum((logged - expected_audit[user_number]).values())
+            problems.append(f'{label}: audit log has {lost} lost and {extra} extra entries')
+
+        live_count, _ = storage.vault_stats(manager.user)
+        if live_count != len(expected[user_number]):
+            problems.append(f'{label}: the index counts {live_count} live records, expected {len(expected[user_number])}')
+        for website in list(expected[user_number])[::max(1, len(expected[user_number]) // 20)]:
+            found: List[Dict[str, str]] = manager.get_credentials(website)
+            if [(record['login'], record['password']) for record in found] != [expected[user_number][website]]:
+                problems.append(f'{label}: the index finds the wrong record for {website}')
+
+    registered: Dict[str, str] = storage.load_users()
+    lost_users: List[str] = [user_id for user_id in expected_users if user_id not in registered]
+    if lost_users:
+        problems.append(f'registry: {len(lost_users)} of {len(expected_users)} registrations lost, '
+                        f'e.g. {lost_users[0]}')
+
+    # Write the entries of the lookups above before the directory goes away
+    storage.flush_audit()
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=4, help='number of worker processes')
+    parser.add_argument('--threads', type=int, default=2, help='writer threads per process')
+    parser.add_argument('--users', type=int, default=3, help='number of users whose vaults every thread writes to')
+    parser.add_argument('--ops', type=int, default=300, help='saves per thread')
+    parser.add_argument('--register-every', type=int, default=10, help='register a new user every N saves')
+    parser.add_argument('--save-users-every', type=int, default=50, help='save the whole registry every N saves')
+    parser.add_argument('--durability', choices=['flush', 'fsync'], default='flush', help='vault durability level')
+    parser.add_argument('--group-commit', action='store_true', help='merge concurrent appends to a vault')
+    parser.add_argument('--block-size', type=int, default=None, help='write block vaults with blocks of this size')
+    args = parser.parse_args()
+
+    # Spawned workers start from a clean interpreter, as separate server processes would
+    context = multiprocessing.get_context('spawn')
+    with temporary_workdir() as work_dir:
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            user_manager: UserManager = UserManager()
+            for number in range(args.users):
+                user_manager.create_user(f'shared{number}', f'shared{number}')
+                PasswordManager(f'shared{number}', f'shared{number}', quiet=True).user.load_or_create_key()
+
+        barrier = context.Barrier(args.processes)
+        results = context.Queue()
+        workers: List[multiprocessing.Process] = [
+            context.Process(target=run_worker, args=(worker, args, work_dir, barrier, results))
+            for worker in range(args.processes)]
+        for worker in workers:
+            worker.start()
+        outcomes: List[Tuple[int, float, float, str]] = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+
+        failures: List[str] = [f'worker {worker} failed:\n{error}' for worker, _, _, error in outcomes if error]
+        if not failures:
+            failures = check_files(args)
+
+        elapsed: float = max(outcome[2] for outcome in outcomes) - min(outcome[1] for outcome in outcomes)
+        saves: int = args.processes * args.threads * args.ops
+        print(f'{args.processes} processes x {args.threads} threads, {saves} saves in {elapsed:.2f} s '
+              f'({saves / elapsed if elapsed > 0 else 0.0:.0f} saves/s), durability {args.durability}, '
+              f'group commit {"on" if args.group_commit else "off"}')
+
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    if not failures:
+        print('no lost or corrupted records, audit entries or registrations')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,14 @@
+import sys
 from PasswordManager import PasswordManager
+from Session import Session
 
 # Maximum characters for user ID and name
 MAX_CHARACTERS_ID = 5
 MAX_CHARACTERS_NAME = 10
 
+# Number of most recent audit entries shown by the "Check the audit history" action
+MAX_AUDIT_ENTRIES = 100
+
 
 def main() -> None:
     """
@@ -14,7 +19,7 @@ def main() -> None:
         Actions:
         1. Create User: Allows users to create an account with a limited ID and name.
         2. Sign In: Enables users to sign in, manage, and display their encrypted credentials.
-        3. Check Audit History: Allows users to check their audit history, including login and action timestamps.
+        3. Check Audit History: Allows users to check their most recent audit entries, including login and action timestamps.
         4. Logout: Exits the program.
 
         The function employs loops for both the main and secondary actions, validating user inputs for better control.
@@ -57,6 +62,9 @@ def main() -> None:
             # Checking if the user creation was successful
             if password_manger_object.user.create_user(limited_user_id, limited_user_name):
 
+                # The session keeps the signed-in user's manager and decrypted credentials until logout
+                session: Session = Session(limited_user_id, limited_user_name)
+
                 # Setting second_cycle_flag to True to enter the secondary loop
                 second_cycle_flag: bool = True
 
@@ -80,7 +88,7 @@ def main() -> None:
                         print()  # Adding an empty line for better visual separation in the output
 
                         # Encrypting and saving credentials
-                        password_manger_object.encrypt_save_credentials(website_input, login_input, password_input)
+                        session.encrypt_save_credentials(website_input, login_input, password_input)
 
                     # Checking if the sub_choice is a digit and equal to '2'
                     elif sub_choice.isdigit() and sub_choice == '2':
@@ -95,17 +103,22 @@ def main() -> None:
 
                         print()  # Adding an empty line for better visual separation in the output
 
-                        # Creating a new PasswordManager instance with limited user ID and name
-                        password_manger_object: PasswordManager = PasswordManager(limited_user_id, limited_user_name)
+                        # The signed-in user's credentials come from the session, which only decrypts what changed
+                        if limited_user_id == session.manager.user_id:
+                            session.decrypt_display_credentials()
+                        else:
+                            # Creating a new PasswordManager instance with limited user ID and name
+                            other_manager: PasswordManager = PasswordManager(limited_user_id, limited_user_name)
 
-                        # Checking if the user exists and displaying credentials if successful
-                        if password_manger_object.user.get_user_name(limited_user_id):
-                            password_manger_object.decrypt_display_credentials()
+                            # Checking if the user exists and displaying credentials if successful
+                            if other_manager.user.get_user_name(limited_user_id):
+                                other_manager.decrypt_display_credentials()
 
                     # Checking if the sub_choice is a digit and equal to '3'
                     elif sub_choice.isdigit() and sub_choice == '3':
 
-                        # Exiting the secondary loop
+                        # Logging out wipes the credentials the session decrypted, then exits the secondary loop
+                        session.close()
                         second_cycle_flag: bool = False
 
                     else:
@@ -131,6 +144,9 @@ def main() -> None:
             # Checking if the user exists
             if password_manger_object.user.get_user_name(limited_user_id):
 
+                # The session keeps the signed-in user's manager and decrypted credentials until logout
+                session: Session = Session(limited_user_id, limited_user_name)
+
                 # Setting second_cycle_flag to True to enter the secondary loop
                 second_cycle_flag: bool = True
 
@@ -154,7 +170,7 @@ def main() -> None:
                         print()  # Adding an empty line for better visual separation in the output
 
                         # Encrypting and saving credentials
-                        password_manger_object.encrypt_save_credentials(website_input, login_input, password_input)
+                        session.encrypt_save_credentials(website_input, login_input, password_input)
 
                     # Checking if the sub_choice is a digit and equal to '2'
                     elif sub_choice.isdigit() and sub_choice == '2':
@@ -169,17 +185,22 @@ def main() -> None:
 
                         print()  # Adding an empty line for better visual separation in the output
 
-                        # Creating a new PasswordManager instance with limited user ID and name
-                        password_manger_object: PasswordManager = PasswordManager(limited_user_id, limited_user_name)
+                        # The signed-in user's credentials come from the session, which only decrypts what changed
+                        if limited_user_id == session.manager.user_id:
+                            session.decrypt_display_credentials()
+                        else:
+                            # Creating a new PasswordManager instance with limited user ID and name
+                            other_manager: PasswordManager = PasswordManager(limited_user_id, limited_user_name)
 
-                        # Checking if the user exists and displaying credentials if successful
-                        if password_manger_object.user.get_user_name(limited_user_id):
-                            password_manger_object.decrypt_display_credentials()
+                            # Checking if the user exists and displaying credentials if successful
+                            if other_manager.user.get_user_name(limited_user_id):
+                                other_manager.decrypt_display_credentials()
 
                     # Checking if the sub_choice is a digit and equal to '3'
                     elif sub_choice.isdigit() and sub_choice == '3':
 
-                        # Exiting the secondary loop
+                        # Logging out wipes the credentials the session decrypted, then exits the secondary loop
+                        session.close()
                         second_cycle_flag: bool = False
 
                     else:
@@ -204,7 +225,9 @@ def main() -> None:
 
             # If the user exists, display the audit history
             if password_manger_object.user.get_user_name(limited_user_id):
-                print(password_manger_object.show_audit_history())
+                for entry in password_manger_object.show_audit_history(MAX_AUDIT_ENTRIES):
+                    print(entry, end='')
+                print()
 
         # Checking if the choice is a digit and equal to '4'
         elif choice.isdigit() and choice == '4':
@@ -218,4 +241,8 @@ def main() -> None:
 
 
 if __name__ == "__main__":
+    # With arguments, run a subcommand of the non-interactive command line instead of the menu
+    if len(sys.argv) > 1:
+        from BatchCli import main as batch_main
+        sys.exit(batch_main(sys.argv[1:]))
     main()
@@ -0,0 +1,26 @@
+import os
+import sys
+from typing import Iterator
+
+import pytest
+
+# The modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from FileStorage import FileStorage
+from KeyRing import get_key_ring
+from RegistryCache import registry_cache
+
+
+@pytest.fixture
+def storage(tmp_path) -> Iterator[FileStorage]:
+    """
+        A FileStorage keeping its registry and the users' files in a temporary data root.
+
+        The process-wide key ring and registry cache are emptied afterwards, so tests do not share keys or users.
+    """
+    file_storage: FileStorage = FileStorage(data_root=str(tmp_path))
+    yield file_storage
+    file_storage.flush_audit()
+    get_key_ring().invalidate()
+    registry_cache.invalidate()
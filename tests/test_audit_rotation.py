@@ -0,0 +1,73 @@
+import os
+import threading
+from typing import List
+
+import pytest
+
+from AuditArchive import (AuditRotationPolicy, archive_audit_file, get_audit_archiver, pending_sequences,
+                          read_manifest, rotate_audit_file, segment_file)
+from AuditWriter import configure_audit_writer
+from FileStorage import FileStorage
+from PasswordManager import PasswordManager
+
+
+def test_history_reads_across_segments_while_archivers_race(storage: FileStorage):
+    policy: AuditRotationPolicy = AuditRotationPolicy(max_bytes=2048)
+    configure_audit_writer(batch_size=25, rotation=policy)
+    try:
+        manager: PasswordManager = PasswordManager('erin', 'erin', storage, quiet=True)
+        expected: List[str] = []
+        for number in range(1000):
+            manager.save_audit_log(f'- entry {number}')
+            expected.append(f'- entry {number}')
+            if number % 25 == 24:
+                storage.flush_audit()
+        storage.flush_audit()
+
+        # Archivers of several processes work on the same audit file while its history is read
+        audit_file: str = os.path.abspath(manager.user.audit_file)
+        lock_dir: str = os.path.abspath(manager.user.lock_dir)
+        errors: List[BaseException] = []
+
+        def archive() -> None:
+            try:
+                archive_audit_file(audit_file, lock_dir, policy)
+            except BaseException as error:
+                errors.append(error)
+
+        archivers: List[threading.Thread] = [threading.Thread(target=archive) for _ in range(4)]
+        for archiver in archivers:
+            archiver.start()
+        while any(archiver.is_alive() for archiver in archivers):
+            history: List[str] = [entry.split(' - ')[-1].rstrip('\n') for entry in manager.user.iter_audit_history()]
+            assert history == expected
+        for archiver in archivers:
+            archiver.join()
+        get_audit_archiver().wait()
+
+        assert errors == []
+        sequences: List[int] = [segment[0] for segment in read_manifest(audit_file)]
+        assert len(sequences) > 1 and sequences == sorted(set(sequences))
+        assert pending_sequences(audit_file, read_manifest(audit_file)) == []
+        assert all(os.path.exists(segment_file(audit_file, sequence)) for sequence in sequences)
+        assert [entry.split(' - ')[-1].rstrip('\n') for entry in manager.user.get_audit_history()] == expected
+    finally:
+        configure_audit_writer()
+
+
+def test_a_bad_page_is_rejected_rather_than_read_as_the_whole_history(storage: FileStorage):
+    manager: PasswordManager = PasswordManager('erin', 'erin', storage, quiet=True)
+    for number in range(30):
+        manager.save_audit_log(f'- entry {number}')
+    for rotated in (False, True):
+        if rotated:
+            # The same checks on a history split into archived segments
+            storage.flush_audit()
+            audit_file: str = os.path.abspath(manager.user.audit_file)
+            rotate_audit_file(audit_file)
+            archive_audit_file(audit_file, os.path.abspath(manager.user.lock_dir), AuditRotationPolicy())
+            assert len(read_manifest(audit_file)) == 1
+        assert len(manager.user.get_audit_page(0, 10)) == 10
+        for page, page_size in ((-1, 10), (0, 0), (1, -5)):
+            with pytest.raises(ValueError):
+                manager.user.get_audit_page(page, page_size)
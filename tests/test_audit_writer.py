@@ -0,0 +1,40 @@
+import os
+from typing import List
+
+from AuditWriter import AUDIT_WRITE_ATTEMPTS, AuditWriter
+
+
+def read_lines(path: str) -> List[str]:
+    with open(path, 'r') as audit_file:
+        return audit_file.read().splitlines()
+
+
+def test_a_failing_audit_file_keeps_the_other_entries_and_the_thread(tmp_path, capsys):
+    writer: AuditWriter = AuditWriter(batch_size=10, flush_interval=60.0)
+    kept: str = str(tmp_path / 'kept_audit.txt')
+    lost: str = str(tmp_path / 'removed' / 'lost_audit.txt')
+    lock_dir: str = str(tmp_path / 'locks')
+    try:
+        writer.write(lost, lock_dir, 'lost 0\n')
+        writer.write(kept, lock_dir, 'kept 0\n')
+        writer.flush()
+        assert read_lines(kept) == ['kept 0']
+
+        # The entries of the failing file are dropped and reported after AUDIT_WRITE_ATTEMPTS batches
+        for _ in range(AUDIT_WRITE_ATTEMPTS):
+            writer.flush()
+        assert 'could not be written' in capsys.readouterr().err
+
+        # The background thread still writes the entries queued later
+        writer.write(kept, lock_dir, 'kept 1\n')
+        writer.close()
+        assert read_lines(kept) == ['kept 0', 'kept 1']
+
+        # Entries queued while a file is missing are written once it can be created again
+        writer.write(lost, lock_dir, 'lost 1\n')
+        writer.flush()
+        os.makedirs(os.path.dirname(lost))
+        writer.close()
+        assert read_lines(lost) == ['lost 1']
+    finally:
+        writer.close()
@@ -0,0 +1,64 @@
+import io
+import json
+from typing import Dict, List
+
+from BatchCli import CommandSession, run_pipe
+from FileStorage import FileStorage
+
+
+def run_lines(storage: FileStorage, commands: List[object]) -> List[Dict[str, object]]:
+    output: io.StringIO = io.StringIO()
+    run_pipe(CommandSession(storage), io.StringIO(''.join(json.dumps(command) + '\n' for command in commands)), output)
+    return [json.loads(line) for line in output.getvalue().splitlines()]
+
+
+def test_bad_commands_fail_only_their_line(storage: FileStorage):
+    results: List[Dict[str, object]] = run_lines(storage, [
+        {'cmd': 'create-user', 'user_id': '1', 'user_name': 'alice'},
+        {'cmd': ['add']},
+        {'cmd': 'add', 'user_id': '1', 'website': 5, 'login': 'alice', 'password': 'secret'},
+        {'cmd': 'audit', 'user_id': '1', 'last': 'ten'},
+        {'cmd': 'add', 'user_id': '1', 'website': 'mail.example', 'login': 'alice', 'password': 'secret'},
+        {'id': 7, 'cmd': 'get', 'user_id': '1', 'website': 'mail.example'},
+    ])
+
+    assert [result['ok'] for result in results] == [True, False, False, False, True, True]
+    assert results[1]['error'] == "Unknown command: ['add']"
+    assert results[2]['error'] == 'Argument website must be a string'
+    assert results[3]['error'] == 'Argument last must be an integer'
+    assert results[5] == {'id': 7, 'ok': True,
+                          'result': [{'website': 'mail.example', 'login': 'alice', 'password': 'secret'}]}
+
+
+def test_undecryptable_vault_fails_the_command(storage: FileStorage):
+    run_lines(storage, [{'cmd': 'create-user', 'user_id': '1', 'user_name': 'alice'},
+                        {'cmd': 'add', 'user_id': '1', 'website': 'mail.example', 'login': 'alice', 'password': 'x'}])
+    storage.flush_audit()
+
+    # Another key in the key file, as if the vault had been encrypted by someone else
+    from cryptography.fernet import Fernet
+    from KeyRing import get_key_ring
+    with open(storage.user_files('1').key_file, 'wb') as key_file:
+        key_file.write(Fernet.generate_key())
+    get_key_ring().invalidate()
+
+    results: List[Dict[str, object]] = run_lines(storage, [{'cmd': 'list', 'user_id': '1'},
+                                                           {'cmd': 'audit', 'user_id': '1', 'last': 1}])
+    assert results[0] == {'ok': False, 'error': "The stored data cannot be decrypted with the user's key"}
+    assert results[1]['ok']
+
+
+def test_audit_rejects_negative_counts_and_empty_pages(storage: FileStorage):
+    results: List[Dict[str, object]] = run_lines(storage, [
+        {'cmd': 'create-user', 'user_id': '1', 'user_name': 'alice'},
+        {'cmd': 'audit', 'user_id': '1', 'page': -1},
+        {'cmd': 'audit', 'user_id': '1', 'page': 0, 'page_size': 0},
+        {'cmd': 'audit', 'user_id': '1', 'last': -3},
+        {'cmd': 'audit', 'user_id': '1', 'page': 0, 'page_size': 1},
+    ])
+
+    assert [result['ok'] for result in results] == [True, False, False, False, True]
+    assert results[1]['error'] == 'Argument page must be at least 0'
+    assert results[2]['error'] == 'Argument page_size must be at least 1'
+    assert results[3]['error'] == 'Argument last must be at least 0'
+    assert len(results[4]['result']) == 1
@@ -0,0 +1,31 @@
+from typing import List
+
+import pytest
+
+from FileStorage import FileStorage
+from PasswordManager import PasswordManager
+
+
+def test_an_incomplete_row_names_its_line_and_keeps_the_rows_before(storage: FileStorage, tmp_path):
+    csv_file = tmp_path / 'credentials.csv'
+    rows: List[str] = [f'site{number}.example,judy,secret{number}' for number in range(5)]
+    csv_file.write_text('website,login,password\n' + '\n'.join(rows) + '\nbroken.example,judy\n' + rows[0] + '\n')
+    manager: PasswordManager = PasswordManager('judy', 'judy', storage, quiet=True)
+
+    with pytest.raises(ValueError, match=r'line 7: the password field is missing'):
+        manager.import_credentials_file(str(csv_file), chunk_size=2)
+    assert [credentials['website'] for credentials in manager.iter_credentials()] == \
+        [f'site{number}.example' for number in range(5)]
+    assert any('Imported 5 credentials, then the import failed' in entry
+               for entry in manager.user.get_audit_history())
+
+
+def test_a_jsonl_line_that_is_not_a_record_names_its_line(storage: FileStorage, tmp_path):
+    jsonl_file = tmp_path / 'credentials.jsonl'
+    jsonl_file.write_text('{"website": "a.example", "login": "judy", "password": "x"}\n\n'
+                          '{"website": "b.example", "login": "judy", "password": 7}\n')
+    manager: PasswordManager = PasswordManager('judy', 'judy', storage, quiet=True)
+
+    with pytest.raises(ValueError, match=r'line 3: the password field is not a string'):
+        manager.import_credentials_file(str(jsonl_file))
+    assert manager.get_credentials('a.example')[0]['password'] == 'x'
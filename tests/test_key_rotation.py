@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from FileStorage import FileStorage
+from KeyRing import get_key_ring
+from KeyRotation import RotationCheckpoint, rotate_keys, rotate_user_key
+from PasswordManager import PasswordManager
+from Session import Session
+
+
+def other_process_storage(storage: FileStorage) -> FileStorage:
+    # A storage of its own, with its own website indexes, stands in for another process on the same data root
+    return FileStorage(users_file=storage.users_file, data_root=storage.data_layout.root)
+
+
+def websites(manager: PasswordManager) -> List[str]:
+    return [credentials['website'] for credentials in manager.iter_credentials()]
+
+
+def test_long_lived_readers_and_writers_follow_a_rotation(storage: FileStorage):
+    manager: PasswordManager = PasswordManager('frank', 'frank', storage, quiet=True)
+    for number in range(10):
+        manager.encrypt_save_credentials(f'site{number}.example', 'frank', f'secret{number}')
+    with Session('frank', 'frank', storage, quiet=True) as session:
+        assert len(session.credentials()) == 10
+        key_ring_id: str = storage.key_ring_id(manager.user)
+        old_key: bytes = manager.user.stored_key
+        old_version: Optional[Tuple[int, int, int]] = manager.user.key_version
+
+        assert rotate_user_key(other_process_storage(storage), 'frank', 'frank')[0] == 10
+
+        # The manager and the session still hold the old key
+        assert manager.get_credentials('site3.example')[0]['password'] == 'secret3'
+        assert websites(manager) == [f'site{number}.example' for number in range(10)]
+        assert [credentials['password'] for credentials in session.credentials()] == \
+            [f'secret{number}' for number in range(10)]
+
+    # A writer with the old key encrypts its records again with the new key
+    stale_manager: PasswordManager = PasswordManager('frank', 'frank', storage, quiet=True)
+    stale_manager.user.key = old_key
+    stale_manager.encrypt_save_credentials('late.example', 'frank', 'late')
+
+    # The key ring of another process that still caches the old key misses on the new key file
+    get_key_ring().put(key_ring_id, old_key, None, old_version)
+    fresh_manager: PasswordManager = PasswordManager('frank', 'frank', storage, quiet=True)
+    assert fresh_manager.user.stored_key != old_key
+    assert fresh_manager.get_credentials('late.example')[0]['password'] == 'late'
+
+
+def test_reads_and_writes_across_live_rotations(storage: FileStorage):
+    manager: PasswordManager = PasswordManager('grace', 'grace', storage, quiet=True)
+    expected: List[str] = [f'site{number}.example' for number in range(50)]
+    manager.import_credentials({'website': website, 'login': 'grace', 'password': 'secret'} for website in expected)
+    writer: PasswordManager = PasswordManager('grace', 'grace', storage, quiet=True)
+    rotator: FileStorage = other_process_storage(storage)
+    errors: List[BaseException] = []
+    written: List[str] = []
+    rotating: threading.Event = threading.Event()
+    rotating.set()
+
+    def rotate() -> None:
+        try:
+            # One rotation at a time, with reads and writes in between as a rotation of every user would leave them
+            for _ in range(5):
+                rotate_user_key(rotator, 'grace', 'grace')
+                time.sleep(0.05)
+        except BaseException as error:
+            errors.append(error)
+        finally:
+            rotating.clear()
+
+    def write() -> None:
+        try:
+            while rotating.is_set():
+                website: str = f'late{len(written)}.example'
+                writer.encrypt_save_credentials(website, 'grace', 'late')
+                written.append(website)
+        except BaseException as error:
+            errors.append(error)
+
+    threads: List[threading.Thread] = [threading.Thread(target=rotate), threading.Thread(target=write)]
+    for thread in threads:
+        thread.start()
+    with Session('grace', 'grace', storage, quiet=True) as session:
+        while rotating.is_set():
+            assert manager.get_credentials('site7.example')[0]['password'] == 'secret'
+            assert websites(manager)[:50] == expected
+            assert [credentials['website'] for credentials in session.credentials()][:50] == expected
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert written
+    assert websites(PasswordManager('grace', 'grace', other_process_storage(storage), quiet=True)) == \
+        expected + written
+
+
+def test_a_vault_that_does_not_decrypt_fails_only_its_user(storage: FileStorage, tmp_path):
+    for user_id in ('henry', 'irene'):
+        PasswordManager(user_id, user_id, storage, quiet=True).encrypt_save_credentials('mail.example', user_id, 'pw')
+
+    # Henry's key file holds another valid key, which does not decrypt his vault
+    henry: PasswordManager = PasswordManager('henry', 'henry', storage, quiet=True)
+    with open(henry.user.key_file, 'wb') as key_file:
+        key_file.write(PasswordManager('irene', 'irene', storage, quiet=True).user.stored_key)
+    get_key_ring().invalidate()
+
+    counts = rotate_keys(storage, [('henry', 'henry'), ('irene', 'irene')],
+                         RotationCheckpoint(str(tmp_path / 'rotation.checkpoint')), workers=1)
+    assert (counts['failed'], counts['rotated']) == (1, 1)
+    assert not os.path.exists(f'{henry.user.users_data_file}.rotate')
+    assert PasswordManager('irene', 'irene', storage, quiet=True).get_credentials('mail.example')[0]['password'] == 'pw'
@@ -0,0 +1,40 @@
+import os
+
+import pytest
+
+from FileStorage import FileStorage
+from PasswordManager import PasswordManager
+
+
+def test_interrupted_move_keeps_the_key(storage: FileStorage, monkeypatch):
+    manager: PasswordManager = PasswordManager('dave', 'dave', storage, quiet=True)
+    manager.encrypt_save_credentials('mail.example', 'dave', 'secret')
+    sharded: FileStorage = FileStorage(users_file=storage.users_file, data_root=storage.data_layout.root,
+                                       layout='sharded')
+
+    # Interrupt the move right before the staging directory is renamed into place
+    replace = os.replace
+
+    def interrupted_replace(source: str, target: str) -> None:
+        if source.endswith('.moving'):
+            raise OSError('interrupted')
+        replace(source, target)
+    monkeypatch.setattr(os, 'replace', interrupted_replace)
+    with pytest.raises(OSError):
+        sharded.move_user_to_sharded('dave')
+    monkeypatch.setattr(os, 'replace', replace)
+
+    # The user still reads every flat file, and finishing the move keeps the same key
+    assert PasswordManager('dave', 'dave', sharded, quiet=True).get_credentials('mail.example')[0]['password'] == \
+        'secret'
+    assert sharded.move_user_to_sharded('dave')
+    assert not os.path.exists(storage.data_layout.flat_files('dave').key_file)
+    assert PasswordManager('dave', 'dave', sharded, quiet=True).get_credentials('mail.example')[0]['password'] == \
+        'secret'
+    assert not sharded.move_user_to_sharded('dave')
+
+    # A flat file that is not the moved one is never deleted nor moved over it
+    with open(storage.data_layout.flat_files('dave').key_file, 'wb') as key_file:
+        key_file.write(b'another key')
+    with pytest.raises(ValueError):
+        sharded.move_user_to_sharded('dave')
@@ -0,0 +1,54 @@
+from typing import List, Optional, Tuple
+
+from FileStorage import FileStorage
+from PasswordManager import PasswordManager
+from Session import Session
+
+
+def passwords(session: Session) -> List[Tuple[str, str]]:
+    return [(record['website'], record['password']) for record in session.credentials()]
+
+
+def fill_vault(manager: PasswordManager) -> None:
+    # Every website is updated once, so a compaction drops half of the records
+    for number in range(10):
+        manager.encrypt_save_credentials(f'site{number}.example', 'carol', 'old')
+    for number in range(10):
+        manager.update_credentials(f'site{number}.example', 'carol', f'new{number}')
+
+
+def test_session_refresh_after_compaction(storage: FileStorage):
+    with Session('carol', 'carol', storage, quiet=True) as session:
+        manager: PasswordManager = session.manager
+        fill_vault(manager)
+        assert passwords(session) == [(f'site{number}.example', f'new{number}') for number in range(10)]
+
+        assert manager.compact_credentials()
+        manager.encrypt_save_credentials('late.example', 'carol', 'late')
+        assert passwords(session) == [(f'site{number}.example', f'new{number}') for number in range(10)] + \
+            [('late.example', 'late')]
+
+
+def test_session_reloads_a_compacted_vault_with_the_old_inode(storage: FileStorage, monkeypatch):
+    with Session('carol', 'carol', storage, quiet=True) as session:
+        manager: PasswordManager = session.manager
+        fill_vault(manager)
+        assert len(passwords(session)) == 10
+
+        # The compacted file gets the inode of the file it replaced, which the file system is free to do
+        first_inode: int = storage.vault_version(manager.user)[0]
+        vault_version = storage.vault_version
+
+        def reused_inode(user) -> Optional[Tuple[int, int, int]]:
+            version: Optional[Tuple[int, int, int]] = vault_version(user)
+            return (first_inode,) + version[1:] if version is not None else None
+        monkeypatch.setattr(storage, 'vault_version', reused_inode)
+
+        assert manager.compact_credentials()
+        manager.delete_credentials('site0.example')
+
+        # Grow the compacted vault past the offset the session read up to, so only the anchor tells them apart
+        for number in range(15):
+            manager.encrypt_save_credentials(f'more{number}.example', 'carol', 'more')
+        assert passwords(session) == [(f'site{number}.example', f'new{number}') for number in range(1, 10)] + \
+            [(f'more{number}.example', 'more') for number in range(15)]
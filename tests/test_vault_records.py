@@ -0,0 +1,94 @@
+import os
+import threading
+from typing import Dict, List, Tuple
+
+import pytest
+
+from FileStorage import FileStorage
+from PasswordManager import PasswordManager
+from Session import Session
+
+
+def stored(manager: PasswordManager) -> List[Tuple[str, str, str]]:
+    return [(record['website'], record['login'], record['password']) for record in manager.iter_credentials()]
+
+
+@pytest.fixture(params=[None, 64], ids=['per-record', 'block'])
+def manager(request, storage: FileStorage) -> PasswordManager:
+    # Blocks of 64 bytes hold a couple of records, so most records end up sealed and a few stay in the tail
+    storage.block_size = request.param
+    return PasswordManager('alice', 'alice', storage, quiet=True)
+
+
+def test_saves_keep_every_record(manager: PasswordManager):
+    manager.encrypt_save_credentials('mail.example', 'alice', 'first')
+    manager.encrypt_save_credentials('mail.example', 'alice.work', 'second')
+    manager.encrypt_save_credentials('shop.example', 'alice', 'third')
+
+    assert stored(manager) == [('mail.example', 'alice', 'first'), ('mail.example', 'alice.work', 'second'),
+                               ('shop.example', 'alice', 'third')]
+    assert [record['login'] for record in manager.get_credentials('mail.example')] == ['alice', 'alice.work']
+    assert manager.storage.vault_stats(manager.user) == (3, 0)
+
+
+def test_update_and_delete_survive_compaction(manager: PasswordManager):
+    for number in range(5):
+        manager.encrypt_save_credentials('mail.example', f'login{number}', 'old')
+        manager.encrypt_save_credentials(f'site{number}.example', 'alice', 'kept')
+    manager.encrypt_save_credentials('gone.example', 'alice', 'old')
+
+    assert manager.update_credentials('mail.example', 'alice', 'new')
+    manager.encrypt_save_credentials('mail.example', 'alice.work', 'added after the update')
+    assert manager.delete_credentials('gone.example')
+    assert not manager.update_credentials('gone.example', 'alice', 'new')
+
+    expected: List[Tuple[str, str, str]] = [(f'site{number}.example', 'alice', 'kept') for number in range(5)] + \
+        [('mail.example', 'alice', 'new'), ('mail.example', 'alice.work', 'added after the update')]
+    assert stored(manager) == expected
+    assert manager.storage.vault_stats(manager.user) == (7, 7)
+
+    assert manager.compact_credentials()
+    assert stored(manager) == expected
+    assert manager.storage.vault_stats(manager.user) == (7, 0)
+    assert manager.get_credentials('gone.example') == []
+    assert [record['password'] for record in manager.get_credentials('mail.example')] == \
+        ['new', 'added after the update']
+
+    # An index rebuilt from the compacted vault reads the same records
+    os.remove(manager.user.index_file)
+    manager.storage._website_indexes.clear()
+    assert stored(manager) == expected
+
+
+def test_session_follows_updates_and_deletes(storage: FileStorage):
+    with Session('bob', 'bob', storage, quiet=True) as session:
+        manager: PasswordManager = session.manager
+        manager.encrypt_save_credentials('mail.example', 'bob', 'first')
+        manager.encrypt_save_credentials('mail.example', 'bob.work', 'second')
+        assert [record['password'] for record in session.credentials()] == ['first', 'second']
+
+        manager.encrypt_save_credentials('shop.example', 'bob', 'third')
+        manager.update_credentials('mail.example', 'bob', 'updated')
+        assert [record['password'] for record in session.credentials()] == ['third', 'updated']
+
+        manager.delete_credentials('shop.example')
+        credentials: List[Dict[str, str]] = session.credentials()
+        assert credentials == [{'website': 'mail.example', 'login': 'bob', 'password': 'updated'}]
+
+
+def test_compaction_check_reads_no_files(manager: PasswordManager, monkeypatch):
+    manager.encrypt_save_credentials('mail.example', 'alice', 'first')
+    for number in range(120):
+        manager.update_credentials('mail.example', 'alice', f'password{number}')
+    for thread in threading.enumerate():
+        if thread.name.startswith('compact-'):
+            thread.join()
+    live_count, dead_count = manager.storage.vault_stats(manager.user)
+    assert live_count == 1 and dead_count < 100
+
+    # The check after a write only looks at the counts kept in memory
+    def no_io(*args, **kwargs):
+        raise AssertionError('file I/O while checking for compaction')
+    monkeypatch.setattr('builtins.open', no_io)
+    monkeypatch.setattr(os, 'stat', no_io)
+    manager._schedule_compaction()